@@ -6,6 +6,9 @@ import re
 import logging
 from typing import Optional
 
+from sa_core.conv_stream import iter_conversations
+from sa_core.db import bulk_update_via_temp_table
+
 logger = logging.getLogger(__name__)
 
 
@@ -161,52 +164,28 @@ def fill_cliente_id_for_ejecucion(conn, ejecucion_id: int):
         conn: Conexión a la base de datos
         ejecucion_id: ID de la ejecución a procesar
     """
-    cursor = conn.cursor(dictionary=True)
+    cursor = conn.cursor()
     
     try:
-        # Obtener conversaciones que NO tienen cliente_id
-        cursor.execute("""
-            SELECT conversacion_pk, conversacion_id
-            FROM sa_conversaciones
-            WHERE ejecucion_id = %s
-              AND (cliente_id IS NULL OR TRIM(cliente_id) = '')
-        """, (ejecucion_id,))
-        
-        conversaciones = cursor.fetchall()
-        total = len(conversaciones)
-        
-        if total == 0:
-            logger.info(f"No hay conversaciones sin cliente_id en ejecución {ejecucion_id}")
-            return
-        
-        logger.info(f"Procesando cliente_id para {total} conversaciones de ejecución {ejecucion_id}")
-        
-        updated = 0
+        # Conversaciones que NO tienen cliente_id, con sus textos en orden de turno_idx
+        # (keyset paginado: sin un SELECT de turnos por conversación)
+        conversaciones = iter_conversations(
+            cursor, ejecucion_id, columns=("text",), conv_columns=("conversacion_id",),
+            conv_where="c.cliente_id IS NULL OR TRIM(c.cliente_id) = ''", include_empty=True,
+        )
+        
+        updates = []
         fallback = 0
         no_id = 0
         
         # Procesar cada conversación
-        for conv in conversaciones:
-            conversacion_pk = conv['conversacion_pk']
-            conversacion_id = conv.get('conversacion_id', '')
+        for conv, turnos in conversaciones:
+            conversacion_id = conv.conversacion_id or ''
             cliente_id = None
             
-            # Buscar en turnos (ordenados por turno_idx)
-            cursor.execute("""
-                SELECT text
-                FROM sa_turnos
-                WHERE conversacion_pk = %s
-                  AND text IS NOT NULL
-                  AND TRIM(text) != ''
-                ORDER BY turno_idx
-            """, (conversacion_pk,))
-            
-            turnos = cursor.fetchall()
-            
             # Buscar DNI en primer turno que lo contenga
             for turno in turnos:
-                text = turno.get('text') or ''
-                cliente_id = extract_cliente_id_from_text(text)
+                cliente_id = extract_cliente_id_from_text(turno.text or '')
                 if cliente_id:
                     break
             
@@ -218,26 +197,24 @@ def fill_cliente_id_for_ejecucion(conn, ejecucion_id: int):
             
             # Actualizar si encontró algo
             if cliente_id:
-                update_cursor = conn.cursor()
-                update_cursor.execute("""
-                    UPDATE sa_conversaciones
-                    SET cliente_id = %s
-                    WHERE conversacion_pk = %s
-                """, (cliente_id, conversacion_pk))
-                update_cursor.close()
-                updated += 1
+                updates.append((conv.conversacion_pk, cliente_id))
             else:
                 no_id += 1
             
             # Log de progreso cada 100
-            if (updated + no_id) % 100 == 0:
-                logger.info(f"Progreso: {updated + no_id}/{total} conversaciones procesadas")
+            if (len(updates) + no_id) % 100 == 0:
+                logger.info(f"Progreso: {len(updates) + no_id} conversaciones procesadas")
+        
+        if not updates and no_id == 0:
+            logger.info(f"No hay conversaciones sin cliente_id en ejecución {ejecucion_id}")
+            return
         
-        # Commit al final
+        # Un único UPDATE ... JOIN y commit al final
+        bulk_update_via_temp_table(cursor, "sa_conversaciones", "conversacion_pk", [("cliente_id", "VARCHAR(64)")], updates)
         conn.commit()
         
         logger.info(f"✓ cliente_id completado para ejecución {ejecucion_id}: "
-                   f"updated={updated}, fallback={fallback}, sin_id={no_id}")
+                   f"updated={len(updates)}, fallback={fallback}, sin_id={no_id}")
         
     except Exception as e:
         logger.error(f"Error procesando cliente_id: {e}", exc_info=True)
@@ -0,0 +1,111 @@
+# sa_core/conv_index.py
+"""
+Índice en memoria de conversaciones (turnos + estado de fase) cargado con
+pocas consultas set-based.
+
+El reclasificador DeepSeek hacía 3-4 SELECT por turno antes de cada llamada al
+LLM (estado del turno para idempotencia, last_phase, COUNT(*) de turnos y los
+textos de la conversación). Con el índice se precargan por lotes de
+conversaciones y el bucle por turno solo toca la BD para escribir; cada
+escritura exitosa se refleja en el índice con set_phase().
+"""
+from decimal import Decimal
+
+from sa_core.conv_stream import iter_conversations
+
+PREFETCH_CHUNK = 500
+
+# Posiciones dentro de cada turno del índice
+T_PK, T_TEXT, T_SPEAKER, T_FASE, T_CONF, T_SOURCE = range(6)
+
+
+def _has_fase(fase) -> bool:
+    # Igual que "fase IS NOT NULL AND TRIM(fase)<>''" (TRIM de MySQL solo quita espacios)
+    return fase is not None and fase.strip(" ") != ""
+
+
+class ConversationIndex:
+    def __init__(self, conn, chunk_size: int = PREFETCH_CHUNK):
+        self.conn = conn
+        self.chunk_size = chunk_size
+        self._convs = {}      # conv_pk -> {turno_idx: [turno_pk, text, speaker, fase, conf, source]}
+        self._by_pk = {}      # turno_pk -> (conv_pk, turno_idx)
+
+    def __contains__(self, conv_pk):
+        return conv_pk in self._convs
+
+    def load(self, conv_pks):
+        """Precarga (en chunks, con iter_conversations) las conversaciones que todavía no están en el índice."""
+        pending = [pk for pk in dict.fromkeys(conv_pks) if pk not in self._convs]
+        if not pending:
+            return
+        cur = self.conn.cursor()
+        try:
+            for start in range(0, len(pending), self.chunk_size):
+                chunk = pending[start:start + self.chunk_size]
+                for pk in chunk:
+                    self._convs[pk] = {}
+                conversations = iter_conversations(
+                    cur, columns=("text", "speaker", "fase", "fase_conf", "fase_source"), conv_pks=chunk,
+                )
+                for conv, turns in conversations:
+                    conv_pk = int(conv.conversacion_pk)
+                    for t in turns:
+                        turno_pk, turno_idx = int(t.turno_pk), int(t.turno_idx)
+                        self._convs[conv_pk][turno_idx] = [turno_pk, t.text or "", t.speaker, t.fase, t.fase_conf, t.fase_source]
+                        self._by_pk[turno_pk] = (conv_pk, turno_idx)
+        finally:
+            cur.close()
+
+    def turns(self, conv_pk) -> dict:
+        """{turno_idx: [turno_pk, text, speaker, fase, conf, source]} de la conversación."""
+        if conv_pk not in self._convs:
+            self.load([conv_pk])
+        return self._convs[conv_pk]
+
+    def rows(self, conv_pk) -> dict:
+        """{turno_idx: dict con las columnas de sa_turnos} (formato de cursor dictionary=True)."""
+        return {
+            idx: {
+                "turno_pk": t[T_PK], "turno_idx": idx, "text": t[T_TEXT], "speaker": t[T_SPEAKER],
+                "fase": t[T_FASE], "fase_conf": t[T_CONF], "fase_source": t[T_SOURCE],
+            }
+            for idx, t in self.turns(conv_pk).items()
+        }
+
+    def texts(self, conv_pk) -> dict:
+        return {idx: t[T_TEXT] for idx, t in self.turns(conv_pk).items()}
+
+    def utterances(self, conv_pk) -> dict:
+        """{turno_idx: (speaker, text)} para armar el contexto del prompt."""
+        return {idx: (t[T_SPEAKER], t[T_TEXT]) for idx, t in self.turns(conv_pk).items()}
+
+    def total(self, conv_pk) -> int:
+        return len(self.turns(conv_pk))
+
+    def state(self, turno_pk):
+        """(fase, fase_conf, fase_source) actual del turno, o None si no está en el índice."""
+        loc = self._by_pk.get(turno_pk)
+        if loc is None:
+            return None
+        t = self._convs[loc[0]][loc[1]]
+        return t[T_FASE], t[T_CONF], t[T_SOURCE]
+
+    def last_phase(self, conv_pk, turno_idx):
+        """(fase, conf, source) del último turno con fase antes de turno_idx, o None."""
+        turns = self.turns(conv_pk)
+        for idx in sorted((i for i in turns if i < turno_idx), reverse=True):
+            t = turns[idx]
+            if _has_fase(t[T_FASE]):
+                return t[T_FASE], t[T_CONF], t[T_SOURCE]
+        return None
+
+    def set_phase(self, turno_pk, fase, conf, source):
+        """Refleja en el índice un UPDATE exitoso de sa_turnos (conf como DECIMAL(6,4))."""
+        loc = self._by_pk.get(turno_pk)
+        if loc is None:
+            return
+        if conf is not None:
+            conf = Decimal(f"{conf:.4f}")
+        t = self._convs[loc[0]][loc[1]]
+        t[T_FASE], t[T_CONF], t[T_SOURCE] = fase, conf, source
@@ -0,0 +1,211 @@
+# sa_core/conv_stream.py
+"""
+Lectura de turnos agrupados por conversación, compartida por las etapas por
+ejecución (fases, fase_seq, secuencias, suavizado, cliente_id, promesas y el
+índice de conversaciones del reclasificador).
+
+Cada etapa armaba su propio "turnos de la ejecución agrupados por
+conversacion_pk": un SELECT por conversación (N+1) o un fetchall() de toda la
+ejecución a dicts. iter_conversations() pagina en dos niveles, ambos por
+keyset y servidos por índices (sin filesort):
+
+- bloques de conversaciones: sa_conversaciones filtrada (ejecución, PKs,
+  condición extra) ORDER BY conversacion_pk LIMIT page_size
+- turnos del bloque: sa_turnos por rango de conversacion_pk (primera a
+  última del bloque), ORDER BY conversacion_pk, turno_idx, turno_pk (el índice
+  (conversacion_pk, turno_idx), que en InnoDB termina en la PK) LIMIT page_size
+
+Cada página lee solo sus filas, así que el trabajo total es O(turnos) y la
+memoria queda acotada a una página + un bloque de conversaciones + la
+conversación en curso. Cada página se lee completa, por lo que el llamador
+puede escribir y hacer commit con la misma conexión entre conversaciones.
+
+Los turnos (y la conversación) son registros con __slots__ con las columnas
+pedidas: se leen como atributos (t.fase) y, para el código que trabaja con las
+filas de cursor dictionary=True, también como t['fase'] / t.get('fase').
+"""
+from functools import lru_cache
+
+PAGE_SIZE = 5000
+
+# Siempre se leen: clave del keyset y orden dentro de la conversación
+TURN_KEY = ("turno_pk", "turno_idx")
+DEFAULT_TURN_COLUMNS = ("turno_pk", "turno_idx", "speaker", "text", "fase", "fase_conf", "fase_source")
+
+
+class Record:
+    """Fila compacta (__slots__ = columnas) con acceso por atributo o por clave."""
+    __slots__ = ()
+
+    def __init__(self, *values):
+        for name, value in zip(self.__slots__, values):
+            setattr(self, name, value)
+
+    def __getitem__(self, key):
+        try:
+            return getattr(self, key)
+        except AttributeError:
+            raise KeyError(key) from None
+
+    def __setitem__(self, key, value):
+        if key not in self.__slots__:
+            raise KeyError(key)
+        setattr(self, key, value)
+
+    def __contains__(self, key):
+        return key in self.__slots__
+
+    def get(self, key, default=None):
+        return getattr(self, key, default)
+
+    def keys(self):
+        return self.__slots__
+
+    def as_dict(self) -> dict:
+        return {name: getattr(self, name) for name in self.__slots__}
+
+    def __eq__(self, other):
+        return isinstance(other, Record) and self.as_dict() == other.as_dict()
+
+    def __repr__(self):
+        return f"{type(self).__name__}({', '.join(f'{k}={v!r}' for k, v in self.as_dict().items())})"
+
+    def __reduce__(self):
+        # Los tipos se crean en runtime: se reconstruyen por columnas (pickle al pool de procesos)
+        return _rebuild_record, (self.__slots__, tuple(getattr(self, name) for name in self.__slots__))
+
+
+@lru_cache(maxsize=None)
+def record_type(fields: tuple, name: str = "TurnRecord") -> type:
+    """Clase Record con __slots__ = fields (una por combinación de columnas)."""
+    return type(name, (Record,), {"__slots__": tuple(fields)})
+
+
+def _rebuild_record(fields, values):
+    return record_type(tuple(fields))(*values)
+
+
+def iter_conversations(cursor, ejecucion_id=None, columns=DEFAULT_TURN_COLUMNS, conv_columns=(),
+                       conv_pks=None, conv_where=None, include_empty=False, limit_convs=0,
+                       page_size=PAGE_SIZE):
+    """
+    (conversación, [turno, ...]) de una ejecución (o de conv_pks) en orden de
+    conversacion_pk, con los turnos ordenados por turno_idx.
+
+    Args:
+        cursor: cursor de tuplas
+        ejecucion_id: ejecución a leer (None = sin filtrar por ejecución)
+        columns: columnas de sa_turnos de cada turno (turno_pk y turno_idx se agregan siempre)
+        conv_columns: columnas de sa_conversaciones de la conversación (además de conversacion_pk)
+        conv_pks: limitar a estas conversaciones
+        conv_where: condición SQL adicional sobre sa_conversaciones (alias 'c')
+        include_empty: incluir conversaciones sin turnos (con lista vacía)
+        limit_convs: cortar después de N conversaciones (0 = todas)
+        page_size: conversaciones por bloque y filas de turnos por página
+    """
+    turn_fields = tuple(dict.fromkeys(TURN_KEY + tuple(columns)))
+    conv_fields = tuple(dict.fromkeys(("conversacion_pk",) + tuple(conv_columns)))
+    TurnRecord = record_type(turn_fields)
+    ConvRecord = record_type(conv_fields, "ConvRecord")
+    idx_pos = 1 + turn_fields.index("turno_idx")  # posiciones en la fila (la 0 es conversacion_pk)
+    pk_pos = 1 + turn_fields.index("turno_pk")
+
+    where, base_params = [], []
+    if ejecucion_id is not None:
+        where.append("c.ejecucion_id = %s")
+        base_params.append(ejecucion_id)
+    if conv_pks is not None:
+        conv_pks = list(conv_pks)
+        if not conv_pks:
+            return
+        where.append(f"c.conversacion_pk IN ({', '.join(['%s'] * len(conv_pks))})")
+        base_params.extend(conv_pks)
+    if conv_where:
+        where.append(f"({conv_where})")
+    conv_sql = f"SELECT {', '.join('c.' + f for f in conv_fields)} FROM sa_conversaciones c"
+    turn_sql = f"SELECT t.conversacion_pk, {', '.join('t.' + f for f in turn_fields)} FROM sa_turnos t"
+
+    def turn_rows(lo, hi):
+        # Turnos de conversacion_pk en [lo, hi] en el orden del índice (conversacion_pk, turno_idx)
+        last = None
+        while True:
+            page_where, params = ["t.conversacion_pk >= %s", "t.conversacion_pk <= %s"], [lo, hi]
+            if last is not None:
+                conv_pk, turno_idx, turno_pk = last
+                params[0] = conv_pk
+                page_where.append(
+                    "(t.conversacion_pk > %s OR (t.conversacion_pk = %s AND "
+                    "(t.turno_idx > %s OR (t.turno_idx = %s AND t.turno_pk > %s))))"
+                )
+                params.extend([conv_pk, conv_pk, turno_idx, turno_idx, turno_pk])
+            cursor.execute(
+                f"{turn_sql} WHERE {' AND '.join(page_where)} "
+                f"ORDER BY t.conversacion_pk, t.turno_idx, t.turno_pk LIMIT %s",
+                tuple(params) + (page_size,)
+            )
+            rows = cursor.fetchall()
+            yield from rows
+            if len(rows) < page_size:
+                return
+            last_row = rows[-1]
+            last = (last_row[0], last_row[idx_pos], last_row[pk_pos])
+
+    yielded = 0
+    last_conv = None
+    while True:
+        # Bloque de conversaciones por PK (keyset sobre conversacion_pk)
+        page_where, params = list(where), list(base_params)
+        if last_conv is not None:
+            page_where.append("c.conversacion_pk > %s")
+            params.append(last_conv)
+        cursor.execute(
+            f"{conv_sql} {'WHERE ' + ' AND '.join(page_where) if page_where else ''} "
+            f"ORDER BY c.conversacion_pk LIMIT %s",
+            tuple(params) + (page_size,)
+        )
+        block = [ConvRecord(*row) for row in cursor.fetchall()]
+        if not block:
+            return
+        last_conv = block[-1].conversacion_pk
+
+        rows = turn_rows(block[0].conversacion_pk, last_conv)
+        for conv, conv_turns in _group_block(block, rows, TurnRecord):
+            if not conv_turns and not include_empty:
+                continue
+            yield conv, conv_turns
+            yielded += 1
+            if limit_convs and yielded >= limit_convs:
+                return
+        if len(block) < page_size:
+            return
+
+
+def _group_block(block, rows, TurnRecord):
+    """
+    (conversación, turnos) de cada conversación del bloque, en orden, a medida
+    que llegan sus filas. Las filas de conversaciones que no están en el bloque
+    (otras ejecuciones intercaladas en el rango de PK) se descartan.
+    """
+    i, turns = 0, []
+    for row in rows:
+        conv_pk = row[0]
+        while block[i].conversacion_pk < conv_pk:
+            yield block[i], turns
+            i, turns = i + 1, []
+        if block[i].conversacion_pk == conv_pk:
+            turns.append(TurnRecord(*row[1:]))
+    yield block[i], turns
+    for conv in block[i + 1:]:
+        yield conv, []
+
+
+def iter_conversation_chunks(conversations, chunk_convs):
+    """Agrupa (conversación, turnos) de a chunk_convs (unidad de trabajo para un pool)."""
+    chunk = []
+    for item in conversations:
+        chunk.append(item)
+        if len(chunk) >= chunk_convs:
+            yield chunk
+            chunk = []
+    if chunk:
+        yield chunk
@@ -35,3 +35,44 @@ def ensure_schema(conn):
                     print(f"Error ejecutando statement: {statement}\n{e}")
     conn.commit()
     cursor.close()
+
+def bulk_update_via_temp_table(cursor, table, key_col, columns, rows, where_extra=None, chunk_size=5000):
+    """
+    UPDATE masivo: carga (key, valores...) en una tabla temporal con INSERT
+    multi-fila y aplica un único UPDATE ... JOIN, en vez de un UPDATE por fila.
+
+    Args:
+        cursor: cursor de la conexión (la tabla temporal vive en esa sesión)
+        table: tabla destino (alias 't' en where_extra)
+        key_col: columna clave de la tabla destino
+        columns: lista de (nombre_columna, tipo_sql) a actualizar
+        rows: lista de tuplas (key, valor1, valor2, ...) en el orden de columns
+        where_extra: condición SQL adicional sobre 't' (se evalúa con los valores previos)
+        chunk_size: filas por INSERT multi-fila a la tabla temporal
+
+    Returns:
+        filas afectadas por el UPDATE
+    """
+    if not rows:
+        return 0
+    tmp = f"tmp_bulk_{table}"
+    col_names = [name for name, _ in columns]
+    col_defs = ", ".join(f"{name} {sql_type}" for name, sql_type in columns)
+    cursor.execute(f"DROP TEMPORARY TABLE IF EXISTS {tmp}")
+    cursor.execute(f"CREATE TEMPORARY TABLE {tmp} (k BIGINT PRIMARY KEY, {col_defs})")
+    try:
+        insert_sql = (
+            f"INSERT INTO {tmp} (k, {', '.join(col_names)}) "
+            f"VALUES ({', '.join(['%s'] * (len(col_names) + 1))})"
+        )
+        for start in range(0, len(rows), chunk_size):
+            cursor.executemany(insert_sql, rows[start:start + chunk_size])
+
+        set_sql = ", ".join(f"t.{name} = u.{name}" for name in col_names)
+        sql = f"UPDATE {table} t JOIN {tmp} u ON t.{key_col} = u.k SET {set_sql}"
+        if where_extra:
+            sql += f" WHERE {where_extra}"
+        cursor.execute(sql)
+        return cursor.rowcount
+    finally:
+        cursor.execute(f"DROP TEMPORARY TABLE IF EXISTS {tmp}")
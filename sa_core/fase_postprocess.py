@@ -0,0 +1,130 @@
+# sa_core/fase_postprocess.py
+"""
+Pasadas de corrección de postprocess_ejecucion en memoria, por conversación.
+
+Antes cada pasada era un UPDATE ... JOIN sobre sa_turnos y las de backfill
+armaban una tabla derivada con un SELECT ... ORDER BY turno_idx DESC LIMIT 1
+correlacionado por cada turno de toda la base (no solo de la ejecución).
+Ahora los turnos de la ejecución se leen una vez ordenados por
+(conversacion_pk, turno_idx) y postprocess_conversation() aplica las seis
+pasadas en orden sobre la conversación:
+
+1) NOISE sin fase <- turno previo (idx-1) / siguiente (idx+1)      NO_IMP
+2) APERTURA en idx > 2 <- turno previo (si no es APERTURA)          AP_IMP
+3) APERTURA con turno siguiente <- última fase válida anterior      AP_BK
+4) CIERRE con previo y siguiente <- turno previo (si no es CIERRE)  CI_IMP
+5) CIERRE con turno siguiente <- última fase válida anterior        CI_BK
+6) CIERRE en turno 1 <- fase del turno 2                            CI_FIX1
+
+Cada pasada ve el resultado de las anteriores y, como el UPDATE que reemplaza,
+evalúa sus condiciones sobre el estado previo a la pasada. Los contadores son
+los de MySQL (filas que cambian) y el parche final se escribe de una vez.
+"""
+from collections import namedtuple
+
+NOISE_IMPUTE_SOURCE = 'NO_IMP'
+APERTURA_IMPUTE_SOURCE = 'AP_IMP'
+APERTURA_BACKFILL_SOURCE = 'AP_BK'
+CIERRE_IMPUTE_SOURCE = 'CI_IMP'
+CIERRE_BACKFILL_SOURCE = 'CI_BK'
+CIERRE_FIX1_SOURCE = 'CI_FIX1'
+
+# Orden de las pasadas (clave del contador)
+PASSES = (
+    "noise_prev", "noise_next", "apertura_impute", "apertura_backfill",
+    "cierre_impute", "cierre_backfill", "turno1_cierre",
+)
+
+# (turno_pk, turno_idx, fase, fase_source) en orden de turno_idx
+PostTurn = namedtuple("PostTurn", "turno_pk turno_idx fase fase_source")
+
+
+def _has_fase(fase) -> bool:
+    # Igual que "fase IS NOT NULL AND TRIM(fase)<>''" (TRIM de MySQL solo quita espacios)
+    return fase is not None and fase.strip(" ") != ""
+
+
+def _apply(state, updates, source, counters, key):
+    """Aplica {idx: fase} con fase_source=source; cuenta solo filas que cambian."""
+    for idx, fase in updates.items():
+        row = state[idx]
+        if row[0] != fase or row[1] != source:
+            counters[key] += 1
+        row[0], row[1] = fase, source
+
+
+def _impute_from_neighbor(state, cond, offset, require_both=False):
+    """{idx: fase del vecino idx+offset} para los turnos que cumplen cond(fase, source, idx, vecino)."""
+    updates = {}
+    for idx, (fase, source) in state.items():
+        neighbor = state.get(idx + offset)
+        if neighbor is None or (require_both and (idx - offset) not in state):
+            continue
+        if cond(fase, source, idx, neighbor[0]):
+            updates[idx] = neighbor[0]
+    return updates
+
+
+def _is_noise_sin_fase(fase, source, idx, vecina):
+    return source == 'NOISE' and not _has_fase(fase) and _has_fase(vecina)
+
+
+def _is_apertura_midcall(fase, source, idx, vecina):
+    return fase == 'APERTURA' and idx > 2 and _has_fase(vecina) and vecina != 'APERTURA'
+
+
+def _is_cierre_midcall(fase, source, idx, vecina):
+    return fase == 'CIERRE' and _has_fase(vecina) and vecina != 'CIERRE'
+
+
+def _backfill(state, order, fase_objetivo):
+    """
+    {idx: última fase válida (con fase y distinta de fase_objetivo) de un turno anterior}
+    para los turnos con fase_objetivo que tienen turno siguiente.
+    """
+    updates = {}
+    last_valid = None
+    for idx in order:
+        fase = state[idx][0]
+        if fase == fase_objetivo and last_valid is not None and (idx + 1) in state:
+            updates[idx] = last_valid
+        if _has_fase(fase) and fase != fase_objetivo:
+            last_valid = fase
+    return updates
+
+
+def postprocess_conversation(turns, counters=None):
+    """
+    Corrige los turnos de una conversación (iterable de PostTurn ordenado por
+    turno_idx). Devuelve [(turno_pk, fase, fase_source)] solo de los turnos cuyo
+    valor final difiere del leído; suma en counters (dict PASSES -> int).
+    """
+    if counters is None:
+        counters = dict.fromkeys(PASSES, 0)
+    turns = list(turns)
+    order = [t.turno_idx for t in turns]
+    state = {t.turno_idx: [t.fase, t.fase_source] for t in turns}
+
+    # 1) NOISE sin fase desde el previo y luego desde el siguiente
+    _apply(state, _impute_from_neighbor(state, _is_noise_sin_fase, -1), NOISE_IMPUTE_SOURCE, counters, "noise_prev")
+    _apply(state, _impute_from_neighbor(state, _is_noise_sin_fase, +1), NOISE_IMPUTE_SOURCE, counters, "noise_next")
+
+    # 2) y 3) APERTURA en mitad de llamada
+    _apply(state, _impute_from_neighbor(state, _is_apertura_midcall, -1),
+           APERTURA_IMPUTE_SOURCE, counters, "apertura_impute")
+    _apply(state, _backfill(state, order, 'APERTURA'), APERTURA_BACKFILL_SOURCE, counters, "apertura_backfill")
+
+    # 4) y 5) CIERRE en mitad de llamada
+    _apply(state, _impute_from_neighbor(state, _is_cierre_midcall, -1, require_both=True),
+           CIERRE_IMPUTE_SOURCE, counters, "cierre_impute")
+    _apply(state, _backfill(state, order, 'CIERRE'), CIERRE_BACKFILL_SOURCE, counters, "cierre_backfill")
+
+    # 6) CIERRE en el turno 1
+    if 1 in state and 2 in state and state[1][0] == 'CIERRE' and _has_fase(state[2][0]):
+        _apply(state, {1: state[2][0]}, CIERRE_FIX1_SOURCE, counters, "turno1_cierre")
+
+    return [
+        (t.turno_pk, state[t.turno_idx][0], state[t.turno_idx][1])
+        for t in turns
+        if (state[t.turno_idx][0], state[t.turno_idx][1]) != (t.fase, t.fase_source)
+    ]
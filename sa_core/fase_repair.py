@@ -0,0 +1,212 @@
+# sa_core/fase_repair.py
+"""
+Motor de reparación de fases: postprocess + suavizado + fase_seq en una pasada.
+
+Antes eran tres etapas que releían todos los turnos de la ejecución y
+reescribían fases por separado (postprocess_ejecucion, suavizar_fases_por_secuencia
+con SELECT por conversación y UPDATE por cambio, build_fase_seq con SELECT por
+conversación y UPDATE por turno). run_repair() lee cada conversación una sola
+vez (sa_core.conv_stream.iter_conversations, keyset paginado), corre las pasadas
+configuradas en orden sobre los turnos en memoria y escribe un único diff de
+fase / fase_conf / fase_source / fase_seq con un UPDATE ... JOIN sobre tabla
+temporal.
+
+Pasadas (REPAIR_PASSES; cada una se puede apagar para comparar A/B):
+- postprocess: correcciones NOISE / APERTURA / CIERRE (sa_core.fase_postprocess)
+- smooth: suavizado de transiciones ilegales (sa_core.fase_smoothing)
+- fase_seq: fase estabilizada para secuencias (sa_core.fase_seq_rules)
+"""
+from decimal import Decimal
+
+from sa_core.conv_stream import PAGE_SIZE, iter_conversations
+from sa_core.db import bulk_update_via_temp_table
+from sa_core.fase_postprocess import PASSES as POSTPROCESS_COUNTERS
+from sa_core.fase_postprocess import PostTurn, postprocess_conversation
+from sa_core.fase_seq_rules import FASE_SEQ_STATS, apply_stabilization_rules
+from sa_core.fase_smoothing import SMOOTH_CONF, SMOOTH_SOURCE, count_violations, smooth_conversation
+
+REPAIR_PASSES = ("postprocess", "smooth", "fase_seq")
+DIFF_COLUMNS = ("fase", "fase_conf", "fase_source", "fase_seq")
+REPAIR_COLUMNS = [("fase", "VARCHAR(32)"), ("fase_conf", "DECIMAL(6,4)"), ("fase_source", "VARCHAR(16)"),
+                  ("fase_seq", "VARCHAR(64)")]
+
+
+def parse_passes(value) -> tuple:
+    """'postprocess,smooth' -> ('postprocess', 'smooth'); valida los nombres."""
+    if isinstance(value, str):
+        value = [p.strip() for p in value.split(",")]
+    passes = tuple(p for p in value if p)
+    unknown = [p for p in passes if p not in REPAIR_PASSES]
+    if unknown:
+        raise ValueError(f"Pasadas desconocidas: {', '.join(unknown)} (opciones: {', '.join(REPAIR_PASSES)})")
+    return passes
+
+
+def new_repair_stats(passes) -> dict:
+    stats = {"conversaciones": 0, "turnos": 0, "diff": 0, "escritos": 0,
+             "por_columna": dict.fromkeys(DIFF_COLUMNS, 0)}
+    if "postprocess" in passes:
+        stats["postprocess"] = dict.fromkeys(POSTPROCESS_COUNTERS, 0)
+    if "smooth" in passes:
+        stats["smooth"] = {"violations_before": 0, "violations_after": 0, "changes": 0}
+    if "fase_seq" in passes:
+        stats["fase_seq"] = dict.fromkeys(FASE_SEQ_STATS, 0)
+    return stats
+
+
+# -----------------------
+# Pasadas: (turns, ctx, stats) -> None, modifican los dicts de turns
+# -----------------------
+def _postprocess_pass(turns, ctx, stats):
+    post = [PostTurn(t["turno_pk"], t["turno_idx"], t["fase"], t["fase_source"]) for t in turns]
+    patch = {pk: (fase, source) for pk, fase, source in postprocess_conversation(post, stats["postprocess"])}
+    for t in turns:
+        if t["turno_pk"] in patch:
+            t["fase"], t["fase_source"] = patch[t["turno_pk"]]
+
+
+def _smooth_pass(turns, ctx, stats):
+    local = [
+        {
+            "turno_pk": t["turno_pk"],
+            "fase": (t["fase"] or "").strip().upper(),
+            "fase_conf": float(t["fase_conf"]) if t["fase_conf"] is not None else None,
+            "fase_source": (t["fase_source"] or ""),
+        }
+        for t in turns
+    ]
+    st = stats["smooth"]
+    st["violations_before"] += count_violations(local)
+    for pos, _old, new_phase in smooth_conversation(local, ctx["conf_min"]):
+        turns[pos]["fase"], turns[pos]["fase_conf"], turns[pos]["fase_source"] = new_phase, SMOOTH_CONF, SMOOTH_SOURCE
+        st["changes"] += 1
+    st["violations_after"] += count_violations(local)
+
+
+def _fase_seq_pass(turns, ctx, stats):
+    updates, st = apply_stabilization_rules(turns, ctx["macro_map"])
+    for t, (_pk, fase_seq) in zip(turns, updates):
+        t["fase_seq"] = fase_seq
+    for key in FASE_SEQ_STATS:
+        stats["fase_seq"][key] += st.get(key, 0)
+
+
+PASS_FUNCS = {
+    "postprocess": _postprocess_pass,
+    "smooth": _smooth_pass,
+    "fase_seq": _fase_seq_pass,
+}
+
+
+def _conf_key(conf):
+    return None if conf is None else round(float(conf), 4)
+
+
+def _row_key(t):
+    return (t["fase"], _conf_key(t["fase_conf"]), t["fase_source"], t["fase_seq"])
+
+
+def repair_conversation(turns, passes, ctx, stats) -> list:
+    """
+    Corre las pasadas (en el orden dado) sobre los turnos de una conversación
+    (dicts con turno_pk, turno_idx, fase, fase_conf, fase_source, fase_seq,
+    speaker, text; ordenados por turno_idx). Devuelve el diff:
+    [(turno_pk, fase, fase_conf, fase_source, fase_seq)] de los turnos que cambian.
+    """
+    before = [_row_key(t) for t in turns]
+    for name in passes:
+        PASS_FUNCS[name](turns, ctx, stats)
+    diff = []
+    for t, old in zip(turns, before):
+        new = _row_key(t)
+        if new == old:
+            continue
+        for col, a, b in zip(DIFF_COLUMNS, old, new):
+            if a != b:
+                stats["por_columna"][col] += 1
+        conf = None if t["fase_conf"] is None else Decimal(f"{float(t['fase_conf']):.4f}")
+        diff.append((t["turno_pk"], t["fase"], conf, t["fase_source"], t["fase_seq"]))
+    return diff
+
+
+# -----------------------
+# BD
+# -----------------------
+def _has_fase_seq_column(cur) -> bool:
+    cur.execute("""
+        SELECT COUNT(*)
+        FROM information_schema.COLUMNS
+        WHERE TABLE_SCHEMA = DATABASE() AND TABLE_NAME = 'sa_turnos' AND COLUMN_NAME = 'fase_seq'
+    """)
+    return int(cur.fetchone()[0]) > 0
+
+
+def _load_macro_map(cur) -> dict:
+    # Igual que build_fase_seq.load_macro_map: sin tabla, cada fase es su propia macro
+    try:
+        cur.execute("SELECT fase, macro_fase FROM sa_fase_macro_map")
+        return {fase: macro for fase, macro in cur.fetchall()}
+    except Exception as e:
+        print(f"[repair] WARNING: no se pudo cargar sa_fase_macro_map: {e}")
+        return {}
+
+
+def iter_repair_conversations(cur, ejecucion_id: int, with_fase_seq: bool, page_size: int = PAGE_SIZE):
+    """(conversacion_pk, [turno dict, ...]) de la ejecución (iter_conversations; fase_seq None sin la columna)."""
+    columns = ["fase", "fase_conf", "fase_source", "speaker", "text"] + (["fase_seq"] if with_fase_seq else [])
+    for conv, records in iter_conversations(cur, ejecucion_id, columns, page_size=page_size):
+        yield conv.conversacion_pk, [{**t.as_dict(), "fase_seq": t.get("fase_seq")} for t in records]
+
+
+def run_repair(conn, ejecucion_id: int, passes=REPAIR_PASSES, conf_min: float = 0.40, write: bool = False,
+               verbose: bool = False, page_size: int = PAGE_SIZE) -> dict:
+    """
+    Repara las fases de la ejecución con las pasadas indicadas y (con write)
+    aplica el diff en una sola escritura + commit. Devuelve las estadísticas
+    (por pasada, cambios por columna, turnos escritos).
+    """
+    passes = parse_passes(passes)
+    stats = new_repair_stats(passes)
+    cur = conn.cursor()
+    try:
+        with_fase_seq = _has_fase_seq_column(cur)
+        ctx = {"conf_min": conf_min, "macro_map": {}}
+        if "fase_seq" in passes:
+            if not with_fase_seq and write:
+                cur.execute("ALTER TABLE sa_turnos ADD COLUMN fase_seq VARCHAR(64) NULL")
+                with_fase_seq = True
+            ctx["macro_map"] = _load_macro_map(cur)
+
+        diff = []
+        for conv_pk, turns in iter_repair_conversations(cur, ejecucion_id, with_fase_seq, page_size):
+            conv_diff = repair_conversation(turns, passes, ctx, stats)
+            diff.extend(conv_diff)
+            stats["conversaciones"] += 1
+            stats["turnos"] += len(turns)
+            if verbose and conv_diff:
+                print(f"[repair] conv_pk={conv_pk} turnos={len(turns)} cambios={len(conv_diff)}")
+        stats["diff"] = len(diff)
+
+        if write and diff:
+            columns = REPAIR_COLUMNS if with_fase_seq else REPAIR_COLUMNS[:-1]
+            rows = diff if with_fase_seq else [row[:-1] for row in diff]
+            stats["escritos"] = bulk_update_via_temp_table(cur, "sa_turnos", "turno_pk", columns, rows)
+            conn.commit()
+    except Exception:
+        conn.rollback()
+        raise
+    finally:
+        cur.close()
+    return stats
+
+
+def format_repair_stats(stats: dict) -> str:
+    lines = [
+        f"conversaciones={stats['conversaciones']} turnos={stats['turnos']} diff={stats['diff']} "
+        f"escritos={stats['escritos']} "
+        + " ".join(f"{col}={n}" for col, n in stats["por_columna"].items())
+    ]
+    for name in REPAIR_PASSES:
+        if name in stats:
+            lines.append(f"  {name}: " + " ".join(f"{k}={v}" for k, v in stats[name].items()))
+    return "\n".join(lines)
@@ -0,0 +1,225 @@
+# sa_core/fase_seq_rules.py
+"""
+Reglas de estabilización de fase_seq (fase estabilizada para análisis de
+secuencias): reducen zigzag y retrocesos sobre la fase original.
+
+Lógica pura por conversación; la usan scripts/build_fase_seq.py y el motor de
+reparación (sa_core.fase_repair, pasada "fase_seq").
+"""
+import re
+
+# Orden de macrofases (para detectar retrocesos)
+MACRO_ORDER = {
+    'APERTURA': 1,
+    'IDENTIFICACION': 2,
+    'INFORMACION_DEUDA': 3,
+    'NEGOCIACION': 4,
+    'CONSULTA_ACEPTACION': 5,
+    'FORMALIZACION_PAGO': 6,
+    'ADVERTENCIAS': 7,
+    'CIERRE': 8,
+}
+
+# Patrones para casos especiales
+PATTERN_DNI = re.compile(r'\d{7,}')  # DNI/documento
+PATTERN_FECHA = re.compile(r'\d{1,2}[/-]\d{1,2}[/-]\d{2,4}')  # Fecha
+PATTERN_DEUDA = re.compile(r'saldo|deuda|mora|vencid|balance|importe', re.IGNORECASE)
+
+
+# Contadores de apply_stabilization_rules (en orden de reporte)
+FASE_SEQ_STATS = (
+    'total', 'null_kept', 'short_client_kept', 'backtrack_prevented', 'identificacion_forced', 'info_deuda_forced',
+    'apertura_blocked', 'formalizacion_blocked', 'info_deuda_blocked', 'formalizacion_kept', 'advertencias_kept',
+    'normal',
+)
+
+
+def get_macro_fase(fase, macro_map):
+    """Obtiene la macrofase para una fase dada"""
+    if not fase or fase.strip() == '':
+        return None
+    
+    # Buscar en el mapa
+    if fase in macro_map:
+        return macro_map[fase]
+    
+    # Fallback: usar la misma fase como macro
+    return fase
+
+
+def is_short_client_response(text, speaker):
+    """Detecta si es una respuesta corta del cliente"""
+    if speaker != 'CLIENTE':
+        return False
+    
+    if not text:
+        return False
+    
+    text_clean = text.strip()
+    
+    # Respuestas muy cortas (<=6 caracteres)
+    if len(text_clean) <= 6:
+        return True
+    
+    # Respuestas monosilábicas comunes
+    short_responses = {'si', 'sí', 'no', 'ok', 'vale', 'ya', 'ajá', 'ajá', 'mmm', 'ehh', '...'}
+    if text_clean.lower() in short_responses:
+        return True
+    
+    return False
+
+
+def detect_identificacion_indicators(text, speaker):
+    """Detecta si el texto contiene indicadores de IDENTIFICACION"""
+    if speaker != 'CLIENTE':
+        return False
+    
+    if not text:
+        return False
+    
+    # Buscar DNI o fecha
+    if PATTERN_DNI.search(text) or PATTERN_FECHA.search(text):
+        return True
+    
+    return False
+
+
+def detect_informacion_deuda_indicators(text):
+    """Detecta si el texto contiene indicadores de INFORMACION_DEUDA"""
+    if not text:
+        return False
+    
+    return bool(PATTERN_DEUDA.search(text))
+
+
+def apply_stabilization_rules(turnos, macro_map):
+    """
+    Aplica reglas de estabilización para calcular fase_seq
+    
+    Returns:
+        list: Lista de (turno_pk, fase_seq) para actualizar
+        dict: Estadísticas de aplicación de reglas
+    """
+    updates = []
+    stats = {
+        'total': len(turnos),
+        'null_kept': 0,
+        'short_client_kept': 0,
+        'backtrack_prevented': 0,
+        'identificacion_forced': 0,
+        'info_deuda_forced': 0,
+        'apertura_blocked': 0,          # F
+        'formalizacion_blocked': 0,     # G
+        'info_deuda_blocked': 0,        # H
+        'formalizacion_kept': 0,        # I
+        'advertencias_kept': 0,         # J
+        'normal': 0,
+    }
+    
+    prev_macro = None
+    
+    for idx, turno in enumerate(turnos):
+        turno_pk = turno['turno_pk']
+        turno_idx = turno['turno_idx']
+        fase = turno['fase']
+        speaker = turno['speaker']
+        text = turno['text'] or ''
+        
+        # REGLA A: NULL/vacío -> mantener NULL
+        if not fase or fase.strip() == '':
+            updates.append((turno_pk, None))
+            stats['null_kept'] += 1
+            continue
+        
+        # Mapear a macro
+        current_macro = get_macro_fase(fase, macro_map)
+        
+        if not current_macro:
+            updates.append((turno_pk, None))
+            stats['null_kept'] += 1
+            continue
+        
+        # REGLA B: Respuestas cortas del CLIENTE -> mantener fase anterior
+        if is_short_client_response(text, speaker):
+            if prev_macro:
+                updates.append((turno_pk, prev_macro))
+                stats['short_client_kept'] += 1
+                continue
+        
+        # REGLA D: IDENTIFICACION al inicio (primeros 6 turnos)
+        if turno_idx <= 6 and detect_identificacion_indicators(text, speaker):
+            current_macro = 'IDENTIFICACION'
+            updates.append((turno_pk, current_macro))
+            stats['identificacion_forced'] += 1
+            prev_macro = current_macro
+            continue
+        
+        # REGLA E: INFORMACION_DEUDA por keywords
+        # PERO NO si ya estamos en NEGOCIACION o más (evitar zigzag)
+        if detect_informacion_deuda_indicators(text):
+            # Verificar si ya estamos en NEGOCIACION o más
+            allow_info_deuda = True
+            if prev_macro and prev_macro in MACRO_ORDER:
+                prev_order = MACRO_ORDER[prev_macro]
+                if prev_order >= 4:  # NEGOCIACION o posterior
+                    allow_info_deuda = False
+            
+            if allow_info_deuda:
+                current_macro = 'INFORMACION_DEUDA'
+                updates.append((turno_pk, current_macro))
+                stats['info_deuda_forced'] += 1
+                prev_macro = current_macro
+                continue
+        
+        # REGLA C: No retroceder más de 2 niveles
+        if prev_macro and current_macro in MACRO_ORDER and prev_macro in MACRO_ORDER:
+            current_order = MACRO_ORDER[current_macro]
+            prev_order = MACRO_ORDER[prev_macro]
+            
+            if current_order < prev_order:
+                diff = prev_order - current_order
+                if diff >= 2:
+                    # Retroceso fuerte: mantener fase anterior
+                    updates.append((turno_pk, prev_macro))
+                    stats['backtrack_prevented'] += 1
+                    continue
+        
+        # REGLAS MONOTÓNICAS F-J (modifican current_macro, no hacen continue)
+        
+        # REGLA F: BLOQUEAR APERTURA una vez en IDENTIFICACION o más
+        if prev_macro and prev_macro in MACRO_ORDER:
+            prev_order = MACRO_ORDER[prev_macro]
+            if prev_order >= 2 and current_macro == 'APERTURA':
+                current_macro = prev_macro
+                stats['apertura_blocked'] += 1
+        
+        # REGLA G: BLOQUEAR FORMALIZACION_PAGO antes de NEGOCIACION
+        if prev_macro and prev_macro in MACRO_ORDER:
+            prev_order = MACRO_ORDER[prev_macro]
+            if current_macro == 'FORMALIZACION_PAGO' and prev_order < 4:
+                current_macro = prev_macro
+                stats['formalizacion_blocked'] += 1
+        
+        # REGLA H: Una vez en NEGOCIACION, no volver a INFORMACION_DEUDA
+        if prev_macro == 'NEGOCIACION' and current_macro == 'INFORMACION_DEUDA':
+            current_macro = 'NEGOCIACION'
+            stats['info_deuda_blocked'] += 1
+        
+        # REGLA I: Una vez en FORMALIZACION_PAGO, mantener hasta CIERRE (salvo ADVERTENCIAS y CIERRE)
+        if prev_macro == 'FORMALIZACION_PAGO':
+            if current_macro in ('NEGOCIACION', 'CONSULTA_ACEPTACION', 'INFORMACION_DEUDA', 'IDENTIFICACION', 'APERTURA'):
+                current_macro = 'FORMALIZACION_PAGO'
+                stats['formalizacion_kept'] += 1
+        
+        # REGLA J: Después de ADVERTENCIAS, no volver a FORMALIZACION/CONSULTA/NEGOCIACION/INFO_DEUDA
+        if prev_macro == 'ADVERTENCIAS':
+            if current_macro in ('FORMALIZACION_PAGO', 'CONSULTA_ACEPTACION', 'NEGOCIACION', 'INFORMACION_DEUDA'):
+                current_macro = 'ADVERTENCIAS'
+                stats['advertencias_kept'] += 1
+        
+        # Caso normal: usar macro actual (posiblemente modificado por F-J)
+        updates.append((turno_pk, current_macro))
+        stats['normal'] += 1
+        prev_macro = current_macro
+    
+    return updates, stats
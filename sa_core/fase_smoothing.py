@@ -0,0 +1,108 @@
+# sa_core/fase_smoothing.py
+"""
+Suavizado de fases por secuencia (transiciones ilegales entre turnos vecinos).
+
+Lógica pura sobre la lista de turnos de una conversación; la usan
+scripts/suavizar_fases_por_secuencia.py y el motor de reparación
+(sa_core.fase_repair, pasada "smooth").
+"""
+from typing import Dict, List, Tuple
+
+SMOOTH_SOURCE = "SMOOTH"
+SMOOTH_CONF = 0.55             # confianza estándar de un turno suavizado
+STRONG_DEEPSEEK_CONF = 0.70    # DEEPSEEK con conf >= esto no se toca
+
+ALLOWED_TRANSITIONS: Dict[str, set] = {
+    "APERTURA": {"APERTURA", "IDENTIFICACION"},
+    "IDENTIFICACION": {"IDENTIFICACION", "INFORMACION_DEUDA"},
+    "INFORMACION_DEUDA": {"INFORMACION_DEUDA", "NEGOCIACION", "ADVERTENCIAS"},
+    "NEGOCIACION": {"NEGOCIACION", "CONSULTA_ACEPTACION", "INFORMACION_DEUDA"},
+    "CONSULTA_ACEPTACION": {"CONSULTA_ACEPTACION", "FORMALIZACION_PAGO", "NEGOCIACION"},
+    "FORMALIZACION_PAGO": {"FORMALIZACION_PAGO", "CIERRE"},
+    "ADVERTENCIAS": {"ADVERTENCIAS", "CIERRE", "NEGOCIACION", "INFORMACION_DEUDA"},
+    "CIERRE": {"CIERRE"},
+}
+
+
+def is_allowed(a: str, b: str) -> bool:
+    if not a or not b:
+        return True
+    a = a.strip().upper()
+    b = b.strip().upper()
+    return b in ALLOWED_TRANSITIONS.get(a, {a}) or a == b
+
+
+def _intermediate_for(a: str, b: str) -> str | None:
+    a = (a or "").strip().upper()
+    b = (b or "").strip().upper()
+    if a == "APERTURA" and b == "NEGOCIACION":
+        return "IDENTIFICACION"
+    if a == "NEGOCIACION" and b == "IDENTIFICACION":
+        return "INFORMACION_DEUDA"
+    return None
+
+
+def count_violations(local: List[dict]) -> int:
+    """Transiciones ilegales entre turnos consecutivos con fase."""
+    violations = 0
+    for i in range(len(local) - 1):
+        a = local[i]["fase"]
+        b = local[i + 1]["fase"]
+        if a and b and not is_allowed(a, b):
+            violations += 1
+    return violations
+
+
+def smooth_conversation(local: List[dict], conf_min: float = 0.40) -> List[Tuple[int, str, str]]:
+    """
+    Una pasada de suavizado sobre los turnos de una conversación (ordenados por
+    turno_idx; cada uno con fase normalizada en mayúsculas, fase_conf float o None
+    y fase_source). Modifica local en el lugar y devuelve [(posición, fase_vieja, fase_nueva)].
+    """
+    changes = []
+    for i in range(len(local) - 1):
+        a = local[i]["fase"]
+        b = local[i + 1]["fase"]
+        if not a or not b:
+            continue
+        if is_allowed(a, b):
+            continue
+
+        # Protection: don't touch strong DeepSeek
+        prot_a = (local[i]["fase_source"] == "DEEPSEEK" and (local[i]["fase_conf"] or 0) >= STRONG_DEEPSEEK_CONF)
+        prot_b = (local[i + 1]["fase_source"] == "DEEPSEEK" and (local[i + 1]["fase_conf"] or 0) >= STRONG_DEEPSEEK_CONF)
+
+        conf_a = (local[i]["fase_conf"] or 0.0)
+        conf_b = (local[i + 1]["fase_conf"] or 0.0)
+
+        new_phase = None
+        target_idx = None
+
+        # Prefer modify the lower confidence turn
+        if (not prot_b) and (conf_b < conf_a or conf_b < conf_min):
+            # change B to A
+            new_phase = a
+            target_idx = i + 1
+        elif (not prot_a) and (conf_a < conf_min):
+            # change A to B
+            new_phase = b
+            target_idx = i
+        else:
+            mid = _intermediate_for(a, b)
+            if mid:
+                if not prot_b and (conf_b <= conf_a):
+                    new_phase = mid
+                    target_idx = i + 1
+                elif not prot_a:
+                    new_phase = mid
+                    target_idx = i
+
+        if new_phase and target_idx is not None:
+            old_phase = local[target_idx]["fase"]
+            if old_phase == new_phase:
+                continue
+            local[target_idx]["fase"] = new_phase
+            local[target_idx]["fase_conf"] = SMOOTH_CONF
+            local[target_idx]["fase_source"] = SMOOTH_SOURCE
+            changes.append((target_idx, old_phase, new_phase))
+    return changes
@@ -0,0 +1,88 @@
+# sa_core/fase_triage.py
+"""
+Triage entre el motor de reglas y el LLM.
+
+Los turnos que las reglas dejan pendientes (conf < umbral) iban todos al LLM,
+aunque muchos son casos obvios mirando el contexto. triage_turn() los resuelve
+localmente solo cuando hay certeza alta y devuelve None para los ambiguos:
+
+- MARGEN: las reglas tienen un candidato con score >= TRIAGE_MIN_SCORE, una
+  ventaja >= min_margin sobre el segundo (detect_fase_rules_ranked) y la fase
+  coincide con la del turno anterior, el siguiente o last_phase.
+- VECINOS: turno corto entre dos turnos con la misma fase y sin evidencia de
+  reglas en contra.
+- SPEAKER: respuesta corta del CLIENTE sin evidencia de reglas justo después
+  de un turno del AGENTE con fase: hereda esa fase.
+
+Cada turno resuelto acá es una llamada al LLM menos (fase_source='TRIAGE').
+"""
+from collections import namedtuple
+
+from sa_core.fases_rules import detect_fase_rules_ranked
+
+TRIAGE_SOURCE = "TRIAGE"
+TRIAGE_CONF = 0.60
+
+TRIAGE_MIN_SCORE = 2      # mismo piso que _pick_fase para considerar que una regla "habló"
+TRIAGE_MIN_MARGIN = 2
+SANDWICH_MAX_WORDS = 12
+SHORT_MAX_WORDS = 7
+
+TRIAGE_REASONS = ("MARGEN", "VECINOS", "SPEAKER")
+
+TriageDecision = namedtuple("TriageDecision", "fase conf reason")
+
+
+def _blank(s) -> bool:
+    return s is None or str(s).strip() == ""
+
+
+def _speaker(s) -> str:
+    return (s or "").strip().upper()
+
+
+def triage_turn(text: str, turn_idx: int, total_turns: int, last_phase: str | None = None,
+                prev_fase: str | None = None, next_fase: str | None = None,
+                speaker: str | None = None, prev_speaker: str | None = None,
+                min_margin: int = TRIAGE_MIN_MARGIN, last_window: int = 3):
+    """
+    Decide localmente la fase de un turno pendiente o devuelve None (va al LLM).
+
+    Args:
+        prev_fase / next_fase: fase actual de los turnos idx-1 / idx+1 (None si no tienen)
+        speaker / prev_speaker: columna speaker del turno y del anterior (AGENTE / CLIENTE)
+        min_margin: ventaja mínima del mejor score de reglas sobre el segundo
+    """
+    prev_fase = None if _blank(prev_fase) else prev_fase.strip()
+    next_fase = None if _blank(next_fase) else next_fase.strip()
+    last_phase = None if _blank(last_phase) else last_phase.strip()
+    n_words = len((text or "").split())
+
+    fase, conf, _score, _second, second_score, margin = detect_fase_rules_ranked(
+        text or "", turn_idx, total_turns, last_phase, (total_turns - turn_idx) < last_window
+    )
+    top_score = second_score + margin
+    rules_silent = top_score < TRIAGE_MIN_SCORE
+
+    # 1) Reglas con ventaja clara y confirmadas por el contexto
+    if (fase and top_score >= TRIAGE_MIN_SCORE and margin >= min_margin
+            and fase in (prev_fase, next_fase, last_phase)):
+        return TriageDecision(fase, round(max(conf, TRIAGE_CONF), 4), "MARGEN")
+
+    # 2) Sándwich: misma fase antes y después
+    if prev_fase and prev_fase == next_fase and n_words <= SANDWICH_MAX_WORDS and (rules_silent or fase == prev_fase):
+        return TriageDecision(prev_fase, TRIAGE_CONF, "VECINOS")
+
+    # 3) Respuesta corta del cliente al agente
+    if (prev_fase and rules_silent and n_words <= SHORT_MAX_WORDS
+            and _speaker(speaker) == "CLIENTE" and _speaker(prev_speaker) == "AGENTE"):
+        return TriageDecision(prev_fase, TRIAGE_CONF, "SPEAKER")
+
+    return None
+
+
+def format_triage(resolved: dict, sent_to_llm: int, calls_avoided: int) -> str:
+    """resolved: {reason: n}. Línea de reporte para CLI / UI."""
+    total = sum(resolved.values())
+    por_motivo = " ".join(f"{r.lower()}={resolved.get(r, 0)}" for r in TRIAGE_REASONS)
+    return f"resueltos_local={total} ({por_motivo}) ambiguos_al_llm={sent_to_llm} llamadas_evitadas={calls_avoided}"
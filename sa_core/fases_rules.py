@@ -1,26 +1,12 @@
 # sa_core/fases_rules.py
 import re
-import unicodedata
-from collections import defaultdict
-
-# -----------------------
-# Normalización
-# -----------------------
-def normalize_text(s: str) -> str:
-    """
-    lower + remover tildes (diacríticos) + colapsar espacios.
-    Importante: NO elimina símbolos como '/', '.', 'S/'.
-    """
-    if not s:
-        return ""
-    s = s.lower()
-    s = unicodedata.normalize("NFD", s)
-    s = "".join(ch for ch in s if unicodedata.category(ch) != "Mn")
-    # Eliminar símbolos comunes que pueden distorsionar tokens (mantener letras y números)
-    s = re.sub(r"[\./:;,_-]", " ", s)
-    s = re.sub(r"\s+", " ", s).strip()
-    return s
+from collections import defaultdict, deque
+from concurrent.futures import ProcessPoolExecutor
 
+from sa_core.db import bulk_update_via_temp_table
+# normalize_text vive en sa_core.normalizacion (caché LRU compartida entre etapas);
+# se re-exporta aquí por compatibilidad.
+from sa_core.normalizacion import ensure_text_norm_column, format_cache_stats, normalize_text
 
 # -----------------------
 # Reglas por fase (Perú)
@@ -105,126 +91,176 @@ def _phase_index(phase: str) -> int:
         return -1
 
 
-def detect_fase_rules_based(text: str, turn_idx: int, total_turns: int, last_phase: str | None = None, is_last_turns: bool = False):
+# -----------------------
+# Motor de scoring
+# -----------------------
+# normalize_text() ya deja el texto en minúsculas y sin tildes, así que las reglas
+# escritas en minúsculas pueden evaluarse sin re.IGNORECASE (bastante más rápido
+# en el motor de re). Las únicas letras que re.I haría coincidir y que sobreviven a
+# lower() son 'ı' y 'ſ': si aparecen, se usan los patrones originales con re.I.
+_CASEFOLD_SPECIAL_RE = re.compile("[\u0131\u017f]")
+
+_FASE_INDEX = {fase: i for i, fase in enumerate(FASE_SEQUENCE)}
+_N_FASES = len(FASE_SEQUENCE)
+I_APERTURA = _FASE_INDEX["APERTURA"]
+I_INFORMACION_DEUDA = _FASE_INDEX["INFORMACION_DEUDA"]
+I_NEGOCIACION = _FASE_INDEX["NEGOCIACION"]
+I_CONSULTA_ACEPTACION = _FASE_INDEX["CONSULTA_ACEPTACION"]
+I_FORMALIZACION_PAGO = _FASE_INDEX["FORMALIZACION_PAGO"]
+I_CIERRE = _FASE_INDEX["CIERRE"]
+
+
+def _case_sensitive(pattern):
+    # Solo si el patrón no tiene mayúsculas (p.ej. \S, \B): lower() no lo altera
+    if pattern.pattern == pattern.pattern.lower():
+        return re.compile(pattern.pattern, pattern.flags & ~re.IGNORECASE)
+    return pattern
+
+
+# (indice_fase, peso, search) en el mismo orden que FASE_RULES
+_RULES_IGNORECASE = [
+    (_FASE_INDEX[fase], weight, pattern.search)
+    for fase, rules in FASE_RULES.items()
+    for pattern, weight in rules.items()
+]
+_RULES_FAST = [
+    (_FASE_INDEX[fase], weight, _case_sensitive(pattern).search)
+    for fase, rules in FASE_RULES.items()
+    for pattern, weight in rules.items()
+]
+
+# Heurísticas contextuales (antes se compilaban en cada llamada)
+DIGAME_RE = re.compile(r"digame[.!]?")
+SI_TEMPRANO_RE = re.compile(r"(si|si senorita|si señorita)[.!]?")
+YA_ACK_RE = re.compile(r"ya[.!]?")
+CONTEXT_NEG_RE = re.compile(r"\b(mi esposo|mi hijo|mis hijos|familiar|familia|gastos|trabaj|desemplead|no tengo|no puedo|ingreso|morosidad|coordinar|comunicar|no se ha podido|no han podido|unos dias|deme unos dias|minimo|mínimo|catalogo|catálogo|ventas|vendo|no vende|no se vende|no pide|no hay)\b", re.I)
+ANTIGUEDAD_RE = re.compile(r"\b\d+\s*(anos?|a[nñ]os?|mes(es)?)\b")
+BUEN_TIEMPO_RE = re.compile(r"\b(buen tiempo|hace tiempo|ya tengo)\b")
+ONLY_DIGITS_RE = re.compile(r"(ya[.,]?\s*)?[0-9\s\.,-]+")
+TARJETA_RE = re.compile(r"\btarjeta\b")
+FOLLOWUP_RE = re.compile(r"devolver la llamada|horario|a que hora|me podria llamar|podria llamar|manana")
+CONTACT_RE = re.compile(r"\b(me podria llamar|podria llamar|me puede llamar|lo llamo|le llamo)\b")
+TIMING_RE = re.compile(r"\b(manana|horario|coordino|coordinar)\b")
+CON_QUIEN_RE = re.compile(r"con quien tengo el gusto")
+MONTO_DEUDA_RE = re.compile(r"\b(deuda|saldo|monto|soles?|s/|tanto)\b")
+SINGLE_DIGITS_SEQ_RE = re.compile(r"(?:\b\d\b[\s\.\-]*){3,}")
+LE_REPITO_RE = re.compile(r"\b(como le repito|le repito)\b", re.I)
+OK_RE = re.compile(r"\bok\b")
+CUANDO_BRIND_RE = re.compile(r"\bcuando le brind")
+SALUDO_INICIO_RE = re.compile(r"\b(al[oó]|buenos dias|buenas tardes|buenas noches|digame)\b", re.I)
+
+CONTINUITY_PHASES = {"INFORMACION_DEUDA", "NEGOCIACION", "CONSULTA_ACEPTACION", "FORMALIZACION_PAGO", "CIERRE"}
+
+
+def fase_score_vector(t: str) -> list:
     """
-    Returns: (fase_or_None, confidence_float_0_1, max_score_int)
+    Scores base de un texto YA normalizado: lista de len(FASE_SEQUENCE) enteros
+    (mismo orden que FASE_SEQUENCE) con la suma de pesos de las reglas que matchean.
     """
-    t = normalize_text(text)
-    scores = {fase: 0 for fase in FASE_SEQUENCE}
-
-    # Scores base
-    for fase, rules in FASE_RULES.items():
-        for pattern, weight in rules.items():
-            if pattern.search(t):
-                scores[fase] += weight
+    scores = [0] * _N_FASES
+    rules = _RULES_FAST if _CASEFOLD_SPECIAL_RE.search(t) is None else _RULES_IGNORECASE
+    for idx, weight, search in rules:
+        if search(t):
+            scores[idx] += weight
+    return scores
 
 
-    # --- Heurísticas contextuales adicionales y ajustes de pesos ---
+def _apply_context_heuristics(scores, t, turn_idx, total_turns, last_phase, is_last_turns):
+    """Ajustes contextuales sobre el vector de scores (in place). Mismo orden que siempre."""
     # 1) "Dígame." temprano solo si venimos de apertura
-    if last_phase == "APERTURA" and turn_idx <= 5 and len(t) <= 25 and re.fullmatch(r"digame[.!]?", t):
-        scores["APERTURA"] += 3
+    if last_phase == "APERTURA" and turn_idx <= 5 and len(t) <= 25 and DIGAME_RE.fullmatch(t):
+        scores[I_APERTURA] += 3
 
     # 2) "Sí" temprano como confirmación inicial (ahora suma a APERTURA y +4)
-    if last_phase == "APERTURA" and turn_idx <= 5 and len(t) <= 20 and re.fullmatch(r"(si|si senorita|si señorita)[.!]?", t):
-        scores["APERTURA"] += 4
+    if last_phase == "APERTURA" and turn_idx <= 5 and len(t) <= 20 and SI_TEMPRANO_RE.fullmatch(t):
+        scores[I_APERTURA] += 4
 
     # 3) Ack "Ya" ultra corto (limitado por contexto, +4)
-    if len(t) <= 5 and re.fullmatch(r"ya[.!]?", t) and last_phase in ("INFORMACION_DEUDA","NEGOCIACION","CONSULTA_ACEPTACION"):
-        scores["CONSULTA_ACEPTACION"] += 4
+    if len(t) <= 5 and YA_ACK_RE.fullmatch(t) and last_phase in ("INFORMACION_DEUDA", "NEGOCIACION", "CONSULTA_ACEPTACION"):
+        scores[I_CONSULTA_ACEPTACION] += 4
 
     # 4) NEGOCIACION contextual extendida (+4, len>=20, context ampliado)
-    context_neg_words = re.compile(r"\b(mi esposo|mi hijo|mis hijos|familiar|familia|gastos|trabaj|desemplead|no tengo|no puedo|ingreso|morosidad|coordinar|comunicar|no se ha podido|no han podido|unos dias|deme unos dias|minimo|mínimo|catalogo|catálogo|ventas|vendo|no vende|no se vende|no pide|no hay)\b", re.I)
-    if last_phase in ("INFORMACION_DEUDA","NEGOCIACION","CONSULTA_ACEPTACION") and len(t) >= 20 and re.search(context_neg_words, t):
-        scores["NEGOCIACION"] += 4
+    if last_phase in ("INFORMACION_DEUDA", "NEGOCIACION", "CONSULTA_ACEPTACION") and len(t) >= 20 and CONTEXT_NEG_RE.search(t):
+        scores[I_NEGOCIACION] += 4
 
-    # 5) Tiempo/antigüedad como parte de NEGOCIACION (años/meses) +4
-    if last_phase in ("NEGOCIACION","CONSULTA_ACEPTACION") and re.search(r"\b\d+\s*(anos?|a[nñ]os?|mes(es)?)\b", t):
-        scores["NEGOCIACION"] += 4
-
-    # 5b) "buen tiempo" sin números
-    if last_phase in ("NEGOCIACION","CONSULTA_ACEPTACION") and re.search(r"\b(buen tiempo|hace tiempo|ya tengo)\b", t):
-        scores["NEGOCIACION"] += 4
+    if last_phase in ("NEGOCIACION", "CONSULTA_ACEPTACION"):
+        # 5) Tiempo/antigüedad como parte de NEGOCIACION (años/meses) +4
+        if ANTIGUEDAD_RE.search(t):
+            scores[I_NEGOCIACION] += 4
+        # 5b) "buen tiempo" sin números
+        if BUEN_TIEMPO_RE.search(t):
+            scores[I_NEGOCIACION] += 4
 
     # 6) Montos en negociación aunque el score base de NEGOCIACION sea 0, pero SOLO con contexto
     if last_phase == "NEGOCIACION" and NUM_RE.search(t) and PAY_WORDS_RE.search(t):
-        scores["NEGOCIACION"] += 3
+        scores[I_NEGOCIACION] += 3
 
     # 7) Turnos de dígitos con prefijo opcional "ya" dentro de formalización (+5)
-    only_digits = (re.fullmatch(r"(ya[.,]?\s*)?[0-9\s\.,-]+", t) is not None) and (NUM_RE.search(t) is not None)
-    if last_phase == "FORMALIZACION_PAGO" and only_digits and len(t) <= 30:
-        scores["FORMALIZACION_PAGO"] += 5
+    if last_phase == "FORMALIZACION_PAGO" and len(t) <= 30 and ONLY_DIGITS_RE.fullmatch(t) and NUM_RE.search(t):
+        scores[I_FORMALIZACION_PAGO] += 5
 
     # 8) CIERRE por "gracias" muy al final
-    if ("gracias" in t) and (turn_idx >= max(1, total_turns-2)):
-        scores["CIERRE"] += 5
+    if ("gracias" in t) and (turn_idx >= max(1, total_turns - 2)):
+        scores[I_CIERRE] += 5
 
     # 9) "tarjeta" como aclaración en negociación
-    if last_phase in ("NEGOCIACION","CONSULTA_ACEPTACION") and re.search(r"\btarjeta\b", t):
-        scores["NEGOCIACION"] += 4
-
-    # 10) "devolver la llamada / horario" (follow-up) - sin acentos porque normalize_text los elimina
-    if last_phase in ("NEGOCIACION","FORMALIZACION_PAGO") and re.search(r"devolver la llamada|horario|a que hora|me podria llamar|podria llamar|manana", t):
-        scores["NEGOCIACION"] += 4
+    if last_phase in ("NEGOCIACION", "CONSULTA_ACEPTACION") and TARJETA_RE.search(t):
+        scores[I_NEGOCIACION] += 4
 
-    # 10b) Re-contacto/coordinar con condición doble (+6)
     if last_phase in ("NEGOCIACION", "FORMALIZACION_PAGO"):
-        contact_match = re.search(r"\b(me podria llamar|podria llamar|me puede llamar|lo llamo|le llamo)\b", t)
-        timing_match = re.search(r"\b(manana|horario|coordino|coordinar)\b", t)
-        if contact_match and timing_match:
-            scores["NEGOCIACION"] += 6
-
-    # 10c) "con quien tengo el gusto" dentro de negociación/formalización (+4)
-    if last_phase in ("NEGOCIACION", "FORMALIZACION_PAGO") and re.search(r"con quien tengo el gusto", t):
-        scores["NEGOCIACION"] += 4
-
-    # 11) "100 y tanto" como monto de deuda (solo si venimos de INFORMACION_DEUDA)
-    if last_phase == "INFORMACION_DEUDA" and NUM_RE.search(t) and re.search(r"\b(deuda|saldo|monto|soles?|s/|tanto)\b", t):
-        scores["INFORMACION_DEUDA"] += 4
-
-    # 12) Chunks de dígitos en formalización (ej: "9 3 1.", "5 8 6.")
-    if last_phase == "FORMALIZACION_PAGO" and DIGITS_CHUNK_RE.search(t):
-        scores["FORMALIZACION_PAGO"] += 4
-
-    # 13) "Le repito" como refuerzo de información de deuda
-    if last_phase == "INFORMACION_DEUDA" and REPITO_RE.search(t):
-        scores["INFORMACION_DEUDA"] += 3
-
-    # 14) "Cuando le brindo" (turno truncado en negociación)
-    if last_phase == "NEGOCIACION" and WHEN_BRINDO_RE.search(t):
-        scores["NEGOCIACION"] += 3
-
-    # 15) Secuencia de dígitos sueltos hereda formalización (+5)
-    single_digits_seq_re = re.compile(r"(?:\b\d\b[\s\.\-]*){3,}")
-    if last_phase == "FORMALIZACION_PAGO" and single_digits_seq_re.search(t):
-        scores["FORMALIZACION_PAGO"] += 5
-
-    # 16) "como le repito / le repito" refuerza información de deuda (+4)
-    if last_phase == "INFORMACION_DEUDA" and re.search(r"\b(como le repito|le repito)\b", t, re.I):
-        scores["INFORMACION_DEUDA"] += 4
-
-    # 17) Truncado "Ok. Cuando le brindo ..." empuja negociación (+4)
-    if last_phase == "NEGOCIACION" and re.search(r"\bok\b", t) and re.search(r"\bcuando le brind", t):
-        scores["NEGOCIACION"] += 4
+        # 10) "devolver la llamada / horario" (follow-up) - sin acentos porque normalize_text los elimina
+        if FOLLOWUP_RE.search(t):
+            scores[I_NEGOCIACION] += 4
+        # 10b) Re-contacto/coordinar con condición doble (+6)
+        if CONTACT_RE.search(t) and TIMING_RE.search(t):
+            scores[I_NEGOCIACION] += 6
+        # 10c) "con quien tengo el gusto" dentro de negociación/formalización (+4)
+        if CON_QUIEN_RE.search(t):
+            scores[I_NEGOCIACION] += 4
+
+    if last_phase == "INFORMACION_DEUDA":
+        # 11) "100 y tanto" como monto de deuda
+        if NUM_RE.search(t) and MONTO_DEUDA_RE.search(t):
+            scores[I_INFORMACION_DEUDA] += 4
+        # 13) "Le repito" como refuerzo de información de deuda
+        if REPITO_RE.search(t):
+            scores[I_INFORMACION_DEUDA] += 3
+        # 16) "como le repito / le repito" refuerza información de deuda (+4)
+        if LE_REPITO_RE.search(t):
+            scores[I_INFORMACION_DEUDA] += 4
+
+    if last_phase == "FORMALIZACION_PAGO":
+        # 12) Chunks de dígitos en formalización (ej: "9 3 1.", "5 8 6.")
+        if DIGITS_CHUNK_RE.search(t):
+            scores[I_FORMALIZACION_PAGO] += 4
+        # 15) Secuencia de dígitos sueltos hereda formalización (+5)
+        if SINGLE_DIGITS_SEQ_RE.search(t):
+            scores[I_FORMALIZACION_PAGO] += 5
+
+    if last_phase == "NEGOCIACION":
+        # 14) "Cuando le brindo" (turno truncado en negociación)
+        if WHEN_BRINDO_RE.search(t):
+            scores[I_NEGOCIACION] += 3
+        # 17) Truncado "Ok. Cuando le brindo ..." empuja negociación (+4)
+        if OK_RE.search(t) and CUANDO_BRIND_RE.search(t):
+            scores[I_NEGOCIACION] += 4
 
     # Heurística: Saludo/atención solo al inicio (mantener)
-    if turn_idx <= 3 and len(t) <= 20:
-        if re.search(r"\b(al[oó]|buenos dias|buenas tardes|buenas noches|digame)\b", t, re.I):
-            scores["APERTURA"] += 3
-
-
+    if turn_idx <= 3 and len(t) <= 20 and SALUDO_INICIO_RE.search(t):
+        scores[I_APERTURA] += 3
 
     # NEGOCIACION: números + palabras de pago (condicional)
-    if scores["NEGOCIACION"] > 0:
-        if NUM_RE.search(t) and PAY_WORDS_RE.search(t):
-            scores["NEGOCIACION"] += 2
+    if scores[I_NEGOCIACION] > 0 and NUM_RE.search(t) and PAY_WORDS_RE.search(t):
+        scores[I_NEGOCIACION] += 2
 
     # CIERRE: bonus solo si ya matcheó algo de cierre y estamos al final
-    if is_last_turns and scores["CIERRE"] > 0:
-        scores["CIERRE"] += 1  # boost moderado
+    if is_last_turns and scores[I_CIERRE] > 0:
+        scores[I_CIERRE] += 1  # boost moderado
+
 
-    # --- BLOQUE DE RETORNO Y CÁLCULO ---
-    max_score = max(scores.values())
-    CONTINUITY_PHASES = {"INFORMACION_DEUDA","NEGOCIACION","CONSULTA_ACEPTACION","FORMALIZACION_PAGO","CIERRE"}
+def _pick_fase(scores, t, last_phase):
+    """Elige (fase, conf, score) a partir del vector ya ajustado."""
+    max_score = max(scores)
     if max_score < 2:
         # fallback de continuidad para respuestas cortas
         if last_phase in CONTINUITY_PHASES:
@@ -233,24 +269,19 @@ def detect_fase_rules_based(text: str, turn_idx: int, total_turns: int, last_pha
                 return last_phase, min(1.0, 4/7.0), 4
         return None, 0.0, None
 
-    # Elegir mejor fase con desempate por secuencia
-    best = None
-    best_score = -1
-    for fase in FASE_SEQUENCE:
-        sc = scores[fase]
-        if sc > best_score:
-            best_score = sc
-            best = fase
+    # Elegir mejor fase con desempate por secuencia (primer máximo en FASE_SEQUENCE)
+    bi = scores.index(max_score)
+    best = FASE_SEQUENCE[bi]
+    best_score = max_score
 
     # Penalización leve por retroceso fuerte
-    if last_phase and best:
-        li = _phase_index(last_phase)
-        bi = _phase_index(best)
-        if li >= 0 and bi >= 0 and bi + 2 < li:  # retroceso >=3 fases
+    if last_phase:
+        li = _FASE_INDEX.get(last_phase, -1)
+        if li >= 0 and bi + 2 < li:  # retroceso >=3 fases
             best_score = max(0, best_score - 2)
             if best_score < 2:
                 corto = (len(t) <= 45) or (len(t.split()) <= 7)
-                if last_phase and (last_phase in CONTINUITY_PHASES) and corto:
+                if last_phase in CONTINUITY_PHASES and corto:
                     # 2nd-chance continuity fallback
                     return last_phase, min(1.0, 4/7.0), 4
                 return None, 0.0, None
@@ -259,6 +290,100 @@ def detect_fase_rules_based(text: str, turn_idx: int, total_turns: int, last_pha
     return best, conf, best_score
 
 
+def detect_fase_rules_based(text: str, turn_idx: int, total_turns: int, last_phase: str | None = None, is_last_turns: bool = False):
+    """
+    Returns: (fase_or_None, confidence_float_0_1, max_score_int)
+
+    El texto se normaliza y se escanea una vez contra todas las reglas precompiladas
+    (fase_score_vector); luego se aplican las heurísticas contextuales. Resultado
+    idéntico a sa_core.fases_rules_legacy.detect_fase_rules_based_legacy.
+    """
+    return _detect_normalized(normalize_text(text), turn_idx, total_turns, last_phase, is_last_turns)
+
+
+def _detect_normalized(t, turn_idx, total_turns, last_phase, is_last_turns):
+    scores = fase_score_vector(t)
+    _apply_context_heuristics(scores, t, turn_idx, total_turns, last_phase, is_last_turns)
+    return _pick_fase(scores, t, last_phase)
+
+
+def detect_fase_rules_ranked(text: str, turn_idx: int, total_turns: int, last_phase: str | None = None,
+                             is_last_turns: bool = False):
+    """
+    Como detect_fase_rules_based pero conserva el segundo mejor candidato.
+
+    Returns: (fase, conf, score, second_fase, second_score, margin) donde
+    (fase, conf, score) es exactamente lo de detect_fase_rules_based y
+    second_* / margin salen del mismo vector ajustado (margin = max - segundo,
+    0 si no hay reglas que matcheen).
+    """
+    t = normalize_text(text)
+    scores = fase_score_vector(t)
+    _apply_context_heuristics(scores, t, turn_idx, total_turns, last_phase, is_last_turns)
+    fase, conf, score = _pick_fase(scores, t, last_phase)
+    ranked = sorted(range(_N_FASES), key=lambda i: (-scores[i], i))
+    bi, si = ranked[0], ranked[1]
+    second_fase = FASE_SEQUENCE[si] if scores[si] > 0 else None
+    return fase, conf, score, second_fase, scores[si], scores[bi] - scores[si]
+
+
+# -----------------------
+# API batch por conversación
+# -----------------------
+def classify_conversation(turns, total_turns=None, last_idx=None, last_window=3, conf_threshold=0.0,
+                          normalized=False):
+    """
+    Clasifica todos los turnos de una conversación de una vez.
+
+    Args:
+        turns: secuencia ordenada por turno_idx de (turno_idx, text) o
+            (turno_idx, text, fase_fija). Si fase_fija no es vacía el turno no se
+            clasifica (p.ej. ya lo resolvió DEEPSEEK) pero sí alimenta last_phase.
+        total_turns: total_turns para las reglas (default: len(turns))
+        last_idx: turno de referencia para is_last_turns (default: total_turns)
+        last_window: is_last_turns = (last_idx - turno_idx) < last_window
+        conf_threshold: debajo de este umbral la fase se descarta y no avanza last_phase
+        normalized: True si el texto de cada turno ya es normalize_text (p.ej. text_norm)
+
+    Returns:
+        lista alineada con turns de (fase, conf, score). Descartados: (None, 0.0, score).
+        Turnos con fase_fija: (fase_fija, None, None).
+    """
+    n = len(turns)
+    total = n if total_turns is None else int(total_turns)
+    ref = total if last_idx is None else int(last_idx)
+    texts = [turn[1] or "" for turn in turns] if normalized else [normalize_text(turn[1]) for turn in turns]
+
+    results = []
+    last_phase = None
+    for turn, t in zip(turns, texts):
+        turno_idx = int(turn[0])
+        fase_fija = turn[2] if len(turn) > 2 else None
+        if fase_fija is not None and str(fase_fija).strip() != "":
+            last_phase = str(fase_fija).strip()
+            results.append((last_phase, None, None))
+            continue
+
+        fase, conf, score = _detect_normalized(t, turno_idx, total, last_phase, (ref - turno_idx) < last_window)
+        if fase is None or conf < conf_threshold:
+            results.append((None, 0.0, score))
+            continue
+        results.append((fase, conf, score))
+        last_phase = fase
+    return results
+
+
+def classify_many(conversations, last_window=3, conf_threshold=0.0, normalized=False):
+    """
+    classify_conversation sobre un chunk de conversaciones (total_turns = len(turns)).
+    Pensado para mapear chunks en un pool de procesos: una llamada por chunk.
+    """
+    return [
+        classify_conversation(turns, last_window=last_window, conf_threshold=conf_threshold, normalized=normalized)
+        for turns in conversations
+    ]
+
+
 def ensure_schema_fases(conn):
     """
     Agrega columnas en sa_conversaciones si faltan.
@@ -292,12 +417,26 @@ def ensure_schema_fases(conn):
     cur.close()
 
 
-def apply_fase_rules_for_run(conn, ejecucion_id: int, limit: int = 0, conf_threshold: float = 0.55, verbose: bool = False):
+def apply_fase_rules_for_run(conn, ejecucion_id: int, limit: int = 0, conf_threshold: float = 0.55, verbose: bool = False,
+                             workers: int = 0, persist_text_norm: bool = False):
     """
     Aplica rules-only a sa_turnos para una ejecución.
     Actualiza sa_turnos (fase, fase_conf, fase_source) y sa_conversaciones (fase_final, ...).
+
+    Con workers > 0 usa el modo masivo (_apply_fase_rules_bulk): lectura por
+    chunks, clasificación en un pool de procesos (workers > 1) y escritura
+    con UPDATE ... JOIN sobre tablas temporales.
+
+    persist_text_norm (implica modo masivo): usa/guarda sa_turnos.text_norm para que
+    re-ejecuciones y otras etapas no vuelvan a normalizar los mismos turnos.
     """
     ensure_schema_fases(conn)
+    if persist_text_norm:
+        ensure_text_norm_column(conn)
+        workers = max(1, workers or 0)
+    if workers and workers > 0:
+        return _apply_fase_rules_bulk(conn, ejecucion_id, limit, conf_threshold, verbose, workers,
+                                      persist_text_norm=persist_text_norm)
 
     cur = conn.cursor()
     params = [ejecucion_id]
@@ -336,30 +475,24 @@ def apply_fase_rules_for_run(conn, ejecucion_id: int, limit: int = 0, conf_thres
             continue
 
         total = len(turns)
-        last_phase = None
         last_non_null_phase = None
         last_non_null_idx = None
 
-        for (turno_pk, turno_idx, text, fase_actual, fase_conf_actual, fase_source_actual) in turns:
-            is_last = (total - int(turno_idx)) < 3
-            # Si ya fue clasificado por DEEPSEEK con fase no vacía, no tocar
-            if (fase_source_actual == "DEEPSEEK") and (fase_actual is not None) and (str(fase_actual).strip() != ""):
-                fa = (str(fase_actual).strip() if fase_actual is not None else "")
-                if fa:
-                    counts[fa] += 1
-                last_phase = str(fase_actual).strip()
-                last_non_null_phase = str(fase_actual).strip()
+        # Si ya fue clasificado por DEEPSEEK con fase no vacía, no tocar (fase fija)
+        items = [
+            (turno_idx, text, fase_actual if fase_source_actual == "DEEPSEEK" else None)
+            for (_, turno_idx, text, fase_actual, _, fase_source_actual) in turns
+        ]
+        results = classify_conversation(items, conf_threshold=conf_threshold)
+
+        for (turno_pk, turno_idx, *_), (fase, conf, _) in zip(turns, results):
+            if conf is None:
+                counts[fase] += 1
+                last_non_null_phase = fase
                 last_non_null_idx = int(turno_idx)
                 skip_deepseek_total += 1
                 continue
 
-            # Caso contrario: aplicar reglas
-            fase, conf, _ = detect_fase_rules_based(text, int(turno_idx), total, last_phase=last_phase, is_last_turns=is_last)
-
-            if conf < conf_threshold: 
-                fase = None
-                conf = 0.0
-
             # actualizar turno (no sobrescribir DEEPSEEK)
             cur.execute(
                 "UPDATE sa_turnos SET fase=%s, fase_conf=%s, fase_source=%s WHERE turno_pk=%s AND (fase_source IS NULL OR fase_source='RULES')",
@@ -369,7 +502,6 @@ def apply_fase_rules_for_run(conn, ejecucion_id: int, limit: int = 0, conf_thres
 
             if fase:
                 counts[fase] += 1
-                last_phase = fase
                 last_non_null_phase = fase
                 last_non_null_idx = int(turno_idx)
             else:
@@ -412,5 +544,171 @@ def apply_fase_rules_for_run(conn, ejecucion_id: int, limit: int = 0, conf_thres
     print(f"Conversaciones procesadas: {len(convs)}")
     print(f"Turnos actualizados: {total_turns_updated}")
     print(f"NULL turnos: {null_count}")
+    if verbose:
+        print(f"Caché de normalización: {format_cache_stats()}")
+
+    cur.close()
+
+
+# -----------------------
+# Modo masivo / paralelo
+# -----------------------
+TURNOS_FASE_COLUMNS = [("fase", "VARCHAR(32)"), ("fase_conf", "DECIMAL(6,4)"), ("fase_source", "VARCHAR(16)")]
+CONV_FINAL_COLUMNS = [("fase_final", "VARCHAR(32)"), ("fase_final_turn_idx", "INT"), ("tipo_finalizacion", "VARCHAR(32)")]
+
+
+def _read_turns_chunk(cur, conv_pks, with_text_norm=False):
+    """
+    Lee en una sola query los turnos de varias conversaciones, agrupados por conversación:
+    {conversacion_pk: [(turno_pk, turno_idx, text, fase, fase_source, text_norm), ...]}
+    """
+    placeholders = ", ".join(["%s"] * len(conv_pks))
+    norm_col = "text_norm" if with_text_norm else "NULL"
+    cur.execute(
+        f"""
+        SELECT conversacion_pk, turno_pk, turno_idx, text, fase, fase_source, {norm_col}
+        FROM sa_turnos
+        WHERE conversacion_pk IN ({placeholders})
+        ORDER BY conversacion_pk, turno_idx
+        """,
+        tuple(conv_pks),
+    )
+    by_conv = {pk: [] for pk in conv_pks}
+    for conv_pk, turno_pk, turno_idx, text, fase, fase_source, text_norm in cur.fetchall():
+        by_conv[conv_pk].append((turno_pk, int(turno_idx), text, fase, fase_source, text_norm))
+    return by_conv
+
+
+def _apply_fase_rules_bulk(conn, ejecucion_id, limit, conf_threshold, verbose, workers,
+                           chunk_convs=500, sub_chunk=50, persist_text_norm=False):
+    """
+    detect-fases masivo. Por cada chunk de conversaciones: una query de lectura,
+    clasificación con classify_many (en ProcessPoolExecutor si workers > 1) y
+    un único escritor que aplica turnos y resúmenes con UPDATE ... JOIN y hace
+    commit por chunk. Mismo resultado que el modo turno a turno.
+    """
+    cur = conn.cursor()
+    params = [ejecucion_id]
+    sql_conv = "SELECT conversacion_pk, conversacion_id FROM sa_conversaciones WHERE ejecucion_id=%s ORDER BY conversacion_pk"
+    if limit and limit > 0:
+        sql_conv += " LIMIT %s"
+        params.append(limit)
+    cur.execute(sql_conv, tuple(params))
+    convs = cur.fetchall()
+    conv_ids = dict(convs)
+
+    counts = defaultdict(int)
+    for f in FASE_SEQUENCE:
+        counts[f] = 0
+    totals = {"null": 0, "updated": 0, "skip_deepseek": 0, "done": 0, "text_norm": 0}
+
+    def classify_chunk(by_conv):
+        # Se normaliza en el proceso principal (caché compartida y text_norm persistido)
+        pks = list(by_conv.keys())
+        inputs = []
+        norm_rows = []  # (turno_pk, text_norm) a persistir
+        for pk in pks:
+            conv_inputs = []
+            for (turno_pk, idx, text, fase, fase_source, text_norm) in by_conv[pk]:
+                if text_norm is None:
+                    text_norm = normalize_text(text)
+                    if persist_text_norm:
+                        norm_rows.append((turno_pk, text_norm))
+                conv_inputs.append((idx, text_norm, fase if fase_source == "DEEPSEEK" else None))
+            inputs.append(conv_inputs)
+        if pool is None:
+            return pks, classify_many(inputs, conf_threshold=conf_threshold, normalized=True), norm_rows
+        futures = [
+            pool.submit(classify_many, inputs[i:i + sub_chunk], 3, conf_threshold, True)
+            for i in range(0, len(inputs), sub_chunk)
+        ]
+        return pks, futures, norm_rows
+
+    def write_chunk(by_conv, pks, results, norm_rows):
+        turn_rows = []
+        conv_rows = []
+        for pk, conv_results in zip(pks, results):
+            last_non_null_phase = None
+            last_non_null_idx = None
+            for (turno_pk, turno_idx, *_), (fase, conf, _) in zip(by_conv[pk], conv_results):
+                if conf is None:
+                    # fase fija (DEEPSEEK): no se toca
+                    counts[fase] += 1
+                    last_non_null_phase = fase
+                    last_non_null_idx = turno_idx
+                    totals["skip_deepseek"] += 1
+                    continue
+                turn_rows.append((turno_pk, fase, conf if fase else None, "RULES" if fase else None))
+                if fase:
+                    counts[fase] += 1
+                    last_non_null_phase = fase
+                    last_non_null_idx = turno_idx
+                else:
+                    totals["null"] += 1
+            tipo = "CIERRE" if last_non_null_phase == "CIERRE" else "CORTE"
+            conv_rows.append((pk, last_non_null_phase, last_non_null_idx, tipo))
+            totals["done"] += 1
+            if verbose and by_conv[pk] and (totals["done"] <= 10 or totals["done"] % 100 == 0):
+                print(f"[detect-fases] conv={conv_ids.get(pk)} turnos={len(by_conv[pk])} fase_final={last_non_null_phase} null_turnos_acum={totals['null']}")
+
+        bulk_update_via_temp_table(
+            cur, "sa_turnos", "turno_pk", TURNOS_FASE_COLUMNS, turn_rows,
+            where_extra="(t.fase_source IS NULL OR t.fase_source='RULES')",
+        )
+        bulk_update_via_temp_table(cur, "sa_conversaciones", "conversacion_pk", CONV_FINAL_COLUMNS, conv_rows)
+        if norm_rows:
+            bulk_update_via_temp_table(cur, "sa_turnos", "turno_pk", [("text_norm", "LONGTEXT")], norm_rows)
+            totals["text_norm"] += len(norm_rows)
+        conn.commit()
+        totals["updated"] += len(turn_rows)
+
+    pool = ProcessPoolExecutor(max_workers=workers) if workers > 1 else None
+    try:
+        pending = deque()
+        conv_pks = [pk for pk, _ in convs]
+        for start in range(0, len(conv_pks), chunk_convs):
+            by_conv = _read_turns_chunk(cur, conv_pks[start:start + chunk_convs], with_text_norm=persist_text_norm)
+            pending.append((by_conv,) + classify_chunk(by_conv))
+            # Mientras el pool clasifica el chunk siguiente, el escritor aplica el anterior
+            while len(pending) > 1 or (pending and pool is None):
+                by_prev, pks, res, norm_rows = pending.popleft()
+                if pool is not None:
+                    res = [r for fut in res for r in fut.result()]
+                write_chunk(by_prev, pks, res, norm_rows)
+        while pending:
+            by_prev, pks, res, norm_rows = pending.popleft()
+            res = [r for fut in res for r in fut.result()]
+            write_chunk(by_prev, pks, res, norm_rows)
+    except Exception:
+        conn.rollback()
+        raise
+    finally:
+        if pool is not None:
+            pool.shutdown()
+
+    if verbose:
+        print("\n--- Conteo por fase (turnos) ---")
+        for f in FASE_SEQUENCE:
+            print(f"{f}: {counts[f]}")
+        print(f"NULL: {totals['null']}")
+        print(f"SKIP por DEEPSEEK: {totals['skip_deepseek']}")
+
+        extras = sorted([k for k in counts.keys() if k not in FASE_SEQUENCE and counts[k] > 0])
+        if extras:
+            print("\n--- Conteo por fase (extras) ---")
+            for k in extras:
+                print(f"{k}: {counts[k]}")
+
+    print("\n--- Resumen de Detección de Fases ---")
+    print(f"ID de Ejecución: {ejecucion_id}")
+    print(f"Conversaciones procesadas: {len(convs)}")
+    print(f"Turnos actualizados: {totals['updated']}")
+    print(f"NULL turnos: {totals['null']}")
+    if workers > 1:
+        print(f"Workers: {workers}")
+    if persist_text_norm:
+        print(f"text_norm persistidos: {totals['text_norm']}")
+    if verbose:
+        print(f"Caché de normalización: {format_cache_stats()}")
 
     cur.close()
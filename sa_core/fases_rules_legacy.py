@@ -0,0 +1,187 @@
+# sa_core/fases_rules_legacy.py
+"""
+Motor de reglas original (un re.search con re.I por patrón y regex inline en
+las heurísticas), conservado tal cual como referencia para el harness de
+regresión de sa_core.fases_rules.detect_fase_rules_based.
+
+No usar en el pipeline: es más lento y debe dar exactamente lo mismo.
+"""
+import re
+import unicodedata
+
+from sa_core.fases_rules import (
+    DIGITS_CHUNK_RE,
+    FASE_RULES,
+    FASE_SEQUENCE,
+    NUM_RE,
+    PAY_WORDS_RE,
+    REPITO_RE,
+    WHEN_BRINDO_RE,
+    _phase_index,
+)
+
+
+def normalize_text_legacy(s: str) -> str:
+    """normalize_text original (sin caché ni atajo ASCII)."""
+    if not s:
+        return ""
+    s = s.lower()
+    s = unicodedata.normalize("NFD", s)
+    s = "".join(ch for ch in s if unicodedata.category(ch) != "Mn")
+    s = re.sub(r"[\./:;,_-]", " ", s)
+    s = re.sub(r"\s+", " ", s).strip()
+    return s
+
+
+def detect_fase_rules_based_legacy(text: str, turn_idx: int, total_turns: int, last_phase: str | None = None, is_last_turns: bool = False):
+    """
+    Implementación original, sin cambios. Returns: (fase_or_None, confidence_float_0_1, max_score_int)
+    """
+    t = normalize_text_legacy(text)
+    scores = {fase: 0 for fase in FASE_SEQUENCE}
+
+    # Scores base
+    for fase, rules in FASE_RULES.items():
+        for pattern, weight in rules.items():
+            if pattern.search(t):
+                scores[fase] += weight
+
+
+    # --- Heurísticas contextuales adicionales y ajustes de pesos ---
+    # 1) "Dígame." temprano solo si venimos de apertura
+    if last_phase == "APERTURA" and turn_idx <= 5 and len(t) <= 25 and re.fullmatch(r"digame[.!]?", t):
+        scores["APERTURA"] += 3
+
+    # 2) "Sí" temprano como confirmación inicial (ahora suma a APERTURA y +4)
+    if last_phase == "APERTURA" and turn_idx <= 5 and len(t) <= 20 and re.fullmatch(r"(si|si senorita|si señorita)[.!]?", t):
+        scores["APERTURA"] += 4
+
+    # 3) Ack "Ya" ultra corto (limitado por contexto, +4)
+    if len(t) <= 5 and re.fullmatch(r"ya[.!]?", t) and last_phase in ("INFORMACION_DEUDA","NEGOCIACION","CONSULTA_ACEPTACION"):
+        scores["CONSULTA_ACEPTACION"] += 4
+
+    # 4) NEGOCIACION contextual extendida (+4, len>=20, context ampliado)
+    context_neg_words = re.compile(r"\b(mi esposo|mi hijo|mis hijos|familiar|familia|gastos|trabaj|desemplead|no tengo|no puedo|ingreso|morosidad|coordinar|comunicar|no se ha podido|no han podido|unos dias|deme unos dias|minimo|mínimo|catalogo|catálogo|ventas|vendo|no vende|no se vende|no pide|no hay)\b", re.I)
+    if last_phase in ("INFORMACION_DEUDA","NEGOCIACION","CONSULTA_ACEPTACION") and len(t) >= 20 and re.search(context_neg_words, t):
+        scores["NEGOCIACION"] += 4
+
+    # 5) Tiempo/antigüedad como parte de NEGOCIACION (años/meses) +4
+    if last_phase in ("NEGOCIACION","CONSULTA_ACEPTACION") and re.search(r"\b\d+\s*(anos?|a[nñ]os?|mes(es)?)\b", t):
+        scores["NEGOCIACION"] += 4
+
+    # 5b) "buen tiempo" sin números
+    if last_phase in ("NEGOCIACION","CONSULTA_ACEPTACION") and re.search(r"\b(buen tiempo|hace tiempo|ya tengo)\b", t):
+        scores["NEGOCIACION"] += 4
+
+    # 6) Montos en negociación aunque el score base de NEGOCIACION sea 0, pero SOLO con contexto
+    if last_phase == "NEGOCIACION" and NUM_RE.search(t) and PAY_WORDS_RE.search(t):
+        scores["NEGOCIACION"] += 3
+
+    # 7) Turnos de dígitos con prefijo opcional "ya" dentro de formalización (+5)
+    only_digits = (re.fullmatch(r"(ya[.,]?\s*)?[0-9\s\.,-]+", t) is not None) and (NUM_RE.search(t) is not None)
+    if last_phase == "FORMALIZACION_PAGO" and only_digits and len(t) <= 30:
+        scores["FORMALIZACION_PAGO"] += 5
+
+    # 8) CIERRE por "gracias" muy al final
+    if ("gracias" in t) and (turn_idx >= max(1, total_turns-2)):
+        scores["CIERRE"] += 5
+
+    # 9) "tarjeta" como aclaración en negociación
+    if last_phase in ("NEGOCIACION","CONSULTA_ACEPTACION") and re.search(r"\btarjeta\b", t):
+        scores["NEGOCIACION"] += 4
+
+    # 10) "devolver la llamada / horario" (follow-up) - sin acentos porque normalize_text los elimina
+    if last_phase in ("NEGOCIACION","FORMALIZACION_PAGO") and re.search(r"devolver la llamada|horario|a que hora|me podria llamar|podria llamar|manana", t):
+        scores["NEGOCIACION"] += 4
+
+    # 10b) Re-contacto/coordinar con condición doble (+6)
+    if last_phase in ("NEGOCIACION", "FORMALIZACION_PAGO"):
+        contact_match = re.search(r"\b(me podria llamar|podria llamar|me puede llamar|lo llamo|le llamo)\b", t)
+        timing_match = re.search(r"\b(manana|horario|coordino|coordinar)\b", t)
+        if contact_match and timing_match:
+            scores["NEGOCIACION"] += 6
+
+    # 10c) "con quien tengo el gusto" dentro de negociación/formalización (+4)
+    if last_phase in ("NEGOCIACION", "FORMALIZACION_PAGO") and re.search(r"con quien tengo el gusto", t):
+        scores["NEGOCIACION"] += 4
+
+    # 11) "100 y tanto" como monto de deuda (solo si venimos de INFORMACION_DEUDA)
+    if last_phase == "INFORMACION_DEUDA" and NUM_RE.search(t) and re.search(r"\b(deuda|saldo|monto|soles?|s/|tanto)\b", t):
+        scores["INFORMACION_DEUDA"] += 4
+
+    # 12) Chunks de dígitos en formalización (ej: "9 3 1.", "5 8 6.")
+    if last_phase == "FORMALIZACION_PAGO" and DIGITS_CHUNK_RE.search(t):
+        scores["FORMALIZACION_PAGO"] += 4
+
+    # 13) "Le repito" como refuerzo de información de deuda
+    if last_phase == "INFORMACION_DEUDA" and REPITO_RE.search(t):
+        scores["INFORMACION_DEUDA"] += 3
+
+    # 14) "Cuando le brindo" (turno truncado en negociación)
+    if last_phase == "NEGOCIACION" and WHEN_BRINDO_RE.search(t):
+        scores["NEGOCIACION"] += 3
+
+    # 15) Secuencia de dígitos sueltos hereda formalización (+5)
+    single_digits_seq_re = re.compile(r"(?:\b\d\b[\s\.\-]*){3,}")
+    if last_phase == "FORMALIZACION_PAGO" and single_digits_seq_re.search(t):
+        scores["FORMALIZACION_PAGO"] += 5
+
+    # 16) "como le repito / le repito" refuerza información de deuda (+4)
+    if last_phase == "INFORMACION_DEUDA" and re.search(r"\b(como le repito|le repito)\b", t, re.I):
+        scores["INFORMACION_DEUDA"] += 4
+
+    # 17) Truncado "Ok. Cuando le brindo ..." empuja negociación (+4)
+    if last_phase == "NEGOCIACION" and re.search(r"\bok\b", t) and re.search(r"\bcuando le brind", t):
+        scores["NEGOCIACION"] += 4
+
+    # Heurística: Saludo/atención solo al inicio (mantener)
+    if turn_idx <= 3 and len(t) <= 20:
+        if re.search(r"\b(al[oó]|buenos dias|buenas tardes|buenas noches|digame)\b", t, re.I):
+            scores["APERTURA"] += 3
+
+
+
+    # NEGOCIACION: números + palabras de pago (condicional)
+    if scores["NEGOCIACION"] > 0:
+        if NUM_RE.search(t) and PAY_WORDS_RE.search(t):
+            scores["NEGOCIACION"] += 2
+
+    # CIERRE: bonus solo si ya matcheó algo de cierre y estamos al final
+    if is_last_turns and scores["CIERRE"] > 0:
+        scores["CIERRE"] += 1  # boost moderado
+
+    # --- BLOQUE DE RETORNO Y CÁLCULO ---
+    max_score = max(scores.values())
+    CONTINUITY_PHASES = {"INFORMACION_DEUDA","NEGOCIACION","CONSULTA_ACEPTACION","FORMALIZACION_PAGO","CIERRE"}
+    if max_score < 2:
+        # fallback de continuidad para respuestas cortas
+        if last_phase in CONTINUITY_PHASES:
+            corto = (len(t) <= 45) or (len(t.split()) <= 7)
+            if corto:
+                return last_phase, min(1.0, 4/7.0), 4
+        return None, 0.0, None
+
+    # Elegir mejor fase con desempate por secuencia
+    best = None
+    best_score = -1
+    for fase in FASE_SEQUENCE:
+        sc = scores[fase]
+        if sc > best_score:
+            best_score = sc
+            best = fase
+
+    # Penalización leve por retroceso fuerte
+    if last_phase and best:
+        li = _phase_index(last_phase)
+        bi = _phase_index(best)
+        if li >= 0 and bi >= 0 and bi + 2 < li:  # retroceso >=3 fases
+            best_score = max(0, best_score - 2)
+            if best_score < 2:
+                corto = (len(t) <= 45) or (len(t.split()) <= 7)
+                if last_phase and (last_phase in CONTINUITY_PHASES) and corto:
+                    # 2nd-chance continuity fallback
+                    return last_phase, min(1.0, 4/7.0), 4
+                return None, 0.0, None
+
+    conf = min(1.0, best_score / 7.0)
+    return best, conf, best_score
@@ -1,63 +1,646 @@
 import os
+import time
+import codecs
+import hashlib
+from collections import deque, namedtuple
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+from dataclasses import dataclass, field
 from mysql.connector import Error
 
-def ingest_dir(conn, input_dir, notas):
+def ingest_dir(conn, input_dir, notas, max_files=0, commit_every=1000, commit_bytes=None,
+               progress_callback=None):
+    """
+    Ingesta secuencial de una carpeta en modo streaming.
+
+    Recorre la carpeta con os.scandir (sin listar todo en memoria), lee un archivo
+    a la vez y confirma en chunks acotados por filas/bytes, de modo que la memoria
+    y el undo log de InnoDB no crecen con el tamaño de la carpeta.
+
+    Returns:
+        (ejecucion_id, inserted_count); (None, 0) si no se pudo crear la ejecución
+
+    Raises:
+        IngestaInterrumpida si falla la BD con la ejecución ya creada
+    """
+    if max_files and max_files > 0:
+        paths = list_txt_files(input_dir)[:max_files]
+    else:
+        paths = iter_txt_files(input_dir)
+    ejecucion_id, inserted_count, _ = ingest_files_parallel(
+        conn, paths, notas, input_dir,
+        workers=0, commit_every=commit_every, commit_bytes=commit_bytes,
+        progress_callback=progress_callback,
+    )
+    return ejecucion_id, inserted_count
+
+
+# -----------------------
+# Ingesta paralela
+# -----------------------
+INSERT_CONVERSACION_SQL = """
+    INSERT INTO sa_conversaciones
+    (ejecucion_id, conversacion_id, raw_path, raw_text, total_turnos)
+    VALUES (%s, %s, %s, %s, %s)
+"""
+
+# Límites por defecto de los chunks de escritura (streaming)
+DEFAULT_BATCH_BYTES = 8 * 1024 * 1024     # por INSERT multi-fila (< max_allowed_packet)
+DEFAULT_COMMIT_BYTES = 64 * 1024 * 1024   # por transacción
+READ_BLOCK_SIZE = 256 * 1024
+
+
+@dataclass
+class IngestStats:
+    """Contadores de throughput de una ingesta (archivos/s y bytes/s)."""
+    files: int = 0
+    bytes: int = 0
+    errors: int = 0
+    latin1_fallbacks: int = 0
+    skipped: int = 0   # incremental: sin cambios (size/mtime) o ya procesado en el checkpoint
+    linked: int = 0    # incremental: mismo content_hash que una conversación ya ingerida
+    commits: int = 0
+    started_at: float = field(default_factory=time.perf_counter)
+    # Último chunk confirmado (commit): para reportar throughput por chunk
+    chunk_files: int = 0
+    chunk_bytes: int = 0
+    chunk_secs: float = 0.0
+
+    @property
+    def elapsed(self) -> float:
+        return max(time.perf_counter() - self.started_at, 1e-9)
+
+    @property
+    def files_per_sec(self) -> float:
+        return self.files / self.elapsed
+
+    @property
+    def bytes_per_sec(self) -> float:
+        return self.bytes / self.elapsed
+
+    @property
+    def chunk_files_per_sec(self) -> float:
+        return self.chunk_files / max(self.chunk_secs, 1e-9)
+
+    @property
+    def chunk_bytes_per_sec(self) -> float:
+        return self.chunk_bytes / max(self.chunk_secs, 1e-9)
+
+    def summary(self) -> str:
+        return (
+            f"archivos={self.files} bytes={self.bytes} errores={self.errors} "
+            f"saltados={self.skipped} vinculados={self.linked} "
+            f"commits={self.commits} {self.files_per_sec:.1f} archivos/s "
+            f"{self.bytes_per_sec / 1024 / 1024:.2f} MB/s"
+        )
+
+
+class IngestaInterrumpida(Exception):
+    """
+    Error de BD después de crear la ejecución. Los chunks ya confirmados quedan
+    en la BD: ejecucion_id permite verlos, reanudarlos (incremental) o limpiarlos.
+    """
+
+    def __init__(self, ejecucion_id, inserted_count, stats, error):
+        super().__init__(
+            f"Ingesta interrumpida en ejecucion_id={ejecucion_id} "
+            f"({inserted_count} conversaciones confirmadas): {error}"
+        )
+        self.ejecucion_id = ejecucion_id
+        self.inserted_count = inserted_count
+        self.stats = stats
+
+
+ReadResult = namedtuple(
+    "ReadResult", "filename path raw_text encoding n_bytes content_hash error"
+)
+
+
+def _read_for_ingest(file_path):
+    """
+    Worker del pool: lee, hashea (sha256) y decodifica un archivo. No toca la BD.
+
+    Lee en bloques y decodifica de forma incremental, así nunca conviven en memoria
+    el archivo completo en bytes y en str. Si aparece un byte inválido para utf-8
+    se reinicia la lectura con latin-1 (que decodifica cualquier secuencia).
+    """
+    filename = os.path.basename(file_path)
+    try:
+        try:
+            raw_text, n_bytes, content_hash = _read_decoding(file_path, 'utf-8')
+            encoding = 'utf-8'
+        except UnicodeDecodeError:
+            raw_text, n_bytes, content_hash = _read_decoding(file_path, 'latin-1')
+            encoding = 'latin-1'
+        return ReadResult(filename, file_path, raw_text, encoding, n_bytes, content_hash, None)
+    except Exception as e:
+        return ReadResult(filename, file_path, None, None, 0, None, str(e))
+
+
+def _read_decoding(file_path, encoding):
+    decoder = codecs.getincrementaldecoder(encoding)()
+    digest = hashlib.sha256()
+    parts = []
+    n_bytes = 0
+    with open(file_path, 'rb') as f:
+        while True:
+            block = f.read(READ_BLOCK_SIZE)
+            if not block:
+                break
+            n_bytes += len(block)
+            digest.update(block)
+            parts.append(decoder.decode(block))
+    parts.append(decoder.decode(b'', final=True))
+    text = ''.join(parts)
+    if '\r' in text:
+        text = text.replace('\r\n', '\n').replace('\r', '\n')
+    return text, n_bytes, digest.hexdigest()
+
+
+def _iter_read_results(file_paths, workers, use_processes=True, max_in_flight=None):
+    """
+    Lee archivos en un pool (o en el hilo actual si workers<=1), en orden.
+
+    Acepta cualquier iterable de rutas (p.ej. un generador de os.scandir) y mantiene
+    como máximo max_in_flight lecturas pendientes: a diferencia de Executor.map, no
+    encola la carpeta entera ni acumula resultados que el escritor aún no consumió.
+    """
+    if workers and workers > 1:
+        pool_cls = ProcessPoolExecutor if use_processes else ThreadPoolExecutor
+        max_in_flight = max_in_flight or workers * 4
+        pending = deque()
+        with pool_cls(max_workers=workers) as pool:
+            for path in file_paths:
+                pending.append(pool.submit(_read_for_ingest, path))
+                if len(pending) >= max_in_flight:
+                    yield pending.popleft().result()
+            while pending:
+                yield pending.popleft().result()
+    else:
+        for path in file_paths:
+            yield _read_for_ingest(path)
+
+
+def iter_txt_files(input_dir):
+    """Genera rutas .txt de la carpeta con os.scandir (orden del sistema de archivos)."""
+    with os.scandir(input_dir) as it:
+        for entry in it:
+            if entry.name.endswith(".txt") and entry.is_file():
+                yield entry.path
+
+
+def list_txt_files(input_dir):
+    """Archivos .txt de la carpeta (orden estable)."""
+    return sorted(iter_txt_files(input_dir))
+
+
+def _insert_batch(conn, cursor, batch):
+    """
+    Inserta un lote con un INSERT multi-fila (executemany). Si el lote falla,
+    reintenta fila por fila para aislar el archivo problemático.
+    Devuelve las filas efectivamente insertadas.
+    """
+    try:
+        cursor.executemany(INSERT_CONVERSACION_SQL, batch)
+        return list(batch)
+    except Error as e:
+        print(f"Warning: Falló INSERT multi-fila ({len(batch)} filas), reintentando fila por fila: {e}")
+    inserted = []
+    for row in batch:
+        try:
+            cursor.execute(INSERT_CONVERSACION_SQL, row)
+            inserted.append(row)
+        except Error as e:
+            print(f"Error insertando conversación {row[1]}: {e}")
+    return inserted
+
+
+def _accept_read(res, stats):
+    """Actualiza contadores; devuelve False si la lectura falló."""
+    if res.error is not None:
+        stats.errors += 1
+        print(f"Error al leer el archivo {res.filename}: {res.error}")
+        return False
+    if res.encoding == 'latin-1':
+        stats.latin1_fallbacks += 1
+        print(f"Warning: Fallback a latin-1 para el archivo {res.filename}")
+    stats.files += 1
+    stats.bytes += res.n_bytes
+    return True
+
+
+def ingest_files_parallel(conn, file_paths, notas, input_dir_info, workers=4, batch_size=200,
+                          commit_every=1000, use_processes=True, progress_callback=None,
+                          batch_bytes=None, commit_bytes=None):
+    """
+    Ingesta en streaming: un pool de workers lee/decodifica archivos y el hilo
+    principal (único escritor) inserta en lotes multi-fila con commits periódicos.
+
+    file_paths puede ser cualquier iterable (también un generador); nunca se
+    materializa la lista completa ni hay más de unas pocas lecturas en vuelo, así
+    que el pico de memoria depende del tamaño de chunk y no del de la carpeta.
+
+    Args:
+        conn: Conexión MySQL
+        file_paths: Rutas de archivos a ingestar (iterable)
+        notas: Notas para sa_ejecuciones
+        input_dir_info: Valor para sa_ejecuciones.input_dir
+        workers: Procesos/hilos lectores (<=1 lee en el hilo principal)
+        batch_size: Filas máximas por INSERT multi-fila
+        commit_every: Filas máximas por transacción (chunk)
+        use_processes: ProcessPoolExecutor (True) o ThreadPoolExecutor (False)
+        progress_callback: Función opcional que recibe IngestStats tras cada lote;
+            stats.chunk_* describe el último chunk confirmado
+        batch_bytes: Bytes máximos por INSERT multi-fila (default DEFAULT_BATCH_BYTES)
+        commit_bytes: Bytes máximos por transacción (default DEFAULT_COMMIT_BYTES)
+
+    Returns:
+        (ejecucion_id, inserted_count, stats); (None, 0, stats) si no se pudo
+        crear la ejecución
+
+    Raises:
+        IngestaInterrumpida si falla la BD con la ejecución ya creada (los chunks
+        anteriores quedan confirmados)
+    """
+    commit_bytes = commit_bytes or DEFAULT_COMMIT_BYTES
+    # Un lote nunca excede el chunk de commit
+    batch_bytes = min(batch_bytes or DEFAULT_BATCH_BYTES, commit_bytes)
+    batch_size = max(1, min(batch_size, commit_every))
     cursor = conn.cursor()
+    stats = IngestStats()
+    ejecucion_id = None
+    committed_count = 0
     try:
-        # 1. Crear una ejecución
-        cursor.execute("INSERT INTO sa_ejecuciones (notas, input_dir) VALUES (%s, %s)", (notas, input_dir))
-        ejecucion_id = cursor.lastrowid
-        
+        cursor.execute("INSERT INTO sa_ejecuciones (notas, input_dir) VALUES (%s, %s)", (notas, input_dir_info))
+        new_id = cursor.lastrowid
+        conn.commit()
+        ejecucion_id = new_id
         print(f"Creada ejecución con ID: {ejecucion_id}")
 
-        # 2. Recorrer archivos .txt
         inserted_count = 0
-        for filename in os.listdir(input_dir):
-            if filename.endswith(".txt"):
-                file_path = os.path.join(input_dir, filename)
-                
-                # 3. Leer contenido del archivo
-                raw_text = ''
-                try:
-                    with open(file_path, 'r', encoding='utf-8') as f:
-                        raw_text = f.read()
-                except UnicodeDecodeError:
-                    try:
-                        with open(file_path, 'r', encoding='latin-1') as f:
-                            raw_text = f.read()
-                        print(f"Warning: Fallback a latin-1 para el archivo {filename}")
-                    except Exception as e:
-                        print(f"Error al leer el archivo {filename} con fallback: {e}")
+        batch = []
+        batch_size_bytes = 0
+        chunk_rows = 0
+        chunk_size_bytes = 0
+        chunk_started = time.perf_counter()
+
+        def commit_chunk():
+            nonlocal chunk_rows, chunk_size_bytes, chunk_started, committed_count
+            conn.commit()
+            committed_count = inserted_count
+            now = time.perf_counter()
+            stats.commits += 1
+            stats.chunk_files = chunk_rows
+            stats.chunk_bytes = chunk_size_bytes
+            stats.chunk_secs = now - chunk_started
+            chunk_rows = 0
+            chunk_size_bytes = 0
+            chunk_started = now
+
+        def flush():
+            nonlocal inserted_count, batch, batch_size_bytes, chunk_rows, chunk_size_bytes
+            if not batch:
+                return
+            n = len(_insert_batch(conn, cursor, batch))
+            inserted_count += n
+            chunk_rows += n
+            chunk_size_bytes += batch_size_bytes
+            batch = []
+            batch_size_bytes = 0
+            if chunk_rows >= commit_every or chunk_size_bytes >= commit_bytes:
+                commit_chunk()
+            if progress_callback:
+                progress_callback(stats)
+
+        for res in _iter_read_results(file_paths, workers, use_processes):
+            if _accept_read(res, stats):
+                batch.append((ejecucion_id, res.filename, res.path, res.raw_text, 0))
+                batch_size_bytes += res.n_bytes
+            if len(batch) >= batch_size or batch_size_bytes >= batch_bytes:
+                flush()
+        flush()
+
+        commit_chunk()
+        print("\n--- Resumen de Ingesta ---")
+        print(f"ID de Ejecución: {ejecucion_id}")
+        print(f"Total de archivos insertados: {inserted_count}")
+        print(f"Throughput: {stats.summary()}")
+
+        return ejecucion_id, inserted_count, stats
+
+    except Error as e:
+        conn.rollback()
+        if ejecucion_id is None:
+            print(f"Error durante la ingesta. No se pudo crear la ejecución. Error: {e}")
+            return None, 0, stats
+        print(f"Error durante la ingesta. Rollback del chunk en curso; la ejecución {ejecucion_id} "
+              f"queda con {committed_count} conversaciones confirmadas. Error: {e}")
+        raise IngestaInterrumpida(ejecucion_id, committed_count, stats, e) from e
+    finally:
+        cursor.close()
+
+
+def ingest_dir_parallel(conn, input_dir, notas, workers=4, batch_size=200, commit_every=1000,
+                        max_files=0, use_processes=True, progress_callback=None):
+    """
+    Versión paralela de ingest_dir. Devuelve (ejecucion_id, inserted_count, stats).
+    """
+    if max_files and max_files > 0:
+        file_paths = list_txt_files(input_dir)[:max_files]
+    else:
+        file_paths = iter_txt_files(input_dir)
+    return ingest_files_parallel(
+        conn, file_paths, notas, input_dir,
+        workers=workers, batch_size=batch_size, commit_every=commit_every,
+        use_processes=use_processes, progress_callback=progress_callback,
+    )
+
+
+# -----------------------
+# Ingesta incremental / reanudable
+# -----------------------
+def ensure_ingest_tables(conn):
+    """Crea las tablas de registro de archivos y checkpoints de ingesta si no existen."""
+    cursor = conn.cursor()
+    try:
+        cursor.execute("""
+            CREATE TABLE IF NOT EXISTS sa_ingest_archivos (
+                archivo_pk BIGINT AUTO_INCREMENT PRIMARY KEY,
+                raw_path VARCHAR(512) NOT NULL,
+                content_hash CHAR(64) NOT NULL,
+                size_bytes BIGINT NOT NULL,
+                mtime DOUBLE NOT NULL,
+                conversacion_pk INT NULL,
+                ejecucion_id INT NOT NULL,
+                updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP ON UPDATE CURRENT_TIMESTAMP,
+                UNIQUE KEY uq_raw_path (raw_path),
+                INDEX idx_content_hash (content_hash),
+                INDEX idx_ejecucion_id (ejecucion_id)
+            )
+        """)
+        cursor.execute("""
+            CREATE TABLE IF NOT EXISTS sa_ingest_checkpoints (
+                ejecucion_id INT PRIMARY KEY,
+                input_dir VARCHAR(512) NOT NULL,
+                status VARCHAR(16) NOT NULL DEFAULT 'RUNNING',
+                last_path VARCHAR(512) NULL,
+                files_done INT NOT NULL DEFAULT 0,
+                files_skipped INT NOT NULL DEFAULT 0,
+                files_linked INT NOT NULL DEFAULT 0,
+                updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP ON UPDATE CURRENT_TIMESTAMP,
+                INDEX idx_input_dir_status (input_dir, status)
+            )
+        """)
+        conn.commit()
+    finally:
+        cursor.close()
+
+
+UPSERT_ARCHIVO_SQL = """
+    INSERT INTO sa_ingest_archivos
+    (raw_path, content_hash, size_bytes, mtime, conversacion_pk, ejecucion_id)
+    VALUES (%s, %s, %s, %s, %s, %s)
+    ON DUPLICATE KEY UPDATE
+        content_hash = VALUES(content_hash),
+        size_bytes = VALUES(size_bytes),
+        mtime = VALUES(mtime),
+        conversacion_pk = VALUES(conversacion_pk),
+        ejecucion_id = VALUES(ejecucion_id)
+"""
+
+
+def _load_registry(cursor, input_dir):
+    """
+    raw_path -> (content_hash, size_bytes, mtime) para archivos ya ingeridos de la
+    carpeta (con conversación; un registro sin conversacion_pk se vuelve a leer).
+    """
+    prefix = os.path.join(input_dir, '')
+    cursor.execute(
+        "SELECT raw_path, content_hash, size_bytes, mtime FROM sa_ingest_archivos "
+        "WHERE raw_path LIKE %s AND conversacion_pk IS NOT NULL",
+        (prefix.replace('\\', '\\\\').replace('%', '\\%').replace('_', '\\_') + '%',)
+    )
+    return {row[0]: (row[1], int(row[2]), float(row[3])) for row in cursor.fetchall()}
+
+
+def _lookup_hashes(cursor, hashes):
+    """content_hash -> conversacion_pk para hashes ya registrados."""
+    if not hashes:
+        return {}
+    hashes = list(hashes)
+    placeholders = ", ".join(["%s"] * len(hashes))
+    cursor.execute(
+        f"""
+        SELECT content_hash, MIN(conversacion_pk)
+        FROM sa_ingest_archivos
+        WHERE content_hash IN ({placeholders}) AND conversacion_pk IS NOT NULL
+        GROUP BY content_hash
+        """,
+        tuple(hashes)
+    )
+    return {row[0]: int(row[1]) for row in cursor.fetchall()}
+
+
+def _insert_conversaciones(conn, cursor, ejecucion_id, rows):
+    """
+    Inserta las filas con _insert_batch y devuelve raw_path -> conversacion_pk
+    solo de las que quedaron insertadas (las nuevas tienen PK mayor que el
+    MAX(conversacion_pk) previo: se leen por rango de PK).
+    """
+    if not rows:
+        return {}
+    cursor.execute("SELECT COALESCE(MAX(conversacion_pk), 0) FROM sa_conversaciones")
+    bound = cursor.fetchone()[0]
+    inserted_paths = {row[2] for row in _insert_batch(conn, cursor, rows)}
+    if not inserted_paths:
+        return {}
+    cursor.execute(
+        "SELECT raw_path, conversacion_pk FROM sa_conversaciones WHERE conversacion_pk > %s AND ejecucion_id = %s",
+        (bound, ejecucion_id)
+    )
+    return {path: int(pk) for path, pk in cursor.fetchall() if path in inserted_paths}
+
+
+def _find_resumable_run(cursor, input_dir):
+    cursor.execute(
+        """
+        SELECT ejecucion_id, last_path
+        FROM sa_ingest_checkpoints
+        WHERE input_dir = %s AND status = 'RUNNING'
+        ORDER BY ejecucion_id DESC
+        LIMIT 1
+        """,
+        (input_dir,)
+    )
+    row = cursor.fetchone()
+    return (int(row[0]), row[1]) if row else (None, None)
+
+
+def ingest_dir_incremental(conn, input_dir, notas, workers=0, batch_size=200, commit_every=1000,
+                           resume=True, use_processes=True, progress_callback=None):
+    """
+    Ingesta incremental y reanudable de una carpeta.
+
+    - Archivos con mismo raw_path, tamaño y mtime que en sa_ingest_archivos se saltan
+      sin leerlos.
+    - Archivos nuevos/modificados se leen y hashean (sha256); si el hash ya existe se
+      vinculan a la conversación existente sin re-insertar raw_text.
+    - El resto se inserta en la ejecución. Solo se registran en sa_ingest_archivos
+      los archivos insertados o vinculados a una conversación existente: uno que
+      falló (lectura o INSERT) se vuelve a intentar en la próxima corrida.
+    - Cada commit guarda un checkpoint: el último archivo procesado antes del
+      primero que falló. Con resume=True una ejecución RUNNING de la misma carpeta
+      se continúa desde ahí en lugar de empezar de cero.
+
+    Returns:
+        (ejecucion_id, inserted_count, stats); (None, 0, stats) si no se pudo
+        crear ni reanudar la ejecución
+
+    Raises:
+        IngestaInterrumpida si falla la BD con la ejecución ya creada (queda
+        RUNNING en el último checkpoint, reanudable)
+    """
+    ensure_ingest_tables(conn)
+    cursor = conn.cursor()
+    stats = IngestStats()
+    ejecucion_id = None
+    committed_count = 0
+    try:
+        last_path = None
+        if resume:
+            ejecucion_id, last_path = _find_resumable_run(cursor, input_dir)
+        if ejecucion_id:
+            print(f"Reanudando ejecución {ejecucion_id} desde checkpoint: {last_path}")
+        else:
+            cursor.execute("INSERT INTO sa_ejecuciones (notas, input_dir) VALUES (%s, %s)", (notas, input_dir))
+            new_id = cursor.lastrowid
+            cursor.execute(
+                "INSERT INTO sa_ingest_checkpoints (ejecucion_id, input_dir) VALUES (%s, %s)",
+                (new_id, input_dir)
+            )
+            conn.commit()
+            ejecucion_id = new_id
+            print(f"Creada ejecución con ID: {ejecucion_id}")
+
+        registry = _load_registry(cursor, input_dir)
+
+        # 1. Filtrar por checkpoint y por (size, mtime) sin leer los archivos
+        to_read = []
+        file_meta = {}
+        for path in list_txt_files(input_dir):
+            if last_path and path <= last_path:
+                stats.skipped += 1
+                continue
+            st = os.stat(path)
+            prev = registry.get(path)
+            if prev and prev[1] == st.st_size and prev[2] == st.st_mtime:
+                stats.skipped += 1
+                continue
+            file_meta[path] = (st.st_size, st.st_mtime)
+            to_read.append(path)
+
+        print(f"Archivos a leer: {len(to_read)} (saltados sin leer: {stats.skipped})")
+
+        inserted_count = 0
+        pending_commit = 0
+        batch = []           # ReadResult pendientes de escribir (también las lecturas fallidas)
+        run_hashes = {}      # content_hash -> conversacion_pk insertada en esta ejecución
+        checkpoint = last_path
+        stalled = False      # ya hubo un archivo fallido: el checkpoint no avanza más
+
+        def flush(force_commit=False):
+            nonlocal inserted_count, pending_commit, batch, checkpoint, stalled, committed_count
+            if batch:
+                read_ok = [r for r in batch if r.error is None]
+                known = _lookup_hashes(cursor, {r.content_hash for r in read_ok} - run_hashes.keys())
+                known.update(run_hashes)
+                # Primer archivo de cada hash nuevo: se inserta; las copias se vinculan después
+                first = {}
+                for r in read_ok:
+                    if r.content_hash not in known and r.content_hash not in first:
+                        first[r.content_hash] = r
+                conv_pks = _insert_conversaciones(conn, cursor, ejecucion_id, [
+                    (ejecucion_id, r.filename, r.path, r.raw_text, 0) for r in first.values()
+                ])
+                inserted_count += len(conv_pks)
+
+                failed, registry_rows = set(), []
+                for r in read_ok:
+                    if first.get(r.content_hash) is r:
+                        conv_pk = conv_pks.get(r.path)
+                        if conv_pk is None:
+                            stats.errors += 1
+                        else:
+                            run_hashes[r.content_hash] = conv_pk
+                    else:
+                        # Copia: se vincula solo si el original existe (o se insertó en este lote)
+                        conv_pk = known.get(r.content_hash, run_hashes.get(r.content_hash))
+                        if conv_pk is not None:
+                            stats.linked += 1
+                    if conv_pk is None:
+                        failed.add(r.path)
                         continue
-                except Exception as e:
-                    print(f"Error al leer el archivo {filename}: {e}")
-                    continue
-
-                # 4. Insertar en sa_conversaciones
-                try:
-                    cursor.execute(
-                        """
-                        INSERT INTO sa_conversaciones 
-                        (ejecucion_id, conversacion_id, raw_path, raw_text, total_turnos)
-                        VALUES (%s, %s, %s, %s, %s)
-                        """,
-                        (ejecucion_id, filename, file_path, raw_text, 0)
-                    )
-                    inserted_count += 1
-                except Error as e:
-                    print(f"Error insertando conversación {filename}: {e}")
-
-        # 5. Commit y resumen
+                    size, mtime = file_meta[r.path]
+                    registry_rows.append((r.path, r.content_hash, size, mtime, conv_pk, ejecucion_id))
+                if registry_rows:
+                    cursor.executemany(UPSERT_ARCHIVO_SQL, registry_rows)
+
+                for r in batch:
+                    if r.error is not None or r.path in failed:
+                        stalled = True
+                    elif not stalled:
+                        checkpoint = r.path
+                pending_commit += len(batch)
+                batch = []
+                if pending_commit >= commit_every or force_commit:
+                    _save_checkpoint(cursor, ejecucion_id, checkpoint, stats)
+                    conn.commit()
+                    committed_count = inserted_count
+                    stats.commits += 1
+                    pending_commit = 0
+                if progress_callback:
+                    progress_callback(stats)
+
+        for res in _iter_read_results(to_read, workers, use_processes):
+            _accept_read(res, stats)
+            batch.append(res)
+            if len(batch) >= batch_size:
+                flush()
+        flush(force_commit=True)
+
+        cursor.execute(
+            "UPDATE sa_ingest_checkpoints SET status = 'DONE', files_done = %s, files_skipped = %s, files_linked = %s WHERE ejecucion_id = %s",
+            (stats.files, stats.skipped, stats.linked, ejecucion_id)
+        )
         conn.commit()
-        print("\n--- Resumen de Ingesta ---")
+        stats.commits += 1
+
+        print("\n--- Resumen de Ingesta Incremental ---")
         print(f"ID de Ejecución: {ejecucion_id}")
         print(f"Total de archivos insertados: {inserted_count}")
-        
-        return ejecucion_id, inserted_count
+        print(f"Saltados (sin cambios/checkpoint): {stats.skipped}")
+        print(f"Vinculados por hash: {stats.linked}")
+        print(f"Throughput: {stats.summary()}")
+
+        return ejecucion_id, inserted_count, stats
 
     except Error as e:
         conn.rollback()
-        print(f"Error durante la ingesta. Rollback realizado. Error: {e}")
-        return None, 0
+        if ejecucion_id is None:
+            print(f"Error durante la ingesta incremental. No se pudo crear la ejecución. Error: {e}")
+            return None, 0, stats
+        print(f"Error durante la ingesta incremental. Rollback al último checkpoint de la ejecución "
+              f"{ejecucion_id} ({committed_count} conversaciones confirmadas). Error: {e}")
+        raise IngestaInterrumpida(ejecucion_id, committed_count, stats, e) from e
     finally:
         cursor.close()
+
+
+def _save_checkpoint(cursor, ejecucion_id, last_path, stats):
+    cursor.execute(
+        """
+        UPDATE sa_ingest_checkpoints
+        SET last_path = %s, files_done = %s, files_skipped = %s, files_linked = %s
+        WHERE ejecucion_id = %s
+        """,
+        (last_path, stats.files, stats.skipped, stats.linked, ejecucion_id)
+    )
@@ -0,0 +1,236 @@
+# sa_core/llm_backends.py
+"""
+Backends intercambiables para LLMClient (el "transporte" de chat completions).
+
+- HTTPBackend: la API real compatible con OpenAI / DeepSeek (requests.Session
+  con keep-alive; es el default).
+- RulesBackend: en proceso, sin red ni API key. Responde con el motor de reglas
+  (detect_fase_rules_based) sobre los turnos OBJETIVO del prompt, con el mismo
+  formato JSON que el LLM (un objeto o el array multi-turno).
+- MockLLMServer: servidor HTTP local que imita /v1/chat/completions con
+  latencia (log-normal) y errores 429/5xx configurables; las respuestas las arma
+  RulesBackend. Se usa con HTTPBackend apuntando a mock.base_url, así el camino
+  HTTP completo (sesión, rate limit, reintentos) se mide sin gastar.
+
+Un backend expone post(payload, timeout) -> respuesta con status_code,
+headers, json() y raise_for_status() (como requests.Response) y close().
+"""
+import json
+import math
+import random
+import re
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import requests
+from requests.adapters import HTTPAdapter
+
+from sa_core.fase_guardrails import has_meaningful_text
+from sa_core.fases_rules import detect_fase_rules_based
+from sa_core.prompt_builder import estimate_message_tokens
+
+BACKENDS = ("http", "rules")
+
+# Conf cuando las reglas no dicen nada y se hereda last_phase
+RULES_FALLBACK_CONF = 0.35
+COMPLETION_TOKENS = 25
+
+_TARGET_RE = re.compile(r"^Turno idx=([+-]?\d+) \(OBJETIVO\)(?: \([AC]\))?: ?(.*)$", re.M)
+_LAST_PHASE_RE = re.compile(r"last_phase=([A-Z_]+)")
+_BATCH_RE = re.compile(r"Turnos OBJETIVO a clasificar:")
+
+
+def chat_completions_url(base_url: str) -> str:
+    b = (base_url or "").rstrip("/")
+    if b.endswith("/v1"):
+        return b + "/chat/completions"
+    return b + "/v1/chat/completions"
+
+
+class BackendResponse:
+    """Respuesta en memoria con la interfaz de requests.Response que usa LLMClient."""
+
+    def __init__(self, status_code: int, data: dict | None = None, headers: dict | None = None):
+        self.status_code = status_code
+        self.headers = headers or {}
+        self._data = data
+
+    def json(self):
+        return self._data
+
+    def raise_for_status(self):
+        if self.status_code >= 400:
+            raise requests.HTTPError(f"{self.status_code} Error (backend local)", response=self)
+
+
+class HTTPBackend:
+    def __init__(self, base_url: str, api_key: str, pool_size: int = 4):
+        if not api_key:
+            raise ValueError("api_key for DeepSeek cannot be empty")
+        self.url = chat_completions_url(base_url)
+        self.session = requests.Session()
+        adapter = HTTPAdapter(pool_connections=1, pool_maxsize=max(1, int(pool_size)), max_retries=0)
+        self.session.mount("http://", adapter)
+        self.session.mount("https://", adapter)
+        self.session.headers.update({
+            "Authorization": f"Bearer {api_key}",
+            "Content-Type": "application/json",
+        })
+
+    def post(self, payload: dict, timeout: float):
+        return self.session.post(self.url, json=payload, timeout=timeout)
+
+    def close(self):
+        self.session.close()
+
+
+def rules_completion(messages: list[dict]) -> dict:
+    """
+    Respuesta tipo chat completion para el prompt de fases, con el motor de reglas.
+    Un turno OBJETIVO -> objeto JSON; prompt multi-turno -> array con turno_idx.
+    """
+    user_msg = messages[-1].get("content") or ""
+    m = _LAST_PHASE_RE.search(user_msg)
+    last_phase = m.group(1) if m else None
+    targets = [(int(idx), text) for idx, text in _TARGET_RE.findall(user_msg)]
+
+    answers = []
+    for idx, text in targets:
+        fase, conf, _score = detect_fase_rules_based(text, max(idx, 0), max(idx, 0) + 3, last_phase)
+        if fase is None and has_meaningful_text(text) and last_phase:
+            fase, conf = last_phase, RULES_FALLBACK_CONF
+        answer = {"turno_idx": idx, "fase_id": fase, "confidence": round(conf, 2), "is_noise": fase is None}
+        answers.append(answer)
+        if fase:
+            last_phase = fase
+
+    if _BATCH_RE.search(user_msg):
+        content = json.dumps(answers, ensure_ascii=False)
+    else:
+        single = answers[0] if answers else {"fase_id": None, "confidence": 0.0, "is_noise": True}
+        single.pop("turno_idx", None)
+        content = json.dumps(single, ensure_ascii=False)
+    prompt_tokens = estimate_message_tokens(messages)
+    return {
+        "choices": [{"message": {"role": "assistant", "content": content}}],
+        "usage": {"prompt_tokens": prompt_tokens, "completion_tokens": COMPLETION_TOKENS,
+                  "total_tokens": prompt_tokens + COMPLETION_TOKENS},
+    }
+
+
+class RulesBackend:
+    """Backend en proceso (sin red): ceiling de throughput del pipeline sin el LLM."""
+    url = "rules://local"
+
+    def post(self, payload: dict, timeout: float):
+        return BackendResponse(200, rules_completion(payload.get("messages") or []))
+
+    def close(self):
+        pass
+
+
+def make_backend(kind: str, base_url: str = "", api_key: str = "", pool_size: int = 4):
+    """Backend por nombre (BACKENDS): 'http' (API real o mock) o 'rules' (en proceso)."""
+    kind = (kind or "http").strip().lower()
+    if kind == "http":
+        return HTTPBackend(base_url, api_key, pool_size)
+    if kind == "rules":
+        return RulesBackend()
+    raise ValueError(f"Backend LLM desconocido: {kind} (opciones: {', '.join(BACKENDS)})")
+
+
+# -----------------------
+# Servidor mock
+# -----------------------
+class _MockHandler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"  # keep-alive, como la API real
+    disable_nagle_algorithm = True
+
+    def log_message(self, *args):
+        pass
+
+    def do_POST(self):
+        body = json.loads(self.rfile.read(int(self.headers.get("Content-Length") or 0)) or b"{}")
+        mock = self.server.mock
+        status, delay = mock._sample()
+        try:
+            time.sleep(delay)
+        finally:
+            mock._done()
+        if status == 200:
+            payload = json.dumps(rules_completion(body.get("messages") or []), ensure_ascii=False).encode()
+        else:
+            payload = b'{"error": {"message": "mock error"}}'
+        self.send_response(status)
+        if status == 429:
+            self.send_header("Retry-After", "0")
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(payload)))
+        self.end_headers()
+        self.wfile.write(payload)
+
+
+class MockLLMServer:
+    """
+    /v1/chat/completions local. Latencia log-normal con mediana latency_ms y
+    dispersión latency_sigma (0 = fija); con probabilidad error_rate responde
+    error_status (429 trae Retry-After: 0). Uso:
+
+        with MockLLMServer(latency_ms=300, error_rate=0.02) as mock:
+            client = LLMClient(mock.base_url, "mock", ...)
+    """
+
+    def __init__(self, latency_ms: float = 300.0, latency_sigma: float = 0.5, error_rate: float = 0.0,
+                 error_status: int = 503, seed: int | None = None, host: str = "127.0.0.1", port: int = 0):
+        self.latency_ms = float(latency_ms)
+        self.latency_sigma = float(latency_sigma)
+        self.error_rate = float(error_rate)
+        self.error_status = int(error_status)
+        self._rnd = random.Random(seed)
+        self._lock = threading.Lock()
+        self._stats = {"requests": 0, "errors": 0, "in_flight": 0, "max_in_flight": 0}
+        self._server = ThreadingHTTPServer((host, port), _MockHandler)
+        self._server.daemon_threads = True
+        self._server.mock = self
+        self._thread = None
+
+    @property
+    def base_url(self) -> str:
+        host, port = self._server.server_address[:2]
+        return f"http://{host}:{port}"
+
+    def _sample(self):
+        with self._lock:
+            self._stats["requests"] += 1
+            status = self.error_status if self._rnd.random() < self.error_rate else 200
+            if status != 200:
+                self._stats["errors"] += 1
+            self._stats["in_flight"] += 1
+            self._stats["max_in_flight"] = max(self._stats["max_in_flight"], self._stats["in_flight"])
+            mu = math.log(max(self.latency_ms, 0.001) / 1000)
+            delay = math.exp(self._rnd.gauss(mu, self.latency_sigma)) if self.latency_sigma > 0 else math.exp(mu)
+        return status, (delay if self.latency_ms > 0 else 0.0)
+
+    def _done(self):
+        with self._lock:
+            self._stats["in_flight"] -= 1
+
+    def stats(self) -> dict:
+        with self._lock:
+            return dict(self._stats)
+
+    def start(self) -> "MockLLMServer":
+        self._thread = threading.Thread(target=self._server.serve_forever, daemon=True)
+        self._thread.start()
+        return self
+
+    def stop(self):
+        self._server.shutdown()
+        self._server.server_close()
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, *exc):
+        self.stop()
@@ -0,0 +1,174 @@
+# sa_core/llm_cache.py
+"""
+Caché persistente (SQLite) de respuestas del LLM.
+
+La clave es un sha256 de model + mensajes (system/user) + temperature, así que
+una re-corrida con el mismo contexto, last_phase_info, fases permitidas y
+template de prompt no vuelve a pagar la llamada. Se guarda el resultado ya
+parseado ({fase, conf, is_noise, raw, ...}).
+
+- TTL (ttl_secs, 0 = sin vencimiento) y tope de entradas (max_entries): al
+  superarlo se borran las menos usadas recientemente.
+- Métricas de hits/misses/puts/evicted (stats / format_stats).
+- cache_only=True: nunca se llama a la API; un miss levanta CacheMiss
+  (re-ejecuciones deterministas offline).
+
+Thread-safe: se usa desde el pool de LLMClient.
+"""
+import hashlib
+import json
+import os
+import sqlite3
+import threading
+import time
+
+DEFAULT_CACHE_PATH = os.path.join("out_reports", "llm_cache.sqlite")
+DEFAULT_TTL_DAYS = 30
+DEFAULT_MAX_ENTRIES = 200000
+
+# Subir si cambia el formato del resultado guardado (invalida la caché anterior)
+KEY_VERSION = 1
+
+# Cada cuántos put se revisa el tope de entradas
+EVICT_EVERY = 500
+
+
+class CacheMiss(Exception):
+    """Miss en modo cache_only: no se permite llamar a la API."""
+
+
+def prompt_fingerprint(model: str, messages: list[dict], temperature: float = 0.0) -> str:
+    """sha256 de todo lo que se envía al modelo."""
+    blob = json.dumps(
+        {"v": KEY_VERSION, "model": model, "messages": messages, "temperature": temperature},
+        ensure_ascii=False, sort_keys=True, separators=(",", ":"),
+    )
+    return hashlib.sha256(blob.encode("utf-8")).hexdigest()
+
+
+class LLMCache:
+    def __init__(self, path: str = DEFAULT_CACHE_PATH, ttl_secs: float = DEFAULT_TTL_DAYS * 86400,
+                 max_entries: int = DEFAULT_MAX_ENTRIES, cache_only: bool = False):
+        self.path = path
+        self.ttl_secs = ttl_secs
+        self.max_entries = max_entries
+        self.cache_only = cache_only
+        if path != ":memory:" and os.path.dirname(path):
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+        self._lock = threading.Lock()
+        self._db = sqlite3.connect(path, check_same_thread=False)
+        if path != ":memory:":
+            self._db.execute("PRAGMA journal_mode=WAL")
+        self._db.execute("PRAGMA synchronous=NORMAL")
+        self._db.execute("""
+            CREATE TABLE IF NOT EXISTS llm_cache (
+                cache_key TEXT PRIMARY KEY,
+                model TEXT,
+                result TEXT NOT NULL,
+                created_at REAL NOT NULL,
+                last_used_at REAL NOT NULL,
+                hits INTEGER NOT NULL DEFAULT 0
+            )
+        """)
+        self._db.execute("CREATE INDEX IF NOT EXISTS idx_llm_cache_last_used ON llm_cache(last_used_at)")
+        self._db.commit()
+        self._puts_since_evict = 0
+        self._stats = {"hits": 0, "misses": 0, "expired": 0, "puts": 0, "evicted": 0}
+
+    def get(self, key: str) -> dict | None:
+        now = time.time()
+        with self._lock:
+            row = self._db.execute(
+                "SELECT result, created_at FROM llm_cache WHERE cache_key=?", (key,)
+            ).fetchone()
+            if row is not None and self.ttl_secs and (now - row[1]) > self.ttl_secs:
+                self._db.execute("DELETE FROM llm_cache WHERE cache_key=?", (key,))
+                self._db.commit()
+                self._stats["expired"] += 1
+                row = None
+            if row is None:
+                self._stats["misses"] += 1
+                return None
+            self._db.execute(
+                "UPDATE llm_cache SET last_used_at=?, hits=hits+1 WHERE cache_key=?", (now, key)
+            )
+            self._db.commit()
+            self._stats["hits"] += 1
+        return json.loads(row[0])
+
+    def put(self, key: str, model: str, result: dict):
+        now = time.time()
+        with self._lock:
+            self._db.execute(
+                """
+                INSERT INTO llm_cache (cache_key, model, result, created_at, last_used_at, hits)
+                VALUES (?, ?, ?, ?, ?, 0)
+                ON CONFLICT(cache_key) DO UPDATE SET
+                    model=excluded.model, result=excluded.result,
+                    created_at=excluded.created_at, last_used_at=excluded.last_used_at
+                """,
+                (key, model, json.dumps(result, ensure_ascii=False), now, now),
+            )
+            self._db.commit()
+            self._stats["puts"] += 1
+            self._puts_since_evict += 1
+            if self._puts_since_evict >= EVICT_EVERY:
+                self._evict_locked()
+
+    def _evict_locked(self):
+        self._puts_since_evict = 0
+        removed = 0
+        if self.ttl_secs:
+            cur = self._db.execute("DELETE FROM llm_cache WHERE created_at < ?", (time.time() - self.ttl_secs,))
+            removed += cur.rowcount
+        if self.max_entries:
+            n = self._db.execute("SELECT COUNT(*) FROM llm_cache").fetchone()[0]
+            if n > self.max_entries:
+                cur = self._db.execute(
+                    """
+                    DELETE FROM llm_cache WHERE cache_key IN (
+                        SELECT cache_key FROM llm_cache ORDER BY last_used_at LIMIT ?
+                    )
+                    """,
+                    (n - self.max_entries,),
+                )
+                removed += cur.rowcount
+        self._db.commit()
+        self._stats["evicted"] += removed
+        return removed
+
+    def evict(self) -> int:
+        """Borra vencidos y, si sobra, los menos usados recientemente. Devuelve filas borradas."""
+        with self._lock:
+            return self._evict_locked()
+
+    def __len__(self):
+        with self._lock:
+            return self._db.execute("SELECT COUNT(*) FROM llm_cache").fetchone()[0]
+
+    def stats(self) -> dict:
+        with self._lock:
+            out = dict(self._stats)
+        lookups = out["hits"] + out["misses"]
+        out["hit_rate"] = (out["hits"] / lookups) if lookups else 0.0
+        return out
+
+    def format_stats(self) -> str:
+        st = self.stats()
+        return (
+            f"hits={st['hits']} misses={st['misses']} hit_rate={st['hit_rate']:.1%} "
+            f"expired={st['expired']} puts={st['puts']} evicted={st['evicted']} "
+            f"cache_only={self.cache_only}"
+        )
+
+    def close(self):
+        with self._lock:
+            if self._puts_since_evict:
+                self._evict_locked()
+            self._db.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
@@ -0,0 +1,274 @@
+# sa_core/llm_client.py
+"""
+Cliente HTTP compartido para el LLM (API compatible con OpenAI / DeepSeek).
+
+- Una requests.Session con keep-alive y pool de conexiones del tamaño de la
+  concurrencia (sin un TCP/TLS handshake por turno).
+- Rate limit con token bucket (rate_per_sec, burst) en lugar de time.sleep fijos.
+- Reintentos con backoff exponencial + jitter ante 429/5xx y errores de red,
+  respetando Retry-After cuando el servidor lo manda.
+- Concurrencia acotada: map_unordered / map_by_key reparten las llamadas en un
+  ThreadPoolExecutor y devuelven los resultados en el hilo que llama, de modo que
+  un único escritor toca la BD.
+- telemetry (opcional, sa_core.llm_telemetry.LLMTelemetry): cada llamada
+  registra estado HTTP, latencia, intentos y el bloque `usage` de la respuesta.
+- backend (opcional, sa_core.llm_backends): transporte de las llamadas. Default
+  HTTPBackend (la API); RulesBackend o un MockLLMServer local para benchmarks
+  sin API key ni costo.
+
+Lo usan scripts/reclasificar_turnos_deepseek.py y ui/analyze.py.
+"""
+import random
+import threading
+import time
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor, FIRST_COMPLETED, wait
+
+import requests
+
+from sa_core.llm_backends import HTTPBackend
+
+RETRY_STATUS = {429, 500, 502, 503, 504}
+
+DEFAULT_CONCURRENCY = 4
+DEFAULT_RATE_PER_SEC = 8.0
+
+
+class TokenBucket:
+    """Token bucket thread-safe: rate tokens/seg, hasta capacity acumulados."""
+
+    def __init__(self, rate: float, capacity: float | None = None):
+        self.rate = float(rate)
+        self.capacity = float(capacity if capacity is not None else max(1.0, rate))
+        self._tokens = self.capacity
+        self._last = time.monotonic()
+        self._lock = threading.Lock()
+        self.waited_secs = 0.0
+
+    def acquire(self, tokens: float = 1.0) -> float:
+        """Bloquea hasta tener `tokens` disponibles. Devuelve los segundos esperados."""
+        if self.rate <= 0:
+            return 0.0
+        waited = 0.0
+        while True:
+            with self._lock:
+                now = time.monotonic()
+                self._tokens = min(self.capacity, self._tokens + (now - self._last) * self.rate)
+                self._last = now
+                if self._tokens >= tokens:
+                    self._tokens -= tokens
+                    self.waited_secs += waited
+                    return waited
+                delay = (tokens - self._tokens) / self.rate
+            time.sleep(delay)
+            waited += delay
+
+
+class LLMClient:
+    """
+    Cliente de chat completions con sesión persistente, rate limit y reintentos.
+
+    Thread-safe: chat() puede llamarse desde varios hilos a la vez (la Session
+    de requests comparte el pool de conexiones del HTTPAdapter).
+    """
+
+    def __init__(self, base_url: str, api_key: str, model: str = "deepseek-chat",
+                 concurrency: int = DEFAULT_CONCURRENCY, rate_per_sec: float = DEFAULT_RATE_PER_SEC,
+                 burst: float | None = None, timeout: float = 60, max_retries: int = 5,
+                 backoff_base: float = 0.5, backoff_max: float = 30.0, telemetry=None, backend=None):
+        self.model = model
+        self.concurrency = max(1, int(concurrency))
+        self.timeout = timeout
+        self.max_retries = max(0, int(max_retries))
+        self.backoff_base = backoff_base
+        self.backoff_max = backoff_max
+        self.bucket = TokenBucket(rate_per_sec, burst if burst is not None else self.concurrency)
+        self.telemetry = telemetry
+        # Sesión keep-alive con pool del tamaño de la concurrencia (o backend inyectado)
+        self.backend = backend if backend is not None else HTTPBackend(base_url, api_key, self.concurrency)
+        self.url = self.backend.url
+
+        self._executor = None
+        self._stats_lock = threading.Lock()
+        self._stats = {"calls": 0, "ok": 0, "errors": 0, "retries": 0, "http_429": 0, "http_5xx": 0, "secs": 0.0}
+
+    # -----------------------
+    # Llamada individual
+    # -----------------------
+    def _count(self, **deltas):
+        with self._stats_lock:
+            for k, v in deltas.items():
+                self._stats[k] += v
+
+    def _backoff(self, attempt: int, retry_after: str | None = None) -> float:
+        if retry_after:
+            try:
+                return min(self.backoff_max, max(0.0, float(retry_after)))
+            except ValueError:
+                pass
+        delay = min(self.backoff_max, self.backoff_base * (2 ** attempt))
+        return delay * (0.5 + random.random() / 2)
+
+    def post_json(self, payload: dict) -> dict:
+        """POST al endpoint con rate limit y reintentos. Devuelve el JSON de la respuesta."""
+        self._count(calls=1)
+        t0 = time.perf_counter()
+        attempt = 0
+        status = None
+        usage = None
+        ok = False
+        try:
+            while True:
+                self.bucket.acquire()
+                status = None
+                try:
+                    r = self.backend.post(payload, self.timeout)
+                except (requests.ConnectionError, requests.Timeout):
+                    if attempt >= self.max_retries:
+                        raise
+                    self._count(retries=1)
+                    time.sleep(self._backoff(attempt))
+                    attempt += 1
+                    continue
+
+                status = r.status_code
+                if r.status_code in RETRY_STATUS:
+                    if r.status_code == 429:
+                        self._count(http_429=1)
+                    else:
+                        self._count(http_5xx=1)
+                    if attempt < self.max_retries:
+                        self._count(retries=1)
+                        time.sleep(self._backoff(attempt, r.headers.get("Retry-After")))
+                        attempt += 1
+                        continue
+                r.raise_for_status()
+                data = r.json()
+                usage = data.get("usage")
+                ok = True
+                self._count(ok=1)
+                return data
+        except Exception:
+            self._count(errors=1)
+            raise
+        finally:
+            dt = time.perf_counter() - t0
+            self._count(secs=dt)
+            if self.telemetry is not None:
+                self.telemetry.record(status, dt, usage, intentos=attempt + 1, ok=ok)
+
+    def chat(self, messages: list[dict], temperature: float = 0.0, **extra) -> str:
+        """Chat completion: devuelve el content del primer choice."""
+        payload = {"model": self.model, "messages": messages, "temperature": temperature}
+        payload.update(extra)
+        data = self.post_json(payload)
+        return data["choices"][0]["message"]["content"]
+
+    # -----------------------
+    # Concurrencia acotada
+    # -----------------------
+    def _pool(self) -> ThreadPoolExecutor:
+        if self._executor is None:
+            self._executor = ThreadPoolExecutor(max_workers=self.concurrency, thread_name_prefix="llm")
+        return self._executor
+
+    def map_unordered(self, fn, items, max_in_flight: int | None = None):
+        """
+        Ejecuta fn(item) en el pool con a lo sumo max_in_flight llamadas pendientes.
+        Genera (item, resultado, excepción) en orden de llegada, en el hilo que llama.
+        """
+        max_in_flight = max_in_flight or self.concurrency * 2
+        pool = self._pool()
+        pending = {}
+        it = iter(items)
+        exhausted = False
+        while True:
+            while not exhausted and len(pending) < max_in_flight:
+                try:
+                    item = next(it)
+                except StopIteration:
+                    exhausted = True
+                    break
+                pending[pool.submit(fn, item)] = item
+            if not pending:
+                return
+            done, _ = wait(pending, return_when=FIRST_COMPLETED)
+            for fut in done:
+                item = pending.pop(fut)
+                exc = fut.exception()
+                yield item, (None if exc else fut.result()), exc
+
+    def map_by_key(self, fn, groups, prepare, max_in_flight: int | None = None):
+        """
+        Como map_unordered, pero los ítems de un mismo grupo van de a uno y en orden:
+        el siguiente ítem del grupo se prepara recién después de que el llamador
+        consumió el resultado anterior (y pudo escribirlo en la BD). Grupos distintos
+        corren en paralelo.
+
+        Args:
+            fn: llamada al LLM, job -> resultado (corre en el pool)
+            groups: iterable de listas de ítems (p.ej. turnos por conversación)
+            prepare: ítem -> job, o None si el ítem se resolvió sin LLM. Corre en
+                el hilo que llama (puede leer/escribir la BD).
+
+        Genera (job, resultado, excepción) en el hilo que llama.
+        """
+        max_in_flight = max_in_flight or self.concurrency * 2
+        pool = self._pool()
+        pending = {}
+        groups_it = iter(groups)
+        exhausted = False
+
+        def submit_next(queue_):
+            while queue_:
+                job = prepare(queue_.popleft())
+                if job is not None:
+                    pending[pool.submit(fn, job)] = (job, queue_)
+                    return True
+            return False
+
+        while True:
+            while not exhausted and len(pending) < max_in_flight:
+                try:
+                    queue_ = deque(next(groups_it))
+                except StopIteration:
+                    exhausted = True
+                    break
+                submit_next(queue_)
+            if not pending:
+                return
+            done, _ = wait(pending, return_when=FIRST_COMPLETED)
+            for fut in done:
+                job, queue_ = pending.pop(fut)
+                exc = fut.exception()
+                yield job, (None if exc else fut.result()), exc
+                submit_next(queue_)
+
+    # -----------------------
+    # Métricas / cierre
+    # -----------------------
+    def stats(self) -> dict:
+        with self._stats_lock:
+            out = dict(self._stats)
+        out["rate_wait_secs"] = self.bucket.waited_secs
+        return out
+
+    def format_stats(self) -> str:
+        st = self.stats()
+        return (
+            f"calls={st['calls']} ok={st['ok']} errors={st['errors']} retries={st['retries']} "
+            f"http_429={st['http_429']} http_5xx={st['http_5xx']} "
+            f"secs={st['secs']:.1f} rate_wait={st['rate_wait_secs']:.1f}s"
+        )
+
+    def close(self):
+        if self._executor is not None:
+            self._executor.shutdown(wait=True)
+            self._executor = None
+        self.backend.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
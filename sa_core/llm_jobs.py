@@ -0,0 +1,239 @@
+# sa_core/llm_jobs.py
+"""
+Trabajos persistentes de reclasificación con LLM (sa_llm_jobs).
+
+Antes cada corrida re-seleccionaba los pendientes con LIMIT sobre el filtro
+completo (y los contaba con COUNT(*) antes y después de cada batch); los turnos
+que el LLM dejaba sin fase (NOISE, conf baja) volvían a salir en el batch
+siguiente y se pagaban otra vez, y si el proceso moría no quedaba registro.
+
+- Un job por (ejecucion_id, origen) con cursor last_turno_pk, estado y contadores.
+- claim(): toma el siguiente chunk de pendientes con keyset (turno_pk > cursor,
+  ORDER BY turno_pk LIMIT n) en lugar de re-escanear el filtro.
+- advance(): después de escribir y commitear el chunk, persiste el cursor y
+  los contadores. Los turnos que quedaron sin resolver por causas transitorias
+  (error de API, presupuesto, cache_only) se pasan en retry_pks y se guardan
+  en sa_llm_job_retries; el cursor avanza igual hasta lo reclamado.
+- start(resume=True) retoma el último job no terminado del mismo origen (CLI
+  o UI) desde su cursor; claim() sirve primero sus reintentos y después sigue
+  con el keyset, sin volver a mandar lo ya procesado.
+
+Un job lo procesa un solo worker a la vez.
+"""
+
+JOB_CHUNK = 500
+
+STATUS_RUNNING = "RUNNING"
+STATUS_PAUSED = "PAUSED"     # corte por max_rows / max_iters / presupuesto: se puede reanudar
+STATUS_DONE = "DONE"
+STATUS_FAILED = "FAILED"
+
+# Criterios de pendiente (alias t = sa_turnos)
+PENDING_FASE = "(t.fase IS NULL OR TRIM(t.fase)='')"
+PENDING_SIN_FUENTE = (
+    "(t.fase IS NULL OR TRIM(t.fase)='')"
+    " AND (t.fase_source IS NULL OR TRIM(t.fase_source)='' OR t.fase_source='NO_IMP')"
+)
+
+COUNTERS = ("turnos", "escritos", "llamadas", "errores")
+
+
+def ensure_llm_jobs_table(conn):
+    """Crea sa_llm_jobs si no existe."""
+    cursor = conn.cursor()
+    try:
+        cursor.execute("""
+            CREATE TABLE IF NOT EXISTS sa_llm_jobs (
+                job_pk BIGINT AUTO_INCREMENT PRIMARY KEY,
+                ejecucion_id INT NOT NULL,
+                origen VARCHAR(16) NOT NULL,
+                status VARCHAR(16) NOT NULL,
+                last_turno_pk BIGINT NOT NULL DEFAULT 0,
+                turnos INT NOT NULL DEFAULT 0,
+                escritos INT NOT NULL DEFAULT 0,
+                llamadas INT NOT NULL DEFAULT 0,
+                errores INT NOT NULL DEFAULT 0,
+                created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+                updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP ON UPDATE CURRENT_TIMESTAMP,
+                INDEX idx_ejecucion_origen (ejecucion_id, origen, status)
+            )
+        """)
+        cursor.execute("""
+            CREATE TABLE IF NOT EXISTS sa_llm_job_retries (
+                job_pk BIGINT NOT NULL,
+                turno_pk BIGINT NOT NULL,
+                PRIMARY KEY (job_pk, turno_pk)
+            )
+        """)
+        conn.commit()
+    finally:
+        cursor.close()
+
+
+def _row_pk(row) -> int:
+    return int(row["turno_pk"] if isinstance(row, dict) else row[0])
+
+
+def _in_placeholders(values) -> str:
+    return ", ".join(["%s"] * len(values))
+
+
+class LLMJob:
+    def __init__(self, conn, job_pk: int, ejecucion_id: int, origen: str, last_turno_pk: int = 0,
+                 counters: dict | None = None, resumed: bool = False):
+        self.conn = conn
+        self.job_pk = job_pk
+        self.ejecucion_id = ejecucion_id
+        self.origen = origen
+        self.last_turno_pk = last_turno_pk   # persistido: todo lo <= ya se procesó (salvo los reintentos)
+        self.resumed = resumed
+        self.status = STATUS_RUNNING
+        self.counters = {k: 0 for k in COUNTERS}
+        self.counters.update(counters or {})
+        self._claimed_pk = last_turno_pk     # hasta dónde se reclamó en esta corrida
+        self._retries = set()                # reintentos persistidos en sa_llm_job_retries
+        self._retry_queue = []               # reintentos de corridas anteriores aún no servidos
+        self._served = set()                 # reintentos servidos desde el último advance()
+
+    @classmethod
+    def start(cls, conn, ejecucion_id: int, origen: str, resume: bool = True) -> "LLMJob":
+        """Retoma el último job no terminado de (ejecucion_id, origen) o crea uno nuevo."""
+        ensure_llm_jobs_table(conn)
+        cursor = conn.cursor()
+        try:
+            row = None
+            if resume:
+                cursor.execute(
+                    """
+                    SELECT job_pk, last_turno_pk, turnos, escritos, llamadas, errores
+                    FROM sa_llm_jobs
+                    WHERE ejecucion_id=%s AND origen=%s AND status<>%s
+                    ORDER BY job_pk DESC
+                    LIMIT 1
+                    """,
+                    (ejecucion_id, origen, STATUS_DONE)
+                )
+                row = cursor.fetchone()
+            if row is not None:
+                job = cls(conn, int(row[0]), ejecucion_id, origen, int(row[1]),
+                          dict(zip(COUNTERS, (int(v) for v in row[2:]))), resumed=True)
+                cursor.execute("UPDATE sa_llm_jobs SET status=%s WHERE job_pk=%s", (STATUS_RUNNING, job.job_pk))
+                cursor.execute("SELECT turno_pk FROM sa_llm_job_retries WHERE job_pk=%s", (job.job_pk,))
+                job._retries = {int(r[0]) for r in cursor.fetchall()}
+                job._retry_queue = sorted(job._retries)
+            else:
+                cursor.execute(
+                    "INSERT INTO sa_llm_jobs (ejecucion_id, origen, status) VALUES (%s, %s, %s)",
+                    (ejecucion_id, origen, STATUS_RUNNING)
+                )
+                job = cls(conn, int(cursor.lastrowid), ejecucion_id, origen)
+            conn.commit()
+        finally:
+            cursor.close()
+        return job
+
+    def claim(self, cursor, columns: str, limit: int = JOB_CHUNK, pending_where: str = PENDING_FASE) -> list:
+        """
+        Siguiente chunk de turnos pendientes: primero los reintentos de corridas
+        anteriores (una vez por corrida), después el keyset por turno_pk desde el cursor.
+        columns debe empezar con t.turno_pk; sirve con cursores de tuplas o dictionary=True.
+        """
+        limit = max(1, int(limit))
+        while self._retry_queue:
+            pks, self._retry_queue = self._retry_queue[:limit], self._retry_queue[limit:]
+            # Los que ya no están pendientes se descartan del set en el próximo advance()
+            self._served.update(pks)
+            cursor.execute(
+                f"""
+                SELECT {columns}
+                FROM sa_turnos t
+                JOIN sa_conversaciones c ON c.conversacion_pk = t.conversacion_pk
+                WHERE c.ejecucion_id = %s
+                  AND t.turno_pk IN ({_in_placeholders(pks)})
+                  AND {pending_where}
+                ORDER BY t.turno_pk
+                """,
+                (self.ejecucion_id, *pks)
+            )
+            rows = cursor.fetchall()
+            if rows:
+                return rows
+        cursor.execute(
+            f"""
+            SELECT {columns}
+            FROM sa_turnos t
+            JOIN sa_conversaciones c ON c.conversacion_pk = t.conversacion_pk
+            WHERE c.ejecucion_id = %s
+              AND t.turno_pk > %s
+              AND {pending_where}
+            ORDER BY t.turno_pk
+            LIMIT %s
+            """,
+            (self.ejecucion_id, self._claimed_pk, limit)
+        )
+        rows = cursor.fetchall()
+        if rows:
+            self._claimed_pk = _row_pk(rows[-1])
+        return rows
+
+    def advance(self, retry_pks=(), **deltas) -> int:
+        """
+        Persiste cursor, reintentos y contadores (deltas: turnos, escritos, llamadas,
+        errores) y hace commit. Llamar después de escribir el chunk. retry_pks: turnos
+        reclamados que quedaron pendientes por causas transitorias. Devuelve el cursor.
+        """
+        retries = (self._retries - self._served) | {int(pk) for pk in retry_pks}
+        self.last_turno_pk = max(self.last_turno_pk, self._claimed_pk)
+        for k, v in deltas.items():
+            self.counters[k] += int(v)
+        self._save(retries)
+        self._served = set()
+        return self.last_turno_pk
+
+    def finish(self, status: str = STATUS_DONE):
+        """
+        Cierra la corrida. DONE solo si no quedaron turnos para reintentar; si
+        no, queda PAUSED para que la próxima corrida los retome.
+        """
+        if status == STATUS_DONE and self._retries:
+            status = STATUS_PAUSED
+        self.status = status
+        self._save()
+
+    def _save(self, retries=None):
+        cursor = self.conn.cursor()
+        try:
+            if retries is not None:
+                removed = sorted(self._retries - retries)
+                added = sorted(retries - self._retries)
+                if removed:
+                    cursor.execute(
+                        f"DELETE FROM sa_llm_job_retries WHERE job_pk=%s AND turno_pk IN ({_in_placeholders(removed)})",
+                        (self.job_pk, *removed)
+                    )
+                if added:
+                    cursor.executemany(
+                        "INSERT INTO sa_llm_job_retries (job_pk, turno_pk) VALUES (%s, %s)",
+                        [(self.job_pk, pk) for pk in added]
+                    )
+            cursor.execute(
+                """
+                UPDATE sa_llm_jobs
+                SET status=%s, last_turno_pk=%s, turnos=%s, escritos=%s, llamadas=%s, errores=%s
+                WHERE job_pk=%s
+                """,
+                (self.status, self.last_turno_pk) + tuple(self.counters[k] for k in COUNTERS) + (self.job_pk,)
+            )
+            self.conn.commit()
+            if retries is not None:
+                self._retries = retries
+        finally:
+            cursor.close()
+
+    def format_status(self) -> str:
+        c = self.counters
+        return (
+            f"job={self.job_pk} status={self.status} {'reanudado ' if self.resumed else ''}"
+            f"cursor_turno_pk={self.last_turno_pk} turnos={c['turnos']} escritos={c['escritos']} "
+            f"llamadas={c['llamadas']} errores={c['errores']} reintentos={len(self._retries)}"
+        )
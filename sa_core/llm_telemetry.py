@@ -0,0 +1,217 @@
+# sa_core/llm_telemetry.py
+"""
+Telemetría de llamadas al LLM: tokens, latencia, estado HTTP y costo por
+llamada, persistidos en sa_llm_llamadas y ligados a ejecucion_id.
+
+- LLMClient llama a record() después de cada llamada (con sus reintentos); el
+  bloque `usage` de la respuesta ya no se descarta.
+- bind(turno_pk, n_turnos) etiqueta las llamadas del hilo actual (una llamada
+  puede cubrir varios turnos en modo batch).
+- Presupuesto por corrida (tokens y/o USD): budget_exhausted() avisa que hay
+  que dejar de despachar; los turnos restantes quedan pendientes. Las llamadas
+  ya en vuelo terminan, así que el consumo puede pasar el tope por poco.
+- summary() / load_usage_summary(): llamadas, tokens, costo, p50/p95 de
+  latencia y tokens por turno (CLI y dashboard).
+
+record() es thread-safe; flush() escribe en la BD y debe llamarse desde el
+hilo dueño de la conexión.
+"""
+import math
+import threading
+
+# USD por millón de tokens (deepseek-chat); se pueden pisar por CLI / config.ini
+DEFAULT_PRICE_IN_PER_MTOK = 0.27
+DEFAULT_PRICE_OUT_PER_MTOK = 1.10
+
+# Registros en memoria antes de volcarlos a sa_llm_llamadas
+FLUSH_EVERY = 200
+
+INSERT_LLAMADA_SQL = """
+    INSERT INTO sa_llm_llamadas
+    (ejecucion_id, origen, model, turno_pk, n_turnos, http_status, outcome, intentos,
+     prompt_tokens, completion_tokens, latency_ms, costo_usd)
+    VALUES (%s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s)
+"""
+
+
+def ensure_llm_calls_table(conn):
+    """Crea sa_llm_llamadas si no existe."""
+    cursor = conn.cursor()
+    try:
+        cursor.execute("""
+            CREATE TABLE IF NOT EXISTS sa_llm_llamadas (
+                llamada_pk BIGINT AUTO_INCREMENT PRIMARY KEY,
+                ejecucion_id INT NOT NULL,
+                origen VARCHAR(16) NOT NULL,
+                model VARCHAR(64) NULL,
+                turno_pk BIGINT NULL,
+                n_turnos INT NOT NULL DEFAULT 1,
+                http_status INT NULL,
+                outcome VARCHAR(16) NOT NULL,
+                intentos INT NOT NULL DEFAULT 1,
+                prompt_tokens INT NOT NULL DEFAULT 0,
+                completion_tokens INT NOT NULL DEFAULT 0,
+                latency_ms INT NOT NULL,
+                costo_usd DECIMAL(12,6) NOT NULL DEFAULT 0,
+                created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+                INDEX idx_ejecucion_id (ejecucion_id)
+            )
+        """)
+        conn.commit()
+    finally:
+        cursor.close()
+
+
+def percentile(values, q: float):
+    """Percentil por rango más cercano (q en 0..100). None si no hay valores."""
+    if not values:
+        return None
+    ordered = sorted(values)
+    rank = max(1, math.ceil(q / 100 * len(ordered)))
+    return ordered[rank - 1]
+
+
+def _summarize(latencies_ms, ok, errors, prompt_tokens, completion_tokens, n_turnos, costo_usd) -> dict:
+    total_tokens = prompt_tokens + completion_tokens
+    return {
+        "calls": ok + errors,
+        "ok": ok,
+        "errors": errors,
+        "prompt_tokens": prompt_tokens,
+        "completion_tokens": completion_tokens,
+        "total_tokens": total_tokens,
+        "costo_usd": costo_usd,
+        "p50_ms": percentile(latencies_ms, 50),
+        "p95_ms": percentile(latencies_ms, 95),
+        "p99_ms": percentile(latencies_ms, 99),
+        "tokens_por_turno": (total_tokens / n_turnos) if n_turnos else 0.0,
+    }
+
+
+def format_usage(st: dict) -> str:
+    p50 = f"{st['p50_ms']}ms" if st["p50_ms"] is not None else "-"
+    p95 = f"{st['p95_ms']}ms" if st["p95_ms"] is not None else "-"
+    return (
+        f"llamadas={st['calls']} ok={st['ok']} errors={st['errors']} "
+        f"tokens_in={st['prompt_tokens']} tokens_out={st['completion_tokens']} "
+        f"tokens/turno={st['tokens_por_turno']:.0f} costo_usd={st['costo_usd']:.4f} p50={p50} p95={p95}"
+    )
+
+
+class LLMTelemetry:
+    def __init__(self, ejecucion_id: int | None, origen: str = "SCRIPT", model: str | None = None,
+                 token_budget: int = 0, cost_budget: float = 0.0,
+                 price_in_per_mtok: float = DEFAULT_PRICE_IN_PER_MTOK,
+                 price_out_per_mtok: float = DEFAULT_PRICE_OUT_PER_MTOK):
+        self.ejecucion_id = ejecucion_id
+        self.origen = origen
+        self.model = model
+        self.token_budget = int(token_budget or 0)
+        self.cost_budget = float(cost_budget or 0.0)
+        self.price_in_per_mtok = price_in_per_mtok
+        self.price_out_per_mtok = price_out_per_mtok
+        self._lock = threading.Lock()
+        self._local = threading.local()
+        self._pending = []   # filas para INSERT_LLAMADA_SQL
+        self._latencies_ms = []
+        self._totals = {"ok": 0, "errors": 0, "prompt_tokens": 0, "completion_tokens": 0, "n_turnos": 0, "costo_usd": 0.0}
+
+    def __len__(self):
+        with self._lock:
+            return len(self._pending)
+
+    def bind(self, turno_pk: int | None = None, n_turnos: int = 1):
+        """Etiqueta las próximas llamadas de este hilo."""
+        self._local.turno_pk = turno_pk
+        self._local.n_turnos = n_turnos
+
+    def cost(self, prompt_tokens: int, completion_tokens: int) -> float:
+        return (prompt_tokens * self.price_in_per_mtok + completion_tokens * self.price_out_per_mtok) / 1_000_000
+
+    def record(self, http_status: int | None, latency_secs: float, usage: dict | None = None,
+               intentos: int = 1, ok: bool | None = None):
+        """Registra una llamada (ok=None: OK si http_status == 200)."""
+        usage = usage or {}
+        prompt_tokens = int(usage.get("prompt_tokens") or 0)
+        completion_tokens = int(usage.get("completion_tokens") or 0)
+        latency_ms = int(round(latency_secs * 1000))
+        costo = self.cost(prompt_tokens, completion_tokens)
+        if ok is None:
+            ok = http_status == 200
+        turno_pk = getattr(self._local, "turno_pk", None)
+        n_turnos = getattr(self._local, "n_turnos", 1)
+        with self._lock:
+            self._pending.append((
+                self.ejecucion_id, self.origen, self.model, turno_pk, n_turnos, http_status,
+                "OK" if ok else "ERROR", intentos, prompt_tokens, completion_tokens, latency_ms, round(costo, 6),
+            ))
+            self._latencies_ms.append(latency_ms)
+            t = self._totals
+            t["ok" if ok else "errors"] += 1
+            t["prompt_tokens"] += prompt_tokens
+            t["completion_tokens"] += completion_tokens
+            t["costo_usd"] += costo
+            if ok:
+                t["n_turnos"] += n_turnos
+
+    def budget_exhausted(self) -> bool:
+        with self._lock:
+            t = self._totals
+            if self.token_budget and t["prompt_tokens"] + t["completion_tokens"] >= self.token_budget:
+                return True
+            return bool(self.cost_budget) and t["costo_usd"] >= self.cost_budget
+
+    def summary(self) -> dict:
+        with self._lock:
+            t = dict(self._totals)
+            latencies = list(self._latencies_ms)
+        return _summarize(latencies, t["ok"], t["errors"], t["prompt_tokens"], t["completion_tokens"],
+                          t["n_turnos"], t["costo_usd"])
+
+    def format_summary(self) -> str:
+        out = format_usage(self.summary())
+        if self.token_budget or self.cost_budget:
+            out += f" budget_tokens={self.token_budget or '-'} budget_usd={self.cost_budget or '-'}"
+        return out
+
+    def flush(self, conn) -> int:
+        """Inserta las llamadas registradas desde el último flush y hace commit."""
+        with self._lock:
+            rows, self._pending = self._pending, []
+        if not rows:
+            return 0
+        cursor = conn.cursor()
+        try:
+            cursor.executemany(INSERT_LLAMADA_SQL, rows)
+            conn.commit()
+        finally:
+            cursor.close()
+        return len(rows)
+
+
+def load_usage_summary(conn, ejecucion_ids: list[int]) -> dict | None:
+    """Resumen de sa_llm_llamadas para las ejecuciones dadas (None si no hay llamadas)."""
+    if not ejecucion_ids:
+        return None
+    placeholders = ", ".join(["%s"] * len(ejecucion_ids))
+    cursor = conn.cursor()
+    try:
+        cursor.execute(
+            f"""
+            SELECT outcome, n_turnos, prompt_tokens, completion_tokens, latency_ms, costo_usd
+            FROM sa_llm_llamadas
+            WHERE ejecucion_id IN ({placeholders})
+            """,
+            tuple(ejecucion_ids)
+        )
+        rows = cursor.fetchall()
+    finally:
+        cursor.close()
+    if not rows:
+        return None
+    ok = sum(1 for r in rows if r[0] == "OK")
+    return _summarize(
+        [int(r[4]) for r in rows], ok, len(rows) - ok,
+        sum(int(r[2]) for r in rows), sum(int(r[3]) for r in rows),
+        sum(int(r[1]) for r in rows if r[0] == "OK"), float(sum(r[5] for r in rows)),
+    )
@@ -0,0 +1,125 @@
+# sa_core/normalizacion.py
+"""
+Capa compartida de normalización de texto con caché LRU acotada.
+
+normalize_text (reglas de fases) y strip_diacritics (reclasificador DeepSeek)
+se recalculaban para los mismos textos en cada etapa; los acks cortos del
+cliente ("sí", "ya", "ok", ...) se repiten millones de veces. Aquí se memoizan
+por texto crudo, con contadores de hits/misses (cache_stats).
+
+Solo se cachean textos de hasta MAX_CACHED_LEN caracteres: los turnos largos casi
+nunca se repiten y llenarían la caché. Esos se calculan directo ("bypass").
+"""
+import os
+import re
+import unicodedata
+from functools import lru_cache
+
+CACHE_SIZE = int(os.environ.get("SA_NORM_CACHE_SIZE", "100000"))
+MAX_CACHED_LEN = int(os.environ.get("SA_NORM_MAX_CACHED_LEN", "200"))
+
+_SYMBOLS_RE = re.compile(r"[\./:;,_-]")
+_SPACES_RE = re.compile(r"\s+")
+
+_bypass = {"normalize_text": 0, "strip_diacritics": 0}
+
+
+def _normalize_text(s: str) -> str:
+    s = s.lower()
+    if not s.isascii():
+        # En ASCII NFD no cambia nada y no hay marcas combinantes
+        s = unicodedata.normalize("NFD", s)
+        s = "".join(ch for ch in s if unicodedata.category(ch) != "Mn")
+    # Eliminar símbolos comunes que pueden distorsionar tokens (mantener letras y números)
+    s = _SYMBOLS_RE.sub(" ", s)
+    s = _SPACES_RE.sub(" ", s).strip()
+    return s
+
+
+def _strip_diacritics(s: str) -> str:
+    if s.isascii():
+        return s
+    nf = unicodedata.normalize("NFD", s)
+    return "".join(ch for ch in nf if not unicodedata.combining(ch))
+
+
+_normalize_text_cached = lru_cache(maxsize=CACHE_SIZE)(_normalize_text)
+_strip_diacritics_cached = lru_cache(maxsize=CACHE_SIZE)(_strip_diacritics)
+
+
+def normalize_text(s: str) -> str:
+    """
+    lower + remover tildes (diacríticos) + colapsar espacios.
+    Importante: NO elimina símbolos como '/', '.', 'S/'.
+    """
+    if not s:
+        return ""
+    if len(s) > MAX_CACHED_LEN:
+        _bypass["normalize_text"] += 1
+        return _normalize_text(s)
+    return _normalize_text_cached(s)
+
+
+def strip_diacritics(s: str) -> str:
+    """NFD + quitar caracteres combinantes (no cambia mayúsculas ni espacios)."""
+    if not s:
+        return ""
+    if len(s) > MAX_CACHED_LEN:
+        _bypass["strip_diacritics"] += 1
+        return _strip_diacritics(s)
+    return _strip_diacritics_cached(s)
+
+
+def cache_stats() -> dict:
+    """Hits/misses/bypass y ocupación de las cachés, por función."""
+    stats = {}
+    for name, fn in (("normalize_text", _normalize_text_cached), ("strip_diacritics", _strip_diacritics_cached)):
+        info = fn.cache_info()
+        lookups = info.hits + info.misses
+        stats[name] = {
+            "hits": info.hits,
+            "misses": info.misses,
+            "bypass": _bypass[name],
+            "size": info.currsize,
+            "maxsize": info.maxsize,
+            "hit_rate": (info.hits / lookups) if lookups else 0.0,
+        }
+    return stats
+
+
+def format_cache_stats() -> str:
+    parts = []
+    for name, st in cache_stats().items():
+        parts.append(
+            f"{name}: hits={st['hits']} misses={st['misses']} bypass={st['bypass']} "
+            f"hit_rate={st['hit_rate']:.1%} size={st['size']}/{st['maxsize']}"
+        )
+    return " | ".join(parts)
+
+
+def clear_cache():
+    _normalize_text_cached.cache_clear()
+    _strip_diacritics_cached.cache_clear()
+    for k in _bypass:
+        _bypass[k] = 0
+
+
+# -----------------------
+# Persistencia en sa_turnos.text_norm
+# -----------------------
+def ensure_text_norm_column(conn):
+    """Agrega sa_turnos.text_norm (normalize_text del turno) si falta."""
+    cur = conn.cursor()
+    try:
+        cur.execute("SELECT DATABASE()")
+        db = cur.fetchone()[0]
+        cur.execute("""
+            SELECT COUNT(*)
+            FROM INFORMATION_SCHEMA.COLUMNS
+            WHERE TABLE_SCHEMA=%s AND TABLE_NAME='sa_turnos' AND COLUMN_NAME='text_norm'
+        """, (db,))
+        if cur.fetchone()[0] == 0:
+            cur.execute("ALTER TABLE sa_turnos ADD COLUMN text_norm LONGTEXT NULL")
+            conn.commit()
+    finally:
+        cur.close()
@@ -0,0 +1,211 @@
+# sa_core/prompt_builder.py
+"""
+Armado compacto de prompts para el LLM de fases.
+
+- load_template(): lee prompts/*.txt una vez (se recarga solo si cambia el
+  mtime) en lugar de abrir el archivo en cada llamada.
+- Prefijo estable: system + la parte del template de usuario anterior al
+  primer placeholder que cambia por llamada (last_phase_info, context_block,
+  target_idxs) se renderiza una vez por (template, fases) y se reutiliza
+  byte a byte, así el caché de prompts del servidor (prefix caching) aplica.
+- build_context_block(): roles desde la columna speaker de sa_turnos (la
+  heurística por regex queda solo como respaldo) y sin turnos de contexto de
+  relleno (has_meaningful_text); los turnos OBJETIVO siempre van.
+- estimate_tokens() y stats(): tokens/request estimados antes y después del
+  recorte, para medir el ahorro.
+"""
+import math
+import os
+import re
+import threading
+
+from sa_core.fase_guardrails import has_meaningful_text
+
+# Aproximación para español con tokenizadores BPE (deepseek/gpt): ~3.5 caracteres por token
+CHARS_PER_TOKEN = 3.5
+# Overhead por mensaje del formato chat (rol + separadores)
+TOKENS_PER_MESSAGE = 4
+
+MAX_TURN_CHARS = 280
+
+DEFAULT_SYSTEM_MSG = "Eres un clasificador de fases de cobranzas. Devuelve SOLO JSON válido y estricto, sin texto adicional."
+
+# Placeholders que cambian en cada llamada: el prefijo cacheable termina antes del primero
+VARIABLE_FIELDS = ("last_phase_info", "context_block", "target_idxs")
+
+SPEAKER_TAGS = {"AGENTE": "A", "CLIENTE": "C"}
+
+_AGENT_RE = re.compile(r"me\s+comunico|de\s+parte\s+de|buen\s+d[ií]a|somos\s+")
+
+
+def estimate_tokens(text: str) -> int:
+    if not text:
+        return 0
+    return math.ceil(len(text) / CHARS_PER_TOKEN)
+
+
+def estimate_message_tokens(messages: list[dict]) -> int:
+    return sum(TOKENS_PER_MESSAGE + estimate_tokens(m.get("content") or "") for m in messages)
+
+
+# -----------------------
+# Templates
+# -----------------------
+_templates = {}
+_prefixes = {}
+_lock = threading.Lock()
+
+
+def load_template(prompt_path: str):
+    """
+    (system_template, user_template) del archivo o None si no existe. Formato:
+    SYSTEM_MESSAGE: ... USER_MESSAGE_TEMPLATE: ... (sin marcadores: todo es user).
+    """
+    try:
+        mtime = os.stat(prompt_path).st_mtime_ns
+    except OSError:
+        return None
+    with _lock:
+        cached = _templates.get(prompt_path)
+    if cached is not None and cached[0] == mtime:
+        return cached[1]
+
+    with open(prompt_path, encoding="utf-8") as f:
+        content = f.read()
+    if "SYSTEM_MESSAGE:" in content and "USER_MESSAGE_TEMPLATE:" in content:
+        system_part, user_part = content.split("USER_MESSAGE_TEMPLATE:", 1)
+        template = (system_part.replace("SYSTEM_MESSAGE:", "").strip(), user_part.strip())
+    else:
+        template = ("", content.strip())
+    with _lock:
+        _templates[prompt_path] = (mtime, template)
+    return template
+
+
+def _split_user_template(user_template: str) -> tuple[str, str]:
+    """Parte el template en (parte estática, resto) antes del primer placeholder variable."""
+    cut = len(user_template)
+    for field in VARIABLE_FIELDS:
+        pos = user_template.find("{" + field + "}")
+        if pos != -1:
+            cut = min(cut, pos)
+    return user_template[:cut], user_template[cut:]
+
+
+def render_prompts(template: tuple[str, str], static_fields: dict, fields: dict) -> tuple[str, str]:
+    """
+    Renderiza (system, user). La parte estática del user (con static_fields, p.ej.
+    phases_list) se arma una vez y se reutiliza idéntica en todas las llamadas.
+    """
+    system_template, user_template = template
+    key = (system_template, user_template, tuple(sorted(static_fields.items())))
+    with _lock:
+        prepared = _prefixes.get(key)
+    if prepared is None:
+        head, tail = _split_user_template(user_template)
+        prepared = (system_template or DEFAULT_SYSTEM_MSG, head.format(**static_fields), tail)
+        with _lock:
+            _prefixes[key] = prepared
+    system_msg, prefix, tail = prepared
+    user_msg = prefix + tail.format(**static_fields, **fields)
+    saved = getattr(fields.get("context_block"), "saved_tokens", 0)
+    _record_request(system_msg, prefix, user_msg, saved)
+    return system_msg, user_msg
+
+
+# -----------------------
+# Contexto
+# -----------------------
+def guess_role(text: str) -> str:
+    """Respaldo cuando no hay speaker: heurística por regex (A = agente, C = cliente)."""
+    return "A" if _AGENT_RE.search((text or "").lower()) else "C"
+
+
+def speaker_tag(speaker, text: str) -> str:
+    tag = SPEAKER_TAGS.get((speaker or "").strip().upper())
+    return tag or guess_role(text)
+
+
+def _clean(text: str, max_chars: int) -> str:
+    return (text or "").replace("\r", " ").replace("\n", " ")[:max_chars]
+
+
+class ContextBlock(str):
+    """Bloque de contexto; recuerda cuántos tokens se ahorraron al omitir relleno."""
+    saved_tokens = 0
+
+
+def build_context_block(turns: dict, indices, targets, label_fn, drop_filler: bool = True,
+                        max_chars: int = MAX_TURN_CHARS) -> ContextBlock:
+    """
+    Bloque de contexto, una línea por turno: "<label> (<A|C>): <texto>".
+
+    Args:
+        turns: {turno_idx: (speaker, text)} de la conversación
+        indices: turno_idx a incluir, en orden (los que no existen se omiten)
+        targets: turno_idx OBJETIVO (siempre se incluyen)
+        label_fn: turno_idx -> etiqueta ("Turno idx=-1", "Turno idx=12 (OBJETIVO)", ...)
+        drop_filler: omitir turnos de contexto sin texto significativo
+    """
+    lines = []
+    full_chars = -1
+    dropped = 0
+    for i in indices:
+        if i not in turns:
+            continue
+        speaker, text = turns[i]
+        t = _clean(text, max_chars)
+        line = f"{label_fn(i)} ({speaker_tag(speaker, t)}): {t}"
+        full_chars += len(line) + 1
+        if drop_filler and i not in targets and not has_meaningful_text(t):
+            dropped += 1
+            continue
+        lines.append(line)
+    block = ContextBlock("\n".join(lines))
+    if dropped:
+        block.saved_tokens = math.ceil(max(full_chars, 0) / CHARS_PER_TOKEN) - estimate_tokens(block)
+    return block
+
+
+# -----------------------
+# Métricas
+# -----------------------
+_stats = {"requests": 0, "tokens": 0, "prefix_tokens": 0, "context_tokens_saved": 0}
+
+
+def _record_request(system_msg: str, prefix: str, user_msg: str, saved_tokens: int = 0):
+    messages = [{"content": system_msg}, {"content": user_msg}]
+    tokens = estimate_message_tokens(messages)
+    prefix_tokens = TOKENS_PER_MESSAGE * 2 + estimate_tokens(system_msg) + estimate_tokens(prefix)
+    with _lock:
+        _stats["requests"] += 1
+        _stats["tokens"] += tokens
+        _stats["prefix_tokens"] += prefix_tokens
+        _stats["context_tokens_saved"] += saved_tokens
+
+
+def stats() -> dict:
+    with _lock:
+        out = dict(_stats)
+    n = out["requests"]
+    out["tokens_per_request"] = (out["tokens"] / n) if n else 0.0
+    # Sin recorte: mismos requests con el contexto completo
+    out["tokens_per_request_before"] = ((out["tokens"] + out["context_tokens_saved"]) / n) if n else 0.0
+    out["prefix_tokens_per_request"] = (out["prefix_tokens"] / n) if n else 0.0
+    return out
+
+
+def format_stats() -> str:
+    st = stats()
+    before, after = st["tokens_per_request_before"], st["tokens_per_request"]
+    pct = (1 - after / before) if before else 0.0
+    return (
+        f"requests={st['requests']} tokens/request≈{after:.0f} (sin recorte≈{before:.0f}, -{pct:.1%}) "
+        f"prefijo_cacheable≈{st['prefix_tokens_per_request']:.0f}"
+    )
+
+
+def reset_stats():
+    with _lock:
+        for k in _stats:
+            _stats[k] = 0
@@ -0,0 +1,273 @@
+# sa_core/run_turns.py
+"""
+Representación columnar en memoria de los turnos de una ejecución.
+
+Las etapas materializaban cada turno como un dict (filas de cursor
+dictionary=True o dicts rearmados desde tuplas): en ejecuciones de ~1M de
+turnos eso son gigas de overhead por fila. RunTurns guarda cada columna en un
+array.array contiguo:
+
+- turno_pk, conversacion_pk, turno_idx: enteros
+- speaker, fase_source y las columnas de fase (fase, fase_8, fase_seq...):
+  códigos int16 internados en un Vocab (0 = NULL); el vocabulario de fases
+  arranca con fases_conversacion y sa_fase_macro_map
+- fase_conf: float64 (NaN = NULL)
+- text: un único str con offsets (inicio de cada turno)
+
+Las conversaciones son rangos contiguos [conv_start[i], conv_start[i + 1]).
+ConvView da acceso a cada una con memoryviews de las columnas (sin copiar ni
+crear objetos por turno); column()/as_numpy() exponen las columnas completas
+para cálculos sobre toda la ejecución.
+"""
+import math
+import sys
+from array import array
+from bisect import bisect_left
+
+from sa_core.conv_stream import PAGE_SIZE, iter_conversations
+
+CODE_TYPE = "h"     # int16: códigos de vocabulario (0 = NULL)
+SPEAKERS = ("AGENTE", "CLIENTE")
+
+
+class Vocab:
+    """Internado str <-> código entero; el código 0 es NULL (None)."""
+
+    def __init__(self, values=()):
+        self.values = [None]
+        self.codes = {None: 0}
+        for value in values:
+            self.code(value)
+
+    def code(self, value) -> int:
+        code = self.codes.get(value)
+        if code is None:
+            code = len(self.values)
+            self.codes[value] = code
+            self.values.append(value)
+        return code
+
+    def __getitem__(self, code):
+        return self.values[code]
+
+    def __len__(self):
+        return len(self.values)
+
+    def __contains__(self, value):
+        return value in self.codes
+
+    def blank_mask(self) -> list:
+        """blank_mask()[código] = True si el valor es NULL o solo espacios (not s.strip())."""
+        return [value is None or not value.strip() for value in self.values]
+
+
+def load_phase_vocab(cursor):
+    """
+    (Vocab de fases, macro_map) desde fases_conversacion (en orden_fase) y
+    sa_fase_macro_map. Sin alguna de las tablas, el vocabulario se completa
+    al cargar los turnos.
+    """
+    vocab = Vocab()
+    macro_map = {}
+    try:
+        cursor.execute("SELECT fase_id FROM fases_conversacion ORDER BY orden_fase")
+        for (fase_id,) in cursor.fetchall():
+            vocab.code(fase_id)
+    except Exception as e:
+        print(f"[run_turns] WARNING: no se pudo cargar fases_conversacion: {e}")
+    try:
+        cursor.execute("SELECT fase, macro_fase FROM sa_fase_macro_map")
+        for fase, macro in cursor.fetchall():
+            macro_map[fase] = macro
+            vocab.code(fase)
+            vocab.code(macro)
+    except Exception as e:
+        print(f"[run_turns] WARNING: no se pudo cargar sa_fase_macro_map: {e}")
+    return vocab, macro_map
+
+
+class ConvView:
+    """Vista de una conversación sobre las columnas de RunTurns (sin copias)."""
+    __slots__ = ("run", "pos", "start", "end")
+
+    def __init__(self, run, pos):
+        self.run = run
+        self.pos = pos
+        self.start = run.conv_start[pos]
+        self.end = run.conv_start[pos + 1]
+
+    @property
+    def conversacion_pk(self):
+        return self.run.conv_pks[self.pos]
+
+    def __len__(self):
+        return self.end - self.start
+
+    def column(self, name) -> memoryview:
+        """Columna de la conversación (memoryview sobre el array de la ejecución)."""
+        return memoryview(self.run.column(name))[self.start:self.end]
+
+    @property
+    def turno_pk(self):
+        return self.column("turno_pk")
+
+    @property
+    def turno_idx(self):
+        return self.column("turno_idx")
+
+    @property
+    def speaker(self):
+        return self.column("speaker")
+
+    def phases(self, name="fase") -> memoryview:
+        return self.column(name)
+
+    def phase(self, j, name="fase"):
+        """Fase decodificada del turno j (posición dentro de la conversación)."""
+        return self.run.vocab[self.run.phase_cols[name][self.start + j]]
+
+    def set_phase(self, j, value, name="fase"):
+        self.run.phase_cols[name][self.start + j] = self.run.vocab.code(value)
+
+    def conf(self, j):
+        value = self.run.fase_conf[self.start + j]
+        return None if math.isnan(value) else value
+
+    def source(self, j):
+        return self.run.sources[self.run.fase_source[self.start + j]]
+
+    def text(self, j) -> str:
+        return self.run.text(self.start + j)
+
+    def texts(self):
+        for i in range(self.start, self.end):
+            yield self.run.text(i)
+
+
+class RunTurns:
+    """
+    Turnos de una ejecución en columnas, ordenados por (conversacion_pk, turno_idx).
+
+    Construcción: RunTurns.from_db(cursor, ejecucion_id, ...) o
+    RunTurns.from_conversations(iterable de (conversación, turnos)); luego
+    conversations() / conversation(conv_pk) dan vistas por conversación.
+    """
+
+    def __init__(self, phase_columns=("fase",), vocab=None, with_text=True, with_conf=True):
+        self.vocab = vocab if vocab is not None else Vocab()
+        self.speakers = Vocab(SPEAKERS)
+        self.sources = Vocab()
+        self.turno_pk = array("q")
+        self.conversacion_pk = array("q")
+        self.turno_idx = array("i")
+        self.speaker = array(CODE_TYPE)
+        self.phase_cols = {name: array(CODE_TYPE) for name in phase_columns}
+        self.fase_conf = array("d") if with_conf else None
+        self.fase_source = array(CODE_TYPE) if with_conf else None
+        self.with_text = with_text
+        self.text_offsets = array("q", [0])
+        self.text_buffer = ""
+        self.conv_pks = array("q")
+        self.conv_start = array("q", [0])
+        self._text_parts = []
+
+    # -----------------------
+    # Construcción
+    # -----------------------
+    def append_conversation(self, conversacion_pk, turns):
+        """Agrega una conversación (turnos como registros de conv_stream o dicts, en orden)."""
+        vocab_code = self.vocab.code
+        for t in turns:
+            self.turno_pk.append(int(t["turno_pk"]))
+            self.conversacion_pk.append(int(conversacion_pk))
+            self.turno_idx.append(int(t["turno_idx"]))
+            self.speaker.append(self.speakers.code(t.get("speaker")))
+            for name, col in self.phase_cols.items():
+                col.append(vocab_code(t.get(name)))
+            if self.fase_conf is not None:
+                conf = t.get("fase_conf")
+                self.fase_conf.append(math.nan if conf is None else float(conf))
+                self.fase_source.append(self.sources.code(t.get("fase_source")))
+            if self.with_text:
+                text = t.get("text") or ""
+                self._text_parts.append(text)
+                self.text_offsets.append(self.text_offsets[-1] + len(text))
+        self.conv_pks.append(int(conversacion_pk))
+        self.conv_start.append(len(self.turno_pk))
+
+    def finish(self):
+        """Une los textos en el buffer único (llamar después del último append_conversation)."""
+        if self._text_parts:
+            self.text_buffer += "".join(self._text_parts)
+            self._text_parts = []
+        return self
+
+    @classmethod
+    def from_conversations(cls, conversations, **kwargs):
+        run = cls(**kwargs)
+        for conv, turns in conversations:
+            conv_pk = conv if isinstance(conv, int) else conv["conversacion_pk"]
+            run.append_conversation(conv_pk, turns)
+        return run.finish()
+
+    @classmethod
+    def from_db(cls, cursor, ejecucion_id, phase_columns=("fase",), vocab=None, with_text=True,
+                with_conf=True, include_empty=False, page_size=PAGE_SIZE):
+        """Carga la ejecución con iter_conversations (keyset paginado) directo a columnas."""
+        columns = ["speaker", *phase_columns]
+        if with_conf:
+            columns += ["fase_conf", "fase_source"]
+        if with_text:
+            columns.append("text")
+        conversations = iter_conversations(cursor, ejecucion_id, columns=columns,
+                                           include_empty=include_empty, page_size=page_size)
+        return cls.from_conversations(conversations, phase_columns=phase_columns, vocab=vocab,
+                                      with_text=with_text, with_conf=with_conf)
+
+    # -----------------------
+    # Acceso
+    # -----------------------
+    @property
+    def n_turns(self) -> int:
+        return len(self.turno_pk)
+
+    @property
+    def n_convs(self) -> int:
+        return len(self.conv_pks)
+
+    def __len__(self):
+        return self.n_convs
+
+    def column(self, name) -> array:
+        if name in self.phase_cols:
+            return self.phase_cols[name]
+        col = getattr(self, name, None)
+        if not isinstance(col, array):
+            raise KeyError(name)
+        return col
+
+    def as_numpy(self, name):
+        """Columna como ndarray de NumPy sin copiar (comparte el buffer del array)."""
+        import numpy as np
+        return np.frombuffer(self.column(name), dtype=self.column(name).typecode)
+
+    def text(self, i) -> str:
+        return self.text_buffer[self.text_offsets[i]:self.text_offsets[i + 1]]
+
+    def conversation(self, conv_pk) -> ConvView:
+        pos = bisect_left(self.conv_pks, conv_pk)
+        if pos == len(self.conv_pks) or self.conv_pks[pos] != conv_pk:
+            raise KeyError(conv_pk)
+        return ConvView(self, pos)
+
+    def conversations(self):
+        for pos in range(len(self.conv_pks)):
+            yield ConvView(self, pos)
+
+    def nbytes(self) -> int:
+        """Bytes de las columnas (arrays + buffer de texto)."""
+        arrays = [self.turno_pk, self.conversacion_pk, self.turno_idx, self.speaker, self.text_offsets,
+                  self.conv_pks, self.conv_start, *self.phase_cols.values()]
+        if self.fase_conf is not None:
+            arrays += [self.fase_conf, self.fase_source]
+        return sum(a.itemsize * len(a) for a in arrays) + sys.getsizeof(self.text_buffer)
@@ -0,0 +1,148 @@
+# sa_core/seq_metrics.py
+"""
+Métricas de secuencia de macrofases vectorizadas sobre toda la ejecución.
+
+build_secuencias.analyze_conversation recorre los turnos de cada conversación
+en Python (get_macro_fase por turno, compactación con un loop y violaciones
+buscando cada par en ALLOWED_TRANSITIONS). sequence_metrics() calcula lo mismo
+para todas las conversaciones de una RunTurns a la vez con NumPy, sobre los
+códigos de fase del Vocab:
+
+- macrofase por turno: tablas código -> código (blanco / macro_map) y np.where
+  con la prioridad fase_seq > fase > fase_8
+- compactación: se descartan los turnos sin macro y se conserva cada turno que
+  cambia de macro o de conversación
+- violaciones: matriz booleana allowed[desde, hasta] indexada con los pares
+  consecutivos de la secuencia compacta
+- inicio/fin, cobertura (pares únicos conversación x macro) y flags con
+  bincount por conversación
+
+Solo los strings de secuencia_macro se arman en Python. El resultado es el
+mismo dict (o None sin fases) que analyze_conversation.
+"""
+import numpy as np
+
+FASES_INICIO_VALIDO = ("APERTURA", "IDENTIFICACION")
+FASE_INFORMACION_DEUDA = "INFORMACION_DEUDA"
+FASE_NEGOCIACION = "NEGOCIACION"
+
+# Columnas de fase que necesita la RunTurns (RunTurns.from_db(..., phase_columns=SEQ_PHASE_COLUMNS))
+SEQ_PHASE_COLUMNS = ("fase", "fase_8", "fase_seq")
+
+
+def macro_code_table(vocab, macro_map) -> np.ndarray:
+    """
+    table[código de fase] = código de get_macro_fase(fase, macro_map); 0 si la
+    fase es blanca o la macro es vacía (el turno no aporta a la secuencia).
+    Interna en vocab las macros que no estaban.
+    """
+    values = list(vocab.values)
+    table = np.zeros(len(values), dtype=np.intp)
+    for code, fase in enumerate(values):
+        if fase is None or not fase.strip():
+            continue
+        macro = macro_map[fase] if fase in macro_map else fase
+        if macro:
+            table[code] = vocab.code(macro)
+    return table
+
+
+def turn_macro_codes(run, macro_map) -> np.ndarray:
+    """Código de macrofase de cada turno de la ejecución (0 = sin macro)."""
+    table = macro_code_table(run.vocab, macro_map)
+    blank = np.array(run.vocab.blank_mask()[:len(table)], dtype=bool)
+    zeros = np.zeros(run.n_turns, dtype=np.intp)
+
+    def codes(name):
+        return run.as_numpy(name).astype(np.intp) if name in run.phase_cols else zeros
+
+    fase_seq, fase, fase_8 = codes("fase_seq"), codes("fase"), codes("fase_8")
+    # fase_seq ya es macro (sin mapear); si no, fase (o fase_8 si fase es blanca) mapeada
+    mapped = table[np.where(blank[fase], fase_8, fase)]
+    return np.where(blank[fase_seq], mapped, fase_seq)
+
+
+def transition_matrix(vocab, allowed_transitions) -> np.ndarray:
+    """allowed[desde, hasta] para los códigos del vocabulario (interna las fases de las transiciones)."""
+    pairs = [(vocab.code(a), vocab.code(b)) for a, b in allowed_transitions]
+    allowed = np.zeros((len(vocab), len(vocab)), dtype=bool)
+    for a, b in pairs:
+        allowed[a, b] = True
+    return allowed
+
+
+def _per_conv_any(conv, mask, n_convs) -> np.ndarray:
+    return np.bincount(conv[mask], minlength=n_convs) > 0
+
+
+def sequence_metrics(run, macro_map, allowed_transitions) -> list:
+    """
+    [(conversacion_pk, métricas | None)] para cada conversación de run (en
+    orden), con los mismos dicts que build_secuencias.analyze_conversation.
+    run debe tener las columnas de fase de SEQ_PHASE_COLUMNS (las que falten
+    se toman como NULL).
+    """
+    vocab = run.vocab
+    n_convs = run.n_convs
+    macro = turn_macro_codes(run, macro_map)
+    allowed = transition_matrix(vocab, allowed_transitions)
+    n_codes = len(vocab)
+
+    # Conversación (posición) de cada turno; solo turnos con macro
+    conv_of_turn = np.repeat(np.arange(n_convs, dtype=np.intp),
+                             np.diff(np.frombuffer(run.conv_start, dtype=np.int64)))
+    valid = macro != 0
+    codes, conv = macro[valid], conv_of_turn[valid]
+
+    # Compactación: el primero de cada racha (cambia la macro o la conversación)
+    keep = np.ones(codes.size, dtype=bool)
+    keep[1:] = (codes[1:] != codes[:-1]) | (conv[1:] != conv[:-1])
+    compact, conv = codes[keep], conv[keep]
+
+    lengths = np.bincount(conv, minlength=n_convs)
+    ends = np.cumsum(lengths)
+    starts = ends - lengths
+    has = lengths > 0
+    fase_inicio = np.zeros(n_convs, dtype=np.intp)
+    fase_fin = np.zeros(n_convs, dtype=np.intp)
+    fase_inicio[has] = compact[starts[has]]
+    fase_fin[has] = compact[ends[has] - 1]
+
+    # Violaciones: pares consecutivos de la misma conversación que no están en la matriz
+    src, dst = compact[:-1], compact[1:]
+    violation = (conv[:-1] == conv[1:]) & (src != dst) & ~allowed[src, dst]
+    violaciones = np.bincount(conv[:-1][violation], minlength=n_convs)
+
+    # Cobertura: macros distintas por conversación
+    cobertura = np.bincount(np.unique(conv * n_codes + compact) // n_codes, minlength=n_convs)
+
+    info_deuda = _per_conv_any(conv, compact == vocab.codes.get(FASE_INFORMACION_DEUDA, -1), n_convs)
+    negociacion = _per_conv_any(conv, compact == vocab.codes.get(FASE_NEGOCIACION, -1), n_convs)
+    inicio_valido = has & np.isin(fase_inicio, [vocab.codes.get(f, -1) for f in FASES_INICIO_VALIDO])
+    cumple = (violaciones == 0) & inicio_valido & info_deuda
+    corte = info_deuda & ~negociacion
+
+    names = vocab.values
+    compact_list = compact.tolist()
+    columns = zip(run.conv_pks, has.tolist(), starts.tolist(), ends.tolist(), fase_inicio.tolist(),
+                  fase_fin.tolist(), cobertura.tolist(), info_deuda.tolist(), negociacion.tolist(),
+                  violaciones.tolist(), cumple.tolist(), corte.tolist(), inicio_valido.tolist())
+    results = []
+    for conv_pk, ok, start, end, inicio, fin, cob, deuda, nego, viol, cump, cor, ini in columns:
+        if not ok:
+            results.append((conv_pk, None))
+            continue
+        results.append((conv_pk, {
+            'conversacion_pk': conv_pk,
+            'secuencia_macro': '>'.join([names[c] for c in compact_list[start:end]]),
+            'fase_inicio': names[inicio],
+            'fase_fin': names[fin],
+            'cobertura_fases': cob,
+            'tiene_informacion_deuda': int(deuda),
+            'tiene_negociacion': int(nego),
+            'violaciones_transicion': viol,
+            'cumple_secuencia': int(cump),
+            'corte_antes_negociacion': int(cor),
+            'inicio_valido': int(ini),
+        }))
+    return results
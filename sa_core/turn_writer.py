@@ -0,0 +1,169 @@
+# sa_core/turn_writer.py
+"""
+Escritura diferida (write-behind) de fase/fase_conf/fase_source en sa_turnos.
+
+El reclasificador hacía un UPDATE por turno con su guarda de idempotencia, un
+SELECT + UPDATE por conversación tocada al final y un único commit: un corte a
+mitad de corrida perdía todo. Con TurnWriteBuffer:
+
+- La guarda se evalúa en Python contra el ConversationIndex (mismo predicado
+  que el SQL y misma semántica de "filas cambiadas" de MySQL), así que los
+  contadores se actualizan al momento y el índice refleja lo escrito.
+- Las filas se agrupan por (guarda, fase_source) y cada flush_every filas se
+  aplican con un UPDATE ... JOIN sobre tabla temporal por grupo (la guarda SQL
+  se mantiene en el WHERE), se recalculan fase_final/tipo_finalizacion de las
+  conversaciones tocadas con una sola sentencia set-based y se hace commit.
+"""
+from decimal import Decimal
+
+from sa_core.db import bulk_update_via_temp_table
+from sa_core.fases_rules import TURNOS_FASE_COLUMNS
+
+FLUSH_EVERY = 500
+RECOMPUTE_CHUNK = 500
+
+# Guardas de idempotencia
+GUARD_PENDIENTE = "PENDIENTE"            # NOISE / NO_TEXT: solo turnos sin fase_source (o NO_IMP)
+GUARD_RECLASIFICABLE = "RECLASIFICABLE"  # HEURISTIC / DEEPSEEK / DEEPSEEK_LOW
+
+GUARD_SQL = {
+    GUARD_PENDIENTE: "(t.fase_source IS NULL OR TRIM(t.fase_source)='' OR t.fase_source='NO_IMP')",
+    GUARD_RECLASIFICABLE: (
+        "(((t.fase_source IS NULL OR TRIM(t.fase_source)='') AND (t.fase IS NULL OR TRIM(t.fase)=''))"
+        " OR t.fase_source='DEEPSEEK_LOW' OR t.fase_source='NO_IMP')"
+    ),
+}
+
+
+def _blank(s) -> bool:
+    # Igual que "s IS NULL OR TRIM(s)=''" (TRIM de MySQL solo quita espacios)
+    return s is None or s.strip(" ") == ""
+
+
+def guard_allows(guard: str, fase, source) -> bool:
+    """Evalúa en Python el mismo predicado que GUARD_SQL[guard]."""
+    if guard == GUARD_PENDIENTE:
+        return _blank(source) or source == "NO_IMP"
+    if guard == GUARD_RECLASIFICABLE:
+        return (_blank(source) and _blank(fase)) or source in ("DEEPSEEK_LOW", "NO_IMP")
+    raise ValueError(f"Guarda desconocida: {guard}")
+
+
+def _as_decimal(conf):
+    # fase_conf es DECIMAL(6,4)
+    return None if conf is None else Decimal(f"{conf:.4f}")
+
+
+def recompute_conversation_final_fields(cur, conv_pks, chunk_size: int = RECOMPUTE_CHUNK):
+    """
+    Recalcula fase_final, fase_final_turn_idx y tipo_finalizacion de las
+    conversaciones indicadas y marca llm_usado=1, con un UPDATE ... JOIN por
+    chunk (en vez de SELECT + UPDATE por conversación). Sin turnos con fase:
+    fase_final=NULL y tipo_finalizacion='CORTE'.
+    """
+    conv_pks = sorted(conv_pks)
+    for start in range(0, len(conv_pks), chunk_size):
+        chunk = conv_pks[start:start + chunk_size]
+        placeholders = ", ".join(["%s"] * len(chunk))
+        cur.execute(
+            f"""
+            UPDATE sa_conversaciones c
+            LEFT JOIN (
+                SELECT t.conversacion_pk, t.turno_idx, TRIM(t.fase) AS fase
+                FROM sa_turnos t
+                JOIN (
+                    SELECT conversacion_pk, MAX(turno_idx) AS turno_idx
+                    FROM sa_turnos
+                    WHERE conversacion_pk IN ({placeholders}) AND fase IS NOT NULL AND TRIM(fase)<>''
+                    GROUP BY conversacion_pk
+                ) m ON m.conversacion_pk = t.conversacion_pk AND m.turno_idx = t.turno_idx
+            ) f ON f.conversacion_pk = c.conversacion_pk
+            SET c.fase_final = f.fase,
+                c.fase_final_turn_idx = f.turno_idx,
+                c.tipo_finalizacion = CASE WHEN f.fase = 'CIERRE' THEN 'CIERRE' ELSE 'CORTE' END,
+                c.llm_usado = 1
+            WHERE c.conversacion_pk IN ({placeholders})
+            """,
+            tuple(chunk) * 2
+        )
+
+
+class TurnWriteBuffer:
+    def __init__(self, conn, conv_index=None, flush_every: int = FLUSH_EVERY):
+        self.conn = conn
+        self.conv_index = conv_index
+        self.flush_every = max(1, int(flush_every))
+        self._groups = {}    # (guarda, fase_source) -> {turno_pk: (fase, conf, source)}
+        self._where = {}     # turno_pk -> (guarda, fase_source) pendiente
+        self._convs = set()  # conversaciones con filas pendientes
+        self._stats = {"rows": 0, "flushes": 0, "statements": 0, "affected": 0, "convs": 0}
+
+    def __len__(self):
+        return len(self._where)
+
+    def write(self, guard: str, turno_pk: int, conv_pk: int, fase, conf, source) -> bool:
+        """
+        Encola el UPDATE si la guarda lo permite y cambia algo (MySQL sin
+        FOUND_ROWS cuenta 0 filas si los valores son iguales). Refleja el cambio
+        en el índice. Devuelve True si se encoló.
+        """
+        conf = None if conf is None else round(conf, 4)
+        state = self.conv_index.state(turno_pk) if self.conv_index is not None else None
+        if state is not None:
+            old_fase, old_conf, old_source = state
+            if not guard_allows(guard, old_fase, old_source):
+                return False
+            if (old_fase, _as_decimal(old_conf), old_source) == (fase, _as_decimal(conf), source):
+                return False
+
+        key = (guard, source)
+        if self._where.get(turno_pk, key) != key:
+            # Mismo turno en otro grupo: aplicar lo anterior primero para respetar el orden
+            self.flush()
+        self._groups.setdefault(key, {})[turno_pk] = (fase, conf, source)
+        self._where[turno_pk] = key
+        self._convs.add(conv_pk)
+        if self.conv_index is not None:
+            self.conv_index.set_phase(turno_pk, fase, conf, source)
+        if len(self._where) >= self.flush_every:
+            self.flush()
+        return True
+
+    def flush(self) -> int:
+        """Aplica lo pendiente (un UPDATE ... JOIN por grupo + recálculo de conversaciones) y hace commit."""
+        if not self._where:
+            return 0
+        affected = 0
+        cur = self.conn.cursor()
+        try:
+            for (guard, _source), rows in self._groups.items():
+                affected += bulk_update_via_temp_table(
+                    cur, "sa_turnos", "turno_pk", TURNOS_FASE_COLUMNS,
+                    [(pk,) + vals for pk, vals in rows.items()],
+                    where_extra=GUARD_SQL[guard],
+                )
+                self._stats["statements"] += 1
+            recompute_conversation_final_fields(cur, self._convs)
+            self.conn.commit()
+        finally:
+            cur.close()
+        self._stats["rows"] += len(self._where)
+        self._stats["affected"] += affected
+        self._stats["convs"] += len(self._convs)
+        self._stats["flushes"] += 1
+        self._groups.clear()
+        self._where.clear()
+        self._convs.clear()
+        return affected
+
+    def stats(self) -> dict:
+        out = dict(self._stats)
+        out["pending"] = len(self._where)
+        return out
+
+    def format_stats(self) -> str:
+        st = self.stats()
+        return (
+            f"flushes={st['flushes']} rows={st['rows']} affected={st['affected']} "
+            f"statements={st['statements']} convs_recalculadas={st['convs']} pending={st['pending']}"
+        )
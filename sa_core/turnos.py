@@ -1,4 +1,7 @@
 import re
+import queue
+import threading
+from concurrent.futures import ProcessPoolExecutor
 from mysql.connector import Error
 from collections import defaultdict
 
@@ -8,6 +11,12 @@ SPEAKER_LINE_RE = re.compile(r"^\s*Hablante\s*(\d+)\s*:\s*(.+)$", re.IGNORECASE)
 # Regex para parsear "AGENTE: texto" / "CLIENTE: texto"
 SPEAKER_LABEL_RE = re.compile(r"^\s*(AGENTE|CLIENTE)\s*:\s*(.+)$", re.IGNORECASE)
 
+# Ambos formatos en una sola alternancia: cada línea se evalúa una única vez.
+# Grupos: (num | label, text)
+SPEAKER_ANY_RE = re.compile(
+    r"^\s*(?:Hablante\s*(\d+)|(AGENTE|CLIENTE))\s*:\s*(.+)$", re.IGNORECASE
+)
+
 # Pesos para la detección del agente
 AGENT_SCORE_PATTERNS = {
     re.compile(r"le saluda", re.I): 4,
@@ -22,6 +31,21 @@ AGENT_SCORE_PATTERNS = {
     re.compile(r"¿Aló\?|Buenos días|Buenas tardes", re.I): 1,
 }
 
+# Misma tabla en minúsculas, sin re.IGNORECASE: se baja a minúsculas cada texto una
+# sola vez y las búsquedas case-sensitive son bastante más rápidas que con re.I.
+# (Los patrones no usan escapes en mayúscula como \S o \D, así que .lower() es seguro.)
+_AGENT_SCORE_PATTERNS_LOWER = [
+    (re.compile(pattern.pattern.lower()), weight)
+    for pattern, weight in AGENT_SCORE_PATTERNS.items()
+]
+
+
+def _agent_score(text):
+    """Score de 'agente' de una intervención (suma de pesos de patrones presentes)."""
+    text = text.lower()
+    return sum(weight for pattern, weight in _AGENT_SCORE_PATTERNS_LOWER if pattern.search(text))
+
+
 def _get_speaker_roles(utterances):
     """
     Determina los roles (AGENTE, CLIENTE, UNKNOWN) basado en las intervenciones.
@@ -38,9 +62,7 @@ def _get_speaker_roles(utterances):
     for speaker_id, texts in speakers_utterances.items():
         # Usar solo las primeras 20 intervenciones para el score
         for text in texts[:20]:
-            for pattern, weight in AGENT_SCORE_PATTERNS.items():
-                if pattern.search(text):
-                    agent_scores[speaker_id] += weight
+            agent_scores[speaker_id] += _agent_score(text)
     
     # 2. Determinar AGENTE
     agent_speaker_id = -1
@@ -79,134 +101,273 @@ def _get_speaker_roles(utterances):
     return role_map, mapping_str
 
 
-def parse_turns_for_run(conn, ejecucion_id, limit=0, verbose=False):
+def parse_conversation_text(raw_text):
+    """
+    Parsea el raw_text de una conversación en turnos (una sola pasada por línea).
+
+    Cada línea se clasifica con SPEAKER_ANY_RE (una única alternancia compilada)
+    y las intervenciones consecutivas del mismo hablante se agrupan en un turno.
+
+    Returns:
+        (turns, mapping_str, format_detected) donde turns es una lista de
+        (speaker_role, text). turns vacío si no hay líneas con formato válido.
+    """
+    utterances = []
+    format_detected = None  # 'hablante_n' o 'agente_cliente' (primer formato visto)
+    match_line = SPEAKER_ANY_RE.match
+
+    for line in raw_text.splitlines():
+        m = match_line(line)
+        if m is None:
+            continue
+        num, label, text = m.groups()
+        if num is not None:
+            utterances.append((int(num), text))
+            if format_detected is None:
+                format_detected = 'hablante_n'
+        else:
+            # Mapear AGENTE->1, CLIENTE->2
+            utterances.append((1 if label.upper() == 'AGENTE' else 2, text))
+            if format_detected is None:
+                format_detected = 'agente_cliente'
+
+    if not utterances:
+        return [], "No utterances", None
+
+    role_map, mapping_str = _get_speaker_roles(utterances)
+
+    # Si el formato es agente_cliente, forzar el mapeo correcto
+    if format_detected == 'agente_cliente':
+        role_map[1] = 'AGENTE'
+        role_map[2] = 'CLIENTE'
+
+    # Agrupar intervenciones consecutivas del mismo hablante
+    turns = []
+    current_speaker_id = utterances[0][0]
+    current_text = [utterances[0][1]]
+    for speaker_id, text in utterances[1:]:
+        if speaker_id != current_speaker_id:
+            turns.append((role_map.get(current_speaker_id, 'UNKNOWN'), "\n".join(current_text)))
+            current_speaker_id = speaker_id
+            current_text = [text]
+        else:
+            current_text.append(text)
+    turns.append((role_map.get(current_speaker_id, 'UNKNOWN'), "\n".join(current_text)))
+
+    return turns, mapping_str, format_detected
+
+
+def iter_conversations_keyset(cursor, ejecucion_id, page_size=200, limit=0):
+    """
+    Recorre las conversaciones de una ejecución por páginas (keyset sobre
+    conversacion_pk), sin traer todos los raw_text a memoria de una vez.
+
+    Yields:
+        listas de dicts {conversacion_pk, conversacion_id, raw_text}
+    """
+    last_pk = 0
+    remaining = limit if limit and limit > 0 else None
+    while True:
+        n = page_size if remaining is None else min(page_size, remaining)
+        if n <= 0:
+            return
+        cursor.execute(
+            """
+            SELECT conversacion_pk, conversacion_id, raw_text
+            FROM sa_conversaciones
+            WHERE ejecucion_id = %s AND conversacion_pk > %s
+            ORDER BY conversacion_pk
+            LIMIT %s
+            """,
+            (ejecucion_id, last_pk, n)
+        )
+        page = cursor.fetchall()
+        if not page:
+            return
+        yield page
+        last_pk = page[-1]['conversacion_pk']
+        if remaining is not None:
+            remaining -= len(page)
+        if len(page) < n:
+            return
+
+
+INSERT_TURNO_SQL = """
+    INSERT INTO sa_turnos (conversacion_pk, turno_idx, speaker, text)
+    VALUES (%s, %s, %s, %s)
+"""
+
+
+def _write_parsed_page(cursor, parsed, insert_batch_size=1000):
+    """
+    Escribe los turnos de varias conversaciones con sentencias coalescidas:
+    un DELETE ... IN, INSERT multi-fila por lotes y un UPDATE con CASE para
+    total_turnos. parsed = [(conversacion_pk, turns), ...].
+    """
+    if not parsed:
+        return 0
+    pks = [pk for pk, _ in parsed]
+    placeholders = ", ".join(["%s"] * len(pks))
+    cursor.execute(f"DELETE FROM sa_turnos WHERE conversacion_pk IN ({placeholders})", tuple(pks))
+
+    rows = [
+        (pk, idx, role, text)
+        for pk, turns in parsed
+        for idx, (role, text) in enumerate(turns, start=1)
+    ]
+    for start in range(0, len(rows), insert_batch_size):
+        cursor.executemany(INSERT_TURNO_SQL, rows[start:start + insert_batch_size])
+
+    case_sql = " ".join(["WHEN %s THEN %s"] * len(parsed))
+    case_params = [v for pk, turns in parsed for v in (pk, len(turns))]
+    cursor.execute(
+        f"UPDATE sa_conversaciones SET total_turnos = CASE conversacion_pk {case_sql} END "
+        f"WHERE conversacion_pk IN ({placeholders})",
+        tuple(case_params) + tuple(pks)
+    )
+    return len(rows)
+
+
+def _parse_page(convs):
+    """
+    Worker del pool: parsea una página de conversaciones (CPU puro, sin BD).
+    convs = [(conversacion_pk, conversacion_id, raw_text), ...]
+    Devuelve [(conversacion_pk, conversacion_id, turns, mapping_str, format_detected), ...]
+    """
+    out = []
+    for pk, conv_id, raw_text in convs:
+        turns, mapping_str, format_detected = parse_conversation_text(raw_text or '')
+        out.append((pk, conv_id, turns, mapping_str, format_detected))
+    return out
+
+
+def _apply_parsed_page(conn, cursor, results, verbose=False):
+    """
+    Escribe y confirma una página parseada (salida de _parse_page).
+    Devuelve (conversaciones_procesadas, turnos_insertados).
+    """
+    parsed = []
+    for pk, conv_id, turns, mapping_str, format_detected in results:
+        if not turns:
+            if verbose:
+                print(f"Conversación {conv_id}: No se encontraron líneas con formato válido. Saltando.")
+            continue
+        parsed.append((pk, turns))
+        if verbose:
+            format_msg = f"Formato: {'AGENTE/CLIENTE' if format_detected == 'agente_cliente' else 'Hablante N'}"
+            print(f"Conversación {conv_id}: {len(turns)} turnos. {format_msg}. Mapping: {mapping_str}")
+
+    processed = 0
+    inserted = 0
+    try:
+        inserted += _write_parsed_page(cursor, parsed)
+        conn.commit()
+        processed += len(parsed)
+    except Error as e:
+        # Aislar la conversación problemática: reintentar de a una
+        print(f"Warning: Falló la escritura coalescida de {len(parsed)} conversaciones, reintentando de a una: {e}")
+        conn.rollback()
+        for pk, turns in parsed:
+            try:
+                inserted += _write_parsed_page(cursor, [(pk, turns)])
+                conn.commit()
+                processed += 1
+            except Error as e2:
+                print(f"Error procesando conversación PK: {pk}: {e2}")
+                conn.rollback()
+
+    if verbose:
+        print(f"--- Página de {len(results)} procesada. Commit realizado. ---")
+    return processed, inserted
+
+
+def _page_rows(page):
+    return [(c['conversacion_pk'], c['conversacion_id'], c['raw_text']) for c in page]
+
+
+def _parse_turns_parallel(conn, cursor, ejecucion_id, limit, verbose, page_size, workers):
+    """
+    Modo paralelo: el hilo principal lee páginas y las reparte a un
+    ProcessPoolExecutor; un único hilo escritor aplica los resultados en el
+    mismo orden de lectura. Lecturas y escrituras comparten la conexión, así
+    que se serializan con un lock (mysql.connector no es thread-safe).
+
+    Devuelve (conversaciones_leidas, procesadas, turnos_insertados).
+    """
+    conn_lock = threading.Lock()
+    pending = queue.Queue(maxsize=workers * 2)  # futures en orden; acota memoria
+    totals = {'processed': 0, 'inserted': 0}
+    writer_error = []
+
+    def writer():
+        write_cursor = conn.cursor()
+        try:
+            while True:
+                fut = pending.get()
+                if fut is None:
+                    return
+                results = fut.result()
+                with conn_lock:
+                    p, n = _apply_parsed_page(conn, write_cursor, results, verbose)
+                totals['processed'] += p
+                totals['inserted'] += n
+        except BaseException as e:
+            writer_error.append(e)
+            # Drenar la cola para no bloquear al productor
+            while pending.get() is not None:
+                pass
+        finally:
+            write_cursor.close()
+
+    writer_thread = threading.Thread(target=writer, name="parse-turns-writer", daemon=True)
+    writer_thread.start()
+    seen = 0
+    try:
+        with ProcessPoolExecutor(max_workers=workers) as pool:
+            pages = iter_conversations_keyset(cursor, ejecucion_id, page_size=page_size, limit=limit)
+            while not writer_error:
+                with conn_lock:
+                    page = next(pages, None)
+                if page is None:
+                    break
+                seen += len(page)
+                pending.put(pool.submit(_parse_page, _page_rows(page)))
+    finally:
+        pending.put(None)
+        writer_thread.join()
+
+    if writer_error:
+        raise writer_error[0]
+    return seen, totals['processed'], totals['inserted']
+
+
+def parse_turns_for_run(conn, ejecucion_id, limit=0, verbose=False, page_size=200, workers=0):
+    """
+    Parsea los turnos de una ejecución. Con workers > 1 el parseo y la
+    asignación de roles se reparten en un ProcessPoolExecutor y un único hilo
+    escribe en la BD; el resultado es idéntico al modo serial.
+    """
     cursor = conn.cursor(dictionary=True)
     
     try:
-        # 1. Buscar conversaciones
-        query = "SELECT conversacion_pk, conversacion_id, raw_text FROM sa_conversaciones WHERE ejecucion_id = %s"
-        params = [ejecucion_id]
-        if limit > 0:
-            query += " LIMIT %s"
-            params.append(limit)
-            
-        cursor.execute(query, tuple(params))
-        conversations = cursor.fetchall()
-        
-        if not conversations:
+        if workers and workers > 1:
+            seen_conversations, processed_conversations, total_turns_inserted = _parse_turns_parallel(
+                conn, cursor, ejecucion_id, limit, verbose, page_size, workers
+            )
+        else:
+            seen_conversations = processed_conversations = total_turns_inserted = 0
+            # Recorrer conversaciones por páginas (keyset), parsear y escribir cada página
+            for page in iter_conversations_keyset(cursor, ejecucion_id, page_size=page_size, limit=limit):
+                seen_conversations += len(page)
+                p, n = _apply_parsed_page(conn, cursor, _parse_page(_page_rows(page)), verbose)
+                processed_conversations += p
+                total_turns_inserted += n
+
+        if seen_conversations == 0:
             print(f"No se encontraron conversaciones para la ejecución ID: {ejecucion_id}")
             return
 
-        total_turns_inserted = 0
-        processed_conversations = 0
-        batch_size = 100
-
-        for i, conv in enumerate(conversations):
-            try:
-                # 2. Parsear intervenciones y determinar roles
-                lines = conv['raw_text'].splitlines()
-                utterances = []
-                format_detected = None  # Track formato: 'hablante_n' o 'agente_cliente'
-                
-                for line in lines:
-                    # Intentar primero formato "Hablante N:"
-                    match = SPEAKER_LINE_RE.match(line)
-                    if match:
-                        speaker_id, text = match.groups()
-                        utterances.append((int(speaker_id), text))
-                        if format_detected is None:
-                            format_detected = 'hablante_n'
-                        continue
-                    
-                    # Intentar formato "AGENTE:" / "CLIENTE:"
-                    match = SPEAKER_LABEL_RE.match(line)
-                    if match:
-                        label, text = match.groups()
-                        # Mapear AGENTE->1, CLIENTE->2
-                        speaker_id = 1 if label.upper() == 'AGENTE' else 2
-                        utterances.append((speaker_id, text))
-                        if format_detected is None:
-                            format_detected = 'agente_cliente'
-
-                if not utterances:
-                    if verbose:
-                        print(f"Conversación {conv['conversacion_id']}: No se encontraron líneas con formato válido. Saltando.")
-                    continue
-                
-                role_map, mapping_str = _get_speaker_roles(utterances)
-                
-                # Si el formato es agente_cliente, forzar el mapeo correcto
-                if format_detected == 'agente_cliente':
-                    role_map[1] = 'AGENTE'
-                    role_map[2] = 'CLIENTE'
-
-                # 3. Agrupar intervenciones en turnos
-                turns = []
-                if utterances:
-                    current_speaker_id = utterances[0][0]
-                    current_text = [utterances[0][1]]
-                    for speaker_id, text in utterances[1:]:
-                        if speaker_id != current_speaker_id:
-                            turns.append({
-                                "speaker_id": current_speaker_id,
-                                "text": "\n".join(current_text)
-                            })
-                            current_speaker_id = speaker_id
-                            current_text = [text]
-                        else:
-                            current_text.append(text)
-                    
-                    turns.append({
-                        "speaker_id": current_speaker_id,
-                        "text": "\n".join(current_text)
-                    })
-
-                # 4. Borrar turnos previos e insertar nuevos
-                cursor.execute("DELETE FROM sa_turnos WHERE conversacion_pk = %s", (conv['conversacion_pk'],))
-                
-                turn_inserts = []
-                for idx, turn in enumerate(turns):
-                    speaker_role = role_map.get(turn['speaker_id'], 'UNKNOWN')
-                    turn_inserts.append((
-                        conv['conversacion_pk'],
-                        idx + 1,
-                        speaker_role,
-                        turn['text']
-                    ))
-                
-                if turn_inserts:
-                    cursor.executemany(
-                        """
-                        INSERT INTO sa_turnos (conversacion_pk, turno_idx, speaker, text)
-                        VALUES (%s, %s, %s, %s)
-                        """,
-                        turn_inserts
-                    )
-                    total_turns_inserted += len(turn_inserts)
-
-                # 5. Actualizar total_turnos en la conversación
-                cursor.execute(
-                    "UPDATE sa_conversaciones SET total_turnos = %s WHERE conversacion_pk = %s",
-                    (len(turns), conv['conversacion_pk'])
-                )
-                
-                processed_conversations += 1
-                if verbose:
-                    format_msg = f"Formato: {'AGENTE/CLIENTE' if format_detected == 'agente_cliente' else 'Hablante N'}"
-                    print(f"Conversación {conv['conversacion_id']}: {len(turns)} turnos. {format_msg}. Mapping: {mapping_str}")
-
-                if (i + 1) % batch_size == 0:
-                    conn.commit()
-                    if verbose:
-                        print(f"--- Lote de {batch_size} procesado. Commit realizado. ---")
-
-            except Error as e:
-                print(f"Error procesando conversación {conv['conversacion_id']} (PK: {conv['conversacion_pk']}): {e}")
-                conn.rollback() # Revertir cambios de la conversación actual
-        
-        conn.commit() # Commit final para el último lote
-
-        # 6. Imprimir resumen
+        # Imprimir resumen
         avg_turns = total_turns_inserted / processed_conversations if processed_conversations > 0 else 0
         print("\n--- Resumen de Parseo de Turnos ---")
         print(f"ID de Ejecución: {ejecucion_id}")
@@ -0,0 +1,181 @@
+"""
+Benchmark end-to-end de la etapa LLM (reclasificación de fases) sin la API real.
+
+Levanta un MockLLMServer local (latencia log-normal y errores configurables;
+respuestas armadas con el motor de reglas) o usa el backend "rules" en
+proceso, y corre contra la BD de config.ini:
+
+- script: scripts.reclasificar_turnos_deepseek.main (--from_db, caché desactivada)
+- ui: ui.analyze._run_deepseek_for_pendientes
+
+para cada valor de --concurrency. Reporta turnos/s, llamadas, round trips a la
+BD (execute/executemany/commit) y latencia p50/p95/p99 por llamada.
+
+Sin --write el target script corre en --dry_run (no escribe y se puede repetir):
+todos los niveles de concurrencia ven el mismo conjunto de pendientes. Con
+--write (obligatorio para el target ui, que siempre escribe) cada corrida deja
+clasificada la ejecución y el nivel siguiente vería menos pendientes, así que
+se mide un solo nivel por invocación, contra una ejecución sandbox recién
+creada (p.ej. tmp_create_sandbox_ej_from_ej2_v2.py) para cada medición.
+
+Uso:
+    python -m scripts.bench_llm_pipeline --ejecucion_id 99 --concurrency 1,4,8,16 --latency_ms 400
+    python -m scripts.bench_llm_pipeline --ejecucion_id 99 --backend rules
+    python -m scripts.bench_llm_pipeline --ejecucion_id 99 --target ui --write --concurrency 8 --error_rate 0.02
+"""
+import argparse
+import configparser
+import contextlib
+import io
+import os
+import time
+
+from sa_core.config import load_config
+from sa_core.db import get_conn
+from sa_core.llm_backends import MockLLMServer
+
+
+def _timed(stats, fn, *args, **kwargs):
+    t0 = time.perf_counter()
+    try:
+        return fn(*args, **kwargs)
+    finally:
+        stats["round_trips"] += 1
+        stats["db_secs"] += time.perf_counter() - t0
+
+
+class _CountingCursor:
+    """Cursor real que cuenta round trips y tiempo en la BD."""
+
+    def __init__(self, cursor, stats):
+        self._cursor = cursor
+        self._stats = stats
+
+    def execute(self, *args, **kwargs):
+        return _timed(self._stats, self._cursor.execute, *args, **kwargs)
+
+    def executemany(self, *args, **kwargs):
+        return _timed(self._stats, self._cursor.executemany, *args, **kwargs)
+
+    def __getattr__(self, name):
+        return getattr(self._cursor, name)
+
+
+class CountingConnection:
+    """Envuelve una conexión mysql.connector contando execute/executemany/commit/rollback."""
+
+    def __init__(self, conn):
+        self._conn = conn
+        self.stats = {"round_trips": 0, "db_secs": 0.0}
+
+    def cursor(self, *args, **kwargs):
+        return _CountingCursor(self._conn.cursor(*args, **kwargs), self.stats)
+
+    def commit(self):
+        return _timed(self.stats, self._conn.commit)
+
+    def rollback(self):
+        return _timed(self.stats, self._conn.rollback)
+
+    def __getattr__(self, name):
+        return getattr(self._conn, name)
+
+
+def _run_script(args, concurrency, base_url, conn):
+    from scripts.reclasificar_turnos_deepseek import main as recl_main
+
+    argv = [
+        "--ejecucion_id", str(args.ejecucion_id), "--from_db", "--max_rows", str(args.max_rows),
+        "--no_cache", "--concurrency", str(concurrency), "--rate_per_sec", str(args.rate_per_sec),
+        "--backend", "rules" if args.backend == "rules" else "http",
+        "--batch_turns", str(args.batch_turns),
+    ]
+    argv += ["--write", "--new_job"] if args.write else ["--dry_run"]
+    os.environ["DEEPSEEK_BASE_URL"] = base_url
+    os.environ.setdefault("DEEPSEEK_API_KEY", "mock")
+    with contextlib.redirect_stdout(io.StringIO()):
+        res = recl_main(argv, conn=conn)
+    return res["selected_rows"], res
+
+
+def _run_ui(args, concurrency, base_url, conn):
+    from ui.analyze import _run_deepseek_for_pendientes
+
+    cfg = configparser.ConfigParser()
+    cfg.read_dict({"deepseek": {
+        "base_url": base_url, "api_key": "mock", "backend": "rules" if args.backend == "rules" else "http",
+        "concurrency": str(concurrency), "rate_per_sec": str(args.rate_per_sec), "cache_enabled": "false",
+    }})
+    try:
+        res = _run_deepseek_for_pendientes(conn, args.ejecucion_id, args.conf_threshold, cfg, lambda msg: None,
+                                           max_iters=args.max_iters, batch_size=args.batch_size) or {}
+    finally:
+        conn.close()
+    return res.get("processed", 0), res
+
+
+def _fmt_ms(v):
+    return f"{v}ms" if v is not None else "-"
+
+
+def main():
+    ap = argparse.ArgumentParser(description="Benchmark de la etapa LLM contra un mock local")
+    ap.add_argument("--ejecucion_id", type=int, required=True)
+    ap.add_argument("--config", default="config.ini")
+    ap.add_argument("--target", choices=("script", "ui"), default="script")
+    ap.add_argument("--backend", choices=("mock", "rules"), default="mock",
+                    help="mock = servidor HTTP local; rules = en proceso (techo sin red)")
+    ap.add_argument("--concurrency", default="1,4,8", help="Lista separada por comas (un solo valor con --write)")
+    ap.add_argument("--latency_ms", type=float, default=300.0, help="Mediana de latencia del mock")
+    ap.add_argument("--latency_sigma", type=float, default=0.5, help="Dispersión log-normal (0 = fija)")
+    ap.add_argument("--error_rate", type=float, default=0.0)
+    ap.add_argument("--error_status", type=int, default=503)
+    ap.add_argument("--rate_per_sec", type=float, default=0.0)
+    ap.add_argument("--max_rows", type=int, default=500, help="Turnos pendientes por corrida (target script)")
+    ap.add_argument("--batch_turns", type=int, default=1)
+    ap.add_argument("--batch_size", type=int, default=500, help="Target ui: turnos por iteración")
+    ap.add_argument("--max_iters", type=int, default=1, help="Target ui: iteraciones")
+    ap.add_argument("--conf_threshold", type=float, default=0.55)
+    ap.add_argument("--seed", type=int, default=42)
+    ap.add_argument("--write", action="store_true", help="Escribir en la BD (obligatorio para el target ui)")
+    args = ap.parse_args()
+
+    if args.target == "ui" and not args.write:
+        raise SystemExit("El target ui escribe en sa_turnos: agregar --write (y usar una ejecución sandbox)")
+    levels = [int(c) for c in args.concurrency.split(",") if c.strip()]
+    if args.write and len(levels) > 1:
+        raise SystemExit("Con --write cada nivel clasifica los pendientes del siguiente: medir un solo --concurrency "
+                         "por invocación, con una ejecución sandbox nueva para cada una")
+    runners = {"script": _run_script, "ui": _run_ui}
+    cfg = load_config(args.config)
+
+    print(f"{'target':<7} {'backend':<6} {'conc':>4} {'turnos':>7} {'secs':>7} {'turnos/s':>9} {'llamadas':>9} "
+          f"{'errores':>7} {'reintentos':>10} {'db_rt':>7} {'db_secs':>7} {'p50':>7} {'p95':>7} {'p99':>7} {'max_in_flight':>13}")
+    target = args.target
+    for concurrency in levels:
+        mock = None
+        if args.backend == "mock":
+            mock = MockLLMServer(args.latency_ms, args.latency_sigma, args.error_rate,
+                                 args.error_status, seed=args.seed).start()
+        conn = CountingConnection(get_conn(cfg))
+        try:
+            t0 = time.perf_counter()
+            n_turnos, res = runners[target](args, concurrency, mock.base_url if mock else "", conn)
+            secs = time.perf_counter() - t0
+        finally:
+            if mock is not None:
+                mock.stop()
+        usage = res.get("usage") or {}
+        client = res.get("client") or {}
+        print(
+            f"{target:<7} {args.backend:<6} {concurrency:>4} {n_turnos:>7} {secs:>7.2f} "
+            f"{(n_turnos / secs if secs else 0):>9.1f} {usage.get('calls', 0):>9} {client.get('errors', 0):>7} {client.get('retries', 0):>10} "
+            f"{conn.stats['round_trips']:>7} {conn.stats['db_secs']:>7.2f} {_fmt_ms(usage.get('p50_ms')):>7} "
+            f"{_fmt_ms(usage.get('p95_ms')):>7} {_fmt_ms(usage.get('p99_ms')):>7} "
+            f"{(mock.stats()['max_in_flight'] if mock else '-'):>13}"
+        )
+    return 0
+
+
+if __name__ == "__main__":
+    raise SystemExit(main())
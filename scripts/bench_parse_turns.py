@@ -0,0 +1,197 @@
+"""
+Micro-benchmark del parser de turnos.
+
+Compara turns/seg del parser actual (sa_core.turnos.parse_conversation_text,
+una sola regex por línea y scoring de agente sin re.I) contra la implementación
+previa (SPEAKER_LINE_RE y luego SPEAKER_LABEL_RE por línea) sobre un corpus
+sintético, y verifica que
+ambos producen exactamente los mismos turnos. También cuenta las sentencias SQL
+que emitiría cada estrategia de escritura (por conversación vs. coalescida).
+
+Uso:
+    python -m scripts.bench_parse_turns --n_convs 10000
+"""
+import argparse
+import random
+import time
+from collections import defaultdict
+
+from sa_core.turnos import (
+    AGENT_SCORE_PATTERNS,
+    SPEAKER_LINE_RE,
+    SPEAKER_LABEL_RE,
+    _write_parsed_page,
+    parse_conversation_text,
+)
+
+FRASES_AGENTE = [
+    "Buenos días, le saluda Carla por encargo de financiera OH!",
+    "Me comunico con usted por una deuda pendiente con importe vencido.",
+    "Tenemos un beneficio de descuento si liquida hoy.",
+    "¿Podría confirmar la fecha de pago?",
+    "Le envío los datos por transferencia, gracias por su tiempo.",
+]
+FRASES_CLIENTE = [
+    "¿Aló?",
+    "Sí, con él habla.",
+    "Ahorita no tengo, el viernes le pago.",
+    "Ya, está bien.",
+    "Ok, gracias, hasta luego.",
+    "eh",
+]
+
+
+def generar_corpus(n_convs, seed=42):
+    """Genera n_convs transcripts con ambos formatos y líneas de ruido."""
+    rnd = random.Random(seed)
+    corpus = []
+    for i in range(n_convs):
+        label_format = (i % 4 == 0)
+        n_lines = rnd.randint(20, 80)
+        agent_num, client_num = (1, 2) if rnd.random() < 0.5 else (2, 1)
+        lines = []
+        for _ in range(n_lines):
+            r = rnd.random()
+            if r < 0.05:
+                lines.append("")  # línea vacía / ruido
+                continue
+            is_agent = r < 0.55
+            text = rnd.choice(FRASES_AGENTE if is_agent else FRASES_CLIENTE)
+            if label_format:
+                lines.append(f"{'AGENTE' if is_agent else 'CLIENTE'}: {text}")
+            else:
+                num = agent_num if is_agent else client_num
+                if rnd.random() < 0.03:
+                    num = 3
+                lines.append(f"Hablante {num}: {text}")
+        corpus.append("\n".join(lines))
+    return corpus
+
+
+def _speaker_roles_legacy(utterances):
+    """Asignación de roles previa (re.I por patrón y por texto), solo para comparar."""
+    speakers_utterances = defaultdict(list)
+    for speaker_id, text in utterances:
+        speakers_utterances[speaker_id].append(text)
+    agent_scores = defaultdict(int)
+    for speaker_id, texts in speakers_utterances.items():
+        for text in texts[:20]:
+            for pattern, weight in AGENT_SCORE_PATTERNS.items():
+                if pattern.search(text):
+                    agent_scores[speaker_id] += weight
+    if any(s > 0 for s in agent_scores.values()):
+        agent_speaker_id = max(agent_scores, key=agent_scores.get)
+    else:
+        agent_speaker_id = max(speakers_utterances, key=lambda spk: len(speakers_utterances[spk]))
+    client_candidates = {
+        speaker_id: len(texts) - (0.5 * agent_scores.get(speaker_id, 0))
+        for speaker_id, texts in speakers_utterances.items()
+        if speaker_id != agent_speaker_id
+    }
+    client_speaker_id = max(client_candidates, key=client_candidates.get) if client_candidates else -1
+    return {
+        spk: "AGENTE" if spk == agent_speaker_id else "CLIENTE" if spk == client_speaker_id else "UNKNOWN"
+        for spk in speakers_utterances
+    }
+
+
+def parse_legacy(raw_text):
+    """Implementación previa (dos regex por línea), conservada solo para comparar."""
+    utterances = []
+    format_detected = None
+    for line in raw_text.splitlines():
+        match = SPEAKER_LINE_RE.match(line)
+        if match:
+            speaker_id, text = match.groups()
+            utterances.append((int(speaker_id), text))
+            if format_detected is None:
+                format_detected = 'hablante_n'
+            continue
+        match = SPEAKER_LABEL_RE.match(line)
+        if match:
+            label, text = match.groups()
+            speaker_id = 1 if label.upper() == 'AGENTE' else 2
+            utterances.append((speaker_id, text))
+            if format_detected is None:
+                format_detected = 'agente_cliente'
+    if not utterances:
+        return []
+    role_map = _speaker_roles_legacy(utterances)
+    if format_detected == 'agente_cliente':
+        role_map[1] = 'AGENTE'
+        role_map[2] = 'CLIENTE'
+    turns = []
+    current_speaker_id = utterances[0][0]
+    current_text = [utterances[0][1]]
+    for speaker_id, text in utterances[1:]:
+        if speaker_id != current_speaker_id:
+            turns.append({"speaker_id": current_speaker_id, "text": "\n".join(current_text)})
+            current_speaker_id = speaker_id
+            current_text = [text]
+        else:
+            current_text.append(text)
+    turns.append({"speaker_id": current_speaker_id, "text": "\n".join(current_text)})
+    return [(role_map.get(t['speaker_id'], 'UNKNOWN'), t['text']) for t in turns]
+
+
+class _CountingCursor:
+    """Cursor que solo cuenta sentencias (para comparar round-trips sin BD)."""
+    def __init__(self):
+        self.statements = 0
+
+    def execute(self, sql, params=None):
+        self.statements += 1
+
+    def executemany(self, sql, rows):
+        self.statements += 1
+
+
+def _bench(fn, corpus, repeat):
+    best = None
+    n_turns = 0
+    for _ in range(repeat):
+        t0 = time.perf_counter()
+        n_turns = 0
+        for raw in corpus:
+            n_turns += len(fn(raw))
+        dt = time.perf_counter() - t0
+        best = dt if best is None else min(best, dt)
+    return n_turns, best
+
+
+def main():
+    ap = argparse.ArgumentParser(description="Benchmark del parser de turnos")
+    ap.add_argument("--n_convs", type=int, default=10000)
+    ap.add_argument("--repeat", type=int, default=3)
+    ap.add_argument("--seed", type=int, default=42)
+    ap.add_argument("--page_size", type=int, default=200)
+    args = ap.parse_args()
+
+    print(f"Generando corpus sintético: {args.n_convs} conversaciones...")
+    corpus = generar_corpus(args.n_convs, args.seed)
+
+    # 1. Equivalencia
+    mismatches = sum(1 for raw in corpus if parse_legacy(raw) != parse_conversation_text(raw)[0])
+    print(f"Diferencias legacy vs nuevo: {mismatches}")
+
+    # 2. Throughput de parseo
+    n_legacy, t_legacy = _bench(parse_legacy, corpus, args.repeat)
+    n_new, t_new = _bench(lambda raw: parse_conversation_text(raw)[0], corpus, args.repeat)
+    print(f"Legacy : {n_legacy} turnos en {t_legacy:.3f}s -> {n_legacy / t_legacy:,.0f} turnos/s")
+    print(f"Nuevo  : {n_new} turnos en {t_new:.3f}s -> {n_new / t_new:,.0f} turnos/s")
+    print(f"Speedup: {t_legacy / t_new:.2f}x")
+
+    # 3. Sentencias SQL emitidas
+    parsed = [(pk, parse_conversation_text(raw)[0]) for pk, raw in enumerate(corpus, start=1)]
+    parsed = [(pk, turns) for pk, turns in parsed if turns]
+    legacy_statements = 3 * len(parsed)  # DELETE + executemany + UPDATE por conversación
+    cur = _CountingCursor()
+    for start in range(0, len(parsed), args.page_size):
+        _write_parsed_page(cur, parsed[start:start + args.page_size])
+    print(f"Sentencias SQL legacy: {legacy_statements}  coalescidas: {cur.statements}")
+
+    return 0 if mismatches == 0 else 1
+
+
+if __name__ == "__main__":
+    raise SystemExit(main())
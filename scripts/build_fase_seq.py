@@ -6,14 +6,17 @@ y mejorar coherencia de secuencias.
 """
 import sys
 import argparse
-import re
 from pathlib import Path
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
 
 # Agregar directorio raíz al path para imports
 sys.path.insert(0, str(Path(__file__).parent.parent))
 
 from sa_core.config import load_config
-from sa_core.db import get_conn
+from sa_core.conv_stream import iter_conversation_chunks, iter_conversations
+from sa_core.db import bulk_update_via_temp_table, get_conn
+from sa_core.fase_seq_rules import FASE_SEQ_STATS, apply_stabilization_rules
 import logging
 
 logging.basicConfig(
@@ -22,23 +25,10 @@ logging.basicConfig(
 )
 logger = logging.getLogger(__name__)
 
+# Conversaciones por chunk (unidad de trabajo del pool; un UPDATE ... JOIN y un commit)
+CHUNK_CONVS = 500
 
-# Orden de macrofases (para detectar retrocesos)
-MACRO_ORDER = {
-    'APERTURA': 1,
-    'IDENTIFICACION': 2,
-    'INFORMACION_DEUDA': 3,
-    'NEGOCIACION': 4,
-    'CONSULTA_ACEPTACION': 5,
-    'FORMALIZACION_PAGO': 6,
-    'ADVERTENCIAS': 7,
-    'CIERRE': 8,
-}
-
-# Patrones para casos especiales
-PATTERN_DNI = re.compile(r'\d{7,}')  # DNI/documento
-PATTERN_FECHA = re.compile(r'\d{1,2}[/-]\d{1,2}[/-]\d{2,4}')  # Fecha
-PATTERN_DEUDA = re.compile(r'saldo|deuda|mora|vencid|balance|importe', re.IGNORECASE)
+TURNO_COLUMNS = ('turno_pk', 'turno_idx', 'fase', 'fase_conf', 'fase_source', 'speaker', 'text')
 
 
 def create_column_if_not_exists(conn):
@@ -95,251 +85,27 @@ def load_macro_map(conn):
         cursor.close()
 
 
-def get_macro_fase(fase, macro_map):
-    """Obtiene la macrofase para una fase dada"""
-    if not fase or fase.strip() == '':
-        return None
-    
-    # Buscar en el mapa
-    if fase in macro_map:
-        return macro_map[fase]
-    
-    # Fallback: usar la misma fase como macro
-    return fase
-
-
-def is_short_client_response(text, speaker):
-    """Detecta si es una respuesta corta del cliente"""
-    if speaker != 'CLIENTE':
-        return False
-    
-    if not text:
-        return False
-    
-    text_clean = text.strip()
-    
-    # Respuestas muy cortas (<=6 caracteres)
-    if len(text_clean) <= 6:
-        return True
-    
-    # Respuestas monosilábicas comunes
-    short_responses = {'si', 'sí', 'no', 'ok', 'vale', 'ya', 'ajá', 'ajá', 'mmm', 'ehh', '...'}
-    if text_clean.lower() in short_responses:
-        return True
-    
-    return False
-
-
-def detect_identificacion_indicators(text, speaker):
-    """Detecta si el texto contiene indicadores de IDENTIFICACION"""
-    if speaker != 'CLIENTE':
-        return False
-    
-    if not text:
-        return False
-    
-    # Buscar DNI o fecha
-    if PATTERN_DNI.search(text) or PATTERN_FECHA.search(text):
-        return True
-    
-    return False
-
-
-def detect_informacion_deuda_indicators(text):
-    """Detecta si el texto contiene indicadores de INFORMACION_DEUDA"""
-    if not text:
-        return False
-    
-    return bool(PATTERN_DEUDA.search(text))
-
-
-def apply_stabilization_rules(turnos, macro_map):
-    """
-    Aplica reglas de estabilización para calcular fase_seq
-    
-    Returns:
-        list: Lista de (turno_pk, fase_seq) para actualizar
-        dict: Estadísticas de aplicación de reglas
-    """
-    updates = []
-    stats = {
-        'total': len(turnos),
-        'null_kept': 0,
-        'short_client_kept': 0,
-        'backtrack_prevented': 0,
-        'identificacion_forced': 0,
-        'info_deuda_forced': 0,
-        'apertura_blocked': 0,          # F
-        'formalizacion_blocked': 0,     # G
-        'info_deuda_blocked': 0,        # H
-        'formalizacion_kept': 0,        # I
-        'advertencias_kept': 0,         # J
-        'normal': 0,
-    }
-    
-    prev_macro = None
-    
-    for idx, turno in enumerate(turnos):
-        turno_pk = turno['turno_pk']
-        turno_idx = turno['turno_idx']
-        fase = turno['fase']
-        speaker = turno['speaker']
-        text = turno['text'] or ''
-        
-        # REGLA A: NULL/vacío -> mantener NULL
-        if not fase or fase.strip() == '':
-            updates.append((turno_pk, None))
-            stats['null_kept'] += 1
-            continue
-        
-        # Mapear a macro
-        current_macro = get_macro_fase(fase, macro_map)
-        
-        if not current_macro:
-            updates.append((turno_pk, None))
-            stats['null_kept'] += 1
-            continue
-        
-        # REGLA B: Respuestas cortas del CLIENTE -> mantener fase anterior
-        if is_short_client_response(text, speaker):
-            if prev_macro:
-                updates.append((turno_pk, prev_macro))
-                stats['short_client_kept'] += 1
-                continue
-        
-        # REGLA D: IDENTIFICACION al inicio (primeros 6 turnos)
-        if turno_idx <= 6 and detect_identificacion_indicators(text, speaker):
-            current_macro = 'IDENTIFICACION'
-            updates.append((turno_pk, current_macro))
-            stats['identificacion_forced'] += 1
-            prev_macro = current_macro
-            continue
-        
-        # REGLA E: INFORMACION_DEUDA por keywords
-        # PERO NO si ya estamos en NEGOCIACION o más (evitar zigzag)
-        if detect_informacion_deuda_indicators(text):
-            # Verificar si ya estamos en NEGOCIACION o más
-            allow_info_deuda = True
-            if prev_macro and prev_macro in MACRO_ORDER:
-                prev_order = MACRO_ORDER[prev_macro]
-                if prev_order >= 4:  # NEGOCIACION o posterior
-                    allow_info_deuda = False
-            
-            if allow_info_deuda:
-                current_macro = 'INFORMACION_DEUDA'
-                updates.append((turno_pk, current_macro))
-                stats['info_deuda_forced'] += 1
-                prev_macro = current_macro
-                continue
-        
-        # REGLA C: No retroceder más de 2 niveles
-        if prev_macro and current_macro in MACRO_ORDER and prev_macro in MACRO_ORDER:
-            current_order = MACRO_ORDER[current_macro]
-            prev_order = MACRO_ORDER[prev_macro]
-            
-            if current_order < prev_order:
-                diff = prev_order - current_order
-                if diff >= 2:
-                    # Retroceso fuerte: mantener fase anterior
-                    updates.append((turno_pk, prev_macro))
-                    stats['backtrack_prevented'] += 1
-                    continue
-        
-        # REGLAS MONOTÓNICAS F-J (modifican current_macro, no hacen continue)
-        
-        # REGLA F: BLOQUEAR APERTURA una vez en IDENTIFICACION o más
-        if prev_macro and prev_macro in MACRO_ORDER:
-            prev_order = MACRO_ORDER[prev_macro]
-            if prev_order >= 2 and current_macro == 'APERTURA':
-                current_macro = prev_macro
-                stats['apertura_blocked'] += 1
-        
-        # REGLA G: BLOQUEAR FORMALIZACION_PAGO antes de NEGOCIACION
-        if prev_macro and prev_macro in MACRO_ORDER:
-            prev_order = MACRO_ORDER[prev_macro]
-            if current_macro == 'FORMALIZACION_PAGO' and prev_order < 4:
-                current_macro = prev_macro
-                stats['formalizacion_blocked'] += 1
-        
-        # REGLA H: Una vez en NEGOCIACION, no volver a INFORMACION_DEUDA
-        if prev_macro == 'NEGOCIACION' and current_macro == 'INFORMACION_DEUDA':
-            current_macro = 'NEGOCIACION'
-            stats['info_deuda_blocked'] += 1
-        
-        # REGLA I: Una vez en FORMALIZACION_PAGO, mantener hasta CIERRE (salvo ADVERTENCIAS y CIERRE)
-        if prev_macro == 'FORMALIZACION_PAGO':
-            if current_macro in ('NEGOCIACION', 'CONSULTA_ACEPTACION', 'INFORMACION_DEUDA', 'IDENTIFICACION', 'APERTURA'):
-                current_macro = 'FORMALIZACION_PAGO'
-                stats['formalizacion_kept'] += 1
-        
-        # REGLA J: Después de ADVERTENCIAS, no volver a FORMALIZACION/CONSULTA/NEGOCIACION/INFO_DEUDA
-        if prev_macro == 'ADVERTENCIAS':
-            if current_macro in ('FORMALIZACION_PAGO', 'CONSULTA_ACEPTACION', 'NEGOCIACION', 'INFORMACION_DEUDA'):
-                current_macro = 'ADVERTENCIAS'
-                stats['advertencias_kept'] += 1
-        
-        # Caso normal: usar macro actual (posiblemente modificado por F-J)
-        updates.append((turno_pk, current_macro))
-        stats['normal'] += 1
-        prev_macro = current_macro
-    
-    return updates, stats
-
-
-def get_conversations_for_ejecucion(conn, ejecucion_id):
-    """Obtiene todas las conversaciones con sus turnos para una ejecución"""
-    cursor = conn.cursor(dictionary=True)
-    
-    try:
-        # Obtener conversaciones
-        cursor.execute("""
-            SELECT conversacion_pk
-            FROM sa_conversaciones
-            WHERE ejecucion_id = %s
-            ORDER BY conversacion_pk
-        """, (ejecucion_id,))
-        
-        conversations = cursor.fetchall()
-        
-        if not conversations:
-            logger.warning(f"No se encontraron conversaciones para ejecucion_id={ejecucion_id}")
-            return {}
-        
-        logger.info(f"✓ Encontradas {len(conversations)} conversaciones")
-        
-        # Para cada conversación, obtener sus turnos
-        result = {}
-        for conv in conversations:
-            conv_pk = conv['conversacion_pk']
-            
-            cursor.execute("""
-                SELECT turno_pk, turno_idx, fase, fase_conf, fase_source, speaker, text
-                FROM sa_turnos
-                WHERE conversacion_pk = %s
-                ORDER BY turno_idx ASC
-            """, (conv_pk,))
-            
-            turnos = cursor.fetchall()
-            result[conv_pk] = turnos
-        
-        return result
-    
-    finally:
-        cursor.close()
+def stabilize_chunk(items, macro_map):
+    """apply_stabilization_rules sobre [(conversación, turnos), ...] de iter_conversations (corre en el pool)"""
+    all_updates = []
+    chunk_stats = dict.fromkeys(FASE_SEQ_STATS, 0)
+    for _conv, turnos in items:
+        updates, stats = apply_stabilization_rules(turnos, macro_map)
+        all_updates.extend(updates)
+        for key in chunk_stats:
+            chunk_stats[key] += stats.get(key, 0)
+    return all_updates, chunk_stats
 
 
 def batch_update_fase_seq(conn, updates):
-    """Actualiza fase_seq en batch"""
+    """Actualiza fase_seq de un chunk con un UPDATE ... JOIN sobre tabla temporal y hace commit"""
     if not updates:
         return
     
     cursor = conn.cursor()
     
     try:
-        cursor.executemany(
-            "UPDATE sa_turnos SET fase_seq = %s WHERE turno_pk = %s",
-            [(fase_seq, turno_pk) for turno_pk, fase_seq in updates]
-        )
+        bulk_update_via_temp_table(cursor, "sa_turnos", "turno_pk", [("fase_seq", "VARCHAR(64)")], updates)
         conn.commit()
     
     except Exception as e:
@@ -394,13 +160,20 @@ def print_summary(global_stats):
     print("\n" + "="*70 + "\n")
 
 
-def run_build_fase_seq(config_path, ejecucion_id):
+def run_build_fase_seq(config_path, ejecucion_id, workers=0, chunk_convs=CHUNK_CONVS):
     """
     Función reutilizable para construir fase_seq (llamable desde UI).
     
+    Lee los turnos con iter_conversations (keyset paginado), aplica las reglas
+    de a chunk_convs conversaciones (en un ProcessPoolExecutor si workers > 1,
+    mientras se escribe el chunk anterior) y escribe cada chunk con un
+    UPDATE ... JOIN y un commit.
+    
     Args:
         config_path: Ruta al archivo config.ini
         ejecucion_id: ID de la ejecución a procesar
+        workers: Procesos para aplicar las reglas (0/1 = en el proceso principal)
+        chunk_convs: Conversaciones por chunk
     
     Returns:
         dict con estadísticas del proceso
@@ -425,47 +198,42 @@ def run_build_fase_seq(config_path, ejecucion_id):
         # Cargar mapeo de fases a macrofases
         macro_map = load_macro_map(conn)
         
-        # Obtener conversaciones y turnos
-        logger.info(f"Obteniendo conversaciones para ejecucion_id={ejecucion_id}...")
-        conversations = get_conversations_for_ejecucion(conn, ejecucion_id)
-        
-        if not conversations:
-            logger.warning("No hay conversaciones para procesar")
-            return {'total': 0, 'message': 'No hay conversaciones para procesar'}
-        
         # Estadísticas globales
-        global_stats = {
-            'total': 0,
-            'null_kept': 0,
-            'short_client_kept': 0,
-            'backtrack_prevented': 0,
-            'identificacion_forced': 0,
-            'info_deuda_forced': 0,
-            'apertura_blocked': 0,
-            'formalizacion_blocked': 0,
-            'info_deuda_blocked': 0,
-            'formalizacion_kept': 0,
-            'advertencias_kept': 0,
-            'normal': 0,
-        }
-        
-        logger.info(f"Procesando {len(conversations)} conversaciones...")
-        
-        # Procesar cada conversación
-        all_updates = []
+        global_stats = dict.fromkeys(FASE_SEQ_STATS, 0)
+        n_convs = 0
         
-        for conv_pk, turnos in conversations.items():
-            # Aplicar reglas de estabilización
-            updates, stats = apply_stabilization_rules(turnos, macro_map)
-            
-            # Acumular updates y stats
-            all_updates.extend(updates)
+        def write_chunk(result):
+            updates, stats = result
             for key in global_stats:
                 global_stats[key] += stats.get(key, 0)
-        
-        # Batch update
-        logger.info(f"Actualizando {len(all_updates)} turnos en base de datos...")
-        batch_update_fase_seq(conn, all_updates)
+            batch_update_fase_seq(conn, updates)
+        
+        logger.info(f"Procesando conversaciones de ejecucion_id={ejecucion_id} (chunks de {chunk_convs}, workers={workers})...")
+        pool = ProcessPoolExecutor(max_workers=workers) if workers > 1 else None
+        read_cursor = conn.cursor()
+        try:
+            pending = deque()
+            conversations = iter_conversations(read_cursor, ejecucion_id, TURNO_COLUMNS, include_empty=True)
+            for items in iter_conversation_chunks(conversations, chunk_convs):
+                n_convs += len(items)
+                if pool is None:
+                    write_chunk(stabilize_chunk(items, macro_map))
+                    continue
+                pending.append(pool.submit(stabilize_chunk, items, macro_map))
+                # Hasta `workers` chunks en el pool; mientras tanto se escribe el más viejo (en orden)
+                while len(pending) > workers:
+                    write_chunk(pending.popleft().result())
+            while pending:
+                write_chunk(pending.popleft().result())
+        finally:
+            read_cursor.close()
+            if pool is not None:
+                pool.shutdown()
+        
+        if n_convs == 0:
+            logger.warning("No hay conversaciones para procesar")
+            return {'total': 0, 'message': 'No hay conversaciones para procesar'}
+        logger.info(f"✓ {n_convs} conversaciones, {global_stats['total']} turnos actualizados")
         
         # Imprimir resumen
         print_summary(global_stats)
@@ -488,11 +256,13 @@ def main():
     parser = argparse.ArgumentParser(description='Construye fase_seq estabilizada para análisis de secuencias')
     parser.add_argument('--config', default='config.ini', help='Ruta al archivo de configuración')
     parser.add_argument('--ejecucion_id', type=int, required=True, help='ID de la ejecución a procesar')
+    parser.add_argument('--workers', type=int, default=0, help='Procesos para aplicar las reglas (0 = en el proceso principal)')
+    parser.add_argument('--chunk_convs', type=int, default=CHUNK_CONVS, help='Conversaciones por chunk (UPDATE y commit)')
     
     args = parser.parse_args()
     
     try:
-        stats = run_build_fase_seq(args.config, args.ejecucion_id)
+        stats = run_build_fase_seq(args.config, args.ejecucion_id, workers=args.workers, chunk_convs=args.chunk_convs)
         logger.info("Proceso completado exitosamente")
         logger.info(f"Estadísticas finales: {stats}")
     except Exception as e:
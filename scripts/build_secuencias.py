@@ -7,13 +7,16 @@ y las almacena en la tabla sa_conversacion_secuencias.
 import sys
 import argparse
 from pathlib import Path
-from collections import defaultdict
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
 
 # Agregar directorio raíz al path para imports
 sys.path.insert(0, str(Path(__file__).parent.parent))
 
 from sa_core.config import load_config
+from sa_core.conv_stream import iter_conversation_chunks, iter_conversations
 from sa_core.db import get_conn
+from sa_core.run_turns import RunTurns, load_phase_vocab
 import logging
 
 logging.basicConfig(
@@ -23,6 +26,16 @@ logging.basicConfig(
 logger = logging.getLogger(__name__)
 
 
+# Conversaciones por chunk (unidad de trabajo del pool; un upsert multi-fila y un commit)
+CHUNK_CONVS = 500
+
+# numpy: métricas vectorizadas sobre toda la ejecución (sa_core.seq_metrics; NumPy es
+#        opcional: sin él se usa python, ver resolve_engine)
+# python: analyze_conversation por conversación (con el log de turnos de --verbose)
+ENGINES = ('numpy', 'python')
+
+TURNO_COLUMNS = ('turno_pk', 'turno_idx', 'fase', 'fase_8', 'fase_seq', 'fase_conf', 'fase_source')
+
 # Transiciones permitidas entre macrofases
 ALLOWED_TRANSITIONS = {
     ('APERTURA', 'IDENTIFICACION'),
@@ -266,94 +279,87 @@ def analyze_conversation(conversacion_pk, turnos, macro_map, verbose=False):
     }
 
 
-def get_conversations_for_ejecucion(conn, ejecucion_id):
-    """Obtiene todas las conversaciones con sus turnos para una ejecución"""
-    cursor = conn.cursor(dictionary=True)
-    
+def analyze_chunk(items, macro_map, verbose=False):
+    """analyze_conversation sobre [(conversación, turnos), ...] de iter_conversations (corre en el pool)"""
+    return [
+        (conv.conversacion_pk, analyze_conversation(conv.conversacion_pk, turnos, macro_map, verbose=verbose))
+        for conv, turnos in items
+    ]
+
+
+def analyze_run(conn, ejecucion_id, macro_map):
+    """
+    Métricas de todas las conversaciones de la ejecución con sequence_metrics:
+    carga las fases en columnas (RunTurns, sin texto; códigos sembrados desde
+    fases_conversacion / sa_fase_macro_map) y devuelve
+    [(conversacion_pk, resultado | None)] igual que analyze_chunk.
+    """
+    # Import diferido: sa_core.seq_metrics requiere NumPy
+    from sa_core.seq_metrics import SEQ_PHASE_COLUMNS, sequence_metrics
+
+    cursor = conn.cursor()
     try:
-        # Obtener conversaciones
-        cursor.execute("""
-            SELECT conversacion_pk, conversacion_id
-            FROM sa_conversaciones
-            WHERE ejecucion_id = %s
-            ORDER BY conversacion_pk
-        """, (ejecucion_id,))
-        
-        conversations = cursor.fetchall()
-        
-        if not conversations:
-            logger.warning(f"No se encontraron conversaciones para ejecucion_id={ejecucion_id}")
-            return {}
-        
-        logger.info(f"✓ Encontradas {len(conversations)} conversaciones")
-        
-        # Para cada conversación, obtener sus turnos
-        result = {}
-        for conv in conversations:
-            conv_pk = conv['conversacion_pk']
-            
-            cursor.execute("""
-                SELECT turno_pk, turno_idx, fase, fase_8, fase_seq, fase_conf, fase_source
-                FROM sa_turnos
-                WHERE conversacion_pk = %s
-                ORDER BY turno_idx ASC
-            """, (conv_pk,))
-            
-            turnos = cursor.fetchall()
-            result[conv_pk] = turnos
-        
-        return result
-    
+        vocab, _ = load_phase_vocab(cursor)
+        run = RunTurns.from_db(cursor, ejecucion_id, phase_columns=SEQ_PHASE_COLUMNS, vocab=vocab,
+                               with_text=False, with_conf=False, include_empty=True)
     finally:
         cursor.close()
+    logger.info(f"✓ {run.n_turns} turnos de {run.n_convs} conversaciones cargados en columnas")
+    return sequence_metrics(run, macro_map, ALLOWED_TRANSITIONS)
+
+
+UPSERT_SECUENCIA_SQL = """
+INSERT INTO sa_conversacion_secuencias (
+    conversacion_pk, ejecucion_id, secuencia_macro,
+    fase_inicio, fase_fin, cobertura_fases,
+    tiene_informacion_deuda, tiene_negociacion,
+    violaciones_transicion, cumple_secuencia, corte_antes_negociacion,
+    inicio_valido
+) VALUES (%s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s)
+ON DUPLICATE KEY UPDATE
+    ejecucion_id = VALUES(ejecucion_id),
+    secuencia_macro = VALUES(secuencia_macro),
+    fase_inicio = VALUES(fase_inicio),
+    fase_fin = VALUES(fase_fin),
+    cobertura_fases = VALUES(cobertura_fases),
+    tiene_informacion_deuda = VALUES(tiene_informacion_deuda),
+    tiene_negociacion = VALUES(tiene_negociacion),
+    violaciones_transicion = VALUES(violaciones_transicion),
+    cumple_secuencia = VALUES(cumple_secuencia),
+    corte_antes_negociacion = VALUES(corte_antes_negociacion),
+    inicio_valido = VALUES(inicio_valido),
+    updated_at = CURRENT_TIMESTAMP
+"""
 
 
-def upsert_secuencia(conn, ejecucion_id, data):
-    """Inserta o actualiza una secuencia en la tabla"""
+def upsert_secuencias(conn, ejecucion_id, results):
+    """Inserta o actualiza un chunk de secuencias con un INSERT multi-fila y hace commit"""
+    if not results:
+        return
     cursor = conn.cursor()
     
-    upsert_sql = """
-    INSERT INTO sa_conversacion_secuencias (
-        conversacion_pk, ejecucion_id, secuencia_macro,
-        fase_inicio, fase_fin, cobertura_fases,
-        tiene_informacion_deuda, tiene_negociacion,
-        violaciones_transicion, cumple_secuencia, corte_antes_negociacion,
-        inicio_valido
-    ) VALUES (%s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s)
-    ON DUPLICATE KEY UPDATE
-        ejecucion_id = VALUES(ejecucion_id),
-        secuencia_macro = VALUES(secuencia_macro),
-        fase_inicio = VALUES(fase_inicio),
-        fase_fin = VALUES(fase_fin),
-        cobertura_fases = VALUES(cobertura_fases),
-        tiene_informacion_deuda = VALUES(tiene_informacion_deuda),
-        tiene_negociacion = VALUES(tiene_negociacion),
-        violaciones_transicion = VALUES(violaciones_transicion),
-        cumple_secuencia = VALUES(cumple_secuencia),
-        corte_antes_negociacion = VALUES(corte_antes_negociacion),
-        inicio_valido = VALUES(inicio_valido),
-        updated_at = CURRENT_TIMESTAMP
-    """
-    
     try:
-        cursor.execute(upsert_sql, (
-            data['conversacion_pk'],
-            ejecucion_id,
-            data['secuencia_macro'],
-            data['fase_inicio'],
-            data['fase_fin'],
-            data['cobertura_fases'],
-            data['tiene_informacion_deuda'],
-            data['tiene_negociacion'],
-            data['violaciones_transicion'],
-            data['cumple_secuencia'],
-            data['corte_antes_negociacion'],
-            data['inicio_valido'],
-        ))
+        cursor.executemany(UPSERT_SECUENCIA_SQL, [
+            (
+                data['conversacion_pk'],
+                ejecucion_id,
+                data['secuencia_macro'],
+                data['fase_inicio'],
+                data['fase_fin'],
+                data['cobertura_fases'],
+                data['tiene_informacion_deuda'],
+                data['tiene_negociacion'],
+                data['violaciones_transicion'],
+                data['cumple_secuencia'],
+                data['corte_antes_negociacion'],
+                data['inicio_valido'],
+            )
+            for data in results
+        ])
         conn.commit()
     
     except Exception as e:
-        logger.error(f"Error en upsert de secuencia: {e}")
+        logger.error(f"Error en upsert de secuencias: {e}")
         conn.rollback()
         raise
     
@@ -387,14 +393,41 @@ def print_summary(stats):
     print("\n" + "="*70 + "\n")
 
 
-def run_build_secuencias(config_path, ejecucion_id, verbose=False):
+def resolve_engine(engine):
+    """
+    Valida engine y devuelve el que se va a usar: 'numpy' pasa a 'python' (con
+    un warning) si NumPy no está instalado.
+    """
+    if engine not in ENGINES:
+        raise ValueError(f"engine desconocido: {engine} (opciones: {', '.join(ENGINES)})")
+    if engine == 'numpy':
+        try:
+            import numpy  # noqa: F401
+        except ImportError:
+            logger.warning("NumPy no está instalado: se usa engine='python' (por conversación)")
+            return 'python'
+    return engine
+
+
+def run_build_secuencias(config_path, ejecucion_id, verbose=False, workers=0, chunk_convs=CHUNK_CONVS,
+                         engine='numpy'):
     """
     Función reutilizable para construir análisis de secuencias (llamable desde UI).
     
+    Con engine='numpy' carga las fases de la ejecución en columnas y calcula
+    las métricas de todas las conversaciones a la vez (analyze_run). Con
+    engine='python' lee los turnos con iter_conversations (keyset paginado) y
+    analiza de a chunk_convs conversaciones (en un ProcessPoolExecutor si
+    workers > 1, mientras se escribe el chunk anterior). En ambos casos se
+    guarda de a chunk_convs conversaciones con un upsert multi-fila y un commit.
+    
     Args:
         config_path: Ruta al archivo config.ini
         ejecucion_id: ID de la ejecución a procesar
         verbose: Si es True, imprime logs detallados
+        workers: Procesos para el análisis con engine='python' (0/1 = en el proceso principal)
+        chunk_convs: Conversaciones por chunk
+        engine: 'numpy' (vectorizado; 'python' si NumPy no está instalado) o 'python' (por conversación)
     
     Returns:
         dict con estadísticas del proceso
@@ -402,6 +435,7 @@ def run_build_secuencias(config_path, ejecucion_id, verbose=False):
     Raises:
         Exception si hay errores críticos
     """
+    engine = resolve_engine(engine)
     config_path = Path(config_path)
     if not config_path.exists():
         raise FileNotFoundError(f"Archivo de configuración no encontrado: {config_path}")
@@ -423,15 +457,7 @@ def run_build_secuencias(config_path, ejecucion_id, verbose=False):
         # Cargar mapeo de fases a macrofases
         macro_map = load_macro_map(conn)
         
-        # Obtener conversaciones y turnos
-        logger.info(f"Obteniendo conversaciones para ejecucion_id={ejecucion_id}...")
-        conversations = get_conversations_for_ejecucion(conn, ejecucion_id)
-        
-        if not conversations:
-            logger.warning("No hay conversaciones para procesar")
-            return {'total': 0, 'message': 'No hay conversaciones para procesar'}
-        
-        # Procesar cada conversación
+        # Procesar conversaciones por chunks
         stats = {
             'total': 0,
             'sin_fases': 0,
@@ -443,28 +469,61 @@ def run_build_secuencias(config_path, ejecucion_id, verbose=False):
             'inicio_valido': 0,
         }
         
-        logger.info(f"Procesando {len(conversations)} conversaciones...")
-        
-        for conv_pk, turnos in conversations.items():
-            stats['total'] += 1
-            
-            # Analizar conversación
-            result = analyze_conversation(conv_pk, turnos, macro_map, verbose=verbose)
-            
-            if result is None:
-                stats['sin_fases'] += 1
-                continue
-            
-            # Actualizar estadísticas
-            stats['cumple_secuencia'] += result['cumple_secuencia']
-            stats['corte_antes_negociacion'] += result['corte_antes_negociacion']
-            stats['total_violaciones'] += result['violaciones_transicion']
-            stats['tiene_info_deuda'] += result['tiene_informacion_deuda']
-            stats['tiene_negociacion'] += result['tiene_negociacion']
-            stats['inicio_valido'] += result['inicio_valido']
+        def write_chunk(analyzed):
+            results = []
+            for conv_pk, result in analyzed:
+                stats['total'] += 1
+                
+                if result is None:
+                    stats['sin_fases'] += 1
+                    continue
+                
+                # Actualizar estadísticas
+                stats['cumple_secuencia'] += result['cumple_secuencia']
+                stats['corte_antes_negociacion'] += result['corte_antes_negociacion']
+                stats['total_violaciones'] += result['violaciones_transicion']
+                stats['tiene_info_deuda'] += result['tiene_informacion_deuda']
+                stats['tiene_negociacion'] += result['tiene_negociacion']
+                stats['inicio_valido'] += result['inicio_valido']
+                results.append(result)
             
             # Guardar en base de datos
-            upsert_secuencia(conn, ejecucion_id, result)
+            upsert_secuencias(conn, ejecucion_id, results)
+        
+        if engine == 'numpy':
+            logger.info(f"Procesando conversaciones de ejecucion_id={ejecucion_id} (vectorizado, escritura en chunks de {chunk_convs})...")
+            analyzed = analyze_run(conn, ejecucion_id, macro_map)
+            if verbose:
+                for conv_pk, result in analyzed:
+                    if result is not None:
+                        logger.debug(f"Conversacion {conv_pk}: {result['secuencia_macro']}")
+            for start in range(0, len(analyzed), chunk_convs):
+                write_chunk(analyzed[start:start + chunk_convs])
+        else:
+            logger.info(f"Procesando conversaciones de ejecucion_id={ejecucion_id} (chunks de {chunk_convs}, workers={workers})...")
+            pool = ProcessPoolExecutor(max_workers=workers) if workers > 1 else None
+            read_cursor = conn.cursor()
+            try:
+                pending = deque()
+                conversations = iter_conversations(read_cursor, ejecucion_id, TURNO_COLUMNS, include_empty=True)
+                for items in iter_conversation_chunks(conversations, chunk_convs):
+                    if pool is None:
+                        write_chunk(analyze_chunk(items, macro_map, verbose))
+                        continue
+                    pending.append(pool.submit(analyze_chunk, items, macro_map, verbose))
+                    # Hasta `workers` chunks en el pool; mientras tanto se escribe el más viejo (en orden)
+                    while len(pending) > workers:
+                        write_chunk(pending.popleft().result())
+                while pending:
+                    write_chunk(pending.popleft().result())
+            finally:
+                read_cursor.close()
+                if pool is not None:
+                    pool.shutdown()
+        
+        if stats['total'] == 0:
+            logger.warning("No hay conversaciones para procesar")
+            return {'total': 0, 'message': 'No hay conversaciones para procesar'}
         
         # Imprimir resumen
         print_summary(stats)
@@ -488,11 +547,15 @@ def main():
     parser.add_argument('--config', default='config.ini', help='Ruta al archivo de configuración')
     parser.add_argument('--ejecucion_id', type=int, required=True, help='ID de la ejecución a procesar')
     parser.add_argument('--verbose', action='store_true', help='Imprimir logs de debug detallados')
+    parser.add_argument('--engine', choices=ENGINES, default='numpy', help='numpy = métricas vectorizadas de toda la ejecución; python = por conversación')
+    parser.add_argument('--workers', type=int, default=0, help='Procesos para analizar conversaciones con --engine python (0 = en el proceso principal)')
+    parser.add_argument('--chunk_convs', type=int, default=CHUNK_CONVS, help='Conversaciones por chunk (upsert y commit)')
     
     args = parser.parse_args()
     
     try:
-        stats = run_build_secuencias(args.config, args.ejecucion_id, verbose=args.verbose)
+        stats = run_build_secuencias(args.config, args.ejecucion_id, verbose=args.verbose,
+                                     workers=args.workers, chunk_convs=args.chunk_convs, engine=args.engine)
         logger.info("Proceso completado exitosamente")
         logger.info(f"Estadísticas finales: {stats}")
     except Exception as e:
@@ -3,6 +3,7 @@ import argparse
 from datetime import date, datetime, timedelta
 
 from sa_core.config import load_config
+from sa_core.conv_stream import iter_conversations
 from sa_core.db import get_conn
 
 # -----------------------------
@@ -605,38 +606,17 @@ def main():
     conn = get_conn(cfg)
     ensure_table(conn)
 
-    cur = conn.cursor(dictionary=True)
-
-    q = """
-    SELECT c.conversacion_pk, c.conversacion_id, t.turno_pk, t.turno_idx, t.speaker, t.text, t.fase, t.fase_source
-    FROM sa_conversaciones c
-    JOIN sa_turnos t ON t.conversacion_pk = c.conversacion_pk
-    WHERE c.ejecucion_id = %s
-    ORDER BY c.conversacion_pk, t.turno_idx
-    """
-    params = [args.ejecucion_id]
-    if args.limit_convs > 0:
-        # limitar conversacion_pk con subquery
-        q = """
-        SELECT c.conversacion_pk, c.conversacion_id, t.turno_pk, t.turno_idx, t.speaker, t.text, t.fase, t.fase_source
-        FROM (
-            SELECT conversacion_pk, conversacion_id
-            FROM sa_conversaciones
-            WHERE ejecucion_id=%s
-            ORDER BY conversacion_pk
-            LIMIT %s
-        ) c
-        JOIN sa_turnos t ON t.conversacion_pk = c.conversacion_pk
-        ORDER BY c.conversacion_pk, t.turno_idx
-        """
-        params = [args.ejecucion_id, args.limit_convs]
+    cur = conn.cursor()
 
-    cur.execute(q, tuple(params))
+    # Turnos agrupados por conversación (keyset paginado); --limit_convs corta
+    # después de las primeras N conversaciones de la ejecución
+    conversations = iter_conversations(
+        cur, args.ejecucion_id, columns=("speaker", "text", "fase", "fase_source"),
+        conv_columns=("conversacion_id",), include_empty=True, limit_convs=args.limit_convs,
+    )
 
     # agrupar por conversación, recolectar candidatos
     promesas = []
-    last_conv = None
-    turns_buf = []
 
     def flush_conv(conv_pk, conv_id, turns):
         if not turns:
@@ -776,22 +756,8 @@ def main():
             "conversacion_id": conv_id,
         })
 
-    for r in cur:
-        conv_pk = r["conversacion_pk"]
-        conv_id = r["conversacion_id"]
-        if last_conv is None:
-            last_conv = conv_pk
-        if conv_pk != last_conv:
-            # flush
-            flush_conv(last_conv, last_conv_id, turns_buf)
-            turns_buf = []
-            last_conv = conv_pk
-        last_conv_id = conv_id
-        turns_buf.append(r)
-
-    # último
-    if last_conv is not None:
-        flush_conv(last_conv, last_conv_id, turns_buf)
+    for conv, turns in conversations:
+        flush_conv(conv.conversacion_pk, conv.conversacion_id, turns)
 
     cur.close()
 
@@ -1,15 +1,7 @@
-﻿import os
-import argparse
+﻿import argparse
 from sa_core.config import load_config
 from sa_core.db import get_conn
-from sa_core.ingest import ingest_dir
-
-def _iter_txt(input_dir, max_files):
-    files = [f for f in os.listdir(input_dir) if f.lower().endswith(".txt")]
-    files.sort()
-    if max_files and max_files > 0:
-        files = files[:max_files]
-    return files
+from sa_core.ingest import ingest_dir, ingest_dir_parallel, ingest_dir_incremental
 
 def main():
     ap = argparse.ArgumentParser()
@@ -17,30 +9,39 @@ def main():
     ap.add_argument("--input_dir", required=True)
     ap.add_argument("--max_files", type=int, default=0)
     ap.add_argument("--notas", default="")
+    ap.add_argument("--workers", type=int, default=0, help="Procesos lectores para ingesta paralela (0 = secuencial)")
+    ap.add_argument("--batch_size", type=int, default=200, help="Filas por INSERT multi-fila (modo paralelo)")
+    ap.add_argument("--commit_every", type=int, default=1000, help="Filas máximas por commit (chunk)")
+    ap.add_argument("--incremental", action="store_true", help="Saltar archivos sin cambios y vincular duplicados por hash")
+    ap.add_argument("--no_resume", action="store_true", help="Con --incremental: no reanudar una ejecución RUNNING previa")
     args = ap.parse_args()
 
     cfg = load_config(args.config)
     conn = get_conn(cfg)
 
-    # ingest_dir original recorre os.listdir(input_dir). Para limitar sin tocar sa_core,
-    # hacemos un "input_dir temporal" con symlinks/copias? No: más simple: ejecutamos
-    # ingest_dir si max_files==0, y si no, iteramos nosotros replicando el bucle.
-    # Como ingest_dir ya hace INSERT de ejecución + lectura + insert, lo más robusto
-    # acá es: si max_files==0 -> ingest_dir; si no -> llamarlo igual pero filtrando
-    # con un monkeypatch de os.listdir dentro del módulo.
-    if args.max_files and args.max_files > 0:
-        import sa_core.ingest as ingest_mod
-        real_listdir = os.listdir
-        allowed = _iter_txt(args.input_dir, args.max_files)
-        def _patched_listdir(_):
-            return allowed
-        ingest_mod.os.listdir = _patched_listdir
-        try:
-            ingest_dir(conn, args.input_dir, args.notas)
-        finally:
-            ingest_mod.os.listdir = real_listdir
-    else:
-        ingest_dir(conn, args.input_dir, args.notas)
+    if args.incremental:
+        ingest_dir_incremental(
+            conn, args.input_dir, args.notas,
+            workers=args.workers,
+            batch_size=args.batch_size,
+            commit_every=args.commit_every,
+            resume=not args.no_resume,
+        )
+        conn.close()
+        return
+
+    if args.workers and args.workers > 0:
+        ingest_dir_parallel(
+            conn, args.input_dir, args.notas,
+            workers=args.workers,
+            batch_size=args.batch_size,
+            commit_every=args.commit_every,
+            max_files=args.max_files,
+        )
+        conn.close()
+        return
+
+    ingest_dir(conn, args.input_dir, args.notas, max_files=args.max_files, commit_every=args.commit_every)
 
     conn.close()
 
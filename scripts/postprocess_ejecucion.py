@@ -4,15 +4,11 @@ import sys
 from contextlib import contextmanager
 
 from sa_core.config import load_config
-from sa_core.db import get_conn
+from sa_core.conv_stream import iter_conversations
+from sa_core.db import bulk_update_via_temp_table, get_conn
+from sa_core.fase_postprocess import PASSES, PostTurn, postprocess_conversation
 
-# Constantes para fase_source
-NOISE_IMPUTE_SOURCE = 'NO_IMP'
-APERTURA_IMPUTE_SOURCE = 'AP_IMP'
-APERTURA_BACKFILL_SOURCE = 'AP_BK'
-CIERRE_IMPUTE_SOURCE = 'CI_IMP'
-CIERRE_BACKFILL_SOURCE = 'CI_BK'
-CIERRE_FIX1_SOURCE = 'CI_FIX1'
+POSTPROCESS_COLUMNS = [("fase", "VARCHAR(32)"), ("fase_source", "VARCHAR(16)")]
 
 @contextmanager
 def transaction(conn, do_write=False):
@@ -36,151 +32,47 @@ def transaction(conn, do_write=False):
     finally:
         cur.close()
 
-def noise_impute_prev_next(cur, ejecucion_id, do_write, verbose):
-    """Imputa fases para turnos 'NOISE' desde el turno previo o siguiente."""
-    print("\n1) Imputing NOISE from previous/next turn...")
-    
-    # Imputar desde el turno previo
-    sql_prev = """
-    UPDATE sa_turnos t
-    JOIN sa_turnos t_prev ON t.conversacion_pk = t_prev.conversacion_pk AND t.turno_idx = t_prev.turno_idx + 1
-    JOIN sa_conversaciones c ON t.conversacion_pk = c.conversacion_pk
-    SET t.fase = t_prev.fase, t.fase_source = %s
-    WHERE c.ejecucion_id = %s
-      AND t.fase_source = 'NOISE' AND (t.fase IS NULL OR TRIM(t.fase) = '')
-      AND t_prev.fase IS NOT NULL AND TRIM(t_prev.fase) <> ''
-    """
-    params = (NOISE_IMPUTE_SOURCE, ejecucion_id)
-    cur.execute(sql_prev, params)
-    count_prev = cur.rowcount or 0
-    print(f"  - Imputed from previous turn: {count_prev} rows")
+def iter_run_conversations(cur, ejecucion_id):
+    """(conversacion_pk, [PostTurn, ...]) por conversación de la ejecución (iter_conversations)."""
+    for conv, turns in iter_conversations(cur, ejecucion_id, columns=("fase", "fase_source")):
+        yield conv.conversacion_pk, [PostTurn(t.turno_pk, t.turno_idx, t.fase, t.fase_source) for t in turns]
 
-    # Imputar desde el turno siguiente
-    sql_next = """
-    UPDATE sa_turnos t
-    JOIN sa_turnos t_next ON t.conversacion_pk = t_next.conversacion_pk AND t.turno_idx = t_next.turno_idx - 1
-    JOIN sa_conversaciones c ON t.conversacion_pk = c.conversacion_pk
-    SET t.fase = t_next.fase, t.fase_source = %s
-    WHERE c.ejecucion_id = %s
-      AND t.fase_source = 'NOISE' AND (t.fase IS NULL OR TRIM(t.fase) = '')
-      AND t_next.fase IS NOT NULL AND TRIM(t_next.fase) <> ''
+def correction_passes(cur, ejecucion_id, do_write, verbose):
     """
-    params = (NOISE_IMPUTE_SOURCE, ejecucion_id)
-    cur.execute(sql_next, params)
-    count_next = cur.rowcount or 0
-    print(f"  - Imputed from next turn: {count_next} rows")
-    return count_prev + count_next
-
-def apertura_midcall_impute_prev(cur, ejecucion_id, do_write, verbose):
-    """Corrige 'APERTURA' en mitad de llamada copiando la fase previa."""
-    print("\n2) Correcting mid-call APERTURA from previous turn...")
-    sql = """
-    UPDATE sa_turnos t
-    JOIN sa_turnos t_prev ON t.conversacion_pk = t_prev.conversacion_pk AND t.turno_idx = t_prev.turno_idx + 1
-    JOIN sa_conversaciones c ON t.conversacion_pk = c.conversacion_pk
-    SET t.fase = t_prev.fase, t.fase_source = %s
-    WHERE c.ejecucion_id = %s
-      AND t.fase = 'APERTURA' AND t.turno_idx > 2
-      AND t_prev.fase IS NOT NULL AND TRIM(t_prev.fase) <> '' AND t_prev.fase <> 'APERTURA'
+    Pasadas 1-6 (NOISE, APERTURA y CIERRE en mitad de llamada, CIERRE en turno 1)
+    calculadas en memoria por conversación (sa_core.fase_postprocess) y escritas
+    con un único UPDATE ... JOIN sobre tabla temporal.
     """
-    params = (APERTURA_IMPUTE_SOURCE, ejecucion_id)
-    cur.execute(sql, params)
-    count = cur.rowcount or 0
-    print(f"  - Corrected mid-call APERTURA: {count} rows")
-    return count
-
-def apertura_midcall_backfill_when_has_next(cur, ejecucion_id, do_write, verbose):
-    """Busca hacia atrás una fase válida para 'APERTURA' en mitad de llamada."""
+    print("\n1-6) Computing correction passes (one ordered pass per conversation)...")
+    counters = dict.fromkeys(PASSES, 0)
+    patch = []
+    n_convs = 0
+    for _conv_pk, turns in iter_run_conversations(cur, ejecucion_id):
+        patch.extend(postprocess_conversation(turns, counters))
+        n_convs += 1
+
+    print(f"  - Conversations scanned: {n_convs}")
+    print("\n1) Imputing NOISE from previous/next turn...")
+    print(f"  - Imputed from previous turn: {counters['noise_prev']} rows")
+    print(f"  - Imputed from next turn: {counters['noise_next']} rows")
+    print("\n2) Correcting mid-call APERTURA from previous turn...")
+    print(f"  - Corrected mid-call APERTURA: {counters['apertura_impute']} rows")
     print("\n3) Backfilling mid-call APERTURA from nearest valid past turn...")
-    sql = """
-    UPDATE sa_turnos t
-    JOIN sa_turnos t_next ON t.conversacion_pk = t_next.conversacion_pk AND t.turno_idx = t_next.turno_idx - 1
-    JOIN sa_conversaciones c ON t.conversacion_pk = c.conversacion_pk
-    JOIN (
-        SELECT t_sub.turno_pk, 
-               (SELECT t_past.fase 
-                FROM sa_turnos t_past
-                WHERE t_past.conversacion_pk = t_sub.conversacion_pk AND t_past.turno_idx < t_sub.turno_idx
-                  AND t_past.fase IS NOT NULL AND TRIM(t_past.fase) <> '' AND t_past.fase <> 'APERTURA'
-                ORDER BY t_past.turno_idx DESC 
-                LIMIT 1) as prev_fase
-        FROM sa_turnos t_sub
-    ) as prev_data ON t.turno_pk = prev_data.turno_pk
-    SET t.fase = prev_data.prev_fase, t.fase_source = %s
-    WHERE c.ejecucion_id = %s
-      AND t.fase = 'APERTURA'
-      AND prev_data.prev_fase IS NOT NULL
-    """
-    params = (APERTURA_BACKFILL_SOURCE, ejecucion_id)
-    cur.execute(sql, params)
-    count = cur.rowcount or 0
-    print(f"  - Backfilled mid-call APERTURA: {count} rows")
-    return count
-
-def cierre_midcall_impute_prev_when_has_next(cur, ejecucion_id, do_write, verbose):
-    """Corrige 'CIERRE' en mitad de llamada si tiene turno siguiente."""
+    print(f"  - Backfilled mid-call APERTURA: {counters['apertura_backfill']} rows")
     print("\n4) Correcting mid-call CIERRE from previous turn...")
-    sql = """
-    UPDATE sa_turnos t
-    JOIN sa_turnos t_prev ON t.conversacion_pk = t_prev.conversacion_pk AND t.turno_idx = t_prev.turno_idx + 1
-    JOIN sa_turnos t_next ON t.conversacion_pk = t_next.conversacion_pk AND t.turno_idx = t_next.turno_idx - 1
-    JOIN sa_conversaciones c ON t.conversacion_pk = c.conversacion_pk
-    SET t.fase = t_prev.fase, t.fase_source = %s
-    WHERE c.ejecucion_id = %s
-      AND t.fase = 'CIERRE'
-      AND t_prev.fase IS NOT NULL AND TRIM(t_prev.fase) <> '' AND t_prev.fase <> 'CIERRE'
-    """
-    params = (CIERRE_IMPUTE_SOURCE, ejecucion_id)
-    cur.execute(sql, params)
-    count = cur.rowcount or 0
-    print(f"  - Corrected mid-call CIERRE: {count} rows")
-    return count
-
-def cierre_backfill_when_has_next(cur, ejecucion_id, do_write, verbose):
-    """Busca hacia atrás una fase válida para 'CIERRE' en mitad de llamada."""
+    print(f"  - Corrected mid-call CIERRE: {counters['cierre_impute']} rows")
     print("\n5) Backfilling mid-call CIERRE from nearest valid past turn...")
-    sql = """
-    UPDATE sa_turnos t
-    JOIN sa_turnos t_next ON t.conversacion_pk = t_next.conversacion_pk AND t.turno_idx = t_next.turno_idx - 1
-    JOIN sa_conversaciones c ON t.conversacion_pk = c.conversacion_pk
-    JOIN (
-        SELECT t_sub.turno_pk, 
-               (SELECT t_past.fase 
-                FROM sa_turnos t_past
-                WHERE t_past.conversacion_pk = t_sub.conversacion_pk AND t_past.turno_idx < t_sub.turno_idx
-                  AND t_past.fase IS NOT NULL AND TRIM(t_past.fase) <> '' AND t_past.fase <> 'CIERRE'
-                ORDER BY t_past.turno_idx DESC 
-                LIMIT 1) as prev_fase
-        FROM sa_turnos t_sub
-    ) as prev_data ON t.turno_pk = prev_data.turno_pk
-    SET t.fase = prev_data.prev_fase, t.fase_source = %s
-    WHERE c.ejecucion_id = %s
-      AND t.fase = 'CIERRE'
-      AND prev_data.prev_fase IS NOT NULL
-    """
-    params = (CIERRE_BACKFILL_SOURCE, ejecucion_id)
-    cur.execute(sql, params)
-    count = cur.rowcount or 0
-    print(f"  - Backfilled mid-call CIERRE: {count} rows")
-    return count
-
-def fix_turno1_cierre(cur, ejecucion_id, do_write, verbose):
-    """Corrige 'CIERRE' en turno 1 si el turno 2 tiene fase válida."""
+    print(f"  - Backfilled mid-call CIERRE: {counters['cierre_backfill']} rows")
     print("\n6) Fixing CIERRE at turn 1...")
-    sql = """
-    UPDATE sa_turnos t
-    JOIN sa_turnos t2 ON t.conversacion_pk = t2.conversacion_pk AND t2.turno_idx = 2
-    JOIN sa_conversaciones c ON t.conversacion_pk = c.conversacion_pk
-    SET t.fase = t2.fase, t.fase_source = %s
-    WHERE c.ejecucion_id = %s
-      AND t.turno_idx = 1 AND t.fase = 'CIERRE'
-      AND t2.fase IS NOT NULL AND TRIM(t2.fase) <> ''
-    """
-    params = (CIERRE_FIX1_SOURCE, ejecucion_id)
-    cur.execute(sql, params)
-    count = cur.rowcount or 0
-    print(f"  - Fixed CIERRE at turn 1: {count} rows")
-    return count
+    print(f"  - Fixed CIERRE at turn 1: {counters['turno1_cierre']} rows")
+
+    # En dry-run también se aplica (y luego rollback) para que las métricas muestren el estado potencial
+    written = bulk_update_via_temp_table(cur, "sa_turnos", "turno_pk", POSTPROCESS_COLUMNS, patch)
+    print(f"\n  - Patch applied in one batched write: {len(patch)} turns ({written} rows changed)")
+    if verbose:
+        for turno_pk, fase, fase_source in patch[:20]:
+            print(f"    - turno_pk={turno_pk} -> fase={fase} fase_source={fase_source}")
+    return sum(counters.values())
 
 def ensure_and_update_fase_8(cur, ejecucion_id, mapeo_version, do_write, verbose):
     """Asegura que la columna fase_8 exista y la actualiza."""
@@ -335,12 +227,7 @@ def main():
 
     try:
         with transaction(conn, args.write) as cur:
-            total_updated += noise_impute_prev_next(cur, args.ejecucion_id, args.write, args.verbose)
-            total_updated += apertura_midcall_impute_prev(cur, args.ejecucion_id, args.write, args.verbose)
-            total_updated += apertura_midcall_backfill_when_has_next(cur, args.ejecucion_id, args.write, args.verbose)
-            total_updated += cierre_midcall_impute_prev_when_has_next(cur, args.ejecucion_id, args.write, args.verbose)
-            total_updated += cierre_backfill_when_has_next(cur, args.ejecucion_id, args.write, args.verbose)
-            total_updated += fix_turno1_cierre(cur, args.ejecucion_id, args.write, args.verbose)
+            total_updated += correction_passes(cur, args.ejecucion_id, args.write, args.verbose)
             total_updated += ensure_and_update_fase_8(cur, args.ejecucion_id, args.mapeo_version, args.write, args.verbose)
             
             # Las métricas se muestran siempre, incluso en dry-run, sobre el estado potencial
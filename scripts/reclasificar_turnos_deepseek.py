@@ -1,10 +1,42 @@
-﻿import os, csv, json, time, argparse, re, unicodedata
-from pathlib import Path
-import requests
+﻿import os, csv, json, argparse, re
 
 from sa_core.config import load_config
+from sa_core.conv_index import ConversationIndex, PREFETCH_CHUNK, T_FASE, T_SPEAKER
 from sa_core.db import get_conn
 from sa_core.fase_guardrails import apply_guardrails
+from sa_core.fase_triage import TRIAGE_MIN_MARGIN, TRIAGE_SOURCE, format_triage, triage_turn
+from sa_core.llm_cache import (
+    DEFAULT_CACHE_PATH,
+    DEFAULT_MAX_ENTRIES,
+    DEFAULT_TTL_DAYS,
+    CacheMiss,
+    LLMCache,
+    prompt_fingerprint,
+)
+from sa_core.llm_jobs import JOB_CHUNK, PENDING_SIN_FUENTE, STATUS_DONE, STATUS_FAILED, STATUS_PAUSED, LLMJob
+from sa_core.llm_backends import BACKENDS, chat_completions_url, make_backend
+from sa_core.llm_client import (
+    DEFAULT_CONCURRENCY,
+    DEFAULT_RATE_PER_SEC,
+    LLMClient,
+)
+from sa_core.llm_telemetry import (
+    DEFAULT_PRICE_IN_PER_MTOK,
+    DEFAULT_PRICE_OUT_PER_MTOK,
+    FLUSH_EVERY as TELEMETRY_FLUSH_EVERY,
+    LLMTelemetry,
+    ensure_llm_calls_table,
+)
+from sa_core.normalizacion import strip_diacritics, format_cache_stats
+from sa_core.prompt_builder import (
+    DEFAULT_SYSTEM_MSG,
+    build_context_block,
+    format_stats as format_prompt_stats,
+    load_template,
+    render_prompts,
+    reset_stats as reset_prompt_stats,
+)
+from sa_core.turn_writer import FLUSH_EVERY, GUARD_PENDIENTE, GUARD_RECLASIFICABLE, TurnWriteBuffer
 
 # Old phases set (legacy)
 OLD_PHASES = {
@@ -19,17 +51,15 @@ OLD_PHASES = {
 }
 
 JSON_RE = re.compile(r"\{.*\}", re.S)
+JSON_ARRAY_RE = re.compile(r"\[.*\]", re.S)
 FILLER_RE = re.compile(r"^(si|sí|ok|okay|ya|aj[aá]|mm+|eh+|gracias|dale|listo|perfecto)\W*$", re.I)
 
 def _chat_completions_url(base_url: str) -> str:
-    b = (base_url or "").rstrip("/")
-    if b.endswith("/v1"):
-        return b + "/chat/completions"
-    return b + "/v1/chat/completions"
+    return chat_completions_url(base_url)
 
 def _strip_diacritics(s: str) -> str:
-    nf = unicodedata.normalize('NFD', s)
-    return ''.join(ch for ch in nf if not unicodedata.combining(ch))
+    # Caché compartida (sa_core.normalizacion): los mismos acks cortos se repiten mucho
+    return strip_diacritics(s)
 
 def _normalize_phase_id(s: str) -> str:
     s = _strip_diacritics(s or '').strip().lower()
@@ -47,125 +77,113 @@ def _normalize_phase_id(s: str) -> str:
     norm = ''.join(out).strip('_').upper()
     return norm
 
-def _load_prompt_template():
+PROMPT_FILE = "prompts/deepseek_prompt.txt"
+
+# Templates por defecto si no existe el archivo. Todo lo fijo va antes de
+# {last_phase_info}: es el prefijo que se repite idéntico en cada llamada.
+DEFAULT_USER_TEMPLATE = (
+    "Fases permitidas: {phases_list}\n\n"
+    "Reglas estrictas de salida:\n"
+    "- Devuelve SOLO JSON exacto: {{\"fase_id\": \"...\", \"confidence\": 0.xx, \"is_noise\": true|false}}.\n"
+    "- Si 'is_noise' es true => 'fase_id' debe ser null.\n"
+    "- Si 'is_noise' es false => 'fase_id' debe ser EXACTAMENTE una de las fases permitidas.\n"
+    "- PROHIBIDO devolver fases viejas/legacy.\n"
+    "- Confidence en rango 0..1.\n\n"
+    "Salida EXACTA JSON: {{\"fase_id\": \"OFERTA_PAGO\", \"confidence\": 0.82, \"is_noise\": false}}\n\n"
+    "Estado previo: {last_phase_info}\n"
+    "Contexto:\n{context_block}"
+)
+
+def _load_prompt_template(prompt_path: str = PROMPT_FILE):
     """
-    Carga el prompt desde prompts/deepseek_prompt.txt.
+    Carga el prompt desde prompts/deepseek_prompt.txt (o prompt_path).
     Retorna (system_msg_template, user_msg_template) o None si no existe.
+    El archivo se lee una vez y se relee solo si cambia (sa_core.prompt_builder).
     """
-    prompt_file = Path("prompts/deepseek_prompt.txt")
-    if not prompt_file.exists():
-        return None
-    
     try:
-        content = prompt_file.read_text(encoding="utf-8")
-        
-        # Parsear formato: SYSTEM_MESSAGE: ... USER_MESSAGE_TEMPLATE: ...
-        system_msg = ""
-        user_msg = ""
-        
-        if "SYSTEM_MESSAGE:" in content and "USER_MESSAGE_TEMPLATE:" in content:
-            parts = content.split("USER_MESSAGE_TEMPLATE:")
-            system_part = parts[0].replace("SYSTEM_MESSAGE:", "").strip()
-            user_part = parts[1].strip()
-            system_msg = system_part
-            user_msg = user_part
-        else:
-            # Fallback: usar todo como user message
-            user_msg = content.strip()
-        
-        return system_msg, user_msg
+        return load_template(prompt_path)
     except Exception as e:
         print(f"[WARN] Error cargando prompt desde archivo: {e}")
         return None
 
 def _build_llm_prompts(context_block: str, last_phase_info: str, allowed_phases: list[str]) -> tuple[str, str]:
-    phases_list = ", ".join(allowed_phases)
-    
-    # Intentar cargar desde archivo
-    template = _load_prompt_template()
-    
-    if template:
-        system_template, user_template = template
-        
-        # Si system_template está vacío, usar default
-        if not system_template:
-            system_msg = "Eres un clasificador de fases de cobranzas. Devuelve SOLO JSON válido y estricto, sin texto adicional."
-        else:
-            system_msg = system_template
-        
-        # Reemplazar placeholders en user_template
-        user_msg = user_template.format(
-            phases_list=phases_list,
-            last_phase_info=last_phase_info,
-            context_block=context_block
-        )
-    else:
-        # FALLBACK: Prompt hardcodeado (comportamiento original)
-        rules = (
-            "Reglas estrictas de salida:\n"
-            "- Devuelve SOLO JSON exacto: {\"fase_id\": \"...\", \"confidence\": 0.xx, \"is_noise\": true|false}.\n"
-            "- Si 'is_noise' es true => 'fase_id' debe ser null.\n"
-            "- Si 'is_noise' es false => 'fase_id' debe ser EXACTAMENTE una de las fases permitidas.\n"
-            "- PROHIBIDO devolver fases viejas/legacy.\n"
-            "- Confidence en rango 0..1.\n"
-        )
-        system_msg = "Eres un clasificador de fases de cobranzas. Devuelve SOLO JSON válido y estricto, sin texto adicional."
-        user_msg = (
-            f"Fases permitidas: {phases_list}\n\n"
-            f"{rules}\n"
-            f"Estado previo: {last_phase_info}\n"
-            f"Contexto:\n{context_block}\n\n"
-            "Salida EXACTA JSON: {\"fase_id\": \"OFERTA_PAGO\", \"confidence\": 0.82, \"is_noise\": false}"
-        )
-    
-    return system_msg, user_msg
+    template = _load_prompt_template() or (DEFAULT_SYSTEM_MSG, DEFAULT_USER_TEMPLATE)
+    return render_prompts(
+        template,
+        {"phases_list": ", ".join(allowed_phases)},
+        {"last_phase_info": last_phase_info, "context_block": context_block},
+    )
 
-def call_deepseek(text: str, prev_fase: str|None, next_fase: str|None, turn_idx: int, total_turns: int,
-                 base_url: str, api_key: str, model: str, timeout: int = 60, context_block: str | None = None,
-                 last_phase_info: str = "last_phase=None conf=None source=None", allowed_phases: list[str] | None = None) -> dict:
-    url = _chat_completions_url(base_url)
-    if context_block is None:
-        # si no hay bloque de contexto, armar uno mínimo con el texto objetivo
-        _san = text[:280].replace('\r', ' ').replace('\n', ' ')
-        context_block = (
-            f"Turno idx=-2: (no disponible)\n"
-            f"Turno idx=-1: (no disponible)\n"
-            f"Turno idx=0 (OBJETIVO): {_san}\n"
-            f"Turno idx=+1: (no disponible)"
-        )
+BATCH_PROMPT_FILE = "prompts/deepseek_batch_prompt.txt"
 
-    sys, usr = _build_llm_prompts(context_block, last_phase_info, allowed_phases or [])
+# Turnos OBJETIVO más separados que esto van en ventanas distintas (el bloque de
+# contexto cubre todo el rango entre el primero y el último)
+BATCH_MAX_GAP = 4
 
-    payload = {
-        "model": model,
-        "messages": [
-            {"role": "system", "content": sys},
-            {"role": "user", "content": usr}
-        ],
-        "temperature": 0.0,
-    }
+def _split_windows(rows: list[dict], max_turns: int, max_gap: int = BATCH_MAX_GAP) -> list[list[dict]]:
+    """Parte los candidatos de una conversación (ordenados por turno_idx) en ventanas."""
+    windows = []
+    for row in rows:
+        if (windows and len(windows[-1]) < max_turns
+                and int(row["turno_idx"]) - int(windows[-1][-1]["turno_idx"]) <= max_gap):
+            windows[-1].append(row)
+        else:
+            windows.append([row])
+    return windows
 
-    if not api_key:
-        raise ValueError("api_key for DeepSeek cannot be empty")
+DEFAULT_BATCH_USER_TEMPLATE = (
+    "Fases permitidas: {phases_list}\n\n"
+    "Reglas estrictas de salida:\n"
+    "- Devuelve SOLO un array JSON con un objeto por turno OBJETIVO: "
+    "[{{\"turno_idx\": N, \"fase_id\": \"...\", \"confidence\": 0.xx, \"is_noise\": true|false}}].\n"
+    "- 'turno_idx' es el idx del turno tal como aparece en el contexto.\n"
+    "- Si 'is_noise' es true => 'fase_id' debe ser null.\n"
+    "- Si 'is_noise' es false => 'fase_id' debe ser EXACTAMENTE una de las fases permitidas.\n"
+    "- PROHIBIDO devolver fases viejas/legacy.\n"
+    "- Confidence en rango 0..1.\n\n"
+    "Salida EXACTA JSON: [{{\"turno_idx\": 12, \"fase_id\": \"OFERTA_PAGO\", \"confidence\": 0.82, \"is_noise\": false}}]\n\n"
+    "Estado previo (antes del primer turno OBJETIVO): {last_phase_info}\n"
+    "Turnos OBJETIVO a clasificar: {target_idxs}\n"
+    "Contexto:\n{context_block}"
+)
 
-    if not api_key:
-        raise ValueError("api_key for DeepSeek cannot be empty")
+def _build_batch_prompts(context_block: str, last_phase_info: str, allowed_phases: list[str],
+                         target_idxs: list[int]) -> tuple[str, str]:
+    """Prompt multi-turno: una sola llamada clasifica todos los turnos OBJETIVO del bloque."""
+    template = _load_prompt_template(BATCH_PROMPT_FILE) or (DEFAULT_SYSTEM_MSG, DEFAULT_BATCH_USER_TEMPLATE)
+    return render_prompts(
+        template,
+        {"phases_list": ", ".join(allowed_phases)},
+        {
+            "last_phase_info": last_phase_info,
+            "context_block": context_block,
+            "target_idxs": ", ".join(str(i) for i in target_idxs),
+        },
+    )
+
+_default_clients = {}
 
-    headers = {
-        "Authorization": f"Bearer {api_key}",
-        "Content-Type": "application/json",
-    }
 
-    r = requests.post(url, headers=headers, json=payload, timeout=timeout)
-    r.raise_for_status()
-    data = r.json()
+def _get_default_client(base_url: str, api_key: str, model: str, timeout) -> LLMClient:
+    """Cliente compartido por (base_url, api_key, model, timeout) para llamadas sueltas: reutiliza la sesión."""
+    key = (base_url, api_key, model, timeout)
+    client = _default_clients.get(key)
+    if client is None:
+        client = LLMClient(base_url, api_key, model, timeout=timeout)
+        _default_clients[key] = client
+    return client
 
-    content = data["choices"][0]["message"]["content"]
+
+def parse_deepseek_content(content: str) -> dict:
+    """Extrae {fase, conf, is_noise, ...} del content devuelto por el LLM."""
     m = JSON_RE.search(content)
     if not m:
         raise ValueError(f"No JSON found in response content: {content[:200]}")
     obj = json.loads(m.group(0))
+    return _result_from_obj(obj, content)
+
 
+def _result_from_obj(obj: dict, content: str) -> dict:
     raw_fase = (obj.get("fase_id") or obj.get("fase") or "").strip()
     fase = _normalize_phase_id(raw_fase)
     conf = obj.get("confidence", obj.get("conf", 0.0))
@@ -186,6 +204,144 @@ def call_deepseek(text: str, prev_fase: str|None, next_fase: str|None, turn_idx:
     conf = max(0.0, min(1.0, conf))
     return {"fase": fase, "conf": conf, "raw": content, "is_noise": is_noise, "noise_reason": noise_reason, "rationale": rationale}
 
+
+def call_deepseek(text: str, prev_fase: str|None, next_fase: str|None, turn_idx: int, total_turns: int,
+                 base_url: str, api_key: str, model: str, timeout: int = 60, context_block: str | None = None,
+                 last_phase_info: str = "last_phase=None conf=None source=None", allowed_phases: list[str] | None = None,
+                 client: LLMClient | None = None, cache: LLMCache | None = None) -> dict:
+    """
+    Clasifica un turno con el LLM. Con `client` usa ese LLMClient (sesión, rate limit
+    y reintentos compartidos); sin él, un cliente por defecto reutilizado entre llamadas.
+    Con `cache`, un prompt idéntico a uno ya respondido no llama a la API (en modo
+    cache_only un miss levanta CacheMiss).
+    Thread-safe: se puede llamar desde el pool de LLMClient.map_*.
+    """
+    if context_block is None:
+        # si no hay bloque de contexto, armar uno mínimo con el texto objetivo
+        _san = text[:280].replace('\r', ' ').replace('\n', ' ')
+        context_block = (
+            f"Turno idx=-2: (no disponible)\n"
+            f"Turno idx=-1: (no disponible)\n"
+            f"Turno idx=0 (OBJETIVO): {_san}\n"
+            f"Turno idx=+1: (no disponible)"
+        )
+
+    sys, usr = _build_llm_prompts(context_block, last_phase_info, allowed_phases or [])
+    messages = [
+        {"role": "system", "content": sys},
+        {"role": "user", "content": usr}
+    ]
+
+    cache_key = None
+    if cache is not None:
+        cache_key = prompt_fingerprint(client.model if client is not None else model, messages, 0.0)
+        hit = cache.get(cache_key)
+        if hit is not None:
+            return hit
+        if cache.cache_only:
+            raise CacheMiss(f"cache miss (cache_only) key={cache_key[:12]}")
+
+    if client is None:
+        if not api_key:
+            raise ValueError("api_key for DeepSeek cannot be empty")
+        client = _get_default_client(base_url, api_key, model, timeout)
+
+    content = client.chat(messages, temperature=0.0)
+    result = parse_deepseek_content(content)
+    if cache is not None:
+        cache.put(cache_key, client.model, result)
+    return result
+
+def parse_deepseek_batch_content(content: str, target_idxs: list[int]) -> dict[int, dict]:
+    """
+    Valida el array JSON de la respuesta multi-turno. Devuelve {turno_idx: resultado}
+    solo con los objetos válidos cuyo turno_idx es uno de los pedidos (sin duplicados).
+    Levanta ValueError si no hay un array JSON parseable.
+    """
+    m = JSON_ARRAY_RE.search(content)
+    if not m:
+        raise ValueError(f"No JSON array found in response content: {content[:200]}")
+    arr = json.loads(m.group(0))
+    if not isinstance(arr, list):
+        raise ValueError("Batch response is not a JSON array")
+    wanted = set(target_idxs)
+    out = {}
+    for obj in arr:
+        if not isinstance(obj, dict):
+            continue
+        try:
+            idx = int(obj.get("turno_idx"))
+        except (TypeError, ValueError):
+            continue
+        if idx not in wanted or idx in out:
+            continue
+        out[idx] = _result_from_obj(obj, json.dumps(obj, ensure_ascii=False))
+    return out
+
+
+def call_deepseek_batch(targets: list[dict], context_block: str, last_phase_info: str,
+                        base_url: str, api_key: str, model: str, timeout: int = 60,
+                        allowed_phases: list[str] | None = None,
+                        client: LLMClient | None = None, cache: LLMCache | None = None) -> tuple[dict, int]:
+    """
+    Clasifica varios turnos de una conversación en una sola llamada.
+
+    Args:
+        targets: un dict por turno con los kwargs de call_deepseek (text, prev_fase,
+            next_fase, turn_idx, total_turns, context_block, last_phase_info); se usan
+            para el fallback de a un turno.
+        context_block: bloque de contexto con todos los turnos OBJETIVO marcados
+
+    Returns:
+        ({turn_idx: resultado o excepción}, cantidad de turnos resueltos por fallback).
+        Los turnos que faltan o vienen mal en el array se piden de a uno con call_deepseek.
+    """
+    target_idxs = [t["turn_idx"] for t in targets]
+    sys_msg, usr = _build_batch_prompts(context_block, last_phase_info, allowed_phases or [], target_idxs)
+    messages = [
+        {"role": "system", "content": sys_msg},
+        {"role": "user", "content": usr}
+    ]
+
+    results = None
+    cache_key = None
+    if cache is not None:
+        cache_key = prompt_fingerprint(client.model if client is not None else model, messages, 0.0)
+        hit = cache.get(cache_key)
+        if hit is not None:
+            results = {int(k): v for k, v in hit.items()}
+
+    if results is None and not (cache is not None and cache.cache_only):
+        if client is None:
+            if not api_key:
+                raise ValueError("api_key for DeepSeek cannot be empty")
+            client = _get_default_client(base_url, api_key, model, timeout)
+        try:
+            content = client.chat(messages, temperature=0.0)
+            results = parse_deepseek_batch_content(content, target_idxs)
+        except (ValueError, KeyError, IndexError, TypeError):
+            # Respuesta mal formada: todo el lote va por el fallback
+            results = {}
+        if cache is not None and results:
+            cache.put(cache_key, client.model, results)
+
+    out = dict(results or {})
+    n_fallback = 0
+    for t in targets:
+        if t["turn_idx"] in out:
+            continue
+        n_fallback += 1
+        if client is not None and client.telemetry is not None:
+            client.telemetry.bind(n_turnos=1)
+        try:
+            out[t["turn_idx"]] = call_deepseek(
+                base_url=base_url, api_key=api_key, model=model, timeout=timeout,
+                allowed_phases=allowed_phases, client=client, cache=cache, **t
+            )
+        except Exception as e:
+            out[t["turn_idx"]] = e
+    return out, n_fallback
+
 def load_allowed_phases(conn) -> list[str]:
     cur = conn.cursor()
     cur.execute("SELECT fase_id FROM fases_conversacion")
@@ -253,50 +409,11 @@ def normalize_fase(fase_raw: str | None, text: str, allowed_set: set[str], old_s
     # Unknown phase -> invalid
     return None
 
-def update_conversation_final_fields(cur, conv_pks):
+def main(argv=None, conn=None):
     """
-    Recalcula fase_final, fase_final_turn_idx y tipo_finalizacion para cada conversacion.
-    Marca llm_usado=1.
+    CLI. Devuelve un resumen de la corrida. conn: conexión ya abierta en lugar de
+    la de --config (scripts/bench_llm_pipeline.py la instrumenta); se cierra al final.
     """
-    for conv_pk in sorted(conv_pks):
-        cur.execute(
-            """
-            SELECT turno_idx, fase
-            FROM sa_turnos
-            WHERE conversacion_pk=%s AND fase IS NOT NULL AND TRIM(fase)<>''
-            ORDER BY turno_idx DESC
-            LIMIT 1
-            """,
-            (conv_pk,)
-        )
-        row = cur.fetchone()
-        if row:
-            turno_idx, fase = int(row[0]), (row[1] or '').strip()
-            fase_final = fase
-            fase_final_turn_idx = turno_idx
-            tipo_finalizacion = 'CIERRE' if fase_final == 'CIERRE' else 'CORTE'
-        else:
-            fase_final = None
-            fase_final_turn_idx = None
-            tipo_finalizacion = 'CORTE'
-
-        cur.execute(
-            "UPDATE sa_conversaciones SET fase_final=%s, fase_final_turn_idx=%s, tipo_finalizacion=%s, llm_usado=1 WHERE conversacion_pk=%s",
-            (fase_final, fase_final_turn_idx, tipo_finalizacion, conv_pk)
-        )
-
-def get_total_turnos_conv(conn, conv_pk, cache):
-    """Devuelve el total de turnos de una conversación, con caché para evitar múltiples SELECTs."""
-    if conv_pk in cache:
-        return cache[conv_pk]
-    cur = conn.cursor()
-    cur.execute("SELECT COUNT(*) FROM sa_turnos WHERE conversacion_pk=%s", (conv_pk,))
-    n = cur.fetchone()[0] or 0
-    cur.close()
-    cache[conv_pk] = int(n)
-    return cache[conv_pk]
-
-def main():
     ap = argparse.ArgumentParser()
     ap.add_argument("--ejecucion_id", type=int, required=True)
     ap.add_argument("--csv", default=None)
@@ -307,9 +424,45 @@ def main():
     ap.add_argument("--dry_run", action="store_true", default=False)  # store_true -> False por defecto
     ap.add_argument("--write", action="store_true", help="si lo pones, escribe en DB")
     ap.add_argument("--mapeo_version", default="v1.0", help="versión del mapeo fase_mapeo_oficial")
-    args = ap.parse_args()
+    ap.add_argument("--concurrency", type=int, default=DEFAULT_CONCURRENCY, help="Llamadas simultáneas al LLM")
+    ap.add_argument("--rate_per_sec", type=float, default=DEFAULT_RATE_PER_SEC, help="Máximo de llamadas/seg (0 = sin límite)")
+    ap.add_argument("--max_retries", type=int, default=5, help="Reintentos ante 429/5xx/errores de red")
+    ap.add_argument("--timeout", type=float, default=60)
+    ap.add_argument("--backend", choices=BACKENDS, default="http",
+                    help="http = API (DEEPSEEK_BASE_URL, o un MockLLMServer local); rules = motor de reglas en proceso, sin API key")
+    ap.add_argument("--batch_turns", type=int, default=1,
+                    help="Turnos pendientes por llamada (misma conversación). 1 = una llamada por turno")
+    ap.add_argument("--batch_max_gap", type=int, default=BATCH_MAX_GAP,
+                    help="Máxima distancia en turno_idx entre turnos de una misma ventana")
+    ap.add_argument("--cache_path", default=DEFAULT_CACHE_PATH, help="Caché SQLite de respuestas del LLM")
+    ap.add_argument("--no_cache", action="store_true", help="No leer ni escribir la caché de respuestas")
+    ap.add_argument("--cache_only", action="store_true", help="Solo respuestas cacheadas: nunca llama a la API")
+    ap.add_argument("--cache_ttl_days", type=float, default=DEFAULT_TTL_DAYS, help="0 = sin vencimiento")
+    ap.add_argument("--cache_max_entries", type=int, default=DEFAULT_MAX_ENTRIES)
+    ap.add_argument("--flush_every", type=int, default=FLUSH_EVERY,
+                    help="Turnos escritos por flush (UPDATE masivo + recálculo de conversaciones + commit)")
+    ap.add_argument("--token_budget", type=int, default=0,
+                    help="Tope de tokens (entrada+salida) de la corrida; al alcanzarlo no se despachan más llamadas (0 = sin tope)")
+    ap.add_argument("--cost_budget", type=float, default=0.0, help="Tope de costo en USD de la corrida (0 = sin tope)")
+    ap.add_argument("--price_in_per_mtok", type=float, default=DEFAULT_PRICE_IN_PER_MTOK, help="USD por millón de tokens de entrada")
+    ap.add_argument("--price_out_per_mtok", type=float, default=DEFAULT_PRICE_OUT_PER_MTOK, help="USD por millón de tokens de salida")
+    ap.add_argument("--job_chunk", type=int, default=JOB_CHUNK,
+                    help="Con --from_db --write: turnos pendientes reclamados por chunk (keyset por turno_pk) del job sa_llm_jobs")
+    ap.add_argument("--new_job", action="store_true",
+                    help="No retomar el job interrumpido de esta ejecución: empezar uno nuevo desde el principio")
+    ap.add_argument("--no_triage", action="store_true",
+                    help="Mandar al LLM todos los pendientes (sin resolver localmente los casos de alta certeza)")
+    ap.add_argument("--triage_min_margin", type=int, default=TRIAGE_MIN_MARGIN,
+                    help="Ventaja mínima del mejor score de reglas sobre el segundo para resolver sin LLM")
+    args = ap.parse_args(argv)
+    if args.cache_only and args.no_cache:
+        raise SystemExit("--cache_only y --no_cache son incompatibles")
 
     api_key = os.getenv("DEEPSEEK_API_KEY", "").strip()
+    if args.cache_only and not api_key:
+        api_key = "cache-only"  # no se usa: nunca se llama a la API
+    if args.backend == "rules" and not api_key:
+        api_key = "rules"  # no se usa: el backend no sale a la red
     if not api_key:
         raise SystemExit("Falta DEEPSEEK_API_KEY en el entorno (PowerShell: $env:DEEPSEEK_API_KEY='...')")
 
@@ -323,13 +476,12 @@ def main():
 
     do_write = bool(args.write) and (not args.dry_run)
 
-    cfg = load_config(args.config)
-    conn = get_conn(cfg)
+    if conn is None:
+        conn = get_conn(load_config(args.config))
     cur = conn.cursor()
 
     updated_turnos = 0
     touched_convs = set()
-    total_turnos_cache = {}
     conv_texts_cache = {}
     ok_high = 0
     ok_low = 0
@@ -338,6 +490,16 @@ def main():
     skipped_non_pending = 0
     heuristic_written = 0
     llm_calls = 0
+    llm_errors = 0
+    cache_only_misses = 0
+    batch_calls = 0
+    batch_fallbacks = 0
+    budget_skipped = 0
+    triage_resolved = {}
+    triage_calls_avoided = 0
+    # Turnos que quedaron pendientes por causas transitorias (error, presupuesto,
+    # cache_only): quedan como reintentos del job
+    retry_pks = set()
     selected_rows = 0
     no_text_written = 0
     invalid_phase_mapped_to_noise = 0
@@ -380,7 +542,13 @@ def main():
     # Build candidate list from CSV or DB
     candidates = []
     mode = "CSV"
-    if args.from_db:
+    llm_job = None
+    if args.from_db and do_write:
+        # Job persistente: los pendientes se reclaman por chunks desde el cursor (reanudable)
+        mode = "DB_JOB"
+        llm_job = LLMJob.start(conn, args.ejecucion_id, "SCRIPT", resume=not args.new_job)
+        print(f"[JOB] {llm_job.format_status()}")
+    elif args.from_db:
         mode = "DB"
         candidates = fetch_candidates_from_db(conn, args.ejecucion_id, args.max_rows)
     else:
@@ -405,328 +573,516 @@ def main():
                 })
 
     selected_rows = len(candidates)
-    print(f"[PICK] mode={mode} selected_rows={selected_rows} ejecucion_id={args.ejecucion_id}")
-
-    for row in candidates:
-
-            turno_pk = int(row["turno_pk"])
-            conv_pk = int(row["conv_pk"])
-            turn_idx = int(row["turno_idx"])
-            # total_turnos_conv puede no existir en CSV ni en DB.
-            val = row.get("total_turnos_conv")
-            if val is not None:
-                try:
-                    total_turns = int(val)
-                except Exception:
-                    total_turns = get_total_turnos_conv(conn, conv_pk, total_turnos_cache)
-            else:
-                total_turns = get_total_turnos_conv(conn, conv_pk, total_turnos_cache)
-            prev_fase = (row.get("prev_fase") or None)
-            next_fase = (row.get("next_fase") or None)
-            text = (row.get("text") or "").strip()
-
-            # NO_TEXT: texto vacío -> marcar y seguir
-            if not text or not text.strip():
-                print(f"[NO_TEXT] turno_pk={turno_pk}")
-                if do_write:
-                    cur.execute(
-                        "UPDATE sa_turnos SET fase=NULL, fase_conf=NULL, fase_source=%s WHERE turno_pk=%s AND (fase_source IS NULL OR TRIM(fase_source)='' OR fase_source='NO_IMP')",
-                        ("NO_TEXT", turno_pk),
-                    )
-                    if cur.rowcount and cur.rowcount > 0:
-                        print(f"[WRITE] turno_pk={turno_pk} old=(fase_source={(db_row[2] if 'db_row' in locals() else 'N/A')}) new=(fase=NULL,source=NO_TEXT)")
-                        no_text_written += 1
-                        updated_turnos += 1
-                        touched_convs.add(conv_pk)
-                    else:
-                        skipped_existing += 1
-                continue
+    if llm_job is None:
+        print(f"[PICK] mode={mode} selected_rows={selected_rows} ejecucion_id={args.ejecucion_id}")
+    else:
+        print(f"[PICK] mode={mode} desde turno_pk>{llm_job.last_turno_pk} job_chunk={args.job_chunk} ejecucion_id={args.ejecucion_id}")
 
-            # Heurística rápida para fillers / muy corto: evitar LLM
-            norm_no_space = _strip_diacritics(text).lower().replace(' ', '')
-            is_filler = (len(norm_no_space) < 12) or bool(FILLER_RE.match(text.strip().lower()))
-            if is_filler:
-                conf_heur = 0.50
-                fase_heur = prev_fase if (prev_fase and prev_fase.strip()) else "INFORMACION_DEUDA"
-                fase_heur_norm = normalize_fase(fase_heur, text, allowed_set, OLD_PHASES, phase_mapping)
-                if do_write:
-                    if fase_heur_norm is None:
-                        cur.execute(
-                            "UPDATE sa_turnos SET fase=NULL, fase_conf=NULL, fase_source=%s WHERE turno_pk=%s AND (fase_source IS NULL OR TRIM(fase_source)='' OR fase_source='NO_IMP')",
-                            ("NOISE", turno_pk),
-                        )
-                        if cur.rowcount and cur.rowcount > 0:
-                            print(f"[WRITE] turno_pk={turno_pk} old=(source={(db_row[2] if 'db_row' in locals() else 'N/A')}) new=(fase=NULL,source=NOISE)")
-                            invalid_phase_mapped_to_noise += 1
-                            updated_turnos += 1
-                            touched_convs.add(conv_pk)
-                        else:
-                            skipped_existing += 1
-                    else:
-                        cur.execute(
-                            "UPDATE sa_turnos SET fase=%s, fase_conf=%s, fase_source=%s WHERE turno_pk=%s AND (((fase_source IS NULL OR TRIM(fase_source)='') AND (fase IS NULL OR TRIM(fase)='')) OR fase_source='DEEPSEEK_LOW' OR fase_source='NO_IMP')",
-                            (fase_heur_norm, round(conf_heur, 4), "HEURISTIC", turno_pk),
-                        )
-                        if cur.rowcount and cur.rowcount > 0:
-                            print(f"[WRITE] turno_pk={turno_pk} old=(source={(db_row[2] if 'db_row' in locals() else 'N/A')}) new=(fase={fase_heur_norm},conf={round(conf_heur, 4)},source=HEURISTIC)")
-                            heuristic_written += 1
-                            updated_turnos += 1
-                            touched_convs.add(conv_pk)
-                        else:
-                            skipped_existing += 1
-                # saltar invocación al LLM
-                continue
+    # Turnos, estado de fase y totales de las conversaciones candidatas, precargados
+    # por lotes: el bucle por turno solo va a la BD para escribir.
+    conv_index = ConversationIndex(conn)
+    # Escrituras diferidas: UPDATE masivo por guarda + commit cada --flush_every turnos
+    writer = TurnWriteBuffer(conn, conv_index, flush_every=args.flush_every)
 
-            # Idempotencia: consultar estado actual en DB antes de invocar DeepSeek
-            cur.execute(
-                "SELECT fase, fase_conf, fase_source FROM sa_turnos WHERE turno_pk=%s",
-                (turno_pk,)
-            )
-            db_row = cur.fetchone()
-            if db_row:
-                fase_db, conf_db, source_db = db_row
-                fase_db_s = (fase_db or "").strip()
-                if (source_db == "DEEPSEEK") and fase_db_s:
-                    print(f"[SKIP_DB] turno_pk={turno_pk} already DEEPSEEK fase={fase_db_s} conf={conf_db if conf_db is not None else 'None'}")
+    def _ensure_conv_texts(conn, conv_pk, cache):
+        if conv_pk in cache:
+            return cache[conv_pk]
+        cache[conv_pk] = conv_index.texts(conv_pk)
+        return cache[conv_pk]
+
+    def _build_context_block_from_cache(conv_pk, turn_idx, cache_by_conv):
+        """Contexto idx-3..idx+1: roles desde speaker y sin turnos de relleno (salvo el OBJETIVO)."""
+        _ensure_conv_texts(conn, conv_pk, cache_by_conv)
+        return build_context_block(
+            conv_index.utterances(conv_pk), range(turn_idx - 3, turn_idx + 2), {turn_idx},
+            lambda i: "Turno idx=0 (OBJETIVO)" if i == turn_idx else f"Turno idx={i - turn_idx:+d}",
+        )
+
+    def _build_batch_context_block(conv_pk, target_idxs, cache_by_conv):
+        """Bloque idx(primero)-3..idx(último)+1 con idx absolutos y los OBJETIVO marcados."""
+        _ensure_conv_texts(conn, conv_pk, cache_by_conv)
+        targets = set(target_idxs)
+        return build_context_block(
+            conv_index.utterances(conv_pk), range(min(targets) - 3, max(targets) + 2), targets,
+            lambda i: f"Turno idx={i} (OBJETIVO)" if i in targets else f"Turno idx={i}",
+        )
+
+    def _write_noise(turno_pk, conv_pk, old_desc):
+        """UPDATE a NOISE si el turno sigue pendiente. Devuelve True si escribió."""
+        nonlocal updated_turnos, skipped_existing
+        if writer.write(GUARD_PENDIENTE, turno_pk, conv_pk, None, None, "NOISE"):
+            if old_desc is not None:
+                print(f"[WRITE] turno_pk={turno_pk} old=({old_desc}) new=(fase=NULL,source=NOISE)")
+            updated_turnos += 1
+            touched_convs.add(conv_pk)
+            return True
+        skipped_existing += 1
+        return False
+
+    def _write_fase(turno_pk, conv_pk, fase_w, conf_w, source, old_desc):
+        """UPDATE de fase si el turno sigue pendiente o es DEEPSEEK_LOW. Devuelve True si escribió."""
+        nonlocal updated_turnos, skipped_existing
+        if writer.write(GUARD_RECLASIFICABLE, turno_pk, conv_pk, fase_w, conf_w, source):
+            print(f"[WRITE] turno_pk={turno_pk} old=({old_desc}) new=(fase={fase_w},conf={round(conf_w, 4)},source={source})")
+            updated_turnos += 1
+            touched_convs.add(conv_pk)
+            return True
+        skipped_existing += 1
+        return False
+
+    def _prefilter(row):
+        """
+        Resuelve sin LLM lo que se pueda (NO_TEXT, fillers, ya clasificados); si hace
+        falta el LLM devuelve el job base. Corre en el hilo principal, justo antes de
+        despachar la llamada: ve lo que ya se escribió de la misma conversación, igual
+        que el bucle secuencial.
+        """
+        nonlocal updated_turnos, no_text_written, skipped_existing, skipped_non_pending
+        nonlocal heuristic_written, invalid_phase_mapped_to_noise, triage_calls_avoided
+
+        turno_pk = int(row["turno_pk"])
+        conv_pk = int(row["conv_pk"])
+        turn_idx = int(row["turno_idx"])
+        # total_turnos_conv puede no existir en CSV ni en DB.
+        val = row.get("total_turnos_conv")
+        if val is not None:
+            try:
+                total_turns = int(val)
+            except Exception:
+                total_turns = conv_index.total(conv_pk)
+        else:
+            total_turns = conv_index.total(conv_pk)
+        prev_fase = (row.get("prev_fase") or None)
+        next_fase = (row.get("next_fase") or None)
+        text = (row.get("text") or "").strip()
+
+        # NO_TEXT: texto vacío -> marcar y seguir
+        if not text or not text.strip():
+            print(f"[NO_TEXT] turno_pk={turno_pk}")
+            if do_write:
+                if writer.write(GUARD_PENDIENTE, turno_pk, conv_pk, None, None, "NO_TEXT"):
+                    print(f"[WRITE] turno_pk={turno_pk} old=(fase_source=N/A) new=(fase=NULL,source=NO_TEXT)")
+                    no_text_written += 1
+                    updated_turnos += 1
+                    touched_convs.add(conv_pk)
+                else:
                     skipped_existing += 1
-                    continue
-                if fase_db_s and (conf_db is not None) and (float(conf_db) >= args.conf_threshold) and (source_db != 'NO_IMP'):
-                    print(f"[SKIP_DB] turno_pk={turno_pk} already has fase={fase_db_s} conf={float(conf_db):.3f} source={(source_db or 'None')}")
-                    skipped_non_pending += 1
-                    continue
-                # No pisar RULES/HEURISTIC/GUARDRAILS (solo permitir DEEPSEEK_LOW/NOISE/NO_IMP o pendiente)
-                if fase_db_s and (source_db and source_db.strip()) and (source_db not in ("DEEPSEEK_LOW", "NOISE", "NO_IMP")):
-                    print(f"[SKIP_DB] turno_pk={turno_pk} source={source_db} fase={fase_db_s} conf={conf_db if conf_db is not None else 'None'} non-pending")
-                    skipped_non_pending += 1
-                    continue
-
-            # Cargar cache de conversación completa y construir bloque de contexto idx-3..idx+1 con roles
-            def _ensure_conv_texts(conn, conv_pk, cache):
-                if conv_pk in cache:
-                    return cache[conv_pk]
-                cur2 = conn.cursor()
-                cur2.execute(
-                    "SELECT turno_idx, text FROM sa_turnos WHERE conversacion_pk=%s ORDER BY turno_idx",
-                    (conv_pk,)
-                )
-                rows = cur2.fetchall()
-                cur2.close()
-                cache[conv_pk] = {int(a): (b or '') for (a, b) in rows}
-                return cache[conv_pk]
-
-            def _detect_role(text: str) -> str:
-                t = (text or '').lower()
-                if re.search(r"me\s+comunico|de\s+parte\s+de|buen\s+d[ií]a|somos\s+", t):
-                    return 'A'  # Agente
-                if FILLER_RE.match(t) or re.search(r"si|sí|ok|ya|no|gracias", t):
-                    return 'C'  # Cliente probable
-                return 'C'
-
-            def _fmt_with_role(i, label, by_idx):
-                t = (by_idx.get(i) or '').replace('\r', ' ').replace('\n', ' ')
-                role = _detect_role(t)
-                return f"{label} ({role}): {t[:280]}"
-
-            def _build_context_block_from_cache(conv_pk, turn_idx, cache_by_conv):
-                by_idx = _ensure_conv_texts(conn, conv_pk, cache_by_conv)
-                block = []
-                block.append(_fmt_with_role(turn_idx - 3, 'Turno idx=-3', by_idx))
-                block.append(_fmt_with_role(turn_idx - 2, 'Turno idx=-2', by_idx))
-                block.append(_fmt_with_role(turn_idx - 1, 'Turno idx=-1', by_idx))
-                tgt = (by_idx.get(turn_idx) or '').replace('\r', ' ').replace('\n', ' ')[:280]
-                role_tgt = _detect_role(tgt)
-                block.append(f"Turno idx=0 (OBJETIVO) ({role_tgt}): {tgt}")
-                block.append(_fmt_with_role(turn_idx + 1, 'Turno idx=+1', by_idx))
-                return "\n".join(block)
-
-            context_block = _build_context_block_from_cache(conv_pk, turn_idx, conv_texts_cache)
-
-            # last_phase info
-            cur.execute(
-                """
-                SELECT fase, fase_conf, fase_source
-                FROM sa_turnos
-                WHERE conversacion_pk=%s AND turno_idx<%s AND fase IS NOT NULL AND TRIM(fase)<>''
-                ORDER BY turno_idx DESC
-                LIMIT 1
-                """,
-                (conv_pk, turn_idx)
+            return None
+
+        # Heurística rápida para fillers / muy corto: evitar LLM
+        norm_no_space = _strip_diacritics(text).lower().replace(' ', '')
+        is_filler = (len(norm_no_space) < 12) or bool(FILLER_RE.match(text.strip().lower()))
+        if is_filler:
+            conf_heur = 0.50
+            fase_heur = prev_fase if (prev_fase and prev_fase.strip()) else "INFORMACION_DEUDA"
+            fase_heur_norm = normalize_fase(fase_heur, text, allowed_set, OLD_PHASES, phase_mapping)
+            if do_write:
+                if fase_heur_norm is None:
+                    if _write_noise(turno_pk, conv_pk, "source=N/A"):
+                        invalid_phase_mapped_to_noise += 1
+                elif _write_fase(turno_pk, conv_pk, fase_heur_norm, conf_heur, "HEURISTIC", "source=N/A"):
+                    heuristic_written += 1
+            # saltar invocación al LLM
+            return None
+
+        # Idempotencia: estado actual del turno (precargado + lo escrito en esta corrida)
+        db_row = conv_index.state(turno_pk)
+        fase_db_s, conf_db, source_db = 'N/A', 'N/A', 'N/A'
+        if db_row:
+            fase_db, conf_db, source_db = db_row
+            fase_db_s = (fase_db or "").strip()
+            if (source_db == "DEEPSEEK") and fase_db_s:
+                print(f"[SKIP_DB] turno_pk={turno_pk} already DEEPSEEK fase={fase_db_s} conf={conf_db if conf_db is not None else 'None'}")
+                skipped_existing += 1
+                return None
+            if fase_db_s and (conf_db is not None) and (float(conf_db) >= args.conf_threshold) and (source_db != 'NO_IMP'):
+                print(f"[SKIP_DB] turno_pk={turno_pk} already has fase={fase_db_s} conf={float(conf_db):.3f} source={(source_db or 'None')}")
+                skipped_non_pending += 1
+                return None
+            # No pisar RULES/HEURISTIC/GUARDRAILS (solo permitir DEEPSEEK_LOW/NOISE/NO_IMP o pendiente)
+            if fase_db_s and (source_db and source_db.strip()) and (source_db not in ("DEEPSEEK_LOW", "NOISE", "NO_IMP")):
+                print(f"[SKIP_DB] turno_pk={turno_pk} source={source_db} fase={fase_db_s} conf={conf_db if conf_db is not None else 'None'} non-pending")
+                skipped_non_pending += 1
+                return None
+
+        # Triage: casos de alta certeza (margen de reglas / fases vecinas / speaker) sin LLM
+        if not args.no_triage:
+            turns = conv_index.turns(conv_pk)
+            prev_t, cur_t, next_t = turns.get(turn_idx - 1), turns.get(turn_idx), turns.get(turn_idx + 1)
+            decision = triage_turn(
+                text, turn_idx, total_turns,
+                last_phase=_last_phase(conv_pk, turn_idx)[0],
+                prev_fase=prev_t[T_FASE] if prev_t else prev_fase,
+                next_fase=next_t[T_FASE] if next_t else next_fase,
+                speaker=cur_t[T_SPEAKER] if cur_t else None,
+                prev_speaker=prev_t[T_SPEAKER] if prev_t else None,
+                min_margin=args.triage_min_margin,
             )
-            lp_row = cur.fetchone()
-            if lp_row:
-                last_phase = (lp_row[0] or '').strip()
-                last_phase_conf = lp_row[1] if lp_row[1] is not None else ''
-                last_phase_source = lp_row[2] or ''
-            else:
-                last_phase, last_phase_conf, last_phase_source = '', '', ''
-            last_phase_info = f"last_phase={last_phase} conf={last_phase_conf} source={last_phase_source}"
-
-            llm_calls += 1
-            res = call_deepseek(
-                text=text,
-                prev_fase=prev_fase,
-                next_fase=next_fase,
-                turn_idx=turn_idx,
-                total_turns=total_turns,
+            if decision is not None:
+                fase_tri = normalize_fase(decision.fase, text, allowed_set, OLD_PHASES, phase_mapping)
+                if fase_tri is not None:
+                    print(f"[TRIAGE] turno_pk={turno_pk} fase={fase_tri} conf={decision.conf} reason={decision.reason} text='{text[:80]}'")
+                    triage_resolved[decision.reason] = triage_resolved.get(decision.reason, 0) + 1
+                    triage_calls_avoided += 1
+                    if do_write:
+                        _write_fase(turno_pk, conv_pk, fase_tri, decision.conf, TRIAGE_SOURCE, "source=N/A")
+                    return None
+
+        return {
+            "turno_pk": turno_pk, "conv_pk": conv_pk, "turn_idx": turn_idx, "total_turns": total_turns,
+            "text": text, "prev_fase": prev_fase, "next_fase": next_fase,
+            "fase_db_s": fase_db_s, "conf_db": conf_db, "source_db": source_db,
+        }
+
+    def _last_phase(conv_pk, turn_idx):
+        """Última fase no vacía antes de turn_idx (según lo escrito hasta ahora) y su descripción."""
+        lp_row = conv_index.last_phase(conv_pk, turn_idx)
+        if lp_row:
+            last_phase = (lp_row[0] or '').strip()
+            last_phase_conf = lp_row[1] if lp_row[1] is not None else ''
+            last_phase_source = lp_row[2] or ''
+        else:
+            last_phase, last_phase_conf, last_phase_source = '', '', ''
+        return last_phase, f"last_phase={last_phase} conf={last_phase_conf} source={last_phase_source}"
+
+    def _over_budget(rows):
+        """Presupuesto agotado: no se despacha y los turnos quedan pendientes."""
+        nonlocal budget_skipped
+        if not telemetry.budget_exhausted():
+            return False
+        if not budget_skipped:
+            print(f"[BUDGET] presupuesto alcanzado ({telemetry.format_summary()}); el resto queda pendiente")
+        budget_skipped += len(rows)
+        retry_pks.update(int(r["turno_pk"]) for r in rows)
+        return True
+
+    def prepare(row):
+        """Un turno por llamada: contexto idx-3..idx+1 y last_phase al momento de despachar."""
+        nonlocal llm_calls
+        if _over_budget([row]):
+            return None
+        job = _prefilter(row)
+        if job is None:
+            return None
+        # Contexto idx-3..idx+1 con roles desde la caché de la conversación
+        job["context_block"] = _build_context_block_from_cache(job["conv_pk"], job["turn_idx"], conv_texts_cache)
+        job["last_phase"], job["last_phase_info"] = _last_phase(job["conv_pk"], job["turn_idx"])
+        llm_calls += 1
+        return job
+
+    def prepare_window(rows):
+        """
+        Modo multi-turno: los turnos de la ventana que necesitan LLM van en una sola
+        llamada. Cada turno conserva su contexto individual para el fallback.
+        """
+        nonlocal llm_calls, batch_calls
+        nonlocal triage_calls_avoided
+        if _over_budget(rows):
+            return None
+        avoided_before = triage_calls_avoided
+        jobs = [job for job in (_prefilter(row) for row in rows) if job is not None]
+        # En modo multi-turno solo se evita la llamada si la ventana entera se resolvió sin LLM
+        triaged = triage_calls_avoided > avoided_before
+        triage_calls_avoided = avoided_before + (1 if triaged and not jobs else 0)
+        if not jobs:
+            return None
+        conv_pk = jobs[0]["conv_pk"]
+        last_phase, last_phase_info = _last_phase(conv_pk, jobs[0]["turn_idx"])
+        for job in jobs:
+            job["context_block"] = _build_context_block_from_cache(conv_pk, job["turn_idx"], conv_texts_cache)
+            job["last_phase"], job["last_phase_info"] = last_phase, last_phase_info
+        llm_calls += len(jobs)
+        if len(jobs) == 1:
+            return jobs[0]
+        batch_calls += 1
+        # Guardrails con la last_phase vigente al aplicar cada turno (como el modo de a uno)
+        for job in jobs:
+            job["refresh_last_phase"] = True
+        return {
+            "batch": jobs,
+            "context_block": _build_batch_context_block(conv_pk, [j["turn_idx"] for j in jobs], conv_texts_cache),
+            "last_phase_info": last_phase_info,
+        }
+
+    def call(job):
+        telemetry.bind(job.get("turno_pk"), len(job.get("batch") or [job]))
+        if "batch" in job:
+            targets = [
+                {k: j[k] for k in ("text", "prev_fase", "next_fase", "total_turns", "context_block", "last_phase_info")}
+                | {"turn_idx": j["turn_idx"]}
+                for j in job["batch"]
+            ]
+            return call_deepseek_batch(
+                targets,
+                context_block=job["context_block"],
+                last_phase_info=job["last_phase_info"],
                 base_url=base_url,
                 api_key=api_key,
                 model=model,
-                context_block=context_block,
-                last_phase_info=last_phase_info,
                 allowed_phases=allowed_list,
+                client=client,
+                cache=cache,
             )
+        return call_deepseek(
+            text=job["text"],
+            prev_fase=job["prev_fase"],
+            next_fase=job["next_fase"],
+            turn_idx=job["turn_idx"],
+            total_turns=job["total_turns"],
+            base_url=base_url,
+            api_key=api_key,
+            model=model,
+            context_block=job["context_block"],
+            last_phase_info=job["last_phase_info"],
+            allowed_phases=allowed_list,
+            client=client,
+            cache=cache,
+        )
 
-            fase = res["fase"]
-            conf = res["conf"]
-            is_noise = res.get("is_noise", 0)
-            noise_reason = res.get("noise_reason", "")
-            rationale = res.get("rationale", "")
-
-            # Manejo de baja confianza: si conf < 0.40, guardar intento con fallback de contexto
-            if int(is_noise) == 1:
-                print(f"[NOISE] turno_pk={turno_pk} reason='{noise_reason}' text='{text[:80]}'")
-                if do_write:
-                    cur.execute(
-                        "UPDATE sa_turnos SET fase=NULL, fase_conf=NULL, fase_source=%s WHERE turno_pk=%s AND (fase_source IS NULL OR TRIM(fase_source)='' OR fase_source='NO_IMP')",
-                        ("NOISE", turno_pk),
-                    )
-                    if cur.rowcount and cur.rowcount > 0:
-                        print(f"[WRITE] turno_pk={turno_pk} old=(fase={fase_db_s if 'fase_db_s' in locals() else 'N/A'},source={source_db if 'source_db' in locals() else 'N/A'}) new=(fase=NULL,source=NOISE)")
-                        noise_written += 1
-                        updated_turnos += 1
-                        touched_convs.add(conv_pk)
-                    else:
-                        skipped_existing += 1
-                continue
+    def apply(job, res):
+        """Post-proceso y escritura del resultado del LLM (único escritor: hilo principal)."""
+        nonlocal ok_high, ok_low, noise_written, invalid_phase_mapped_to_noise, wrote_old_phase
+        turno_pk, conv_pk, turn_idx = job["turno_pk"], job["conv_pk"], job["turn_idx"]
+        text, prev_fase, next_fase = job["text"], job["prev_fase"], job["next_fase"]
+        old_desc = f"fase={job['fase_db_s']},source={job['source_db']}"
 
-            if conf < 0.40 or fase == "NONE":
-                # Low confidence: try normalize predicted (fase) to allowed; else mark NOISE
-                conf_out = round(max(conf, 0.40), 2)
-                norm_low = normalize_fase(fase, text, allowed_set, OLD_PHASES, phase_mapping)
-                print(f"[ATTEMPT] turno_pk={turno_pk} conf={conf:.3f} fase={fase} -> norm={norm_low} text='{text[:80]}'")
-                if do_write:
-                    if norm_low is None:
-                        cur.execute(
-                            "UPDATE sa_turnos SET fase=NULL, fase_conf=NULL, fase_source=%s WHERE turno_pk=%s AND (fase_source IS NULL OR TRIM(fase_source)='' OR fase_source='NO_IMP')",
-                            ("NOISE", turno_pk),
-                        )
-                        if cur.rowcount and cur.rowcount > 0:
-                            invalid_phase_mapped_to_noise += 1
-                            updated_turnos += 1
-                            touched_convs.add(conv_pk)
-                        else:
-                            skipped_existing += 1
-                    else:
-                        if norm_low in OLD_PHASES:
-                            wrote_old_phase += 1
-                        cur.execute(
-                            "UPDATE sa_turnos SET fase=%s, fase_conf=%s, fase_source=%s WHERE turno_pk=%s AND (((fase_source IS NULL OR TRIM(fase_source)='') AND (fase IS NULL OR TRIM(fase)='')) OR fase_source='DEEPSEEK_LOW' OR fase_source='NO_IMP')",
-                            (norm_low, round(conf_out, 4), "DEEPSEEK_LOW", turno_pk),
-                        )
-                        if cur.rowcount and cur.rowcount > 0:
-                            print(f"[WRITE] turno_pk={turno_pk} old=(fase={fase_db_s if 'fase_db_s' in locals() else 'N/A'},source={source_db if 'source_db' in locals() else 'N/A'}) new=(fase={norm_low},conf={round(conf_out, 4)},source=DEEPSEEK_LOW)")
-                            ok_low += 1
-                            updated_turnos += 1
-                            touched_convs.add(conv_pk)
-                        else:
-                            skipped_existing += 1
-                continue
+        fase = res["fase"]
+        conf = res["conf"]
+        is_noise = res.get("is_noise", 0)
+        noise_reason = res.get("noise_reason", "")
+        rationale = res.get("rationale", "")
 
-            # Si no alcanza umbral, escribir como DEEPSEEK_LOW para evitar pendientes infinitos
-            if conf < args.conf_threshold:
-                norm_low = normalize_fase(fase, text, allowed_set, OLD_PHASES, phase_mapping)
-                print(f"[LOW] turno_pk={turno_pk} conf={conf:.3f} fase={fase} -> norm={norm_low} text='{text[:80]}'")
-                if do_write:
-                    if norm_low is None:
-                        cur.execute(
-                            "UPDATE sa_turnos SET fase=NULL, fase_conf=NULL, fase_source=%s WHERE turno_pk=%s AND (fase_source IS NULL OR TRIM(fase_source)='' OR fase_source='NO_IMP')",
-                            ("NOISE", turno_pk),
-                        )
-                        if cur.rowcount and cur.rowcount > 0:
-                            print(f"[WRITE] turno_pk={turno_pk} old=(fase={fase_db_s if 'fase_db_s' in locals() else 'N/A'},source={source_db if 'source_db' in locals() else 'N/A'}) new=(fase=NULL,source=NOISE)")
-                            invalid_phase_mapped_to_noise += 1
-                            updated_turnos += 1
-                            touched_convs.add(conv_pk)
-                        else:
-                            skipped_existing += 1
-                    else:
-                        if norm_low in OLD_PHASES:
-                            wrote_old_phase += 1
-                        cur.execute(
-                            "UPDATE sa_turnos SET fase=%s, fase_conf=%s, fase_source=%s WHERE turno_pk=%s AND (((fase_source IS NULL OR TRIM(fase_source)='') AND (fase IS NULL OR TRIM(fase)='')) OR fase_source='DEEPSEEK_LOW' OR fase_source='NO_IMP')",
-                            (norm_low, round(conf, 4), "DEEPSEEK_LOW", turno_pk),
-                        )
-                        if cur.rowcount and cur.rowcount > 0:
-                            print(f"[WRITE] turno_pk={turno_pk} old=(fase={fase_db_s if 'fase_db_s' in locals() else 'N/A'},source={source_db if 'source_db' in locals() else 'N/A'}) new=(fase={norm_low},conf={round(conf, 4)},source=DEEPSEEK_LOW)")
-                            ok_low += 1
-                            updated_turnos += 1
-                            touched_convs.add(conv_pk)
-                        else:
-                            skipped_existing += 1
-                continue
+        if int(is_noise) == 1:
+            print(f"[NOISE] turno_pk={turno_pk} reason='{noise_reason}' text='{text[:80]}'")
+            if do_write:
+                if _write_noise(turno_pk, conv_pk, old_desc):
+                    noise_written += 1
+            return
 
-            # Guardrails post-LLM
-            by_idx = conv_texts_cache.get(conv_pk, {})
-            prev_texts = [by_idx.get(turn_idx - k, '') for k in [1,2,3]]
-            next_text = by_idx.get(turn_idx + 1, '')
-            has_next_meaningful = bool(next_text and len(next_text.strip())>0 and not FILLER_RE.match(next_text.strip().lower()))
-            final_fase, final_conf, _final_source_unused, reason = apply_guardrails(
-                fase, conf, 0, last_phase, has_next_meaningful, text, prev_texts
-            )
-            if final_fase != fase:
-                print(f"[GUARD] turno_pk={turno_pk} pred={fase}/{conf:.2f} -> final={final_fase}/{final_conf:.2f} reason={reason}")
-            else:
-                print(f"[OK] turno_pk={turno_pk} -> fase={fase} conf={conf:.3f} prev={prev_fase} next={next_fase} text='{text[:80]}' rationale='{rationale[:60]}'")
-            # Normalize final_fase to allowed
-            norm_final = normalize_fase(final_fase, text, allowed_set, OLD_PHASES, phase_mapping)
-            if norm_final is None:
-                print(f"[FINAL->NOISE] turno_pk={turno_pk} final={final_fase} not allowed -> NOISE")
-                if do_write:
-                    cur.execute(
-                        "UPDATE sa_turnos SET fase=NULL, fase_conf=NULL, fase_source=%s WHERE turno_pk=%s AND (fase_source IS NULL OR TRIM(fase_source)='' OR fase_source='NO_IMP')",
-                        ("NOISE", turno_pk),
-                    )
-                    if cur.rowcount and cur.rowcount > 0:
-                        print(f"[WRITE] turno_pk={turno_pk} old=(fase={fase_db_s if 'fase_db_s' in locals() else 'N/A'},source={source_db if 'source_db' in locals() else 'N/A'}) new=(fase=NULL,source=NOISE)")
+        # Manejo de baja confianza: si conf < 0.40, guardar intento con fallback de contexto
+        if conf < 0.40 or fase == "NONE":
+            # Low confidence: try normalize predicted (fase) to allowed; else mark NOISE
+            conf_out = round(max(conf, 0.40), 2)
+            norm_low = normalize_fase(fase, text, allowed_set, OLD_PHASES, phase_mapping)
+            print(f"[ATTEMPT] turno_pk={turno_pk} conf={conf:.3f} fase={fase} -> norm={norm_low} text='{text[:80]}'")
+            if do_write:
+                if norm_low is None:
+                    if _write_noise(turno_pk, conv_pk, None):
+                        invalid_phase_mapped_to_noise += 1
+                else:
+                    if norm_low in OLD_PHASES:
+                        wrote_old_phase += 1
+                    if _write_fase(turno_pk, conv_pk, norm_low, conf_out, "DEEPSEEK_LOW", old_desc):
+                        ok_low += 1
+            return
+
+        # Si no alcanza umbral, escribir como DEEPSEEK_LOW para evitar pendientes infinitos
+        if conf < args.conf_threshold:
+            norm_low = normalize_fase(fase, text, allowed_set, OLD_PHASES, phase_mapping)
+            print(f"[LOW] turno_pk={turno_pk} conf={conf:.3f} fase={fase} -> norm={norm_low} text='{text[:80]}'")
+            if do_write:
+                if norm_low is None:
+                    if _write_noise(turno_pk, conv_pk, old_desc):
                         invalid_phase_mapped_to_noise += 1
-                        updated_turnos += 1
-                        touched_convs.add(conv_pk)
-                    else:
-                        skipped_existing += 1
-            else:
-                if do_write:
-                    if norm_final in OLD_PHASES:
+                else:
+                    if norm_low in OLD_PHASES:
                         wrote_old_phase += 1
-                    # Mapeo adicional: INFORMACION_DEUDA -> EXPOSICION_DEUDA
-                    final_to_write = norm_final
-                    if norm_final == 'INFORMACION_DEUDA':
-                        final_to_write = 'EXPOSICION_DEUDA'
-                        print(f"[MAP] turno_pk={turno_pk} INFORMACION_DEUDA -> EXPOSICION_DEUDA")
-                    # Source: DEEPSEEK (high) per spec; keep threshold already passed
-                    cur.execute(
-                        "UPDATE sa_turnos SET fase=%s, fase_conf=%s, fase_source=%s WHERE turno_pk=%s AND (((fase_source IS NULL OR TRIM(fase_source)='') AND (fase IS NULL OR TRIM(fase)='')) OR fase_source='DEEPSEEK_LOW' OR fase_source='NO_IMP')",
-                        (final_to_write, round(final_conf, 4), "DEEPSEEK", turno_pk),
-                    )
-                    if cur.rowcount and cur.rowcount > 0:
-                        print(f"[WRITE] turno_pk={turno_pk} old=(fase={fase_db_s if 'fase_db_s' in locals() else 'N/A'},conf={conf_db if 'conf_db' in locals() else 'N/A'},source={source_db if 'source_db' in locals() else 'N/A'}) new=(fase={final_to_write},conf={round(final_conf, 4)},source=DEEPSEEK)")
-                        updated_turnos += 1
-                        ok_high += 1
-                        touched_convs.add(conv_pk)
-                    else:
-                        skipped_existing += 1
-
-            time.sleep(0.10)  # micro-rate-limit
-
-    if do_write and updated_turnos:
-        # recalcular estado final de conversación y marcar llm_usado=1
-        update_conversation_final_fields(cur, touched_convs)
-        conn.commit()
+                    if _write_fase(turno_pk, conv_pk, norm_low, conf, "DEEPSEEK_LOW", old_desc):
+                        ok_low += 1
+            return
+
+        # Guardrails post-LLM
+        if job.get("refresh_last_phase"):
+            job["last_phase"], _ = _last_phase(conv_pk, turn_idx)
+        by_idx = conv_texts_cache.get(conv_pk, {})
+        prev_texts = [by_idx.get(turn_idx - k, '') for k in [1,2,3]]
+        next_text = by_idx.get(turn_idx + 1, '')
+        has_next_meaningful = bool(next_text and len(next_text.strip())>0 and not FILLER_RE.match(next_text.strip().lower()))
+        final_fase, final_conf, _final_source_unused, reason = apply_guardrails(
+            fase, conf, 0, job["last_phase"], has_next_meaningful, text, prev_texts
+        )
+        if final_fase != fase:
+            print(f"[GUARD] turno_pk={turno_pk} pred={fase}/{conf:.2f} -> final={final_fase}/{final_conf:.2f} reason={reason}")
+        else:
+            print(f"[OK] turno_pk={turno_pk} -> fase={fase} conf={conf:.3f} prev={prev_fase} next={next_fase} text='{text[:80]}' rationale='{rationale[:60]}'")
+        # Normalize final_fase to allowed
+        norm_final = normalize_fase(final_fase, text, allowed_set, OLD_PHASES, phase_mapping)
+        if norm_final is None:
+            print(f"[FINAL->NOISE] turno_pk={turno_pk} final={final_fase} not allowed -> NOISE")
+            if do_write:
+                if _write_noise(turno_pk, conv_pk, old_desc):
+                    invalid_phase_mapped_to_noise += 1
+        elif do_write:
+            if norm_final in OLD_PHASES:
+                wrote_old_phase += 1
+            # Mapeo adicional: INFORMACION_DEUDA -> EXPOSICION_DEUDA
+            final_to_write = norm_final
+            if norm_final == 'INFORMACION_DEUDA':
+                final_to_write = 'EXPOSICION_DEUDA'
+                print(f"[MAP] turno_pk={turno_pk} INFORMACION_DEUDA -> EXPOSICION_DEUDA")
+            # Source: DEEPSEEK (high) per spec; keep threshold already passed
+            old_desc_conf = f"fase={job['fase_db_s']},conf={job['conf_db']},source={job['source_db']}"
+            if _write_fase(turno_pk, conv_pk, final_to_write, final_conf, "DEEPSEEK", old_desc_conf):
+                ok_high += 1
+
+    # Turnos de una misma conversación en orden (el contexto de cada uno ve lo
+    # escrito para los anteriores); conversaciones distintas en paralelo.
+    def _iter_groups(candidates):
+        """Grupos por conversación; precarga el índice de a PREFETCH_CHUNK conversaciones."""
+        por_conv = {}
+        for row in candidates:
+            por_conv.setdefault(int(row["conv_pk"]), []).append(row)
+        conv_pks = list(por_conv)
+        for start in range(0, len(conv_pks), PREFETCH_CHUNK):
+            chunk = conv_pks[start:start + PREFETCH_CHUNK]
+            conv_index.load(chunk)
+            for conv_pk in chunk:
+                rows = por_conv[conv_pk]
+                if args.batch_turns > 1:
+                    # Ventanas de turnos cercanos de la misma conversación: una llamada por ventana
+                    yield _split_windows(rows, args.batch_turns, args.batch_max_gap)
+                else:
+                    yield rows
+
+    prepare_fn = prepare_window if args.batch_turns > 1 else prepare
+
+    def _handle_result(job, res, exc):
+        nonlocal cache_only_misses, llm_errors
+        if isinstance(exc, CacheMiss):
+            # Modo cache_only: el turno queda pendiente, sin llamar a la API
+            cache_only_misses += 1
+            retry_pks.add(job["turno_pk"])
+            print(f"[CACHE_MISS] turno_pk={job['turno_pk']}")
+            return
+        if exc is not None:
+            # El turno queda pendiente; se retoma en la próxima corrida
+            llm_errors += 1
+            retry_pks.add(job["turno_pk"])
+            print(f"[ERROR] turno_pk={job['turno_pk']} {type(exc).__name__}: {str(exc)[:200]}")
+            return
+        apply(job, res)
+
+    reset_prompt_stats()
+    # Tokens, latencia y estado por llamada (sa_llm_llamadas) + presupuesto de la corrida
+    telemetry = LLMTelemetry(
+        args.ejecucion_id, origen="SCRIPT", model=model,
+        token_budget=args.token_budget, cost_budget=args.cost_budget,
+        price_in_per_mtok=args.price_in_per_mtok, price_out_per_mtok=args.price_out_per_mtok,
+    )
+    if do_write:
+        ensure_llm_calls_table(conn)
+    client = LLMClient(
+        base_url, api_key, model,
+        concurrency=args.concurrency,
+        rate_per_sec=args.rate_per_sec,
+        timeout=args.timeout,
+        max_retries=args.max_retries,
+        telemetry=telemetry,
+        backend=make_backend(args.backend, base_url, api_key, args.concurrency),
+    )
+    cache = None
+    if not args.no_cache:
+        cache = LLMCache(
+            args.cache_path,
+            ttl_secs=args.cache_ttl_days * 86400,
+            max_entries=args.cache_max_entries,
+            cache_only=args.cache_only,
+        )
+    def _process(candidates):
+        nonlocal batch_fallbacks
+        for job, res, exc in client.map_by_key(call, _iter_groups(candidates), prepare_fn):
+            if do_write and len(telemetry) >= TELEMETRY_FLUSH_EVERY:
+                telemetry.flush(conn)
+            if "batch" not in job:
+                _handle_result(job, res, exc)
+                continue
+            if exc is None:
+                results, n_fallback = res
+                batch_fallbacks += n_fallback
+            for sub in job["batch"]:
+                if exc is not None:
+                    _handle_result(sub, None, exc)
+                else:
+                    sub_res = results.get(sub["turn_idx"])
+                    sub_exc = sub_res if isinstance(sub_res, Exception) else None
+                    _handle_result(sub, None if sub_exc else sub_res, sub_exc)
+
+    def _run_job():
+        """
+        Reclama pendientes por chunks (keyset desde el cursor del job), los procesa
+        y recién después de escribirlos (flush + commit) avanza el cursor: un corte
+        a mitad de chunk se retoma desde el último chunk confirmado.
+        """
+        nonlocal selected_rows
+        columns = "t.turno_pk, t.conversacion_pk, t.turno_idx, t.text"
+        while not telemetry.budget_exhausted():
+            limit = args.job_chunk
+            if args.max_rows and args.max_rows > 0:
+                limit = min(limit, args.max_rows - selected_rows)
+                if limit <= 0:
+                    return STATUS_PAUSED
+            rows = llm_job.claim(cur, columns, limit, PENDING_SIN_FUENTE)
+            if not rows:
+                return STATUS_DONE
+            chunk = [
+                {"turno_pk": int(r[0]), "conv_pk": int(r[1]), "turno_idx": int(r[2]), "text": (r[3] or ""),
+                 "prev_fase": None, "next_fase": None}
+                for r in rows
+            ]
+            selected_rows += len(chunk)
+            before = (updated_turnos, llm_calls, llm_errors)
+            _process(chunk)
+            writer.flush()
+            telemetry.flush(conn)
+            llm_job.advance(
+                retry_pks, turnos=len(chunk), escritos=updated_turnos - before[0],
+                llamadas=llm_calls - before[1], errores=llm_errors - before[2],
+            )
+            print(f"[CLAIM] {llm_job.format_status()} chunk={len(chunk)}")
+        return STATUS_PAUSED
+
+    try:
+        if llm_job is None:
+            _process(candidates)
+        else:
+            llm_job.finish(_run_job())
+    except BaseException:
+        if llm_job is not None:
+            llm_job.finish(STATUS_FAILED)
+        raise
+    finally:
+        client.close()
+        if cache is not None:
+            cache.close()
+        # Lo que quede en el buffer (también si se cortó la corrida): turnos +
+        # estado final de sus conversaciones (llm_usado=1) y commit
+        writer.flush()
+        if do_write:
+            telemetry.flush(conn)
 
     cur.close()
     conn.close()
 
     print(f"\nDONE write={args.write} dry_run={args.dry_run} do_write={do_write} updated_turnos={updated_turnos} touched_convs={len(touched_convs)} base_url={base_url} model={model}")
-    print(f"Summary: selected_rows={selected_rows} llm_calls={llm_calls} ok_high={ok_high} ok_low={ok_low} heuristic_written={heuristic_written} no_text_written={no_text_written} noise_written={noise_written} skipped_existing={skipped_existing} skipped_non_pending={skipped_non_pending}")
+    print(f"Summary: selected_rows={selected_rows} llm_calls={llm_calls} ok_high={ok_high} ok_low={ok_low} heuristic_written={heuristic_written} no_text_written={no_text_written} noise_written={noise_written} skipped_existing={skipped_existing} skipped_non_pending={skipped_non_pending} llm_errors={llm_errors}")
+    if args.batch_turns > 1:
+        print(f"Batch: batch_turns={args.batch_turns} batch_calls={batch_calls} batch_fallbacks={batch_fallbacks}")
+    print(f"LLM: {client.format_stats()}")
+    print(f"Uso LLM: {telemetry.format_summary()} budget_skipped={budget_skipped}")
+    if not args.no_triage:
+        print(f"Triage: {format_triage(triage_resolved, llm_calls, triage_calls_avoided)}")
+    if do_write:
+        print(f"Escritura: {writer.format_stats()}")
+    if llm_job is not None:
+        print(f"Job: {llm_job.format_status()}")
+    if cache is not None:
+        print(f"Caché LLM: {cache.format_stats()} cache_only_misses={cache_only_misses}")
+    print(f"Prompt: {format_prompt_stats()}")
+    print(f"Normalización: {format_cache_stats()}")
+    return {
+        "selected_rows": selected_rows, "llm_calls": llm_calls, "updated_turnos": updated_turnos,
+        "llm_errors": llm_errors, "client": client.stats(), "usage": telemetry.summary(),
+    }
 
 if __name__ == "__main__":
     main()
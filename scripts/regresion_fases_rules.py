@@ -0,0 +1,147 @@
+"""
+Harness de regresión del motor de reglas de fases.
+
+Recorre los turnos guardados en sa_turnos (toda la BD o una ejecución) y compara
+turno por turno la salida (fase, conf, score) de
+sa_core.fases_rules.detect_fase_rules_based contra la implementación original
+conservada en sa_core.fases_rules_legacy. La cadena de last_phase se arma igual
+que en apply_fase_rules_for_run (solo avanza con fases aceptadas por umbral).
+
+Con --exhaustivo cada turno se evalúa además con todos los last_phase posibles y
+con is_last_turns True/False.
+
+Uso:
+    python -m scripts.regresion_fases_rules --ejecucion_id 12
+    python -m scripts.regresion_fases_rules --exhaustivo --limit 500
+"""
+import argparse
+import sys
+import time
+
+from sa_core.config import load_config
+from sa_core.db import get_conn
+from sa_core.fases_rules import FASE_SEQUENCE, detect_fase_rules_based
+from sa_core.fases_rules_legacy import detect_fase_rules_based_legacy
+
+CONTEXTOS_EXHAUSTIVOS = [None] + FASE_SEQUENCE
+
+
+def iter_conversaciones_turnos(conn, ejecucion_id=None, limit=0, page_size=200):
+    """Genera (conversacion_pk, [(turno_idx, text), ...]) paginando por conversacion_pk."""
+    cur = conn.cursor()
+    last_pk = 0
+    vistos = 0
+    try:
+        while True:
+            n = page_size if not limit else min(page_size, limit - vistos)
+            if n <= 0:
+                return
+            where = "conversacion_pk > %s"
+            params = [last_pk]
+            if ejecucion_id:
+                where += " AND ejecucion_id = %s"
+                params.append(ejecucion_id)
+            cur.execute(
+                f"SELECT conversacion_pk FROM sa_conversaciones WHERE {where} ORDER BY conversacion_pk LIMIT %s",
+                tuple(params) + (n,)
+            )
+            pks = [r[0] for r in cur.fetchall()]
+            if not pks:
+                return
+            placeholders = ", ".join(["%s"] * len(pks))
+            cur.execute(
+                f"""
+                SELECT conversacion_pk, turno_idx, text
+                FROM sa_turnos
+                WHERE conversacion_pk IN ({placeholders})
+                ORDER BY conversacion_pk, turno_idx
+                """,
+                tuple(pks)
+            )
+            por_conv = {pk: [] for pk in pks}
+            for conv_pk, turno_idx, text in cur.fetchall():
+                por_conv[conv_pk].append((int(turno_idx), text or ""))
+            for pk in pks:
+                yield pk, por_conv[pk]
+            vistos += len(pks)
+            last_pk = pks[-1]
+    finally:
+        cur.close()
+
+
+def comparar_conversacion(conv_pk, turnos, conf_threshold, exhaustivo, diffs, tiempos):
+    """Compara ambos motores sobre una conversación. Devuelve cantidad de evaluaciones."""
+    total = len(turnos)
+    last_phase = None
+    n = 0
+    for turno_idx, text in turnos:
+        is_last = (total - turno_idx) < 3
+        contextos = [(last_phase, is_last)]
+        if exhaustivo:
+            contextos += [(lp, il) for lp in CONTEXTOS_EXHAUSTIVOS for il in (False, True)]
+        chain_ref = None
+        for lp, il in contextos:
+            t0 = time.perf_counter()
+            nuevo = detect_fase_rules_based(text, turno_idx, total, last_phase=lp, is_last_turns=il)
+            t1 = time.perf_counter()
+            ref = detect_fase_rules_based_legacy(text, turno_idx, total, last_phase=lp, is_last_turns=il)
+            t2 = time.perf_counter()
+            tiempos["nuevo"] += t1 - t0
+            tiempos["legacy"] += t2 - t1
+            n += 1
+            if chain_ref is None:
+                chain_ref = ref
+            if nuevo != ref:
+                diffs.append((conv_pk, turno_idx, text, lp, il, nuevo, ref))
+
+        # Cadena de last_phase igual que apply_fase_rules_for_run
+        fase, conf, _ = chain_ref
+        if fase and conf >= conf_threshold:
+            last_phase = fase
+    return n
+
+
+def main():
+    ap = argparse.ArgumentParser(description="Regresión: motor de reglas nuevo vs. original")
+    ap.add_argument("--config", default="config.ini")
+    ap.add_argument("--ejecucion_id", type=int, default=0, help="0 = todas las ejecuciones")
+    ap.add_argument("--limit", type=int, default=0, help="Máximo de conversaciones (0 = todas)")
+    ap.add_argument("--conf_threshold", type=float, default=0.55)
+    ap.add_argument("--exhaustivo", action="store_true", help="Probar además todos los last_phase posibles")
+    ap.add_argument("--max_diffs", type=int, default=20, help="Diferencias a mostrar")
+    args = ap.parse_args()
+
+    cfg = load_config(args.config)
+    conn = get_conn(cfg)
+    if conn is None:
+        print("No se pudo conectar a MySQL.")
+        return 2
+
+    diffs = []
+    tiempos = {"nuevo": 0.0, "legacy": 0.0}
+    n_convs = 0
+    n_evals = 0
+    try:
+        for conv_pk, turnos in iter_conversaciones_turnos(conn, args.ejecucion_id or None, args.limit):
+            n_evals += comparar_conversacion(conv_pk, turnos, args.conf_threshold, args.exhaustivo, diffs, tiempos)
+            n_convs += 1
+            if n_convs % 500 == 0:
+                print(f"  ... {n_convs} conversaciones, {n_evals} evaluaciones, {len(diffs)} diferencias")
+    finally:
+        conn.close()
+
+    print("\n--- Regresión motor de reglas ---")
+    print(f"Conversaciones: {n_convs}")
+    print(f"Evaluaciones: {n_evals}")
+    print(f"Diferencias: {len(diffs)}")
+    if n_evals:
+        print(f"Legacy: {n_evals / max(tiempos['legacy'], 1e-9):,.0f} turnos/s")
+        print(f"Nuevo : {n_evals / max(tiempos['nuevo'], 1e-9):,.0f} turnos/s")
+    for conv_pk, turno_idx, text, lp, il, nuevo, ref in diffs[:args.max_diffs]:
+        print(f"  conv_pk={conv_pk} turno_idx={turno_idx} last_phase={lp} is_last={il} nuevo={nuevo} legacy={ref} text={text[:80]!r}")
+
+    return 0 if not diffs else 1
+
+
+if __name__ == "__main__":
+    sys.exit(main())
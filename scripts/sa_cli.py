@@ -7,11 +7,13 @@ sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
 
 from sa_core.config import load_config
 from sa_core.db import get_conn, ensure_schema
-from sa_core.ingest import ingest_dir
+from sa_core.ingest import ingest_dir, ingest_dir_parallel, ingest_dir_incremental
 from sa_core.turnos import parse_turns_for_run
 from sa_core.fases_rules import apply_fase_rules_for_run
 from scripts.export_pendientes_llm import export_pendientes_llm
 from scripts.suavizar_fases_por_secuencia import suavizar_fases_por_secuencia
+from sa_core.fase_repair import REPAIR_PASSES, format_repair_stats, run_repair
+from scripts.postprocess_ejecucion import ensure_and_update_fase_8, show_metrics, transaction
 
 def main():
     parser = argparse.ArgumentParser(description="CLI para Speech Analytics")
@@ -21,12 +23,16 @@ def main():
     ingest_parser = subparsers.add_parser('ingest', help='Ingesta de conversaciones desde un directorio.')
     ingest_parser.add_argument('--input_dir', required=True, help='Directorio con archivos .txt a ingestar.')
     ingest_parser.add_argument('--notas', default='', help='Notas para la ejecución.')
+    ingest_parser.add_argument('--workers', type=int, default=0, help='Procesos lectores para ingesta paralela (0 = secuencial).')
+    ingest_parser.add_argument('--batch_size', type=int, default=200, help='Filas por INSERT multi-fila en modo paralelo.')
+    ingest_parser.add_argument('--incremental', action='store_true', help='Saltar archivos sin cambios, vincular duplicados por hash y reanudar desde checkpoint.')
 
     # Comando parse-turns
     parse_parser = subparsers.add_parser('parse-turns', help='Parsea los turnos de las conversaciones de una ejecución.')
     parse_parser.add_argument('--ejecucion_id', required=True, type=int, help='ID de la ejecución a procesar.')
     parse_parser.add_argument('--limit', type=int, default=0, help='Limitar el número de conversaciones a procesar (0 para todas).')
     parse_parser.add_argument('--verbose', action='store_true', help='Mostrar logs detallados durante el proceso.')
+    parse_parser.add_argument('--workers', type=int, default=0, help='Procesos para parseo/roles en paralelo (0 = serial).')
 
     # Comando detect-fases
     fases_parser = subparsers.add_parser('detect-fases', help='Detecta fases en los turnos de una ejecución.')
@@ -34,9 +40,11 @@ def main():
     fases_parser.add_argument('--limit', type=int, default=0, help='Limitar el número de conversaciones a procesar (0 para todas).')
     fases_parser.add_argument('--conf_threshold', type=float, default=0.55)
     fases_parser.add_argument('--verbose', action='store_true', help='Mostrar logs detallados durante el proceso.')
+    fases_parser.add_argument('--persist_text_norm', action='store_true', help='Usar/guardar sa_turnos.text_norm (texto normalizado) para no recalcularlo en re-ejecuciones.')
+    fases_parser.add_argument('--workers', type=int, default=0, help='Modo masivo: >0 lee/escribe por chunks con UPDATE JOIN; >1 clasifica en un pool de procesos (0 = turno a turno).')
 
     # Comando pipeline-fases
-    pipe_parser = subparsers.add_parser('pipeline-fases', help='Pipeline completo: RULES -> export pendientes -> (opcional) DeepSeek -> recalc resumen.')
+    pipe_parser = subparsers.add_parser('pipeline-fases', help='Pipeline completo: RULES -> export pendientes -> (opcional) DeepSeek -> reparación + fase_8 -> recalc resumen.')
     pipe_parser.add_argument('--ejecucion_id', required=True, type=int, help='ID de la ejecución a procesar.')
     pipe_parser.add_argument('--limit', type=int, default=0, help='Limitar conversaciones para RULES (0 = todas).')
     pipe_parser.add_argument('--conf_threshold', type=float, default=0.55, help='Umbral de confianza para RULES y filtro de pendientes.')
@@ -45,9 +53,16 @@ def main():
     pipe_parser.add_argument('--write', action='store_true', help='Si se establece junto a pipeline DeepSeek, escribe en DB.')
     pipe_parser.add_argument('--dry_run', action='store_true', help='Dry-run para DeepSeek (no escribe).')
     pipe_parser.add_argument('--mapeo_version', default='v1.0', help='Versión del mapeo fase_mapeo_oficial (ej: v12a8_ej2_2026-02-09).')
-    pipe_parser.add_argument('--postprocess', action='store_true', default=True, help='Ejecutar postprocesado al final (default: True).')
+    pipe_parser.add_argument('--postprocess', action='store_true', default=True, help='Ejecutar postprocesado al final (default: True): reparación (ver repair-fases) + fase_8.')
     pipe_parser.add_argument('--no-postprocess', dest='postprocess', action='store_false', help='NO ejecutar postprocesado al final.')
+    pipe_parser.add_argument('--smooth', action='store_true', help='Incluir el suavizado de transiciones en la reparación del postprocesado.')
+    pipe_parser.add_argument('--conf_min', type=float, default=0.40, help='conf_min del suavizado (ver smooth-fases).')
     pipe_parser.add_argument('--verbose', action='store_true', help='Logs detallados durante el pipeline.')
+    pipe_parser.add_argument('--workers', type=int, default=0, help='RULES en modo masivo/paralelo (ver detect-fases --workers).')
+    pipe_parser.add_argument('--deepseek_batch_turns', type=int, default=1, help='Turnos pendientes por llamada a DeepSeek (1 = una llamada por turno).')
+    pipe_parser.add_argument('--deepseek_token_budget', type=int, default=0, help='Tope de tokens de DeepSeek para la corrida (0 = sin tope).')
+    pipe_parser.add_argument('--deepseek_cost_budget', type=float, default=0.0, help='Tope de costo en USD de DeepSeek para la corrida (0 = sin tope).')
+    pipe_parser.add_argument('--deepseek_new_job', action='store_true', help='No retomar el job DeepSeek interrumpido de la ejecución (empezar uno nuevo).')
 
     # Comando export-pendientes-llm
     export_parser = subparsers.add_parser('export-pendientes-llm', help='Exporta pendientes LLM a CSV para una ejecución.')
@@ -63,6 +78,14 @@ def main():
     smooth_parser.add_argument('--write', action='store_true', help='Si se establece, aplica cambios en DB.')
     smooth_parser.add_argument('--verbose', action='store_true', help='Mostrar logs detallados durante el suavizado.')
 
+    # Comando repair-fases
+    repair_parser = subparsers.add_parser('repair-fases', help='Postprocess + suavizado + fase_seq en una sola pasada por conversación.')
+    repair_parser.add_argument('--ejecucion_id', required=True, type=int, help='ID de la ejecución a procesar.')
+    repair_parser.add_argument('--passes', default=','.join(REPAIR_PASSES), help=f'Pasadas a correr, en orden (opciones: {",".join(REPAIR_PASSES)}).')
+    repair_parser.add_argument('--conf_min', type=float, default=0.40, help='conf_min del suavizado (ver smooth-fases).')
+    repair_parser.add_argument('--write', action='store_true', help='Si se establece, aplica el diff en DB.')
+    repair_parser.add_argument('--verbose', action='store_true', help='Mostrar cambios por conversación.')
+
     args = parser.parse_args()
 
     try:
@@ -87,10 +110,15 @@ def main():
                 print(f"Error: El directorio de entrada '{args.input_dir}' no existe.")
                 sys.exit(1)
             
-            ingest_dir(conn, args.input_dir, args.notas)
+            if args.incremental:
+                ingest_dir_incremental(conn, args.input_dir, args.notas, workers=args.workers, batch_size=args.batch_size)
+            elif args.workers and args.workers > 0:
+                ingest_dir_parallel(conn, args.input_dir, args.notas, workers=args.workers, batch_size=args.batch_size)
+            else:
+                ingest_dir(conn, args.input_dir, args.notas)
         
         elif args.command == 'parse-turns':
-            parse_turns_for_run(conn, args.ejecucion_id, args.limit, args.verbose)
+            parse_turns_for_run(conn, args.ejecucion_id, args.limit, args.verbose, workers=args.workers)
 
         elif args.command == 'detect-fases':
             apply_fase_rules_for_run(
@@ -99,6 +127,8 @@ def main():
                 limit=args.limit,
                 conf_threshold=args.conf_threshold,
                 verbose=args.verbose,
+                workers=args.workers,
+                persist_text_norm=args.persist_text_norm,
             )
 
         elif args.command == 'pipeline-fases':
@@ -109,6 +139,7 @@ def main():
                 limit=args.limit,
                 conf_threshold=args.conf_threshold,
                 verbose=args.verbose,
+                workers=args.workers,
             )
 
             # 2) Exportar pendientes
@@ -142,6 +173,14 @@ def main():
                     cmd.append("--write")
                 if args.dry_run:
                     cmd.append("--dry_run")
+                if args.deepseek_batch_turns > 1:
+                    cmd.extend(["--batch_turns", str(args.deepseek_batch_turns)])
+                if args.deepseek_token_budget > 0:
+                    cmd.extend(["--token_budget", str(args.deepseek_token_budget)])
+                if args.deepseek_cost_budget > 0:
+                    cmd.extend(["--cost_budget", str(args.deepseek_cost_budget)])
+                if args.deepseek_new_job:
+                    cmd.append("--new_job")
                 
                 result = subprocess.run(cmd, capture_output=False)
                 if result.returncode != 0:
@@ -156,30 +195,30 @@ def main():
                 convs_llm_usado = int(cur.fetchone()[0])
                 cur.close()
 
-            # 4) Postprocesado
+            # 4) Postprocesado: correcciones (+ suavizado) + fase_seq en una pasada (run_repair), luego fase_8
             postprocess_executed = False
             if args.postprocess:
-                if args.verbose:
-                    print("\n--- Ejecutando postprocess_ejecucion.py ---")
-                
-                import subprocess
                 do_write_postprocess = bool(args.write) and (not args.dry_run)
-                cmd_post = [
-                    sys.executable, "-m", "scripts.postprocess_ejecucion",
-                    "--ejecucion_id", str(args.ejecucion_id),
-                    "--mapeo_version", args.mapeo_version,
-                    "--config", "config.ini",
-                ]
-                if do_write_postprocess:
-                    cmd_post.append("--write")
+                passes = ('postprocess', 'smooth', 'fase_seq') if args.smooth else ('postprocess', 'fase_seq')
                 if args.verbose:
-                    cmd_post.append("--verbose")
-                
-                result_post = subprocess.run(cmd_post, capture_output=False)
-                if result_post.returncode == 0:
+                    print(f"\n--- Reparación de fases ({','.join(passes)}) + fase_8 ---")
+                try:
+                    stats = run_repair(
+                        conn,
+                        ejecucion_id=args.ejecucion_id,
+                        passes=passes,
+                        conf_min=args.conf_min,
+                        write=do_write_postprocess,
+                        verbose=args.verbose,
+                    )
+                    print(format_repair_stats(stats))
+                    with transaction(conn, do_write_postprocess) as cur:
+                        ensure_and_update_fase_8(cur, args.ejecucion_id, args.mapeo_version, do_write_postprocess, args.verbose)
+                        if do_write_postprocess:
+                            show_metrics(cur, args.ejecucion_id)
                     postprocess_executed = True
-                else:
-                    print(f"WARNING: postprocess_ejecucion falló con código {result_post.returncode}")
+                except Exception as e:
+                    print(f"WARNING: postprocesado falló: {e}")
 
             # 5) Resumen final
             cur = conn.cursor()
@@ -272,6 +311,19 @@ def main():
                 verbose=args.verbose,
             )
 
+        elif args.command == 'repair-fases':
+            stats = run_repair(
+                conn,
+                ejecucion_id=args.ejecucion_id,
+                passes=args.passes,
+                conf_min=args.conf_min,
+                write=args.write,
+                verbose=args.verbose,
+            )
+            print("--- Reparación de Fases ---")
+            print(f"Ejecución: {args.ejecucion_id} pasadas={args.passes} modo={'write' if args.write else 'dry-run'}")
+            print(format_repair_stats(stats))
+
 
     finally:
         if conn and conn.is_connected():
@@ -0,0 +1,100 @@
+"""
+Test del iterador compartido por conversación (sa_core.conv_stream): keyset
+paginado sobre sqlite3, conversaciones vacías, filtros y registros __slots__.
+No requiere BD.
+"""
+import pickle
+import random
+import sqlite3
+import sys
+
+from sa_core.conv_stream import iter_conversation_chunks, iter_conversations
+
+
+class _SqliteCursor:
+    """Cursor con placeholders %s sobre sqlite3 (el SQL de iter_conversations es portable)."""
+
+    def __init__(self, db):
+        self.cur = db.cursor()
+        self.queries = 0
+
+    def execute(self, sql, params=()):
+        self.queries += 1
+        self.cur.execute(sql.replace("%s", "?"), params)
+
+    def fetchall(self):
+        return self.cur.fetchall()
+
+
+def test_conv_stream():
+    """Test 1: iter_conversations, keyset paginado agrupado por conversación con registros __slots__"""
+    db = sqlite3.connect(":memory:")
+    db.executescript(
+        "CREATE TABLE sa_conversaciones (conversacion_pk INTEGER PRIMARY KEY, ejecucion_id INT, conversacion_id TEXT, cliente_id TEXT);"
+        "CREATE TABLE sa_turnos (turno_pk INTEGER PRIMARY KEY, conversacion_pk INT, turno_idx INT, speaker TEXT, text TEXT, fase TEXT);"
+    )
+    rnd = random.Random(7)
+    esperado, pk = {}, 0
+    for conv_pk in range(1, 30):
+        ejecucion = 1 if conv_pk < 26 and conv_pk % 7 else 2  # la 7, 14 y 21 intercaladas en el rango
+        db.execute("INSERT INTO sa_conversaciones VALUES (?, ?, ?, ?)",
+                   (conv_pk, ejecucion, f"conv-{conv_pk}", "123" if conv_pk % 5 == 0 else None))
+        idxs = sorted(rnd.randint(1, 12) for _ in range(rnd.choice([0, 1, 4, 9])))  # vacías e idx repetidos
+        for idx in idxs:
+            pk += 1
+            db.execute("INSERT INTO sa_turnos VALUES (?, ?, ?, ?, ?, ?)", (pk, conv_pk, idx, "AGENTE", f"t{pk}", None))
+            if ejecucion == 1:
+                esperado.setdefault(conv_pk, []).append((pk, idx))
+
+    cur = _SqliteCursor(db)
+    leido = {conv.conversacion_pk: [(t.turno_pk, t.turno_idx) for t in turns]
+             for conv, turns in iter_conversations(cur, 1, columns=("text",), page_size=4)}
+    assert leido == esperado, (leido, esperado)
+    n_turnos = sum(len(v) for v in esperado.values())
+    # O(páginas), no O(conversaciones): bloques de 4 conversaciones + páginas de 4 turnos del rango de PK
+    n_bloques = (25 - 3) // 4 + 1
+    en_rango = db.execute("SELECT COUNT(*) FROM sa_turnos WHERE conversacion_pk < 26").fetchone()[0]
+    assert cur.queries <= 2 * n_bloques + en_rango // 4, cur.queries
+
+    # Conversaciones vacías, columnas de la conversación, filtro y límite
+    cur = _SqliteCursor(db)
+    convs = list(iter_conversations(cur, 1, columns=("text", "fase"), conv_columns=("conversacion_id",),
+                                    conv_where="c.cliente_id IS NULL", include_empty=True, page_size=3))
+    assert [c.conversacion_pk for c, _ in convs] == [pk for pk in range(1, 26) if pk % 5 and pk % 7]
+    assert all(c.conversacion_id == f"conv-{c.conversacion_pk}" for c, _ in convs)
+    assert all(turns == [] for c, turns in convs if c.conversacion_pk not in esperado)
+    primeras = list(iter_conversations(_SqliteCursor(db), 1, columns=("text",), include_empty=True, limit_convs=3, page_size=2))
+    assert [c.conversacion_pk for c, _ in primeras] == [1, 2, 3]
+    assert [len(ch) for ch in iter_conversation_chunks(iter(range(7)), 3)] == [3, 3, 1]
+
+    # Registros: atributos, acceso tipo dict, asignación y pickle (pool de procesos)
+    conv, turns = next((c, t) for c, t in convs if t)
+    t = turns[0]
+    assert t["text"] == t.text and t.get("fase_seq") is None and "fase" in t and not hasattr(t, "__dict__")
+    t["fase"] = "CIERRE"
+    assert pickle.loads(pickle.dumps(turns)) == turns and pickle.loads(pickle.dumps(conv)) == conv
+    try:
+        t["fase_seq"] = "X"
+        raise AssertionError("se esperaba KeyError")
+    except KeyError:
+        pass
+    print(f"✓ Test 1: iter_conversations, {len(esperado)} conversaciones / {n_turnos} turnos en páginas de 4")
+
+
+def run_all_tests():
+    print("=" * 70)
+    print("TEST: iterador de conversaciones por ejecución")
+    print("=" * 70)
+    ok = True
+    for test in (test_conv_stream,):
+        try:
+            test()
+        except AssertionError:
+            ok = False
+        print()
+    print("✓ TODOS LOS TESTS PASARON" if ok else "⚠ ALGUNOS TESTS FALLARON")
+    return ok
+
+
+if __name__ == "__main__":
+    sys.exit(0 if run_all_tests() else 1)
@@ -0,0 +1,51 @@
+"""
+Test de las pasadas de corrección de postprocess_ejecucion calculadas en memoria
+(sa_core.fase_postprocess): mismo orden y semántica que los UPDATE originales.
+No requiere BD.
+"""
+import sys
+
+from sa_core.fase_postprocess import PASSES, PostTurn, postprocess_conversation
+
+
+def test_postprocess_conversation():
+    """Test 1: pasadas de postprocess_ejecucion en memoria (mismo orden y semántica que los UPDATE)"""
+    filas = [
+        (1, "CIERRE", "RULES"), (2, "APERTURA", "RULES"), (3, None, "NOISE"), (4, "NEGOCIACION", "RULES"),
+        (5, "APERTURA", "RULES"), (6, "APERTURA", "RULES"), (7, "CIERRE", "DEEPSEEK"), (8, " ", "NOISE"),
+        (10, "CIERRE", "RULES"),
+    ]
+    turns = [PostTurn(100 + idx, idx, fase, src) for idx, fase, src in filas]
+    counters = dict.fromkeys(PASSES, 0)
+    patch = {pk: (fase, src) for pk, fase, src in postprocess_conversation(turns, counters)}
+
+    assert patch[108] == ("CIERRE", "NO_IMP")             # NOISE <- previo (CIERRE, todavía sin corregir)
+    assert patch[105] == ("NEGOCIACION", "AP_IMP")        # APERTURA en idx > 2 <- previo
+    assert patch[106] == ("NEGOCIACION", "AP_BK")         # el previo era APERTURA en la pasada 2: backfill
+    # idx 3 (NOISE imputado como APERTURA en la pasada 1) y 2: backfill desde el CIERRE del turno 1
+    assert patch[102] == ("CIERRE", "AP_BK") and patch[103] == ("CIERRE", "AP_BK")
+    assert patch[107] == ("NEGOCIACION", "CI_IMP")        # CIERRE con previo y siguiente
+    assert patch[101] == ("CIERRE", "CI_FIX1")            # CIERRE en turno 1 <- turno 2 (cuenta por el cambio de source)
+    assert 110 not in patch and 104 not in patch          # último turno (sin idx+1) y turnos válidos intactos
+    assert counters == {"noise_prev": 2, "noise_next": 0, "apertura_impute": 1, "apertura_backfill": 3,
+                        "cierre_impute": 1, "cierre_backfill": 0, "turno1_cierre": 1}, counters
+    print(f"✓ Test 1: postprocess en memoria, {len(patch)} turnos en el parche ({counters})")
+
+
+def run_all_tests():
+    print("=" * 70)
+    print("TEST: postprocess de fases en memoria")
+    print("=" * 70)
+    ok = True
+    for test in (test_postprocess_conversation,):
+        try:
+            test()
+        except AssertionError:
+            ok = False
+        print()
+    print("✓ TODOS LOS TESTS PASARON" if ok else "⚠ ALGUNOS TESTS FALLARON")
+    return ok
+
+
+if __name__ == "__main__":
+    sys.exit(0 if run_all_tests() else 1)
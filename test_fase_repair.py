@@ -0,0 +1,61 @@
+"""
+Test del motor de reparación de fases (sa_core.fase_repair): postprocess,
+suavizado y fase_seq encadenados en memoria, apagables y con un único diff.
+No requiere BD.
+"""
+import sys
+
+from sa_core.fase_repair import new_repair_stats, parse_passes, repair_conversation
+
+
+def test_repair_pipeline():
+    """Test 1: motor de reparación, pasadas encadenadas y apagables (A/B) con un único diff"""
+    def turnos():
+        filas = [(1, "APERTURA", "RULES", 0.9, "AGENTE", "buenos días"),
+                 (2, None, "NOISE", None, "CLIENTE", "si"),
+                 (3, "NEGOCIACION", "RULES", 0.3, "AGENTE", "le ofrezco un descuento"),
+                 (4, "IDENTIFICACION", "RULES", 0.2, "AGENTE", "me confirma su nombre"),
+                 (5, "CIERRE", "RULES", 0.9, "AGENTE", "gracias, hasta luego")]
+        return [{"turno_pk": 10 + i, "turno_idx": i, "fase": f, "fase_source": src, "fase_conf": conf,
+                 "fase_seq": None, "speaker": sp, "text": tx} for i, f, src, conf, sp, tx in filas]
+
+    ctx = {"conf_min": 0.40, "macro_map": {}}
+    todas = parse_passes("postprocess,smooth,fase_seq")
+    stats = new_repair_stats(todas)
+    diff = {row[0]: row[1:] for row in repair_conversation(turnos(), todas, ctx, stats)}
+    assert diff[12][0] == "APERTURA" and diff[12][2] == "NO_IMP"     # postprocess: NOISE <- previo
+    assert diff[13][2] == "SMOOTH" and stats["smooth"]["changes"] >= 1
+    assert all(row[3] for pk, row in diff.items() if pk != 12) and stats["fase_seq"]["total"] == 5
+
+    # Sin postprocess el turno NOISE queda sin fase; solo fase_seq no toca fase/fase_conf/fase_source
+    sin_post = parse_passes("smooth,fase_seq")
+    diff_b = {row[0]: row[1:] for row in repair_conversation(turnos(), sin_post, ctx, new_repair_stats(sin_post))}
+    assert 12 not in diff_b or diff_b[12][0] is None
+    st_seq = new_repair_stats(("fase_seq",))
+    repair_conversation(turnos(), ("fase_seq",), ctx, st_seq)
+    assert st_seq["por_columna"]["fase"] == st_seq["por_columna"]["fase_source"] == 0
+    try:
+        parse_passes("postprocess,foo")
+        raise AssertionError("se esperaba ValueError")
+    except ValueError:
+        pass
+    print(f"✓ Test 1: motor de reparación, diff de {len(diff)} turnos ({stats['por_columna']})")
+
+
+def run_all_tests():
+    print("=" * 70)
+    print("TEST: motor de reparación de fases")
+    print("=" * 70)
+    ok = True
+    for test in (test_repair_pipeline,):
+        try:
+            test()
+        except AssertionError:
+            ok = False
+        print()
+    print("✓ TODOS LOS TESTS PASARON" if ok else "⚠ ALGUNOS TESTS FALLARON")
+    return ok
+
+
+if __name__ == "__main__":
+    sys.exit(0 if run_all_tests() else 1)
@@ -0,0 +1,53 @@
+"""
+Test del triage local previo al LLM (sa_core.fase_triage): ranking con segundo
+candidato idéntico al motor de reglas y resolución por MARGEN/VECINOS/SPEAKER.
+No requiere BD.
+"""
+import sys
+
+from sa_core.fases_rules import detect_fase_rules_based, detect_fase_rules_ranked
+from sa_core.fase_triage import TRIAGE_CONF, triage_turn
+from test_fases_rules_engine import _corpus
+
+
+def test_triage():
+    """Test 1: ranking con segundo candidato y triage local antes del LLM"""
+    for text in _corpus(n=100, seed=13):
+        for last_phase in (None, "NEGOCIACION", "CIERRE"):
+            ranked = detect_fase_rules_ranked(text, 3, 10, last_phase, False)
+            assert ranked[:3] == detect_fase_rules_based(text, 3, 10, last_phase, False)
+            assert ranked[5] >= 0 and (ranked[3] is None or ranked[4] > 0)
+
+    # Margen claro confirmado por la fase del turno anterior
+    d = triage_turn("tiene una deuda pendiente de 300 soles", 4, 12, last_phase="IDENTIFICACION",
+                    prev_fase="INFORMACION_DEUDA", speaker="AGENTE")
+    assert d is not None and d.fase == "INFORMACION_DEUDA" and d.reason == "MARGEN"
+    # Sin confirmación del contexto: ambiguo -> LLM
+    assert triage_turn("tiene una deuda pendiente de 300 soles", 4, 12, prev_fase="CIERRE", next_fase="CIERRE") is None
+    # Sándwich de fases vecinas
+    d = triage_turn("mire usted la verdad", 5, 12, prev_fase="NEGOCIACION", next_fase="NEGOCIACION")
+    assert d == ("NEGOCIACION", TRIAGE_CONF, "VECINOS")
+    # Respuesta corta del cliente al agente; si el anterior es del cliente no aplica
+    d = triage_turn("mire usted la verdad", 5, 12, prev_fase="NEGOCIACION", speaker="CLIENTE", prev_speaker="AGENTE")
+    assert d is not None and d.reason == "SPEAKER"
+    assert triage_turn("mire usted la verdad", 5, 12, prev_fase="NEGOCIACION", speaker="CLIENTE", prev_speaker="CLIENTE") is None
+    print("✓ Test 1: ranking idéntico en (fase, conf, score) y triage MARGEN/VECINOS/SPEAKER/ambiguo")
+
+
+def run_all_tests():
+    print("=" * 70)
+    print("TEST: triage de fases previo al LLM")
+    print("=" * 70)
+    ok = True
+    for test in (test_triage,):
+        try:
+            test()
+        except AssertionError:
+            ok = False
+        print()
+    print("✓ TODOS LOS TESTS PASARON" if ok else "⚠ ALGUNOS TESTS FALLARON")
+    return ok
+
+
+if __name__ == "__main__":
+    sys.exit(0 if run_all_tests() else 1)
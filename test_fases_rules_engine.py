@@ -0,0 +1,147 @@
+"""
+Test del motor de reglas de fases: el scorer precompilado debe dar exactamente
+el mismo (fase, conf, score) que la implementación original (fases_rules_legacy).
+No requiere BD.
+"""
+import random
+import re
+import sys
+
+from sa_core.fases_rules import (
+    FASE_RULES,
+    FASE_SEQUENCE,
+    classify_conversation,
+    classify_many,
+    detect_fase_rules_based,
+    fase_score_vector,
+    normalize_text,
+)
+from sa_core.fases_rules_legacy import detect_fase_rules_based_legacy, normalize_text_legacy
+from sa_core.normalizacion import cache_stats, strip_diacritics
+
+# Textos con disparadores de las heurísticas contextuales y casos borde
+TEXTOS_FIJOS = [
+    "", ".", "Dígame.", "Sí señorita.", "ya.", "Ya", "¿Aló?", "Buenos días",
+    "9 3 1.", "5 8 6", "ya 123", "ya, 45 60", "350 soles", "100 y tanto de deuda",
+    "Ok. Cuando le brindo", "como le repito, su saldo", "hace 2 años que no trabajo en eso",
+    "le llamo mañana para coordinar el horario", "con quien tengo el gusto",
+    "muchas gracias, hasta luego", "SALDO PENDIENTE DE LA TARJETA", "ſaldo", "ıdentidad",
+    "S/ 200 para pagar la cuota", "mi esposo no tiene trabajo ahorita, no tengo",
+]
+
+
+def _vocabulario():
+    """Fragmentos literales tomados de las propias reglas."""
+    palabras = set()
+    for reglas in FASE_RULES.values():
+        for pattern in reglas:
+            for alt in pattern.pattern.split("|"):
+                alt = re.sub(r"\\[bsdw]|[()?*+\[\]{}\\^$]|\d,?", "", alt).strip()
+                if alt:
+                    palabras.add(alt)
+    return sorted(palabras) + TEXTOS_FIJOS
+
+
+def _corpus(n=400, seed=7):
+    rnd = random.Random(seed)
+    vocab = _vocabulario()
+    return TEXTOS_FIJOS + [
+        " ".join(rnd.choice(vocab) for _ in range(rnd.randint(1, 6))) for _ in range(n)
+    ]
+
+
+def test_identico_a_legacy():
+    """Test 1: mismo resultado que el motor original en todos los contextos"""
+    contextos = [None] + FASE_SEQUENCE
+    posiciones = [(1, 10, False), (3, 4, True), (9, 10, True)]
+    diferencias = []
+    evaluados = 0
+    for text in _corpus():
+        for last_phase in contextos:
+            for turn_idx, total, is_last in posiciones:
+                nuevo = detect_fase_rules_based(text, turn_idx, total, last_phase=last_phase, is_last_turns=is_last)
+                ref = detect_fase_rules_based_legacy(text, turn_idx, total, last_phase=last_phase, is_last_turns=is_last)
+                evaluados += 1
+                if nuevo != ref:
+                    diferencias.append((text, last_phase, turn_idx, nuevo, ref))
+
+    if diferencias:
+        print(f"✗ Test 1: {len(diferencias)} diferencias de {evaluados}")
+        for d in diferencias[:5]:
+            print(f"    {d}")
+    else:
+        print(f"✓ Test 1: {evaluados} evaluaciones idénticas al motor original")
+    assert not diferencias
+
+
+def test_score_vector():
+    """Test 2: vector de scores de tamaño fijo en orden FASE_SEQUENCE"""
+    scores = fase_score_vector(normalize_text("Su deuda asciende a 300 soles, ¿le parece bien?"))
+    assert len(scores) == len(FASE_SEQUENCE)
+    assert scores[FASE_SEQUENCE.index("INFORMACION_DEUDA")] > 0
+    assert scores[FASE_SEQUENCE.index("CONSULTA_ACEPTACION")] > 0
+    print(f"✓ Test 2: vector de scores {dict(zip(FASE_SEQUENCE, scores))}")
+
+
+def test_classify_conversation():
+    """Test 3: classify_conversation == bucle turno a turno con last_phase (y fases fijas)"""
+    corpus = _corpus(n=200, seed=11)
+    rnd = random.Random(5)
+    conversaciones = [corpus[i:i + 12] for i in range(0, len(corpus), 12)]
+    for textos in conversaciones:
+        turns = []
+        for idx, text in enumerate(textos, start=1):
+            fija = rnd.choice(FASE_SEQUENCE) if rnd.random() < 0.1 else None
+            turns.append((idx, text, fija))
+
+        esperado = []
+        last_phase = None
+        total = len(turns)
+        for idx, text, fija in turns:
+            if fija:
+                esperado.append((fija, None, None))
+                last_phase = fija
+                continue
+            fase, conf, score = detect_fase_rules_based_legacy(text, idx, total, last_phase=last_phase, is_last_turns=(total - idx) < 3)
+            if fase is None or conf < 0.55:
+                esperado.append((None, 0.0, score))
+            else:
+                esperado.append((fase, conf, score))
+                last_phase = fase
+
+        assert classify_conversation(turns, conf_threshold=0.55) == esperado
+
+    sin_fijas = [list(enumerate(textos, start=1)) for textos in conversaciones]
+    assert classify_many(sin_fijas) == [classify_conversation(c) for c in sin_fijas]
+    print(f"✓ Test 3: {len(conversaciones)} conversaciones clasificadas en batch igual que turno a turno")
+
+
+def test_normalizacion_cacheada():
+    """Test 4: normalize_text cacheado == original, con contadores de hits"""
+    textos = _corpus(n=200, seed=3) + ["Sí", "sí", "SÍ", "ya", "ok", "Ñandú: ¿Aló?", "x" * 500, "ſaldo ıdentidad"]
+    antes = cache_stats()["normalize_text"]["hits"]
+    for _ in range(2):
+        for text in textos:
+            assert normalize_text(text) == normalize_text_legacy(text)
+    assert cache_stats()["normalize_text"]["hits"] > antes
+    assert strip_diacritics("Señorita, ¿cómo está?") == "Senorita, ¿como esta?"
+    print(f"✓ Test 4: normalización idéntica; caché {cache_stats()['normalize_text']}")
+
+
+def run_all_tests():
+    print("=" * 70)
+    print("TEST: motor de reglas de fases (nuevo vs. original)")
+    print("=" * 70)
+    ok = True
+    for test in (test_identico_a_legacy, test_score_vector, test_classify_conversation, test_normalizacion_cacheada):
+        try:
+            test()
+        except AssertionError:
+            ok = False
+        print()
+    print("✓ TODOS LOS TESTS PASARON" if ok else "⚠ ALGUNOS TESTS FALLARON")
+    return ok
+
+
+if __name__ == "__main__":
+    sys.exit(0 if run_all_tests() else 1)
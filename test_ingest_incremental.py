@@ -0,0 +1,206 @@
+"""
+Test de la ingesta incremental (sa_core.ingest.ingest_dir_incremental) sobre
+sqlite3 con un adaptador mínimo de la conexión MySQL: salto por tamaño+mtime,
+vinculación por hash, INSERT que falla y reanudación desde el checkpoint; y de
+la ejecución parcial que informa ingest_files_parallel ante un error de BD.
+No requiere BD.
+"""
+import os
+import re
+import sqlite3
+import sys
+import tempfile
+
+from mysql.connector import Error
+
+from sa_core.ingest import IngestaInterrumpida, ingest_dir_incremental, ingest_files_parallel
+
+SCHEMA = """
+CREATE TABLE sa_ejecuciones (ejecucion_id INTEGER PRIMARY KEY, notas TEXT, input_dir TEXT);
+CREATE TABLE sa_conversaciones (conversacion_pk INTEGER PRIMARY KEY, ejecucion_id INT, conversacion_id TEXT,
+    raw_path TEXT, raw_text TEXT, total_turnos INT);
+CREATE TABLE sa_ingest_archivos (archivo_pk INTEGER PRIMARY KEY, raw_path TEXT UNIQUE, content_hash TEXT,
+    size_bytes INT, mtime REAL, conversacion_pk INT, ejecucion_id INT);
+CREATE TABLE sa_ingest_checkpoints (ejecucion_id INTEGER PRIMARY KEY, input_dir TEXT, status TEXT DEFAULT 'RUNNING',
+    last_path TEXT, files_done INT DEFAULT 0, files_skipped INT DEFAULT 0, files_linked INT DEFAULT 0);
+CREATE TRIGGER rechazar_malo BEFORE INSERT ON sa_conversaciones WHEN NEW.conversacion_id = 'malo.txt'
+BEGIN SELECT RAISE(ABORT, 'fila rechazada'); END;
+"""
+
+
+class _SqliteCursor:
+    """Cursor MySQL sobre sqlite3: %s, ON DUPLICATE KEY, LIKE con escape y errores como mysql Error."""
+
+    def __init__(self, db):
+        self.cur = db.cursor()
+
+    @property
+    def lastrowid(self):
+        return self.cur.lastrowid
+
+    def _sql(self, sql):
+        if "ON DUPLICATE KEY UPDATE" in sql:
+            sql = sql[:sql.index("ON DUPLICATE KEY UPDATE")].replace("INSERT INTO", "INSERT OR REPLACE INTO")
+        return sql.replace("LIKE %s", "LIKE %s ESCAPE '\\'").replace("%s", "?")
+
+    def execute(self, sql, params=()):
+        if sql.strip().startswith("CREATE TABLE IF NOT EXISTS"):
+            return  # el esquema sqlite lo crea el test
+        try:
+            self.cur.execute(self._sql(sql), params)
+        except sqlite3.Error as e:
+            raise Error(msg=str(e)) from None
+
+    def executemany(self, sql, rows):
+        # Un único INSERT multi-fila (atómico), como el executemany de mysql.connector
+        rows = list(rows)
+        sql = self._sql(sql)
+        values = re.search(r"VALUES\s*(\([^)]*\))", sql)
+        sql = sql[:values.start(1)] + ", ".join([values.group(1)] * len(rows))
+        try:
+            self.cur.execute(sql, [v for row in rows for v in row])
+        except sqlite3.Error as e:
+            raise Error(msg=str(e)) from None
+
+    def fetchone(self):
+        return self.cur.fetchone()
+
+    def fetchall(self):
+        return self.cur.fetchall()
+
+    def close(self):
+        self.cur.close()
+
+
+class _SqliteConn:
+    def __init__(self):
+        self.db = sqlite3.connect(":memory:")
+        self.db.executescript(SCHEMA)
+
+    def cursor(self):
+        return _SqliteCursor(self.db)
+
+    def commit(self):
+        self.db.commit()
+
+    def rollback(self):
+        self.db.rollback()
+
+    def query(self, sql, params=()):
+        return self.db.execute(sql, params).fetchall()
+
+
+def _write(input_dir, name, text):
+    path = os.path.join(input_dir, name)
+    with open(path, "w", encoding="utf-8") as f:
+        f.write(text)
+    return path
+
+
+def test_skip_link_y_insert_fallido():
+    """Test 1: salto por tamaño+mtime, vinculación por hash e INSERT que falla (sin registrar)"""
+    conn = _SqliteConn()
+    with tempfile.TemporaryDirectory() as input_dir:
+        a = _write(input_dir, "a.txt", "AGENTE: hola\nCLIENTE: hola")
+        b = _write(input_dir, "b.txt", "AGENTE: hola\nCLIENTE: hola")   # copia de a
+        c = _write(input_dir, "c.txt", "AGENTE: buen día")
+        malo = _write(input_dir, "malo.txt", "AGENTE: se rechaza")
+        z = _write(input_dir, "z.txt", "AGENTE: se rechaza")           # copia del que falla
+
+        ejecucion_id, inserted, stats = ingest_dir_incremental(conn, input_dir, "t1", batch_size=10)
+        assert ejecucion_id and inserted == 2 and stats.linked == 1 and stats.errors == 1
+        registro = dict(conn.query("SELECT raw_path, conversacion_pk FROM sa_ingest_archivos"))
+        convs = dict(conn.query("SELECT raw_path, conversacion_pk FROM sa_conversaciones"))
+        assert set(registro) == {a, b, c}, registro
+        assert registro[a] == registro[b] == convs[a] and registro[c] == convs[c]
+        assert malo not in convs and z not in registro
+
+        # Segunda corrida: a, b, c sin cambios se saltan sin leer; malo y z se reintentan
+        _, inserted, stats = ingest_dir_incremental(conn, input_dir, "t2", batch_size=10)
+        assert inserted == 0 and stats.skipped == 3 and stats.files == 2 and stats.errors == 1
+
+        # Sin el error, malo se inserta y z se vincula a él
+        conn.db.execute("DROP TRIGGER rechazar_malo")
+        _, inserted, stats = ingest_dir_incremental(conn, input_dir, "t3", batch_size=1)
+        registro = dict(conn.query("SELECT raw_path, conversacion_pk FROM sa_ingest_archivos"))
+        convs = dict(conn.query("SELECT raw_path, conversacion_pk FROM sa_conversaciones"))
+        assert inserted == 1 and stats.linked == 1 and registro[z] == registro[malo] == convs[malo]
+        assert conn.query("SELECT COUNT(*) FROM sa_ingest_archivos WHERE conversacion_pk IS NULL") == [(0,)]
+    print("✓ Test 1: salto por tamaño+mtime, vinculación por hash e INSERT fallido sin registrar")
+
+
+def test_reanudar_desde_checkpoint():
+    """Test 2: una lectura fallida frena el checkpoint; la reanudación la reintenta"""
+    conn = _SqliteConn()
+    with tempfile.TemporaryDirectory() as input_dir:
+        paths = [_write(input_dir, f"{name}.txt", f"AGENTE: {name}") for name in "abcd"]
+        calls = []
+
+        def progress(stats):
+            calls.append(stats.files)
+            if len(calls) == 1:
+                os.remove(paths[1])  # b falla al leerse
+            elif len(calls) == 3:
+                raise RuntimeError("corte")  # interrupción después de confirmar c
+
+        try:
+            ingest_dir_incremental(conn, input_dir, "t", batch_size=1, commit_every=1, progress_callback=progress)
+            raise AssertionError("se esperaba la interrupción")
+        except RuntimeError:
+            pass
+        (ejecucion_id, status, last_path), = conn.query(
+            "SELECT ejecucion_id, status, last_path FROM sa_ingest_checkpoints")
+        assert status == "RUNNING" and last_path == paths[0], last_path
+
+        _write(input_dir, "b.txt", "AGENTE: b")
+        resumed_id, inserted, stats = ingest_dir_incremental(conn, input_dir, "t", batch_size=1)
+        assert resumed_id == ejecucion_id and inserted == 2 and stats.skipped == 2
+        convs = conn.query("SELECT raw_path FROM sa_conversaciones WHERE ejecucion_id = ? ORDER BY raw_path",
+                           (ejecucion_id,))
+        assert [p for (p,) in convs] == paths
+        assert conn.query("SELECT status FROM sa_ingest_checkpoints") == [("DONE",)]
+    print("✓ Test 2: checkpoint frenado en la lectura fallida y reanudación sin duplicados")
+
+
+def test_ejecucion_parcial():
+    """Test 3: un error de BD a mitad de la ingesta informa la ejecución y lo ya confirmado"""
+    conn = _SqliteConn()
+    commit = conn.commit
+    commits = []
+
+    def failing_commit():
+        commits.append(1)
+        if len(commits) == 3:  # 1) ejecución, 2) primer chunk, 3) falla
+            raise Error(msg="conexión perdida")
+        commit()
+
+    conn.commit = failing_commit
+    with tempfile.TemporaryDirectory() as input_dir:
+        paths = [_write(input_dir, f"{name}.txt", f"AGENTE: {name}") for name in "abc"]
+        try:
+            ingest_files_parallel(conn, paths, "t", input_dir, workers=0, batch_size=1, commit_every=1)
+            raise AssertionError("se esperaba IngestaInterrumpida")
+        except IngestaInterrumpida as e:
+            assert e.ejecucion_id == 1 and e.inserted_count == 1 and "ejecucion_id=1" in str(e)
+        assert conn.query("SELECT raw_path FROM sa_conversaciones WHERE ejecucion_id = 1") == [(paths[0],)]
+    print("✓ Test 3: IngestaInterrumpida con la ejecución parcial y las conversaciones confirmadas")
+
+
+def run_all_tests():
+    print("=" * 70)
+    print("TEST: ingesta incremental / reanudable")
+    print("=" * 70)
+    ok = True
+    for test in (test_skip_link_y_insert_fallido, test_reanudar_desde_checkpoint, test_ejecucion_parcial):
+        try:
+            test()
+        except AssertionError as e:
+            print(f"✗ {test.__doc__}: {e}")
+            ok = False
+        print()
+    print("✓ TODOS LOS TESTS PASARON" if ok else "⚠ ALGUNOS TESTS FALLARON")
+    return ok
+
+
+if __name__ == "__main__":
+    sys.exit(0 if run_all_tests() else 1)
@@ -0,0 +1,332 @@
+"""
+Test del cliente LLM compartido (sa_core.llm_client) contra un servidor HTTP
+local que imita /v1/chat/completions. No requiere BD ni red externa.
+"""
+import json
+import sys
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import requests
+
+from sa_core.llm_backends import MockLLMServer, RulesBackend
+from sa_core.llm_cache import CacheMiss, LLMCache
+from sa_core.llm_client import LLMClient, TokenBucket
+from sa_core.llm_telemetry import LLMTelemetry, percentile
+
+
+class _StubHandler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"  # keep-alive
+    disable_nagle_algorithm = True
+
+    def setup(self):
+        super().setup()
+        with self.server.lock:
+            self.server.connections += 1
+
+    def log_message(self, *args):
+        pass
+
+    def do_POST(self):
+        body = json.loads(self.rfile.read(int(self.headers["Content-Length"])))
+        srv = self.server
+        with srv.lock:
+            srv.requests += 1
+            status = srv.statuses.pop(0) if srv.statuses else 200
+            srv.in_flight += 1
+            srv.max_in_flight = max(srv.max_in_flight, srv.in_flight)
+        time.sleep(srv.delay)
+        with srv.lock:
+            srv.in_flight -= 1
+
+        if status == 200:
+            content = json.dumps({"fase_id": body["messages"][-1]["content"], "confidence": 0.9, "is_noise": False})
+            usage = {"prompt_tokens": 100, "completion_tokens": 20, "total_tokens": 120}
+            payload = json.dumps({"choices": [{"message": {"content": content}}], "usage": usage}).encode()
+        else:
+            payload = b'{"error": "stub"}'
+        self.send_response(status)
+        if status == 429:
+            self.send_header("Retry-After", "0")
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(payload)))
+        self.end_headers()
+        self.wfile.write(payload)
+
+
+def _start_stub(statuses=None, delay=0.0):
+    srv = ThreadingHTTPServer(("127.0.0.1", 0), _StubHandler)
+    srv.daemon_threads = True
+    srv.lock = threading.Lock()
+    srv.statuses = list(statuses or [])
+    srv.delay = delay
+    srv.requests = srv.connections = srv.in_flight = srv.max_in_flight = 0
+    threading.Thread(target=srv.serve_forever, daemon=True).start()
+    return srv, f"http://127.0.0.1:{srv.server_address[1]}"
+
+
+def _client(url, **kw):
+    kw.setdefault("rate_per_sec", 0)
+    kw.setdefault("backoff_base", 0.01)
+    return LLMClient(url, "test-key", "stub-model", **kw)
+
+
+def test_reintentos_429_5xx():
+    """Test 1: 429 y 503 se reintentan; un 400 no"""
+    srv, url = _start_stub(statuses=[429, 503])
+    with _client(url) as client:
+        content = client.chat([{"role": "user", "content": "APERTURA"}])
+        assert json.loads(content)["fase_id"] == "APERTURA"
+        st = client.stats()
+        assert st["retries"] == 2 and st["http_429"] == 1 and st["http_5xx"] == 1 and st["ok"] == 1
+
+        srv.statuses = [400]
+        try:
+            client.chat([{"role": "user", "content": "x"}])
+            raise AssertionError("400 debería propagarse")
+        except requests.HTTPError:
+            pass
+        assert client.stats()["errors"] == 1
+
+        srv.statuses = [500, 500, 500]
+        client.max_retries = 2
+        try:
+            client.chat([{"role": "user", "content": "x"}])
+            raise AssertionError("se esperaba HTTPError tras agotar reintentos")
+        except requests.HTTPError:
+            pass
+    srv.shutdown()
+    print(f"✓ Test 1: reintentos OK ({client.format_stats()})")
+
+
+def test_concurrencia_y_keep_alive():
+    """Test 2: map_unordered respeta la concurrencia y reutiliza conexiones"""
+    srv, url = _start_stub(delay=0.05)
+    items = [f"T{i}" for i in range(24)]
+    with _client(url, concurrency=4) as client:
+        t0 = time.perf_counter()
+        results = {}
+        for item, content, exc in client.map_unordered(
+            lambda it: client.chat([{"role": "user", "content": it}]), items
+        ):
+            assert exc is None
+            results[item] = json.loads(content)["fase_id"]
+        dt = time.perf_counter() - t0
+    srv.shutdown()
+    assert results == {it: it for it in items}
+    assert srv.max_in_flight <= 4
+    assert srv.max_in_flight > 1
+    assert srv.connections <= 4, srv.connections
+    assert dt < 24 * 0.05
+    print(f"✓ Test 2: {len(items)} llamadas en {dt:.2f}s, max_in_flight={srv.max_in_flight}, conexiones={srv.connections}")
+
+
+def test_map_by_key_orden_por_grupo():
+    """Test 3: map_by_key procesa cada grupo en orden, uno a la vez"""
+    srv, url = _start_stub(delay=0.01)
+    groups = [[(g, i) for i in range(5)] for g in range(6)]
+    aplicados = []
+    en_vuelo = set()
+    with _client(url, concurrency=3) as client:
+        def prepare(item):
+            g, i = item
+            assert g not in en_vuelo, "dos ítems del mismo grupo en vuelo"
+            if i == 2:
+                return None  # resuelto sin LLM
+            en_vuelo.add(g)
+            return item
+
+        def call(item):
+            return client.chat([{"role": "user", "content": f"{item[0]}-{item[1]}"}])
+
+        for job, _content, exc in client.map_by_key(call, groups, prepare):
+            assert exc is None
+            en_vuelo.discard(job[0])
+            aplicados.append(job)
+    srv.shutdown()
+    for g in range(6):
+        assert [i for gg, i in aplicados if gg == g] == [0, 1, 3, 4]
+    print(f"✓ Test 3: {len(aplicados)} jobs aplicados en orden por grupo")
+
+
+def test_token_bucket():
+    """Test 4: el token bucket limita la tasa sostenida"""
+    bucket = TokenBucket(rate=50, capacity=1)
+    t0 = time.perf_counter()
+    for _ in range(11):
+        bucket.acquire()
+    dt = time.perf_counter() - t0
+    assert dt >= 0.18, dt
+    print(f"✓ Test 4: 11 tokens a 50/s en {dt:.2f}s")
+
+
+def test_cache_respuestas():
+    """Test 5: caché persistente: hit sin HTTP, cache_only, TTL y tope de entradas"""
+    from scripts.reclasificar_turnos_deepseek import call_deepseek
+
+    srv, url = _start_stub()
+    kwargs = dict(prev_fase=None, next_fase=None, turn_idx=3, total_turns=9,
+                  base_url=url, api_key="test-key", model="stub-model", allowed_phases=["APERTURA", "CIERRE"])
+    with _client(url) as client, LLMCache(":memory:") as cache:
+        r1 = call_deepseek("¿Me confirma su DNI por favor?", client=client, cache=cache, **kwargs)
+        r2 = call_deepseek("¿Me confirma su DNI por favor?", client=client, cache=cache, **kwargs)
+        assert r1 == r2
+        assert srv.requests == 1
+        st = cache.stats()
+        assert st["hits"] == 1 and st["misses"] == 1 and st["puts"] == 1
+
+        cache.cache_only = True
+        try:
+            call_deepseek("otro texto que nunca se consultó", client=client, cache=cache, **kwargs)
+            raise AssertionError("se esperaba CacheMiss")
+        except CacheMiss:
+            pass
+        assert srv.requests == 1
+
+        cache.ttl_secs = 1e-9
+        cache.cache_only = False
+        call_deepseek("¿Me confirma su DNI por favor?", client=client, cache=cache, **kwargs)
+        assert srv.requests == 2 and cache.stats()["expired"] == 1
+    srv.shutdown()
+
+    with LLMCache(":memory:", ttl_secs=0, max_entries=10) as cache:
+        for i in range(25):
+            cache.put(f"k{i}", "m", {"fase": "APERTURA", "conf": 0.9})
+            time.sleep(0.001)
+        cache.get("k0")  # el más viejo, pero usado recién: sobrevive
+        assert cache.evict() == 15
+        assert len(cache) == 10
+        assert cache.get("k0") is not None and cache.get("k1") is None
+    print(f"✓ Test 5: caché de respuestas OK ({st})")
+
+
+def test_batch_multiturno():
+    """Test 6: array multi-turno validado; lo que falta o viene mal va de a uno"""
+    from scripts.reclasificar_turnos_deepseek import call_deepseek_batch, parse_deepseek_batch_content
+
+    content = """```json
+    [{"turno_idx": 4, "fase_id": "Negociación", "confidence": 0.8, "is_noise": false},
+     {"turno_idx": 4, "fase_id": "CIERRE", "confidence": 0.9, "is_noise": false},
+     {"turno_idx": 99, "fase_id": "CIERRE", "confidence": 0.9, "is_noise": false},
+     {"turno_idx": "x"}, "basura",
+     {"turno_idx": 6, "fase_id": null, "confidence": 0.7, "is_noise": true}]
+    ```"""
+    res = parse_deepseek_batch_content(content, [4, 5, 6])
+    assert sorted(res) == [4, 6]
+    assert res[4]["fase"] == "NEGOCIACION" and res[4]["conf"] == 0.8
+    assert res[6]["is_noise"] == 1
+    try:
+        parse_deepseek_batch_content('{"fase_id": "CIERRE"}', [1])
+        raise AssertionError("se esperaba ValueError sin array")
+    except ValueError:
+        pass
+
+    # El stub responde un objeto (no array): todo el lote cae al fallback de a un turno
+    srv, url = _start_stub()
+    targets = [
+        {"text": f"texto {i}", "prev_fase": None, "next_fase": None, "turn_idx": i, "total_turns": 9,
+         "context_block": f"FALLBACK{i}", "last_phase_info": "last_phase=None"}
+        for i in (2, 3)
+    ]
+    with _client(url) as client:
+        out, n_fallback = call_deepseek_batch(
+            targets, context_block="bloque", last_phase_info="last_phase=None",
+            base_url=url, api_key="test-key", model="stub-model", allowed_phases=["CIERRE"], client=client,
+        )
+    srv.shutdown()
+    assert n_fallback == 2 and srv.requests == 3
+    assert sorted(out) == [2, 3] and all(isinstance(r, dict) for r in out.values())
+    print(f"✓ Test 6: batch multi-turno validado, {n_fallback} turnos por fallback")
+
+
+def test_telemetria_y_presupuesto():
+    """Test 7: usage/latencia/estado por llamada y corte por presupuesto de tokens"""
+    assert percentile([5, 1, 3, 2, 4], 50) == 3 and percentile([5, 1, 3, 2, 4], 95) == 5
+    assert percentile([], 50) is None
+
+    srv, url = _start_stub(statuses=[503, 400])
+    telemetry = LLMTelemetry(7, model="stub-model", token_budget=500,
+                             price_in_per_mtok=1.0, price_out_per_mtok=2.0)
+    with _client(url, telemetry=telemetry) as client:
+        telemetry.bind(turno_pk=42)
+        try:
+            client.chat([{"role": "user", "content": "x"}])
+            raise AssertionError("400 debería propagarse")
+        except requests.HTTPError:
+            pass
+        items = [f"T{i}" for i in range(10)]
+        despachados = 0
+        for _item, _content, exc in client.map_unordered(
+            lambda it: client.chat([{"role": "user", "content": it}]),
+            (it for it in items if not telemetry.budget_exhausted()),
+            max_in_flight=1,
+        ):
+            assert exc is None
+            despachados += 1
+    srv.shutdown()
+
+    st = telemetry.summary()
+    # 120 tokens por llamada OK: a la 5ta (600 >= 500) deja de despachar
+    assert despachados == 5, despachados
+    assert st["ok"] == 5 and st["errors"] == 1 and st["calls"] == 6
+    assert st["prompt_tokens"] == 500 and st["completion_tokens"] == 100
+    assert st["tokens_por_turno"] == 120
+    assert abs(st["costo_usd"] - (500 * 1.0 + 100 * 2.0) / 1e6) < 1e-12
+    assert st["p50_ms"] is not None and st["p95_ms"] >= st["p50_ms"]
+    filas = telemetry._pending
+    assert filas[0][3] == 42 and filas[0][5] == 400 and filas[0][6] == "ERROR" and filas[0][7] == 2
+    assert telemetry.budget_exhausted()
+    print(f"✓ Test 7: telemetría {telemetry.format_summary()}")
+
+
+def test_backends_locales():
+    """Test 8: backend de reglas en proceso y MockLLMServer con errores, sin API key real"""
+    from scripts.reclasificar_turnos_deepseek import call_deepseek, call_deepseek_batch
+
+    textos = {2: "tiene una deuda pendiente de 300 soles", 3: "muchas gracias por su tiempo, que tenga buen día"}
+    targets = [
+        {"text": t, "prev_fase": None, "next_fase": None, "turn_idx": i, "total_turns": 9,
+         "context_block": f"Turno idx=0 (OBJETIVO) (A): {t}", "last_phase_info": "last_phase=APERTURA"}
+        for i, t in textos.items()
+    ]
+    bloque = "\n".join(f"Turno idx={i} (OBJETIVO) (A): {t}" for i, t in textos.items())
+    with LLMClient("", "rules", "stub-model", rate_per_sec=0, backend=RulesBackend()) as client:
+        out, n_fallback = call_deepseek_batch(
+            targets, context_block=bloque, last_phase_info="last_phase=APERTURA",
+            base_url="", api_key="rules", model="stub-model", client=client,
+        )
+    assert n_fallback == 0 and sorted(out) == [2, 3], (n_fallback, out)
+    assert all(r["fase"] for r in out.values())
+
+    with MockLLMServer(latency_ms=5, latency_sigma=0, error_rate=0.3, seed=7) as mock:
+        with _client(mock.base_url, max_retries=8) as client:
+            res = [call_deepseek(t["text"], None, None, t["turn_idx"], 9, mock.base_url, "mock", "stub-model",
+                                 context_block=t["context_block"], client=client) for t in targets * 5]
+            st = client.stats()
+        ms = mock.stats()
+    assert len(res) == 10 and all(r["fase"] for r in res)
+    assert st["errors"] == 0 and st["retries"] == ms["errors"] > 0, (st, ms)
+    assert ms["requests"] == 10 + ms["errors"]
+    print(f"✓ Test 8: backends locales OK (mock: {ms['requests']} requests, {ms['errors']} errores reintentados)")
+
+
+def run_all_tests():
+    print("=" * 70)
+    print("TEST: cliente LLM (stub HTTP local)")
+    print("=" * 70)
+    ok = True
+    for test in (test_reintentos_429_5xx, test_concurrencia_y_keep_alive, test_map_by_key_orden_por_grupo, test_token_bucket,
+                 test_cache_respuestas, test_batch_multiturno, test_telemetria_y_presupuesto, test_backends_locales):
+        try:
+            test()
+        except AssertionError as e:
+            print(f"✗ {test.__name__}: {e}")
+            ok = False
+        print()
+    print("✓ TODOS LOS TESTS PASARON" if ok else "⚠ ALGUNOS TESTS FALLARON")
+    return ok
+
+
+if __name__ == "__main__":
+    sys.exit(0 if run_all_tests() else 1)
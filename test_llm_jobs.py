@@ -0,0 +1,155 @@
+"""
+Test de los jobs persistentes de reclasificación LLM (sa_core.llm_jobs.LLMJob)
+sobre sqlite3: claim por keyset, advance con reintentos persistidos en
+sa_llm_job_retries, finish DONE -> PAUSED con reintentos y reanudación que
+sirve primero los reintentos sin volver a reclamar lo ya procesado.
+No requiere BD.
+"""
+import sqlite3
+import sys
+
+from sa_core.llm_jobs import STATUS_DONE, STATUS_PAUSED, LLMJob
+
+SCHEMA = """
+CREATE TABLE sa_conversaciones (conversacion_pk INTEGER PRIMARY KEY, ejecucion_id INT);
+CREATE TABLE sa_turnos (turno_pk INTEGER PRIMARY KEY, conversacion_pk INT, turno_idx INT, fase TEXT);
+CREATE TABLE sa_llm_jobs (job_pk INTEGER PRIMARY KEY, ejecucion_id INT, origen TEXT, status TEXT,
+    last_turno_pk INT DEFAULT 0, turnos INT DEFAULT 0, escritos INT DEFAULT 0, llamadas INT DEFAULT 0,
+    errores INT DEFAULT 0);
+CREATE TABLE sa_llm_job_retries (job_pk INT, turno_pk INT, PRIMARY KEY (job_pk, turno_pk));
+INSERT INTO sa_conversaciones VALUES (1, 1), (2, 1), (3, 2);
+INSERT INTO sa_turnos VALUES (1, 1, 0, NULL), (2, 1, 1, NULL), (3, 1, 2, NULL),
+    (4, 2, 0, NULL), (5, 2, 1, ''), (6, 2, 2, NULL), (7, 3, 0, NULL);
+"""
+
+COLUMNS = "t.turno_pk, t.conversacion_pk, t.turno_idx"
+
+
+class _SqliteCursor:
+    """Cursor MySQL sobre sqlite3 (%s -> ?); el esquema lo crea el test."""
+
+    def __init__(self, db):
+        self.cur = db.cursor()
+
+    @property
+    def lastrowid(self):
+        return self.cur.lastrowid
+
+    def execute(self, sql, params=()):
+        if sql.strip().startswith("CREATE TABLE IF NOT EXISTS"):
+            return
+        self.cur.execute(sql.replace("%s", "?"), params)
+
+    def executemany(self, sql, rows):
+        self.cur.executemany(sql.replace("%s", "?"), rows)
+
+    def fetchone(self):
+        return self.cur.fetchone()
+
+    def fetchall(self):
+        return self.cur.fetchall()
+
+    def close(self):
+        self.cur.close()
+
+
+class _SqliteConn:
+    def __init__(self):
+        self.db = sqlite3.connect(":memory:")
+        self.db.executescript(SCHEMA)
+
+    def cursor(self):
+        return _SqliteCursor(self.db)
+
+    def commit(self):
+        self.db.commit()
+
+    def query(self, sql, params=()):
+        return self.db.execute(sql, params).fetchall()
+
+
+def _resolve(conn, pks):
+    conn.db.executemany("UPDATE sa_turnos SET fase='CIERRE' WHERE turno_pk=?", [(pk,) for pk in pks])
+    conn.db.commit()
+
+
+def _claim(conn, job, limit=3):
+    cur = conn.cursor()
+    try:
+        return [row[0] for row in job.claim(cur, COLUMNS, limit)]
+    finally:
+        cur.close()
+
+
+def test_reintentos_y_reanudacion():
+    """Test 1: el cursor avanza con reintentos persistidos; finish queda PAUSED y la reanudación los sirve primero"""
+    conn = _SqliteConn()
+    job = LLMJob.start(conn, 1, "SCRIPT")
+    assert not job.resumed
+
+    assert _claim(conn, job) == [1, 2, 3]
+    _resolve(conn, [1, 3])                   # el 2 falla (error de API)
+    assert job.advance({2}, turnos=3, escritos=2, llamadas=2, errores=1) == 3
+    assert conn.query("SELECT turno_pk FROM sa_llm_job_retries") == [(2,)]
+
+    assert _claim(conn, job) == [4, 5, 6]    # el reintento no se vuelve a servir en esta corrida
+    _resolve(conn, [4, 5, 6])
+    assert job.advance(turnos=3, escritos=3, llamadas=3) == 6
+    assert _claim(conn, job) == []
+    job.finish(STATUS_DONE)
+    assert job.status == STATUS_PAUSED
+    assert conn.query("SELECT status, last_turno_pk, turnos, errores FROM sa_llm_jobs") == [
+        (STATUS_PAUSED, 6, 6, 1)]
+
+    # Reanudación: solo el reintento, sin volver a reclamar (ni pagar) 3..6
+    resumed = LLMJob.start(conn, 1, "SCRIPT")
+    assert resumed.resumed and resumed.job_pk == job.job_pk and resumed.last_turno_pk == 6
+    assert "reintentos=1" in resumed.format_status()
+    assert _claim(conn, resumed) == [2]
+    _resolve(conn, [2])
+    resumed.advance(turnos=1, escritos=1, llamadas=1)
+    assert _claim(conn, resumed) == []
+    resumed.finish(STATUS_DONE)
+    assert conn.query("SELECT status, turnos FROM sa_llm_jobs") == [(STATUS_DONE, 7)]
+    assert conn.query("SELECT COUNT(*) FROM sa_llm_job_retries") == [(0,)]
+    print("✓ Test 1: cursor hasta lo reclamado, reintentos persistidos, PAUSED y reanudación sin re-facturar")
+
+
+def test_reintento_resuelto_afuera():
+    """Test 2: un reintento que ya no está pendiente se descarta y el claim sigue con el keyset"""
+    conn = _SqliteConn()
+    job = LLMJob.start(conn, 1, "UI")
+    assert _claim(conn, job, limit=2) == [1, 2]
+    job.advance({1, 2})
+    job.finish(STATUS_PAUSED)
+
+    _resolve(conn, [1, 2])                   # resueltos por otra corrida
+    resumed = LLMJob.start(conn, 1, "UI")
+    assert _claim(conn, resumed, limit=2) == [3, 4]
+    resumed.advance()
+    assert conn.query("SELECT COUNT(*) FROM sa_llm_job_retries") == [(0,)]
+    assert _claim(conn, resumed, limit=5) == [5, 6]   # el turno 7 es de otra ejecución
+    resumed.advance()
+    resumed.finish(STATUS_DONE)
+    assert resumed.status == STATUS_DONE
+    print("✓ Test 2: reintento resuelto afuera descartado y keyset desde el cursor")
+
+
+def run_all_tests():
+    print("=" * 70)
+    print("TEST: jobs persistentes de reclasificación LLM")
+    print("=" * 70)
+    ok = True
+    for test in (test_reintentos_y_reanudacion, test_reintento_resuelto_afuera):
+        try:
+            test()
+        except AssertionError as e:
+            print(f"✗ {test.__doc__}: {e}")
+            ok = False
+        print()
+    print("✓ TODOS LOS TESTS PASARON" if ok else "⚠ ALGUNOS TESTS FALLARON")
+    return ok
+
+
+if __name__ == "__main__":
+    sys.exit(0 if run_all_tests() else 1)
@@ -185,6 +185,54 @@ def test_fallback_when_file_missing():
         traceback.print_exc()
         return False
 
+def test_prompt_compacto():
+    """Test 6: prefijo estable, contexto sin relleno y roles desde speaker"""
+    try:
+        sys.path.insert(0, '.')
+        from scripts.reclasificar_turnos_deepseek import _build_llm_prompts
+        from sa_core.prompt_builder import build_context_block, estimate_tokens, stats
+
+        turns = {
+            3: ("AGENTE", "Le comento que su deuda es de 300 soles"),
+            4: ("CLIENTE", "ya"),
+            5: ("CLIENTE", "no tengo trabajo ahorita"),
+            6: ("CLIENTE", "ok"),
+        }
+        block = build_context_block(turns, range(2, 7), {6}, lambda i: f"Turno idx={i}")
+        lineas = block.splitlines()
+        if [l.split(" ")[1] for l in lineas] != ["idx=3", "idx=5", "idx=6"]:
+            print(f"✗ Test 6: contexto inesperado: {lineas}")
+            return False
+        if not lineas[0].startswith("Turno idx=3 (A):") or not lineas[1].startswith("Turno idx=5 (C):"):
+            print(f"✗ Test 6: roles no salen de speaker: {lineas}")
+            return False
+        if block.saved_tokens <= 0:
+            print("✗ Test 6: no se contabilizó el ahorro del relleno omitido")
+            return False
+
+        allowed = ["APERTURA", "NEGOCIACION", "CIERRE"]
+        antes = stats()["requests"]
+        s1, u1 = _build_llm_prompts(block, "last_phase=APERTURA", allowed)
+        s2, u2 = _build_llm_prompts("Turno idx=0 (OBJETIVO) (C): otro texto", "last_phase=None", allowed)
+        comun = len(u1)
+        for i, (a, b) in enumerate(zip(u1, u2)):
+            if a != b:
+                comun = i
+                break
+        if s1 != s2 or "Salida EXACTA JSON" not in u1[:comun] or "APERTURA, NEGOCIACION" not in u1[:comun]:
+            print("✗ Test 6: el prefijo estático no es común a las llamadas")
+            return False
+        if stats()["requests"] != antes + 2 or estimate_tokens(u1) <= 0:
+            print("✗ Test 6: métricas de tokens no registradas")
+            return False
+        print(f"✓ Test 6: prefijo común de {comun} chars, {block.saved_tokens} tokens de relleno omitidos")
+        return True
+    except Exception as e:
+        print(f"✗ Test 6: Error: {e}")
+        import traceback
+        traceback.print_exc()
+        return False
+
 def run_all_tests():
     """Ejecuta todos los tests"""
     print("=" * 70)
@@ -197,7 +245,8 @@ def run_all_tests():
         test_prompt_file_format,
         test_load_prompt_function,
         test_build_llm_prompts_fallback,
-        test_fallback_when_file_missing
+        test_fallback_when_file_missing,
+        test_prompt_compacto
     ]
     
     results = []
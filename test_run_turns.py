@@ -0,0 +1,83 @@
+"""
+Test del contenedor columnar de turnos (sa_core.run_turns): RunTurns cargada con
+keyset sobre sqlite3, vocabulario de fases y vistas por conversación sin copias.
+No requiere BD.
+"""
+import random
+import sqlite3
+import sys
+
+from sa_core.conv_stream import iter_conversations
+from sa_core.run_turns import RunTurns, load_phase_vocab
+from test_conv_stream import _SqliteCursor
+
+
+def test_run_turns():
+    """Test 1: RunTurns, columnas + vocabulario de fases + vistas por conversación sin copias"""
+    db = sqlite3.connect(":memory:")
+    db.executescript(
+        "CREATE TABLE fases_conversacion (fase_id TEXT, orden_fase INT);"
+        "INSERT INTO fases_conversacion VALUES ('IDENTIFICACION', 2), ('APERTURA', 1);"
+        "CREATE TABLE sa_fase_macro_map (fase TEXT, macro_fase TEXT);"
+        "INSERT INTO sa_fase_macro_map VALUES ('CONSULTA_ACEPTACION', 'NEGOCIACION');"
+        "CREATE TABLE sa_conversaciones (conversacion_pk INTEGER PRIMARY KEY, ejecucion_id INT);"
+        "CREATE TABLE sa_turnos (turno_pk INTEGER PRIMARY KEY, conversacion_pk INT, turno_idx INT, speaker TEXT,"
+        " text TEXT, fase TEXT, fase_seq TEXT, fase_conf REAL, fase_source TEXT);"
+    )
+    rnd = random.Random(11)
+    fases = [None, "", "APERTURA", "NEGOCIACION", "CONSULTA_ACEPTACION", "CIERRE "]
+    pk = 0
+    for conv_pk in (3, 5, 8, 13):
+        db.execute("INSERT INTO sa_conversaciones VALUES (?, 1)", (conv_pk,))
+        for idx in range(1, rnd.randint(2, 9)):
+            pk += 1
+            fase = rnd.choice(fases)
+            db.execute("INSERT INTO sa_turnos VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)",
+                       (pk, conv_pk, idx, rnd.choice(["AGENTE", "CLIENTE", None]), rnd.choice(["", "sí", "señor ñandú"]),
+                        fase, rnd.choice([None, "NEGOCIACION"]), None if fase is None else 0.5, rnd.choice([None, "RULES"])))
+
+    vocab, macro_map = load_phase_vocab(_SqliteCursor(db))
+    assert vocab.values[:4] == [None, "APERTURA", "IDENTIFICACION", "CONSULTA_ACEPTACION"] and macro_map
+    cols = ("fase", "fase_seq")
+    run = RunTurns.from_db(_SqliteCursor(db), 1, phase_columns=cols, vocab=vocab, page_size=5)
+    esperado = list(iter_conversations(_SqliteCursor(db), 1, columns=("speaker", "text", *cols, "fase_conf", "fase_source")))
+    assert run.n_convs == 4 and run.n_turns == pk and list(run.conv_pks) == [3, 5, 8, 13]
+    for view, (conv, turns) in zip(run.conversations(), esperado):
+        assert view.conversacion_pk == conv.conversacion_pk and len(view) == len(turns)
+        assert list(view.turno_pk) == [t.turno_pk for t in turns] and list(view.turno_idx) == [t.turno_idx for t in turns]
+        for j, t in enumerate(turns):
+            assert (view.phase(j), view.phase(j, "fase_seq"), view.text(j)) == (t.fase, t.fase_seq, t.text)
+            assert (view.conf(j), view.source(j), run.speakers[view.speaker[j]]) == (t.fase_conf, t.fase_source, t.speaker)
+
+    # Vistas y ndarray comparten el buffer: escribir en la ejecución se ve en ambos
+    view = run.conversation(8)
+    fases_np = run.as_numpy("fase")
+    view.set_phase(0, "CIERRE")
+    assert view.phase(0) == "CIERRE" and fases_np[view.start] == vocab.code("CIERRE") == view.phases()[0]
+    blank = vocab.blank_mask()
+    assert blank[vocab.code("")] and blank[0] and not blank[vocab.code("CIERRE ")]
+    try:
+        run.conversation(4)
+        raise AssertionError("se esperaba KeyError")
+    except KeyError:
+        pass
+    print(f"✓ Test 1: RunTurns, {run.n_turns} turnos en {run.nbytes()} bytes, vocabulario de {len(vocab)} fases")
+
+
+def run_all_tests():
+    print("=" * 70)
+    print("TEST: RunTurns (turnos de la ejecución en columnas)")
+    print("=" * 70)
+    ok = True
+    for test in (test_run_turns,):
+        try:
+            test()
+        except AssertionError:
+            ok = False
+        print()
+    print("✓ TODOS LOS TESTS PASARON" if ok else "⚠ ALGUNOS TESTS FALLARON")
+    return ok
+
+
+if __name__ == "__main__":
+    sys.exit(0 if run_all_tests() else 1)
@@ -0,0 +1,83 @@
+"""
+Test de las métricas de secuencia vectorizadas (sa_core.seq_metrics): mismo
+resultado que build_secuencias.analyze_conversation conversación por conversación.
+No requiere BD.
+"""
+import random
+import sys
+
+from sa_core.run_turns import RunTurns
+from sa_core.seq_metrics import SEQ_PHASE_COLUMNS, sequence_metrics
+from scripts.build_secuencias import ALLOWED_TRANSITIONS, analyze_conversation, resolve_engine
+
+
+def test_sequence_metrics():
+    """Test 1: métricas de secuencia vectorizadas == analyze_conversation por conversación"""
+    rnd = random.Random(25)
+    macros = ["APERTURA", "IDENTIFICACION", "INFORMACION_DEUDA", "NEGOCIACION", "CONSULTA_ACEPTACION",
+              "FORMALIZACION_PAGO", "ADVERTENCIAS", "CIERRE"]
+    fases = macros + [None, "", "   ", "CIERRE ", "SALUDO", "OFERTA", "RUIDO", "SIN_MACRO"]
+    macro_map = {"SALUDO": "APERTURA", "OFERTA": "NEGOCIACION", "RUIDO": "", "SIN_MACRO": None, "CIERRE ": "CIERRE"}
+    conversations = []
+    for conv_pk in range(1, 301):
+        n = rnd.choice([0, 1, 2, rnd.randint(3, 25)])
+        turns = [
+            {"turno_pk": conv_pk * 100 + idx, "turno_idx": idx, "fase": rnd.choice(fases),
+             "fase_8": rnd.choice(fases), "fase_seq": rnd.choice([None, None, "", " ", *macros])}
+            for idx in range(1, n + 1)
+        ]
+        # Rachas de la misma fase para que la compactación tenga qué colapsar
+        for a, b in zip(turns, turns[1:]):
+            if rnd.random() < 0.4:
+                b["fase"], b["fase_seq"] = a["fase"], a["fase_seq"]
+        conversations.append((conv_pk, turns))
+
+    esperado = [(pk, analyze_conversation(pk, turns, macro_map)) for pk, turns in conversations]
+    run = RunTurns.from_conversations(conversations, phase_columns=SEQ_PHASE_COLUMNS, with_text=False, with_conf=False)
+    resultado = sequence_metrics(run, macro_map, ALLOWED_TRANSITIONS)
+    assert resultado == esperado
+    con_fases = [r for _pk, r in resultado if r is not None]
+    assert all(type(r["cobertura_fases"]) is int and type(r["cumple_secuencia"]) is int for r in con_fases)
+    assert any(r["violaciones_transicion"] for r in con_fases) and any(r["cumple_secuencia"] for r in con_fases)
+    assert sequence_metrics(RunTurns(phase_columns=SEQ_PHASE_COLUMNS), macro_map, ALLOWED_TRANSITIONS) == []
+    print(f"✓ Test 1: métricas de secuencia vectorizadas, {len(con_fases)}/{len(resultado)} conversaciones con fases")
+
+
+
+def test_sin_numpy():
+    """Test 2: build_secuencias se importa sin NumPy y engine='numpy' pasa a 'python'"""
+    assert resolve_engine("numpy") == "numpy" and resolve_engine("python") == "python"
+    saved = {name: sys.modules.pop(name) for name in ("scripts.build_secuencias", "sa_core.seq_metrics")}
+    saved["numpy"] = sys.modules["numpy"]
+    sys.modules["numpy"] = None  # import numpy -> ImportError
+    try:
+        import scripts.build_secuencias as build
+        assert "sa_core.seq_metrics" not in sys.modules
+        assert build.resolve_engine("numpy") == "python"
+        try:
+            build.resolve_engine("rust")
+            raise AssertionError("se esperaba ValueError")
+        except ValueError:
+            pass
+    finally:
+        sys.modules.update(saved)
+    print("✓ Test 2: build_secuencias importable sin NumPy, con fallback a engine='python'")
+
+
+def run_all_tests():
+    print("=" * 70)
+    print("TEST: métricas de secuencia vectorizadas")
+    print("=" * 70)
+    ok = True
+    for test in (test_sequence_metrics, test_sin_numpy):
+        try:
+            test()
+        except AssertionError:
+            ok = False
+        print()
+    print("✓ TODOS LOS TESTS PASARON" if ok else "⚠ ALGUNOS TESTS FALLARON")
+    return ok
+
+
+if __name__ == "__main__":
+    sys.exit(0 if run_all_tests() else 1)
@@ -1,6 +1,7 @@
 """
 Pipeline de análisis completo para ejecuciones
 """
+import itertools
 import logging
 from typing import Callable, Optional
 import os
@@ -11,6 +12,19 @@ from sa_core.turnos import parse_turns_for_run
 from sa_core.fases import detect_fases_for_run
 from sa_core.fase_guardrails import apply_guardrails, has_meaningful_text
 from sa_core.cliente_id import ensure_cliente_id_column, fill_cliente_id_for_ejecucion
+from sa_core.conv_index import ConversationIndex
+from sa_core.fase_triage import TRIAGE_MIN_MARGIN, TRIAGE_SOURCE, format_triage, triage_turn
+from sa_core.llm_cache import DEFAULT_CACHE_PATH, DEFAULT_TTL_DAYS, LLMCache
+from sa_core.llm_backends import make_backend
+from sa_core.llm_client import DEFAULT_CONCURRENCY, DEFAULT_RATE_PER_SEC, LLMClient
+from sa_core.llm_jobs import JOB_CHUNK, PENDING_FASE, STATUS_DONE, STATUS_FAILED, STATUS_PAUSED, LLMJob
+from sa_core.llm_telemetry import (
+    DEFAULT_PRICE_IN_PER_MTOK,
+    DEFAULT_PRICE_OUT_PER_MTOK,
+    LLMTelemetry,
+    ensure_llm_calls_table,
+)
+from sa_core.prompt_builder import build_context_block, format_stats as format_prompt_stats, reset_stats as reset_prompt_stats
 
 # Scripts de secuencias
 from scripts.build_fase_seq import run_build_fase_seq
@@ -156,6 +170,10 @@ def _run_deepseek_for_pendientes(conn, ejecucion_id: int, conf_threshold: float,
     Criterio de pendiente:
     - fase IS NULL OR TRIM(fase) = ''
     
+    Los batches se reclaman con keyset desde el cursor de un job de sa_llm_jobs
+    (origen UI): si la corrida se corta, la próxima retoma desde el último batch
+    confirmado sin volver a mandar al LLM lo ya procesado.
+    
     Args:
         max_iters: Máximo de iteraciones/batches a procesar
         batch_size: Tamaño del batch por iteración
@@ -197,6 +215,9 @@ def _run_deepseek_for_pendientes(conn, ejecucion_id: int, conf_threshold: float,
         
         return False
     
+    client = None
+    cache = None
+    llm_job = None
     try:
         # Importar módulo de DeepSeek
         try:
@@ -210,8 +231,13 @@ def _run_deepseek_for_pendientes(conn, ejecucion_id: int, conf_threshold: float,
         deepseek_base_url = cfg.get('deepseek', 'base_url', fallback=None)
         deepseek_api_key = cfg.get('deepseek', 'api_key', fallback=None)
         deepseek_model = cfg.get('deepseek', 'model', fallback='deepseek-chat')
+        deepseek_timeout = cfg.getfloat('deepseek', 'timeout_seconds', fallback=60)
+        deepseek_concurrency = cfg.getint('deepseek', 'concurrency', fallback=DEFAULT_CONCURRENCY)
+        deepseek_rate = cfg.getfloat('deepseek', 'rate_per_sec', fallback=DEFAULT_RATE_PER_SEC)
+        # http = API (o un MockLLMServer local); rules = motor de reglas en proceso (benchmarks)
+        deepseek_backend = cfg.get('deepseek', 'backend', fallback='http')
         
-        if not deepseek_base_url or not deepseek_api_key:
+        if deepseek_backend == 'http' and (not deepseek_base_url or not deepseek_api_key):
             logger.warning("Configuración de DeepSeek incompleta en config.ini")
             report("⚠️ DeepSeek no configurado (revisar config.ini)")
             return
@@ -235,26 +261,49 @@ def _run_deepseek_for_pendientes(conn, ejecucion_id: int, conf_threshold: float,
                 "CONSULTA_ACEPTACION", "FORMALIZACION_PAGO", "ADVERTENCIAS", "CIERRE"
             ]
         
-        # Obtener turnos pendientes (solo NULL o vacíos)
-        # Criterio: fase NULL O vacía (sin considerar confianza)
-        query = """
-            SELECT t.turno_pk, t.conversacion_pk, t.turno_idx, t.text, t.speaker,
-                   t.fase, t.fase_conf, t.fase_source,
-                   c.total_turnos, c.conversacion_id
-            FROM sa_turnos t
-            JOIN sa_conversaciones c ON c.conversacion_pk = t.conversacion_pk
-            WHERE c.ejecucion_id = %s
-              AND (t.fase IS NULL OR TRIM(t.fase) = '')
-            ORDER BY c.conversacion_pk, t.turno_idx
+        # Turnos pendientes (fase NULL o vacía, sin considerar confianza), reclamados
+        # por keyset desde el cursor del job
+        pending_columns = """
+            t.turno_pk, t.conversacion_pk, t.turno_idx, t.text, t.speaker,
+            t.fase, t.fase_conf, t.fase_source,
+            c.total_turnos, c.conversacion_id
         """
+        claim_size = batch_size if batch_size > 0 else JOB_CHUNK
         
-        # Agregar LIMIT para batch_size
-        query_params = (ejecucion_id,)
-        if batch_size > 0:
-            query += " LIMIT %s"
-            query_params = query_params + (batch_size,)
-        
-        report(f"  📊 Iniciando DeepSeek en batches (max_iters={max_iters}, batch_size={batch_size})")
+        report(f"  📊 Iniciando DeepSeek en batches (max_iters={max_iters}, batch_size={batch_size}, concurrency={deepseek_concurrency})")
+
+        reset_prompt_stats()
+        # Telemetría por llamada (sa_llm_llamadas) y presupuesto opcional de la corrida
+        telemetry = LLMTelemetry(
+            ejecucion_id, origen="UI", model=deepseek_model,
+            token_budget=cfg.getint('deepseek', 'token_budget', fallback=0),
+            cost_budget=cfg.getfloat('deepseek', 'cost_budget', fallback=0.0),
+            price_in_per_mtok=cfg.getfloat('deepseek', 'price_in_per_mtok', fallback=DEFAULT_PRICE_IN_PER_MTOK),
+            price_out_per_mtok=cfg.getfloat('deepseek', 'price_out_per_mtok', fallback=DEFAULT_PRICE_OUT_PER_MTOK),
+        )
+        ensure_llm_calls_table(conn)
+        # Triage: casos de alta certeza se resuelven sin LLM (fase_source='TRIAGE')
+        triage_enabled = cfg.getboolean('deepseek', 'triage', fallback=True)
+        triage_min_margin = cfg.getint('deepseek', 'triage_min_margin', fallback=TRIAGE_MIN_MARGIN)
+        triage_resolved = {}
+        llm_jobs_total = 0
+
+        # Cliente compartido: sesión keep-alive, rate limit y reintentos 429/5xx
+        client = LLMClient(
+            deepseek_base_url, deepseek_api_key, deepseek_model,
+            concurrency=deepseek_concurrency,
+            rate_per_sec=deepseek_rate,
+            timeout=deepseek_timeout,
+            telemetry=telemetry,
+            backend=make_backend(deepseek_backend, deepseek_base_url, deepseek_api_key, deepseek_concurrency),
+        )
+        # Caché persistente de respuestas (mismo prompt => sin llamada a la API)
+        if cfg.getboolean('deepseek', 'cache_enabled', fallback=True):
+            cache = LLMCache(
+                cfg.get('deepseek', 'cache_path', fallback=DEFAULT_CACHE_PATH),
+                ttl_secs=cfg.getfloat('deepseek', 'cache_ttl_days', fallback=DEFAULT_TTL_DAYS) * 86400,
+                cache_only=cfg.getboolean('deepseek', 'cache_only', fallback=False),
+            )
         
         # Fases legacy explícitas
         allowed_phases = [
@@ -262,59 +311,38 @@ def _run_deepseek_for_pendientes(conn, ejecucion_id: int, conf_threshold: float,
             "CONSULTA_ACEPTACION", "FORMALIZACION_PAGO", "ADVERTENCIAS", "CIERRE"
         ]
         
+        # Job persistente: retoma la corrida interrumpida de esta ejecución (si hay)
+        llm_job = LLMJob.start(conn, ejecucion_id, "UI")
+        if llm_job.resumed:
+            report(f"  ↩️ Retomando job {llm_job.job_pk} desde turno_pk>{llm_job.last_turno_pk}")
+        job_status = STATUS_PAUSED
+        
         # Sistema de batches iterativos
         total_processed_all = 0
         total_updates_all = 0
         
         for iter_num in range(1, max_iters + 1):
-            # Contar pendientes ANTES del batch
-            cursor.execute(
-                """
-                SELECT COUNT(*) as pendientes
-                FROM sa_turnos t
-                JOIN sa_conversaciones c ON c.conversacion_pk = t.conversacion_pk
-                WHERE c.ejecucion_id = %s
-                  AND (t.fase IS NULL OR TRIM(t.fase) = '')
-                """,
-                (ejecucion_id,)
-            )
-            pendientes_antes = cursor.fetchone()['pendientes']
-            
-            # Si no hay pendientes, terminar
-            if pendientes_antes == 0:
-                report(f"  ℹ️ Iteración {iter_num}/{max_iters}: Sin pendientes, finalizando")
+            if telemetry.budget_exhausted():
+                report(f"  ⚠️ Presupuesto LLM alcanzado; los turnos restantes quedan pendientes")
                 break
-            
-            report(f"  🔄 Iteración {iter_num}/{max_iters}: {pendientes_antes} turnos pendientes")
-            logger.info(f"[DeepSeek] Iter {iter_num}/{max_iters}: pendientes_antes={pendientes_antes}, batch_size={batch_size}")
-            
-            # Recargar pending_turns para este batch
-            cursor.execute(query, query_params)
-            pending_turns = cursor.fetchall()
+
+            # Siguiente batch de pendientes después del cursor (sin re-escanear ni COUNT(*))
+            pending_turns = llm_job.claim(cursor, pending_columns, claim_size, PENDING_FASE)
             
             if len(pending_turns) == 0:
-                report(f"  ℹ️ Iteración {iter_num}/{max_iters}: Query retornó 0 turnos, finalizando")
+                report(f"  ℹ️ Iteración {iter_num}/{max_iters}: Sin pendientes, finalizando")
+                job_status = STATUS_DONE
                 break
             
-            # Agrupar por conversación para calcular contextos
-            from collections import defaultdict
-            convs = defaultdict(list)
-            for turn in pending_turns:
-                convs[turn['conversacion_pk']].append(turn)
+            report(f"  🔄 Iteración {iter_num}/{max_iters}: {len(pending_turns)} turnos pendientes (turno_pk>{llm_job.last_turno_pk})")
+            logger.info(f"[DeepSeek] Iter {iter_num}/{max_iters}: claimed={len(pending_turns)}, batch_size={claim_size}, job={llm_job.job_pk}")
             
-            # Cargar todos los turnos de cada conversación para calcular contextos
-            conv_all_turns = {}
-            for conv_pk in convs.keys():
-                cursor.execute(
-                    """
-                    SELECT turno_pk, turno_idx, text, speaker, fase, fase_conf, fase_source
-                    FROM sa_turnos
-                    WHERE conversacion_pk = %s
-                    ORDER BY turno_idx
-                    """,
-                    (conv_pk,)
-                )
-                conv_all_turns[conv_pk] = {row['turno_idx']: row for row in cursor.fetchall()}
+            # Conversaciones del batch (en orden) y todos sus turnos para calcular contextos
+            # (iter_conversations por lote de conversaciones en vez de una consulta por conversación)
+            conv_pks = list(dict.fromkeys(turn['conversacion_pk'] for turn in pending_turns))
+            conv_index = ConversationIndex(conn)
+            conv_index.load(conv_pks)
+            conv_all_turns = {conv_pk: conv_index.rows(conv_pk) for conv_pk in conv_pks}
             
             # Procesar cada turno del batch
             updates = []
@@ -324,72 +352,74 @@ def _run_deepseek_for_pendientes(conn, ejecucion_id: int, conf_threshold: float,
             guardrails_count = 0
             deepseek_count = 0
             skipped_filter = 0
+            triage_count = 0
             batch_total = len(pending_turns)
             
+            # 1) Armar los jobs (contexto) en el hilo principal
+            jobs = []
             for turn in pending_turns:
                 try:
-                    # Construir contexto enriquecido con turnos cercanos
                     text = turn['text'] or ""
-                    turno_idx = turn['turno_idx']
-                    conv_pk = turn['conversacion_pk']
-                    all_turns = conv_all_turns[conv_pk]
-                    total_turns = turn['total_turnos']
-                    
+
                     # Filtro previo: saltar basura antes de llamar DeepSeek
                     if should_skip_deepseek(text):
                         skipped_filter += 1
                         processed += 1
                         continue
-                    
-                    # Derivar prev_fase y next_fase de turnos inmediatos
-                    prev_fase = None
-                    next_fase = None
-                    prev_idx = turno_idx - 1
-                    next_idx = turno_idx + 1
-                    
-                    if prev_idx in all_turns and all_turns[prev_idx].get('fase'):
-                        prev_fase = all_turns[prev_idx]['fase'].strip() or None
-                    
-                    if next_idx in all_turns and all_turns[next_idx].get('fase'):
-                        next_fase = all_turns[next_idx]['fase'].strip() or None
-                    
-                    # Construir context_block con turnos cercanos (idx-2 a idx+2)
-                    context_lines = []
-                    for i in range(turno_idx - 2, turno_idx + 3):
-                        if i in all_turns:
-                            t = all_turns[i]
-                            t_text = (t.get('text') or '').replace('\r', ' ').replace('\n', ' ')[:280]
-                            t_speaker = t.get('speaker') or 'unknown'
-                            
-                            if i == turno_idx:
-                                context_lines.append(f"Turno idx={i} (OBJETIVO): {t_speaker}: {t_text}")
-                            else:
-                                context_lines.append(f"Turno idx={i}: {t_speaker}: {t_text}")
-                    
-                    context_block = "\n".join(context_lines)
-                    
-                    # Información de última fase para contexto adicional
-                    last_phase_info = ""
-                    if prev_idx in all_turns:
-                        prev_t = all_turns[prev_idx]
-                        last_phase_info = f"last_phase={prev_t.get('fase')} conf={prev_t.get('fase_conf')} source={prev_t.get('fase_source')}"
-                    
-                    # Llamar DeepSeek con contexto enriquecido
-                    result = call_deepseek(
-                        text=text,
-                        prev_fase=prev_fase,
-                        next_fase=next_fase,
-                        turn_idx=turno_idx,
-                        total_turns=total_turns,
-                        base_url=deepseek_base_url,
-                        api_key=deepseek_api_key,
-                        model=deepseek_model,
-                        timeout=60,
-                        context_block=context_block,
-                        last_phase_info=last_phase_info,
-                        allowed_phases=allowed_phases
-                    )
-                    
+
+                    all_turns = conv_all_turns[turn['conversacion_pk']]
+                    decision = _triage_pending_turn(turn, all_turns, triage_min_margin) if triage_enabled else None
+                    if decision is not None:
+                        updates.append((decision.fase, decision.conf, TRIAGE_SOURCE, turn['turno_pk']))
+                        # Visible para los vecinos siguientes de la misma conversación
+                        all_turns[turn['turno_idx']].update(fase=decision.fase, fase_conf=decision.conf, fase_source=TRIAGE_SOURCE)
+                        triage_resolved[decision.reason] = triage_resolved.get(decision.reason, 0) + 1
+                        triage_count += 1
+                        processed += 1
+                        continue
+
+                    jobs.append(_build_deepseek_job(turn, all_turns))
+                except Exception as e:
+                    logger.error(f"Error procesando turno {turn['turno_pk']}: {e}", exc_info=True)
+                    errors += 1
+                    processed += 1
+
+            def call(job):
+                telemetry.bind(job['turn']['turno_pk'])
+                return call_deepseek(
+                    text=job['text'],
+                    prev_fase=job['prev_fase'],
+                    next_fase=job['next_fase'],
+                    turn_idx=job['turno_idx'],
+                    total_turns=job['total_turns'],
+                    base_url=deepseek_base_url,
+                    api_key=deepseek_api_key,
+                    model=deepseek_model,
+                    context_block=job['context_block'],
+                    last_phase_info=job['last_phase_info'],
+                    allowed_phases=allowed_phases,
+                    client=client,
+                    cache=cache,
+                )
+
+            llm_jobs_total += len(jobs)
+
+            # 2) Llamadas concurrentes; los resultados vuelven a este hilo (único escritor).
+            #    Con el presupuesto agotado no se despachan más jobs (quedan pendientes).
+            within_budget = itertools.takewhile(lambda _job: not telemetry.budget_exhausted(), jobs)
+            # Sin resultado (presupuesto o error): quedan como reintentos del job
+            retry_pks = {job['turn']['turno_pk'] for job in jobs}
+            for job, result, exc in client.map_unordered(call, within_budget):
+                turn = job['turn']
+                try:
+                    if exc is not None:
+                        raise exc
+                    retry_pks.discard(turn['turno_pk'])
+
+                    text = job['text']
+                    turno_idx = job['turno_idx']
+                    all_turns = job['all_turns']
+
                     # Extraer resultado (keys: "fase", "conf", "is_noise", "raw", "noise_reason", "rationale")
                     fase = (result.get("fase") or "").strip()
                     conf = float(result.get("conf") or 0.0)
@@ -478,52 +508,130 @@ def _run_deepseek_for_pendientes(conn, ejecucion_id: int, conf_threshold: float,
                     processed += 1
                     continue
         
-            # Commit final del batch
+            # Commit final del batch; recién entonces avanza el cursor del job
             if updates:
                 _commit_deepseek_updates(conn, cursor, updates)
-            
-            # Contar pendientes DESPUÉS del batch
-            cursor.execute(
-                """
-                SELECT COUNT(*) as pendientes
-                FROM sa_turnos t
-                JOIN sa_conversaciones c ON c.conversacion_pk = t.conversacion_pk
-                WHERE c.ejecucion_id = %s
-                  AND (t.fase IS NULL OR TRIM(t.fase) = '')
-                """,
-                (ejecucion_id,)
-            )
-            pendientes_despues = cursor.fetchone()['pendientes']
+            telemetry.flush(conn)
             
             # Estadísticas del batch
-            total_updates_batch = deepseek_count + guardrails_count + noise_count
+            total_updates_batch = deepseek_count + guardrails_count + noise_count + triage_count
+            llm_job.advance(
+                retry_pks, turnos=batch_total, escritos=deepseek_count + guardrails_count + triage_count,
+                llamadas=len(jobs) - len(retry_pks), errores=errors,
+            )
             total_processed_all += processed
             total_updates_all += total_updates_batch
             
             report(f"     ✓ Batch {iter_num} completado:")
             report(f"       - Procesados: {processed}")
             report(f"       - Skipped (filtro): {skipped_filter}")
-            report(f"       - Updates: {total_updates_batch} (DEEPSEEK={deepseek_count}, GUARDRAILS={guardrails_count}, NOISE={noise_count})")
+            report(f"       - Updates: {total_updates_batch} (DEEPSEEK={deepseek_count}, GUARDRAILS={guardrails_count}, NOISE={noise_count}, TRIAGE={triage_count})")
             report(f"       - Errores: {errors}")
-            report(f"       - Pendientes restantes: {pendientes_despues}")
+            report(f"       - Job: {llm_job.format_status()}")
             
             logger.info(
                 f"[DeepSeek] Iter {iter_num}/{max_iters}: "
-                f"pendientes_antes={pendientes_antes}, "
+                f"claimed={batch_total}, "
                 f"updates_escritos={total_updates_batch}, "
-                f"pendientes_despues={pendientes_despues}"
+                f"cursor_turno_pk={llm_job.last_turno_pk}"
             )
         
+        llm_job.finish(job_status)
         cursor.close()
         
         # Logs finales globales
         report(f"  ✅ Pipeline DeepSeek finalizado:")
         report(f"    - Total procesados: {total_processed_all}")
         report(f"    - Total updates: {total_updates_all}")
+        report(f"    - LLM: {client.format_stats()}")
+        report(f"    - Uso LLM: {telemetry.format_summary()}")
+        report(f"    - Job: {llm_job.format_status()}")
+        if triage_enabled:
+            report(f"    - Triage: {format_triage(triage_resolved, llm_jobs_total, sum(triage_resolved.values()))}")
+        report(f"    - Prompt: {format_prompt_stats()}")
+        if cache is not None:
+            report(f"    - Caché LLM: {cache.format_stats()}")
+        return {
+            "processed": total_processed_all, "updates": total_updates_all, "llm_calls": llm_jobs_total,
+            "client": client.stats(), "usage": telemetry.summary(),
+        }
     
     except Exception as e:
         logger.error(f"Error en DeepSeek: {e}", exc_info=True)
+        if llm_job is not None:
+            llm_job.finish(STATUS_FAILED)
         raise
+    finally:
+        if client is not None:
+            client.close()
+        if cache is not None:
+            cache.close()
+
+
+def _triage_pending_turn(turn: dict, all_turns: dict, min_margin: int):
+    """triage_turn con las fases vecinas y el speaker de la conversación (None = va al LLM)."""
+    turno_idx = turn['turno_idx']
+    prev_t = all_turns.get(turno_idx - 1) or {}
+    next_t = all_turns.get(turno_idx + 1) or {}
+    last_phase = None
+    for idx in sorted((i for i in all_turns if i < turno_idx), reverse=True):
+        fase = all_turns[idx].get('fase')
+        if fase and fase.strip():
+            last_phase = fase.strip()
+            break
+    return triage_turn(
+        turn['text'] or "", turno_idx, turn['total_turnos'] or len(all_turns),
+        last_phase=last_phase,
+        prev_fase=prev_t.get('fase'),
+        next_fase=next_t.get('fase'),
+        speaker=turn.get('speaker'),
+        prev_speaker=prev_t.get('speaker'),
+        min_margin=min_margin,
+    )
+
+
+def _build_deepseek_job(turn: dict, all_turns: dict) -> dict:
+    """Contexto de un turno pendiente para call_deepseek (turnos cercanos y fases vecinas)."""
+    text = turn['text'] or ""
+    turno_idx = turn['turno_idx']
+
+    # Derivar prev_fase y next_fase de turnos inmediatos
+    prev_fase = None
+    next_fase = None
+    prev_idx = turno_idx - 1
+    next_idx = turno_idx + 1
+
+    if prev_idx in all_turns and all_turns[prev_idx].get('fase'):
+        prev_fase = all_turns[prev_idx]['fase'].strip() or None
+
+    if next_idx in all_turns and all_turns[next_idx].get('fase'):
+        next_fase = all_turns[next_idx]['fase'].strip() or None
+
+    # Construir context_block con turnos cercanos (idx-2 a idx+2), sin relleno salvo el OBJETIVO
+    window = range(turno_idx - 2, turno_idx + 3)
+    context_block = build_context_block(
+        {i: (all_turns[i].get('speaker'), all_turns[i].get('text')) for i in window if i in all_turns},
+        window, {turno_idx},
+        lambda i: f"Turno idx={i} (OBJETIVO)" if i == turno_idx else f"Turno idx={i}",
+    )
+
+    # Información de última fase para contexto adicional
+    last_phase_info = ""
+    if prev_idx in all_turns:
+        prev_t = all_turns[prev_idx]
+        last_phase_info = f"last_phase={prev_t.get('fase')} conf={prev_t.get('fase_conf')} source={prev_t.get('fase_source')}"
+
+    return {
+        'turn': turn,
+        'text': text,
+        'turno_idx': turno_idx,
+        'total_turns': turn['total_turnos'],
+        'all_turns': all_turns,
+        'prev_fase': prev_fase,
+        'next_fase': next_fase,
+        'context_block': context_block,
+        'last_phase_info': last_phase_info,
+    }
 
 
 def _commit_deepseek_updates(conn, cursor, updates):
@@ -1,17 +1,18 @@
 """
 Funciones de importación para la UI
 """
-import os
 import logging
-from typing import List
+from typing import Callable, List, Optional
 from sa_core.config import load_config
 from sa_core.db import get_conn
-from sa_core.ingest import ingest_dir
+from sa_core.ingest import ingest_dir, ingest_dir_parallel, ingest_dir_incremental, ingest_files_parallel
 
 logger = logging.getLogger(__name__)
 
 
-def run_import_from_folder(config_path: str, input_dir: str, notas: str = "UI import") -> int:
+def run_import_from_folder(config_path: str, input_dir: str, notas: str = "UI import", workers: int = 0,
+                           batch_size: int = 200, progress_callback: Optional[Callable] = None,
+                           incremental: bool = False) -> int:
     """
     Importa todos los archivos .txt de una carpeta a la BD
     
@@ -19,6 +20,11 @@ def run_import_from_folder(config_path: str, input_dir: str, notas: str = "UI im
         config_path: Ruta al config.ini
         input_dir: Directorio con archivos .txt
         notas: Notas para la ejecución
+        workers: Hilos lectores para ingesta paralela (0 = ingest_dir secuencial)
+        batch_size: Filas por INSERT multi-fila en modo paralelo
+        progress_callback: Recibe IngestStats (archivos/s, bytes/s) tras cada lote
+        incremental: Saltar archivos ya ingeridos, vincular duplicados por hash y
+            reanudar una importación interrumpida de la misma carpeta
     
     Returns:
         ejecucion_id creado
@@ -31,7 +37,27 @@ def run_import_from_folder(config_path: str, input_dir: str, notas: str = "UI im
         conn = get_conn(cfg)
         
         logger.info(f"Iniciando importación desde carpeta: {input_dir}")
-        ejecucion_id, inserted_count = ingest_dir(conn, input_dir, notas)
+        if incremental:
+            ejecucion_id, inserted_count, stats = ingest_dir_incremental(
+                conn, input_dir, notas,
+                workers=workers,
+                batch_size=batch_size,
+                use_processes=False,
+                progress_callback=progress_callback,
+            )
+            logger.info(f"Throughput ingesta: {stats.summary()}")
+        elif workers and workers > 0:
+            # En la UI se usan hilos (no procesos) para no re-lanzar la app Tk
+            ejecucion_id, inserted_count, stats = ingest_dir_parallel(
+                conn, input_dir, notas,
+                workers=workers,
+                batch_size=batch_size,
+                use_processes=False,
+                progress_callback=progress_callback,
+            )
+            logger.info(f"Throughput ingesta: {stats.summary()}")
+        else:
+            ejecucion_id, inserted_count = ingest_dir(conn, input_dir, notas)
         
         conn.close()
         
@@ -46,7 +72,8 @@ def run_import_from_folder(config_path: str, input_dir: str, notas: str = "UI im
         raise
 
 
-def run_import_from_files(config_path: str, files: List[str], notas: str = "UI import (archivos)") -> int:
+def run_import_from_files(config_path: str, files: List[str], notas: str = "UI import (archivos)",
+                          progress_callback: Optional[Callable] = None) -> int:
     """
     Importa archivos específicos a la BD creando una ejecución temporal
     
@@ -54,6 +81,7 @@ def run_import_from_files(config_path: str, files: List[str], notas: str = "UI i
         config_path: Ruta al config.ini
         files: Lista de rutas absolutas a archivos
         notas: Notas para la ejecución
+        progress_callback: Recibe IngestStats tras cada lote (stats.chunk_* = último commit)
     
     Returns:
         ejecucion_id creado
@@ -67,53 +95,22 @@ def run_import_from_files(config_path: str, files: List[str], notas: str = "UI i
     try:
         cfg = load_config(config_path)
         conn = get_conn(cfg)
-        cursor = conn.cursor()
         
-        # Crear ejecución
+        # Streaming: un archivo en memoria a la vez y commits por chunks acotados
         input_dir_info = f"{len(files)} archivos seleccionados"
-        cursor.execute(
-            "INSERT INTO sa_ejecuciones (notas, input_dir) VALUES (%s, %s)",
-            (notas, input_dir_info)
+        ejecucion_id, inserted_count, stats = ingest_files_parallel(
+            conn, files, notas, input_dir_info,
+            workers=0,
+            use_processes=False,
+            progress_callback=progress_callback,
         )
-        ejecucion_id = cursor.lastrowid
-        
-        logger.info(f"Creada ejecución {ejecucion_id} para {len(files)} archivos")
-        
-        # Insertar cada archivo
-        inserted_count = 0
-        for file_path in files:
-            try:
-                # Leer archivo
-                raw_text = ''
-                try:
-                    with open(file_path, 'r', encoding='utf-8') as f:
-                        raw_text = f.read()
-                except UnicodeDecodeError:
-                    with open(file_path, 'r', encoding='latin-1') as f:
-                        raw_text = f.read()
-                    logger.warning(f"Fallback a latin-1 para {file_path}")
-                
-                # Insertar conversación
-                filename = os.path.basename(file_path)
-                cursor.execute(
-                    """
-                    INSERT INTO sa_conversaciones 
-                    (ejecucion_id, conversacion_id, raw_path, raw_text, total_turnos)
-                    VALUES (%s, %s, %s, %s, %s)
-                    """,
-                    (ejecucion_id, filename, file_path, raw_text, 0)
-                )
-                inserted_count += 1
-                
-            except Exception as e:
-                logger.error(f"Error procesando {file_path}: {e}")
-                continue
-        
-        conn.commit()
-        cursor.close()
         conn.close()
         
+        if not ejecucion_id:
+            raise Exception("Error en la ingesta: no se pudo crear ejecución")
+        
         logger.info(f"Importación exitosa: ejecucion_id={ejecucion_id}, archivos={inserted_count}/{len(files)}")
+        logger.info(f"Throughput ingesta: {stats.summary()}")
         
         if inserted_count == 0:
             raise Exception("No se pudo importar ningún archivo")
@@ -27,6 +27,15 @@ class StatsEjecucion:
     promesas_con_monto: int = 0
     promesas_sin_monto: int = 0
 
+    # Opcional: telemetría LLM (sa_llm_llamadas)
+    llm_llamadas: int = 0
+    llm_errores: int = 0
+    llm_tokens: int = 0
+    llm_tokens_por_turno: float = 0.0
+    llm_costo_usd: float = 0.0
+    llm_p50_ms: Optional[int] = None
+    llm_p95_ms: Optional[int] = None
+
 @dataclass
 class Conversacion:
     """Información de conversación"""
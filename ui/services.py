@@ -8,6 +8,7 @@ from contextlib import contextmanager
 
 from sa_core.config import load_config
 from sa_core.db import get_conn
+from sa_core.llm_telemetry import load_usage_summary
 from ui.models import EjecucionInfo, StatsEjecucion, Conversacion, Turno, SecuenciaInfo, SecuenciaKPIs
 
 logger = logging.getLogger(__name__)
@@ -249,6 +250,21 @@ def listar_ejecuciones(conn) -> List[EjecucionInfo]:
         logger.error(f"Error listando ejecuciones: {e}")
         return []
 
+def _fill_llm_usage(conn, stats: StatsEjecucion, ejecucion_ids: List[int]):
+    """Opcional: llamadas, tokens, costo y latencia p50/p95 del LLM (sa_llm_llamadas)"""
+    if not tabla_existe(conn, "sa_llm_llamadas"):
+        return
+    usage = load_usage_summary(conn, ejecucion_ids)
+    if not usage:
+        return
+    stats.llm_llamadas = usage["calls"]
+    stats.llm_errores = usage["errors"]
+    stats.llm_tokens = usage["total_tokens"]
+    stats.llm_tokens_por_turno = usage["tokens_por_turno"]
+    stats.llm_costo_usd = usage["costo_usd"]
+    stats.llm_p50_ms = usage["p50_ms"]
+    stats.llm_p95_ms = usage["p95_ms"]
+
 @with_reconnect
 def stats_ejecucion(conn, ejecucion_id: int, conf_threshold: float = 0.08) -> StatsEjecucion:
     """Obtiene estadísticas de una ejecución específica"""
@@ -332,6 +348,8 @@ def stats_ejecucion(conn, ejecucion_id: int, conf_threshold: float = 0.08) -> St
                     stats.promesas_con_monto = row["con_monto"] or 0
                     stats.promesas_sin_monto = row["sin_monto"] or 0
     
+        _fill_llm_usage(conn, stats, [ejecucion_id])
+    
     except Exception as e:
         logger.error(f"Error obteniendo stats para ejecucion_id={ejecucion_id}: {e}")
     
@@ -425,6 +443,8 @@ def stats_total(conn, ejecucion_ids: List[int], conf_threshold: float = 0.08) ->
                     stats.promesas_con_monto = row["con_monto"] or 0
                     stats.promesas_sin_monto = row["sin_monto"] or 0
     
+        _fill_llm_usage(conn, stats, ejecucion_ids)
+    
     except Exception as e:
         logger.error(f"Error obteniendo stats totales: {e}")
     
@@ -609,6 +609,14 @@ class DashboardView(ttk.Frame):
                 ("Promesas sin monto:", f"{stats.promesas_sin_monto} ({self._pct(stats.promesas_sin_monto, stats.total_promesas)})"),
             ])
         
+        if stats.llm_llamadas > 0:
+            kpis.extend([
+                ("Llamadas LLM:", f"{stats.llm_llamadas} (errores: {stats.llm_errores})"),
+                ("Tokens LLM:", f"{stats.llm_tokens} ({stats.llm_tokens_por_turno:.0f}/turno)"),
+                ("Latencia LLM p50/p95:", f"{stats.llm_p50_ms} / {stats.llm_p95_ms} ms"),
+                ("Costo LLM (USD):", f"{stats.llm_costo_usd:.4f}"),
+            ])
+        
         # Configurar columnas para expandir
         for col in range(4):
             kpi_frame.columnconfigure(col, weight=1 if col % 2 == 1 else 0)